@@ -10,11 +10,12 @@ import os
 import re
 import random
 import hashlib
+import threading
 from math import gcd
 from fractions import Fraction
 import csv
 import pytz  # NOUVEAU : Pour la gestion du fuseau horaire du Québec
-import backup_scheduler  # Ceci démarre automatiquement le scheduler
+import backup_scheduler  # Sauvegarde GitHub : job planifié via erp_jobs
 from fournisseurs import show_fournisseurs_page
 from assistant_ia_simple import show_assistant_ia_page
 
@@ -538,7 +539,8 @@ except ImportError:
 
 # NOUVELLE ARCHITECTURE : Import SQLite Database
 try:
-    from erp_database import ERPDatabase, convertir_pieds_pouces_fractions_en_valeur_decimale, convertir_imperial_vers_metrique
+    from erp_database import ERPDatabase, get_shared_database, convertir_pieds_pouces_fractions_en_valeur_decimale, convertir_imperial_vers_metrique
+    from erp_jobs import get_job_runner
     ERP_DATABASE_AVAILABLE = True
 except ImportError:
     ERP_DATABASE_AVAILABLE = False
@@ -841,11 +843,18 @@ def show_project_statistics(projects, crm_manager):
         ca_par_heure = ca_total / temps_total if temps_total > 0 else 0
         st.metric("💎 CA/Heure", format_currency(ca_par_heure))
 
-def advanced_project_search(projects, search_term, crm_manager):
-    """Recherche avancée dans les projets"""
+def advanced_project_search(projects, search_term, crm_manager, db=None):
+    """Recherche avancée dans les projets (index FTS5 : projets, opérations, matériaux)"""
     if not search_term:
         return projects
     
+    if db is not None and getattr(db, 'search_index_available', False):
+        # Un projet correspond si lui-même, une de ses opérations ou un de ses matériaux correspond
+        hits = db.search_global(search_term, entites=['projects', 'operations', 'materials'], limit=None)
+        # Ids comparés en texte : projets à id TEXT, opérations / matériaux à project_id INTEGER
+        matching_ids = {str(hit['projet_id']) for hit in hits if hit.get('projet_id') is not None}
+        return [p for p in projects if str(p.get('id')) in matching_ids]
+    
     search_term = search_term.lower()
     results = []
     
@@ -1400,6 +1409,10 @@ class GestionnaireProjetSQL:
     def __init__(self, db: ERPDatabase):
         self.db = db
         self.next_id = 10000  # Commence à 10000 pour professionnalisme
+        self._id_lock = threading.Lock()
+        # Mémo des projets pour la durée d'un rerun Streamlit (voir begin_rerun), propre à chaque
+        # thread de script : l'instance est partagée par toutes les sessions du processus
+        self._local = threading.local()
         self._init_next_id()
 
     def _init_next_id(self):
@@ -1431,8 +1444,19 @@ class GestionnaireProjetSQL:
 
     @property
     def projets(self):
-        """Propriété pour maintenir compatibilité avec l'ancien code"""
-        return self.get_all_projects()
+        """Propriété pour maintenir compatibilité avec l'ancien code (mémorisée par rerun)"""
+        projets = getattr(self._local, 'projets', None)
+        if projets is None:
+            projets = self._local.projets = self.get_all_projects()
+        return projets
+
+    def begin_rerun(self):
+        """Début d'un rerun Streamlit : le prochain accès à .projets relit la base"""
+        self._local.projets = None
+
+    def invalidate_projets_cache(self):
+        """Invalide le mémo après une écriture sur les projets"""
+        self._local.projets = None
 
     def ajouter_projet(self, projet_data, custom_id=None):
         """
@@ -1453,15 +1477,17 @@ class GestionnaireProjetSQL:
                 # Si c'est un ID numérique, ajuster next_id si nécessaire
                 try:
                     numeric_id = int(project_id)
-                    if numeric_id >= self.next_id:
-                        self.next_id = numeric_id + 1
+                    with self._id_lock:
+                        if numeric_id >= self.next_id:
+                            self.next_id = numeric_id + 1
                 except ValueError:
                     # ID non numérique, pas besoin d'ajuster next_id
                     pass
             else:
-                # Utiliser l'auto-incrémentation numérique
-                project_id = str(self.next_id)
-                self.next_id += 1
+                # Utiliser l'auto-incrémentation numérique (compteur partagé par les sessions)
+                with self._id_lock:
+                    project_id = str(self.next_id)
+                    self.next_id += 1
 
             # VALIDATION PRÉALABLE des clés étrangères
             if projet_data.get('client_company_id'):
@@ -1518,6 +1544,7 @@ class GestionnaireProjetSQL:
                     (project_id, emp_id, 'Membre équipe')
                 )
 
+            self.invalidate_projets_cache()
             return project_id
 
         except ValueError as ve:
@@ -1565,6 +1592,7 @@ class GestionnaireProjetSQL:
                         (str(projet_id), emp_id, 'Membre équipe')
                     )
 
+            self.invalidate_projets_cache()
             return True
 
         except Exception as e:
@@ -1584,6 +1612,7 @@ class GestionnaireProjetSQL:
             # Supprimer le projet
             self.db.execute_update("DELETE FROM projects WHERE id = ?", (projet_id_str,))
 
+            self.invalidate_projets_cache()
             return True
 
         except Exception as e:
@@ -1591,7 +1620,7 @@ class GestionnaireProjetSQL:
             return False
 
     def get_all_projects(self):
-        """Récupère tous les projets depuis SQLite"""
+        """Récupère tous les projets depuis SQLite (4 requêtes au total, quel que soit N)"""
         try:
             query = '''
                 SELECT p.*, c.nom as client_nom_company
@@ -1606,30 +1635,16 @@ class GestionnaireProjetSQL:
             '''
             rows = self.db.execute_query(query)
 
+            operations_par_projet, materiaux_par_projet, employes_par_projet = self._load_project_children()
+
             projets = []
             for row in rows:
                 projet = dict(row)
+                projet_key = str(projet['id'])
 
-                # Récupérer opérations
-                operations = self.db.execute_query(
-                    "SELECT * FROM operations WHERE project_id = ? ORDER BY sequence_number",
-                    (projet['id'],)
-                )
-                projet['operations'] = [dict(op) for op in operations]
-
-                # Récupérer matériaux
-                materiaux = self.db.execute_query(
-                    "SELECT * FROM materials WHERE project_id = ?",
-                    (projet['id'],)
-                )
-                projet['materiaux'] = [dict(mat) for mat in materiaux]
-
-                # Récupérer employés assignés
-                employes_assignes = self.db.execute_query(
-                    "SELECT employee_id FROM project_assignments WHERE project_id = ?",
-                    (projet['id'],)
-                )
-                projet['employes_assignes'] = [row['employee_id'] for row in employes_assignes]
+                projet['operations'] = operations_par_projet.get(projet_key, [])
+                projet['materiaux'] = materiaux_par_projet.get(projet_key, [])
+                projet['employes_assignes'] = employes_par_projet.get(projet_key, [])
 
                 # Compatibilité avec ancien format
                 if not projet.get('client_nom_cache') and projet.get('client_nom_company'):
@@ -1643,6 +1658,31 @@ class GestionnaireProjetSQL:
             st.error(f"Erreur récupération projets: {e}")
             return []
 
+    def _load_project_children(self):
+        """
+        Charge en bloc opérations, matériaux et assignations de tous les projets
+        (une requête par table) et les regroupe en mémoire par project_id.
+        """
+        operations_par_projet = {}
+        for op in self.db.execute_query(
+            "SELECT * FROM operations WHERE project_id IS NOT NULL ORDER BY project_id, sequence_number"
+        ):
+            operations_par_projet.setdefault(str(op['project_id']), []).append(op)
+
+        materiaux_par_projet = {}
+        for mat in self.db.execute_query(
+            "SELECT * FROM materials WHERE project_id IS NOT NULL ORDER BY project_id, id"
+        ):
+            materiaux_par_projet.setdefault(str(mat['project_id']), []).append(mat)
+
+        employes_par_projet = {}
+        for assignment in self.db.execute_query(
+            "SELECT project_id, employee_id FROM project_assignments WHERE project_id IS NOT NULL"
+        ):
+            employes_par_projet.setdefault(str(assignment['project_id']), []).append(assignment['employee_id'])
+
+        return operations_par_projet, materiaux_par_projet, employes_par_projet
+
 # ========================
 # INITIALISATION ERP SYSTÈME
 # ========================
@@ -2081,96 +2121,133 @@ def force_recreate_projects_table_with_text_id(db):
             
 # app.py - NOUVELLE VERSION DE init_erp_system()
 
-def init_erp_system():
-    """Initialise le système ERP complet et tous ses gestionnaires."""
-    
+# Ressources partagées exposées dans st.session_state (références, aucune copie par session)
+SHARED_RESOURCE_KEYS = [
+    'storage_manager', 'erp_db', 'job_runner', 'gestionnaire', 'gestionnaire_crm',
+    'gestionnaire_employes', 'gestionnaire_produits', 'gestionnaire_fournisseurs',
+    'gestionnaire_formulaires', 'gestionnaire_devis', 'timetracker_unified', 'attachments_manager',
+]
+
+
+@st.cache_resource(show_spinner=False)
+def get_erp_resources():
+    """
+    Construit une seule fois par processus la base ERP et les gestionnaires (sans état
+    propre à une session), partagés par toutes les sessions Streamlit.
+    """
+    resources = {'erreurs': []}
+
     # -----------------------------------------------------
     # 1. GESTIONNAIRE DE STOCKAGE PERSISTANT (PRIORITAIRE)
     # -----------------------------------------------------
     db_path = "erp_production_dg.db" # Chemin par défaut
-    if PERSISTENT_STORAGE_AVAILABLE and 'storage_manager' not in st.session_state:
+    if PERSISTENT_STORAGE_AVAILABLE:
         try:
-            st.session_state.storage_manager = init_persistent_storage()
-            db_path = st.session_state.storage_manager.db_path
+            resources['storage_manager'] = init_persistent_storage()
+            db_path = resources['storage_manager'].db_path
         except Exception as e:
-            st.error(f"❌ Erreur initialisation stockage persistant: {e}")
-            st.session_state.storage_manager = None
+            resources['erreurs'].append(f"❌ Erreur initialisation stockage persistant: {e}")
+            resources['storage_manager'] = None
 
     # -----------------------------------------------------
     # 2. BASE DE DONNÉES (le cœur du système)
     # -----------------------------------------------------
-    if ERP_DATABASE_AVAILABLE and 'erp_db' not in st.session_state:
-        st.session_state.erp_db = ERPDatabase(db_path)
-        # La migration et les données de base sont gérées dans le constructeur de ERPDatabase
-        st.session_state.migration_completed = True
-        print("✅ Base de données ERP initialisée.")
+    if not ERP_DATABASE_AVAILABLE:
+        return resources
+
+    # La migration et les données de base sont gérées dans le constructeur de ERPDatabase
+    db = get_shared_database(db_path)
+    resources['erp_db'] = db
+    print("✅ Base de données ERP initialisée.")
+
+    # Jobs de maintenance en arrière-plan (un exécuteur par processus)
+    try:
+        resources['job_runner'] = get_job_runner(db, setup=backup_scheduler.register_backup_job)
+    except Exception as e:
+        print(f"⚠️ Exécuteur de jobs indisponible: {e}")
+        resources['job_runner'] = None
 
-    # Si la DB n'est pas initialisée, on arrête ici.
-    if 'erp_db' not in st.session_state:
-        st.error("ERREUR CRITIQUE : Impossible d'initialiser la base de données ERP.")
-        st.stop()
-    
     # -----------------------------------------------------
     # 3. GESTIONNAIRES DE MODULES (dépendent de la DB)
     # -----------------------------------------------------
-    
+
     # Gestionnaire Projets
-    if 'gestionnaire' not in st.session_state:
-        st.session_state.gestionnaire = GestionnaireProjetSQL(st.session_state.erp_db)
-        print("✅ Gestionnaire Projets initialisé.")
+    resources['gestionnaire'] = GestionnaireProjetSQL(db)
+    print("✅ Gestionnaire Projets initialisé.")
 
     # Gestionnaire CRM
-    if CRM_AVAILABLE and 'gestionnaire_crm' not in st.session_state:
-        st.session_state.gestionnaire_crm = GestionnaireCRM(db=st.session_state.erp_db)
+    if CRM_AVAILABLE:
+        resources['gestionnaire_crm'] = GestionnaireCRM(db=db)
         print("✅ Gestionnaire CRM initialisé.")
-        
+
     # Gestionnaire Employés
-    if EMPLOYEES_AVAILABLE and 'gestionnaire_employes' not in st.session_state:
-        st.session_state.gestionnaire_employes = GestionnaireEmployes()
+    if EMPLOYEES_AVAILABLE:
+        resources['gestionnaire_employes'] = GestionnaireEmployes(db=db)
         print("✅ Gestionnaire Employés initialisé.")
 
     # Gestionnaire Produits
-    if PRODUITS_AVAILABLE and 'gestionnaire_produits' not in st.session_state:
-        st.session_state.gestionnaire_produits = GestionnaireProduits(db=st.session_state.erp_db)
+    if PRODUITS_AVAILABLE:
+        resources['gestionnaire_produits'] = GestionnaireProduits(db=db)
         print("✅ Gestionnaire Produits initialisé.")
 
     # Gestionnaire Fournisseurs (dépend du CRM et des Produits)
-    if FOURNISSEURS_AVAILABLE and 'gestionnaire_fournisseurs' not in st.session_state:
-        st.session_state.gestionnaire_fournisseurs = GestionnaireFournisseurs(
-            db=st.session_state.erp_db,
-            crm_manager=st.session_state.get('gestionnaire_crm'),
-            product_manager=st.session_state.get('gestionnaire_produits')
+    if FOURNISSEURS_AVAILABLE:
+        resources['gestionnaire_fournisseurs'] = GestionnaireFournisseurs(
+            db=db,
+            crm_manager=resources.get('gestionnaire_crm'),
+            product_manager=resources.get('gestionnaire_produits')
         )
         print("✅ Gestionnaire Fournisseurs initialisé avec ses dépendances.")
 
     # Gestionnaire Formulaires
-    if FORMULAIRES_AVAILABLE and 'gestionnaire_formulaires' not in st.session_state:
-        st.session_state.gestionnaire_formulaires = GestionnaireFormulaires(st.session_state.erp_db)
+    if FORMULAIRES_AVAILABLE:
+        resources['gestionnaire_formulaires'] = GestionnaireFormulaires(db)
         print("✅ Gestionnaire Formulaires initialisé.")
 
     # Gestionnaire Devis (dépend de plusieurs autres)
-    if DEVIS_AVAILABLE and 'gestionnaire_devis' not in st.session_state:
-        st.session_state.gestionnaire_devis = GestionnaireDevis(
-            db=st.session_state.erp_db,
-            crm_manager=st.session_state.get('gestionnaire_crm'),
-            project_manager=st.session_state.get('gestionnaire'),
-            product_manager=st.session_state.get('gestionnaire_produits')
+    if DEVIS_AVAILABLE:
+        resources['gestionnaire_devis'] = GestionnaireDevis(
+            db=db,
+            crm_manager=resources.get('gestionnaire_crm'),
+            project_manager=resources['gestionnaire'],
+            product_manager=resources.get('gestionnaire_produits')
         )
         print("✅ Gestionnaire Devis initialisé.")
 
     # TimeTracker Unifié
-    if TIMETRACKER_AVAILABLE and 'timetracker_unified' not in st.session_state:
-        st.session_state.timetracker_unified = initialize_timetracker_unified(st.session_state.erp_db)
+    if TIMETRACKER_AVAILABLE:
+        resources['timetracker_unified'] = initialize_timetracker_unified(db)
         print("✅ TimeTracker Unifié initialisé.")
 
     # Gestionnaire Pièces Jointes
-    if ATTACHMENTS_AVAILABLE and 'attachments_manager' not in st.session_state:
-        st.session_state.attachments_manager = init_attachments_manager(
-            st.session_state.erp_db,
-            st.session_state.get('storage_manager')
-        )
+    if ATTACHMENTS_AVAILABLE:
+        resources['attachments_manager'] = AttachmentsManager(db, resources.get('storage_manager'))
         print("✅ Gestionnaire Pièces Jointes initialisé.")
-            
+
+    return resources
+
+
+def init_erp_system():
+    """Initialise le système ERP : rattache la session aux ressources partagées du processus."""
+    resources = get_erp_resources()
+
+    if 'erp_db' not in st.session_state:
+        for erreur in resources['erreurs']:
+            st.error(erreur)
+
+    for key in SHARED_RESOURCE_KEYS:
+        if resources.get(key) is not None and key not in st.session_state:
+            st.session_state[key] = resources[key]
+    st.session_state.migration_completed = True
+
+    # Si la DB n'est pas initialisée, on arrête ici.
+    if 'erp_db' not in st.session_state:
+        st.error("ERREUR CRITIQUE : Impossible d'initialiser la base de données ERP.")
+        st.stop()
+
+    # Nouveau rerun : les projets mémorisés au rerun précédent (par ce thread) sont périmés
+    st.session_state.gestionnaire.begin_rerun()
+
 def get_system_stats():
     """Récupère les statistiques système"""
     try:
@@ -2575,6 +2652,7 @@ def show_erp_main():
 
     # Affichage du statut de stockage persistant dans la sidebar
     show_storage_status_sidebar()
+    show_jobs_status_sidebar()
 
     # Statistiques dans la sidebar
     try:
@@ -2925,6 +3003,10 @@ def show_storage_status_sidebar():
         if storage_info.get('backup_count', 0) > 0:
             st.sidebar.metric("Sauvegardes", storage_info['backup_count'])
 
+        if storage_info.get('backup_in_progress') is not None:
+            st.sidebar.progress(storage_info['backup_in_progress'] / 100,
+                                text=f"💾 Sauvegarde en cours ({storage_info['backup_in_progress']}%)")
+
         # Usage disque (Render uniquement)
         if storage_info.get('disk_usage'):
             disk = storage_info['disk_usage']
@@ -2945,6 +3027,44 @@ def show_storage_status_sidebar():
     except Exception as e:
         st.sidebar.error(f"Erreur statut stockage: {str(e)[:50]}...")
 
+def show_jobs_status_sidebar():
+    """Affiche l'état des jobs de maintenance en arrière-plan dans la sidebar"""
+    runner = st.session_state.get('job_runner')
+    if not runner:
+        return
+
+    try:
+        jobs = runner.get_jobs_status()
+        if not jobs:
+            return
+
+        statut_icons = {'EN_ATTENTE': '⏳', 'EN_COURS': '🔄', 'TERMINE': '✅', 'ECHEC': '❌', None: '➖'}
+        nb_echecs = sum(1 for job in jobs if job.get('statut') == 'ECHEC')
+
+        with st.sidebar.expander(f"⚙️ Tâches de fond{f' ({nb_echecs} ❌)' if nb_echecs else ''}", expanded=False):
+            for job in jobs:
+                icon = statut_icons.get(job.get('statut'), '❔')
+                st.markdown(f"{icon} **{job['nom']}**")
+                details = []
+                if job.get('fin'):
+                    details.append(str(job['fin'])[:16])
+                if job.get('duree_ms') is not None:
+                    details.append(f"{job['duree_ms'] / 1000:.1f} s")
+                if job.get('intervalle'):
+                    details.append(f"toutes les {int(job['intervalle'] // 60)} min")
+                if details:
+                    st.caption(" · ".join(details))
+                if job.get('statut') == 'ECHEC' and job.get('erreur'):
+                    st.caption(f"⚠️ {str(job['erreur'])[:80]}")
+
+                if job.get('statut') not in ('EN_ATTENTE', 'EN_COURS'):
+                    if st.button("▶️ Lancer", key=f"job_run_{job['nom']}", help=job.get('description')):
+                        if runner.submit(job['nom']):
+                            st.toast(f"⏳ {job['nom']} planifié")
+                        st.rerun()
+    except Exception as e:
+        st.sidebar.error(f"Erreur statut des tâches: {str(e)[:50]}...")
+
 # ========================
 # FONCTIONS DE VUE ET DE RENDU ERP
 # ========================
@@ -3450,7 +3570,7 @@ def show_liste_projets():
         
         # Recherche avancée
         if recherche:
-            projets_filtres = advanced_project_search(projets_filtres, recherche, crm_manager)
+            projets_filtres = advanced_project_search(projets_filtres, recherche, crm_manager, gestionnaire.db)
         
         # Filtres par statut
         if 'Tous' not in filtre_statut and filtre_statut:
@@ -4676,9 +4796,9 @@ def main():
         # Sauvegarde automatique toutes les 100 actions
         if st.session_state.action_counter % 100 == 0:
             try:
-                backup_path = st.session_state.storage_manager.create_backup("auto")
-                if backup_path:
-                    st.toast("💾 Sauvegarde automatique effectuée", icon="✅")
+                # Sauvegarde en ligne dans un thread : la page n'attend pas la copie
+                st.session_state.storage_manager.start_backup("auto")
+                st.toast("💾 Sauvegarde automatique lancée", icon="✅")
             except Exception as e:
                 print(f"Erreur sauvegarde automatique: {e}")
 
@@ -9,6 +9,8 @@ from typing import Dict, List, Optional, Any
 import logging
 from anthropic import Anthropic
 
+from erp_search import SEARCH_TABLE, build_match_query
+
 # Configuration du logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -52,6 +54,20 @@ class AssistantIASimple:
     # MÉTHODES D'ACCÈS AUX DONNÉES ERP
     # =========================================================================
     
+    def _filtre_recherche(self, entite: str, alias: str, terme: str, colonnes_like: List[str]):
+        """
+        Condition SQL de recherche sur une entité : index FTS5 si disponible,
+        sinon LIKE sur les colonnes indiquées. Retourne (condition, paramètres).
+        """
+        match = build_match_query(terme)
+        if match and getattr(self.db, 'search_index_available', False):
+            condition = (f"{alias}.id IN (SELECT entite_id FROM {SEARCH_TABLE} "
+                         f"WHERE {SEARCH_TABLE} MATCH ? AND entite = '{entite}')")
+            return condition, (match,)
+        
+        condition = "(" + " OR ".join(f"{col} LIKE ?" for col in colonnes_like) + ")"
+        return condition, tuple(f'%{terme}%' for _ in colonnes_like)
+    
     def _search_erp_data(self, query: str) -> Dict[str, Any]:
         """Recherche dans les données ERP"""
         if not self.db:
@@ -63,13 +79,15 @@ class AssistantIASimple:
         try:
             # Recherche projets
             if any(word in query_lower for word in ['projet', 'project', 'chantier']):
-                projects = self.db.execute_query("""
+                condition, params = self._filtre_recherche(
+                    'projects', 'p', query, ['p.nom_projet', 'p.description'])
+                projects = self.db.execute_query(f"""
                     SELECT p.*, c.nom as client_nom 
                     FROM projects p 
                     LEFT JOIN companies c ON p.client_company_id = c.id 
-                    WHERE p.nom_projet LIKE ? OR p.description LIKE ?
+                    WHERE {condition}
                     LIMIT 5
-                """, (f'%{query}%', f'%{query}%'))
+                """, params)
                 
                 if projects:
                     # Valider les données avant de les ajouter
@@ -82,29 +100,30 @@ class AssistantIASimple:
             
             # Recherche produits
             if any(word in query_lower for word in ['produit', 'product', 'article', 'référence']):
-                produits = self.db.execute_query("""
+                condition, params = self._filtre_recherche(
+                    'produits', 'produits', query, ['nom', 'code_produit', 'description', 'materiau'])
+                produits = self.db.execute_query(f"""
                     SELECT code_produit, nom, categorie, materiau, nuance, 
                            dimensions, unite_vente, prix_unitaire, 
                            stock_disponible, stock_minimum, fournisseur_principal
                     FROM produits 
-                    WHERE actif = 1 AND (
-                        nom LIKE ? OR code_produit LIKE ? OR 
-                        description LIKE ? OR materiau LIKE ?
-                    )
+                    WHERE actif = 1 AND {condition}
                     LIMIT 5
-                """, (f'%{query}%', f'%{query}%', f'%{query}%', f'%{query}%'))
+                """, params)
                 
                 if produits:
                     results['produits'] = [dict(prod) for prod in produits]
             
             # Recherche inventaire
             if any(word in query_lower for word in ['stock', 'inventaire', 'matériel']):
-                items = self.db.execute_query("""
+                condition, params = self._filtre_recherche(
+                    'inventory_items', 'inventory_items', query, ['nom', 'description'])
+                items = self.db.execute_query(f"""
                     SELECT nom, quantite_metric, statut 
                     FROM inventory_items 
-                    WHERE nom LIKE ? OR description LIKE ?
+                    WHERE {condition}
                     LIMIT 5
-                """, (f'%{query}%', f'%{query}%'))
+                """, params)
                 
                 if items:
                     results['inventaire'] = [dict(item) for item in items]
@@ -126,19 +145,23 @@ class AssistantIASimple:
             
             # Recherche clients
             if any(word in query_lower for word in ['client', 'entreprise']):
-                companies = self.db.execute_query("""
+                condition, params = self._filtre_recherche(
+                    'companies', 'companies', query, ['nom', 'secteur'])
+                companies = self.db.execute_query(f"""
                     SELECT nom, secteur, ville 
                     FROM companies 
-                    WHERE nom LIKE ? OR secteur LIKE ?
+                    WHERE {condition}
                     LIMIT 5
-                """, (f'%{query}%', f'%{query}%'))
+                """, params)
                 
                 if companies:
                     results['entreprises'] = [dict(comp) for comp in companies]
             
             # Recherche bons de travail
             if any(word in query_lower for word in ['bon', 'bt', 'travail']):
-                bts = self.db.execute_query("""
+                condition, params = self._filtre_recherche(
+                    'formulaires', 'f', query, ['f.numero_document', 'f.notes'])
+                bts = self.db.execute_query(f"""
                     SELECT f.numero_document, f.statut, f.priorite, f.created_at, 
                            f.metadonnees_json, f.notes,
                            (SELECT fl.description FROM formulaire_lignes fl 
@@ -146,10 +169,10 @@ class AssistantIASimple:
                             ORDER BY fl.sequence_ligne LIMIT 1) as premiere_ligne
                     FROM formulaires f 
                     WHERE f.type_formulaire = 'BON_TRAVAIL' 
-                    AND (f.numero_document LIKE ? OR f.notes LIKE ?)
+                    AND {condition}
                     ORDER BY f.created_at DESC
                     LIMIT 5
-                """, (f'%{query}%', f'%{query}%'))
+                """, params)
                 
                 if bts:
                     # Traiter les métadonnées JSON pour extraire le titre
@@ -172,7 +195,9 @@ class AssistantIASimple:
             
             # Recherche devis
             if any(word in query_lower for word in ['devis', 'quote', 'estimation']):
-                devis = self.db.execute_query("""
+                condition, params = self._filtre_recherche(
+                    'formulaires', 'f', query, ['f.numero_document', 'f.notes'])
+                devis = self.db.execute_query(f"""
                     SELECT f.numero_document, f.statut, f.priorite, f.created_at, 
                            f.metadonnees_json, f.notes, f.montant_total,
                            (SELECT fl.description FROM formulaire_lignes fl 
@@ -180,10 +205,10 @@ class AssistantIASimple:
                             ORDER BY fl.sequence_ligne LIMIT 1) as premiere_ligne
                     FROM formulaires f 
                     WHERE f.type_formulaire = 'ESTIMATION' 
-                    AND (f.numero_document LIKE ? OR f.notes LIKE ?)
+                    AND {condition}
                     ORDER BY f.created_at DESC
                     LIMIT 5
-                """, (f'%{query}%', f'%{query}%'))
+                """, params)
                 
                 if devis:
                     # Traiter les métadonnées JSON pour extraire le titre
@@ -206,15 +231,16 @@ class AssistantIASimple:
             
             # Recherche contacts
             if any(word in query_lower for word in ['contact', 'personne', 'responsable']):
-                contacts = self.db.execute_query("""
+                condition, params = self._filtre_recherche(
+                    'contacts', 'c', query, ['c.nom_famille', 'c.prenom', 'c.email', 'comp.nom'])
+                contacts = self.db.execute_query(f"""
                     SELECT c.*, comp.nom as entreprise_nom
                     FROM contacts c
                     LEFT JOIN companies comp ON c.company_id = comp.id
-                    WHERE c.nom_famille LIKE ? OR c.prenom LIKE ? 
-                    OR c.email LIKE ? OR comp.nom LIKE ?
+                    WHERE {condition}
                     ORDER BY c.nom_famille, c.prenom
                     LIMIT 10
-                """, (f'%{query}%', f'%{query}%', f'%{query}%', f'%{query}%'))
+                """, params)
                 
                 if contacts:
                     results['contacts'] = [dict(c) for c in contacts]
@@ -2428,20 +2454,18 @@ Réponds de manière professionnelle et structurée."""
                     search_term = query[7:].strip() if len(query) > 7 else ''
                 if search_term:
                     try:
-                        contacts = self.db.execute_query("""
+                        condition, params = self._filtre_recherche(
+                            'contacts', 'c', search_term,
+                            ['c.nom_famille', 'c.prenom', "c.nom_famille || ' ' || c.prenom",
+                             "c.prenom || ' ' || c.nom_famille", 'c.email', 'comp.nom'])
+                        contacts = self.db.execute_query(f"""
                             SELECT c.*, comp.nom as entreprise_nom
                             FROM contacts c
                             LEFT JOIN companies comp ON c.company_id = comp.id
-                            WHERE LOWER(c.nom_famille) LIKE LOWER(?) 
-                               OR LOWER(c.prenom) LIKE LOWER(?)
-                               OR LOWER(c.nom_famille || ' ' || c.prenom) LIKE LOWER(?)
-                               OR LOWER(c.prenom || ' ' || c.nom_famille) LIKE LOWER(?)
-                               OR LOWER(c.email) LIKE LOWER(?)
-                               OR LOWER(comp.nom) LIKE LOWER(?)
+                            WHERE {condition}
                             ORDER BY c.nom_famille, c.prenom
                             LIMIT 20
-                        """, (f'%{search_term}%', f'%{search_term}%', f'%{search_term}%', 
-                              f'%{search_term}%', f'%{search_term}%', f'%{search_term}%'))
+                        """, params)
                         
                         if contacts:
                             results = {'contacts': [dict(c) for c in contacts]}
@@ -0,0 +1,406 @@
+# attachment_previews.py - Aperçus précalculés des pièces jointes
+# ERP Production DG Inc. - Miniatures, extraits texte, 1re page PDF ; cache disque borné par empreinte
+
+import os
+import time
+import atexit
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Dict, Optional, Tuple
+
+from PIL import Image
+
+try:
+    import fitz  # PyMuPDF : rendu de la 1re page en image (optionnel)
+    PDF_RENDER_AVAILABLE = True
+except ImportError:
+    PDF_RENDER_AVAILABLE = False
+
+try:
+    from PyPDF2 import PdfReader, PdfWriter
+    PDF_EXTRACT_AVAILABLE = True
+except ImportError:
+    PDF_EXTRACT_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+
+# Incrémenté quand les générateurs changent : les anciens aperçus ne sont plus relus
+PREVIEW_FORMAT_VERSION = 1
+
+IMAGE_EXTENSIONS = {'jpg', 'jpeg', 'png', 'gif', 'bmp', 'webp'}
+TEXT_EXTENSIONS = {'txt', 'md', 'csv', 'json', 'xml'}
+PDF_EXTENSIONS = {'pdf'}
+
+# Côté maximal des miniatures (pixels)
+DEFAULT_THUMBNAIL_SIZE = 1024
+THUMBNAIL_JPEG_QUALITY = 85
+
+# Caractères conservés pour l'aperçu texte
+DEFAULT_TEXT_PREVIEW_CHARS = 10240
+TEXT_TRUNCATED_NOTICE = "\n\n... (fichier tronqué pour l'aperçu)"
+
+# Rendu de la 1re page PDF (PyMuPDF)
+PDF_RENDER_DPI = 110
+
+DEFAULT_CACHE_MAX_MB = 256
+DEFAULT_PREVIEW_WORKERS = 2
+
+# Attente maximale d'un aperçu généré à la demande avant d'afficher « en cours »
+DEFAULT_PREVIEW_WAIT_SECONDS = 10
+
+# Délai avant de retenter un aperçu en échec (fichier pas encore en place, erreur d'E/S...)
+DEFAULT_PREVIEW_RETRY_SECONDS = 300
+
+# Compteurs de prévisualisations : écriture groupée
+COUNTER_FLUSH_SIZE = 50
+COUNTER_FLUSH_SECONDS = 30
+
+
+def preview_kind(extension: str) -> Optional[str]:
+    """Type d'aperçu d'une extension : 'image', 'text', 'pdf' ou None"""
+    ext = (extension or '').lower().lstrip('.')
+    if ext in IMAGE_EXTENSIONS:
+        return 'image'
+    if ext in TEXT_EXTENSIONS:
+        return 'text'
+    if ext in PDF_EXTENSIONS:
+        return 'pdf'
+    return None
+
+
+# =========================================================================
+# GÉNÉRATEURS
+# =========================================================================
+
+def generate_image_thumbnail(source_path: str, dest_base: str, max_size: int = DEFAULT_THUMBNAIL_SIZE) -> str:
+    """
+    Miniature réduite (JPEG, PNG si transparence).
+
+    Returns:
+        Chemin du fichier généré
+    """
+    with Image.open(source_path) as img:
+        # Décodage JPEG directement à une résolution réduite
+        img.draft('RGB', (max_size, max_size))
+        img.seek(0)  # 1re image des GIF animés
+        img.thumbnail((max_size, max_size))
+
+        if img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info):
+            dest_path = f"{dest_base}.png"
+            img.convert('RGBA').save(dest_path, 'PNG', optimize=True)
+        else:
+            dest_path = f"{dest_base}.jpg"
+            img.convert('RGB').save(dest_path, 'JPEG', quality=THUMBNAIL_JPEG_QUALITY, optimize=True)
+    return dest_path
+
+
+def generate_text_snippet(source_path: str, dest_base: str, max_chars: int = DEFAULT_TEXT_PREVIEW_CHARS) -> str:
+    """Début du fichier texte (UTF-8), avec mention de troncature"""
+    with open(source_path, 'r', encoding='utf-8', errors='ignore') as f:
+        content = f.read(max_chars + 1)
+    if len(content) > max_chars:
+        content = content[:max_chars] + TEXT_TRUNCATED_NOTICE
+
+    dest_path = f"{dest_base}.txt"
+    with open(dest_path, 'w', encoding='utf-8') as f:
+        f.write(content)
+    return dest_path
+
+
+def generate_pdf_first_page(source_path: str, dest_base: str) -> str:
+    """
+    1re page d'un PDF : image PNG si PyMuPDF est installé, sinon PDF d'une seule page
+    (PyPDF2) affiché à la place du document complet.
+    """
+    if PDF_RENDER_AVAILABLE:
+        dest_path = f"{dest_base}.png"
+        with fitz.open(source_path) as document:
+            document[0].get_pixmap(dpi=PDF_RENDER_DPI).save(dest_path)
+        return dest_path
+
+    if PDF_EXTRACT_AVAILABLE:
+        dest_path = f"{dest_base}.pdf"
+        reader = PdfReader(source_path)
+        writer = PdfWriter()
+        writer.add_page(reader.pages[0])
+        with open(dest_path, 'wb') as f:
+            writer.write(f)
+        return dest_path
+
+    raise RuntimeError("Ni PyMuPDF ni PyPDF2 disponible pour l'aperçu PDF")
+
+
+GENERATORS = {
+    'image': generate_image_thumbnail,
+    'text': generate_text_snippet,
+    'pdf': generate_pdf_first_page,
+}
+
+# Extensions possibles des aperçus générés (recherche dans le cache)
+PREVIEW_FILE_EXTENSIONS = ('.jpg', '.png', '.txt', '.pdf')
+
+
+# =========================================================================
+# CACHE DISQUE BORNÉ
+# =========================================================================
+
+class PreviewCache:
+    """
+    Aperçus stockés sur disque par empreinte de contenu (previews/<ab>/<empreinte>.v<N>.<type>.<ext>),
+    générés par un pool de threads, à l'upload ou à la première demande.
+    Taille totale bornée : les aperçus les moins récemment consultés sont supprimés.
+    Un échec de génération est mémorisé retry_seconds, puis l'aperçu est retenté.
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: Optional[int] = None, workers: Optional[int] = None,
+                 retry_seconds: Optional[float] = None):
+        self.cache_dir = cache_dir
+        if max_bytes is None:
+            max_bytes = int(os.environ.get('ATTACHMENTS_PREVIEW_CACHE_MB', DEFAULT_CACHE_MAX_MB)) * 1024 * 1024
+        self.max_bytes = max_bytes
+        if workers is None:
+            workers = int(os.environ.get('ATTACHMENTS_PREVIEW_WORKERS', DEFAULT_PREVIEW_WORKERS))
+        if retry_seconds is None:
+            retry_seconds = float(os.environ.get('ATTACHMENTS_PREVIEW_RETRY_SECONDS', DEFAULT_PREVIEW_RETRY_SECONDS))
+        self.retry_seconds = retry_seconds
+
+        self._lock = threading.Lock()
+        self._pending: Dict[str, object] = {}
+        # clé → (horodatage de l'échec, message)
+        self._failed: Dict[str, Tuple[float, str]] = {}
+        self._executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix='erp-preview')
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._total_bytes = sum(size for _, _, size in self._entries())
+        self.stats = {'hits': 0, 'generated': 0, 'evicted': 0, 'errors': 0}
+
+    def _entry_base(self, file_hash: str, kind: str) -> str:
+        return os.path.join(self.cache_dir, file_hash[:2], f"{file_hash}.v{PREVIEW_FORMAT_VERSION}.{kind}")
+
+    def _entries(self):
+        """(chemin, date de dernier accès, taille) de tous les aperçus"""
+        entries = []
+        for shard in os.scandir(self.cache_dir):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                if entry.is_file() and '.tmp' not in entry.name:
+                    stat = entry.stat()
+                    entries.append((entry.path, stat.st_mtime, stat.st_size))
+        return entries
+
+    def lookup(self, file_hash: str, kind: str) -> Optional[str]:
+        """Chemin de l'aperçu en cache (marqué comme récemment utilisé) ou None"""
+        base = self._entry_base(file_hash, kind)
+        for extension in PREVIEW_FILE_EXTENSIONS:
+            path = base + extension
+            if os.path.exists(path):
+                try:
+                    os.utime(path)
+                except OSError:
+                    pass
+                return path
+        return None
+
+    def _recent_failure(self, key: str) -> Optional[str]:
+        """Message du dernier échec s'il date de moins de retry_seconds (appelé sous _lock)"""
+        failure = self._failed.get(key)
+        if failure is None:
+            return None
+        if time.monotonic() - failure[0] >= self.retry_seconds:
+            del self._failed[key]
+            return None
+        return failure[1]
+
+    def schedule(self, file_hash: str, extension: str, source_path: str):
+        """
+        Lance la génération de l'aperçu en arrière-plan (sans effet s'il existe,
+        est déjà en cours, a échoué récemment ou si le type n'est pas prévisualisable).
+
+        Returns:
+            Future de génération, ou None
+        """
+        kind = preview_kind(extension)
+        if not kind or not file_hash:
+            return None
+        key = f"{file_hash}.{kind}"
+        with self._lock:
+            future = self._pending.get(key)
+            if future is not None:
+                return future
+            if self._recent_failure(key) or self.lookup(file_hash, kind):
+                return None
+            future = self._executor.submit(self._generate, file_hash, kind, source_path)
+            self._pending[key] = future
+            return future
+
+    def get(self, file_hash: str, extension: str, source_path: str,
+            wait: float = DEFAULT_PREVIEW_WAIT_SECONDS) -> Dict[str, Optional[str]]:
+        """
+        Aperçu d'un fichier, généré si nécessaire (attente bornée).
+
+        Returns:
+            kind ('image', 'text', 'pdf' ou None), path (fichier d'aperçu), status
+            ('ok', 'pending', 'error', 'unsupported'), error
+        """
+        kind = preview_kind(extension)
+        result = {'kind': kind, 'path': None, 'status': 'unsupported', 'error': None}
+        if not kind:
+            return result
+
+        path = self.lookup(file_hash, kind)
+        if path:
+            self.stats['hits'] += 1
+            result.update(path=path, status='ok')
+            return result
+
+        future = self.schedule(file_hash, extension, source_path)
+        if future is not None:
+            try:
+                future.result(timeout=wait)
+            except FutureTimeoutError:
+                result['status'] = 'pending'
+                return result
+            except Exception:
+                pass  # Erreur conservée dans _failed
+
+        with self._lock:
+            error = self._recent_failure(f"{file_hash}.{kind}")
+        if error:
+            result.update(status='error', error=error)
+            return result
+
+        path = self.lookup(file_hash, kind)
+        result.update(path=path, status='ok' if path else 'error',
+                      error=None if path else "Aperçu introuvable après génération")
+        return result
+
+    def _generate(self, file_hash: str, kind: str, source_path: str) -> Optional[str]:
+        key = f"{file_hash}.{kind}"
+        base = self._entry_base(file_hash, kind)
+        tmp_base = f"{base}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(base), exist_ok=True)
+            tmp_path = GENERATORS[kind](source_path, tmp_base)
+            # Extension choisie par le générateur (ex: .png si transparence)
+            path = base + tmp_path[len(tmp_base):]
+            os.replace(tmp_path, path)
+
+            size = os.path.getsize(path)
+            with self._lock:
+                self._total_bytes += size
+                self.stats['generated'] += 1
+                self._failed.pop(key, None)
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+            return path
+        except Exception as e:
+            logger.warning(f"⚠️ Aperçu {kind} impossible pour {os.path.basename(source_path)}: {e}")
+            with self._lock:
+                now = time.monotonic()
+                # Échecs expirés oubliés : la table ne grossit pas avec le nombre de fichiers
+                for expired in [k for k, (at, _) in self._failed.items() if now - at >= self.retry_seconds]:
+                    del self._failed[expired]
+                self._failed[key] = (now, str(e))
+                self.stats['errors'] += 1
+            for extension in PREVIEW_FILE_EXTENSIONS:
+                if os.path.exists(tmp_base + extension):
+                    os.remove(tmp_base + extension)
+            return None
+        finally:
+            with self._lock:
+                self._pending.pop(key, None)
+
+    def _evict(self):
+        """Supprime les aperçus les moins récemment utilisés jusqu'à 90 % de la limite"""
+        with self._lock:
+            entries = sorted(self._entries(), key=lambda entry: entry[1])
+            total = sum(size for _, _, size in entries)
+            target = self.max_bytes * 0.9
+            evicted = 0
+            for path, _, size in entries:
+                if total <= target:
+                    break
+                try:
+                    os.remove(path)
+                    total -= size
+                    evicted += 1
+                except OSError:
+                    pass
+            self._total_bytes = total
+            self.stats['evicted'] += evicted
+        if evicted:
+            logger.info(f"🧹 Cache d'aperçus: {evicted} aperçu(s) supprimé(s) ({total / (1024*1024):.1f} MB)")
+
+    def get_info(self) -> Dict[str, float]:
+        return {
+            'size_mb': round(self._total_bytes / (1024 * 1024), 2),
+            'max_mb': round(self.max_bytes / (1024 * 1024), 2),
+            **self.stats,
+        }
+
+
+# =========================================================================
+# COMPTEURS DE PRÉVISUALISATIONS
+# =========================================================================
+
+class PreviewCounterBuffer:
+    """
+    Compteurs preview_count accumulés en mémoire et écrits par lots
+    (une transaction pour COUNTER_FLUSH_SIZE vues ou toutes les COUNTER_FLUSH_SECONDS).
+    """
+
+    def __init__(self, db, flush_size: int = COUNTER_FLUSH_SIZE, flush_seconds: float = COUNTER_FLUSH_SECONDS):
+        self.db = db
+        self.flush_size = flush_size
+        self.flush_seconds = flush_seconds
+        self._counts: Dict[int, int] = {}
+        self._lock = threading.Lock()
+        self._last_flush = time.monotonic()
+        atexit.register(self.flush)
+
+    def record(self, attachment_id: int):
+        with self._lock:
+            self._counts[attachment_id] = self._counts.get(attachment_id, 0) + 1
+            due = (sum(self._counts.values()) >= self.flush_size
+                   or time.monotonic() - self._last_flush >= self.flush_seconds)
+        if due:
+            self.flush()
+
+    def pending(self, attachment_id: int) -> int:
+        """Vues pas encore écrites en base (à ajouter à preview_count pour l'affichage)"""
+        return self._counts.get(attachment_id, 0)
+
+    def flush(self) -> int:
+        """Écrit les compteurs en attente ; retourne le nombre de vues écrites"""
+        with self._lock:
+            counts, self._counts = self._counts, {}
+            self._last_flush = time.monotonic()
+        if not counts:
+            return 0
+        try:
+            with self.db.write_transaction('project_attachments') as conn:
+                conn.executemany(
+                    "UPDATE project_attachments SET preview_count = preview_count + ? WHERE id = ?",
+                    [(count, attachment_id) for attachment_id, count in counts.items()]
+                )
+            return sum(counts.values())
+        except Exception as e:
+            logger.warning(f"⚠️ Écriture des compteurs d'aperçus reportée: {e}")
+            with self._lock:
+                for attachment_id, count in counts.items():
+                    self._counts[attachment_id] = self._counts.get(attachment_id, 0) + count
+            return 0
+
+
+def fallback_preview_key(file_path: str) -> str:
+    """Clé de cache des pièces jointes sans empreinte de contenu (anciennes lignes)"""
+    try:
+        stat = os.stat(file_path)
+        signature = f"{os.path.abspath(file_path)}:{stat.st_size}:{stat.st_mtime_ns}"
+    except OSError:
+        signature = os.path.abspath(file_path)
+    return hashlib.sha256(signature.encode('utf-8')).hexdigest()
@@ -11,9 +11,60 @@ import hashlib
 import shutil
 from typing import List, Dict, Optional, Tuple
 import base64
+import threading
 from PIL import Image
 import io
 
+from attachment_previews import PreviewCache, PreviewCounterBuffer, preview_kind, fallback_preview_key
+
+
+# Stockage adressé par contenu : un fichier par contenu distinct, blobs/<ab>/<cd>/<sha256>,
+# partagé par toutes les pièces jointes (tous projets) qui ont ce contenu
+BLOBS_SUBDIR = 'blobs'
+
+# Taille des morceaux lus / hachés / écrits pendant l'upload
+BLOB_CHUNK_SIZE = 1024 * 1024
+
+# Délai avant suppression d'un blob qui n'est plus référencé (ATTACHMENTS_GC_GRACE_DAYS)
+BLOB_GC_GRACE_DAYS = 7
+
+# Compteur de références des blobs tenu à jour par triggers sur project_attachments
+# (seules les pièces jointes actives comptent)
+BLOB_REFCOUNT_TRIGGERS = [
+    """
+    CREATE TRIGGER IF NOT EXISTS trigger_attachment_blob_ref_insert
+    AFTER INSERT ON project_attachments
+    FOR EACH ROW WHEN NEW.is_active = 1
+    BEGIN
+        UPDATE attachment_blobs SET ref_count = ref_count + 1, zero_ref_since = NULL
+        WHERE sha256 = NEW.file_hash;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trigger_attachment_blob_ref_update
+    AFTER UPDATE OF is_active, file_hash ON project_attachments
+    FOR EACH ROW
+    BEGIN
+        UPDATE attachment_blobs SET ref_count = ref_count - 1,
+               zero_ref_since = CASE WHEN ref_count - 1 <= 0 THEN CURRENT_TIMESTAMP ELSE zero_ref_since END
+        WHERE OLD.is_active = 1 AND sha256 = OLD.file_hash;
+        UPDATE attachment_blobs SET ref_count = ref_count + 1, zero_ref_since = NULL
+        WHERE NEW.is_active = 1 AND sha256 = NEW.file_hash;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trigger_attachment_blob_ref_delete
+    AFTER DELETE ON project_attachments
+    FOR EACH ROW WHEN OLD.is_active = 1
+    BEGIN
+        UPDATE attachment_blobs SET ref_count = ref_count - 1,
+               zero_ref_since = CASE WHEN ref_count - 1 <= 0 THEN CURRENT_TIMESTAMP ELSE zero_ref_since END
+        WHERE sha256 = OLD.file_hash;
+    END
+    """,
+]
+
+
 class AttachmentsManager:
     """
     Gestionnaire de pièces jointes pour les projets ERP DG Inc.
@@ -26,6 +77,10 @@ class AttachmentsManager:
         
         # CORRIGÉ : Configuration robuste pour Render
         self.base_upload_dir = self._get_upload_directory()
+        self.blobs_dir = os.path.join(self.base_upload_dir, BLOBS_SUBDIR)
+        self.blobs_tmp_dir = os.path.join(self.blobs_dir, 'tmp')
+        # Sérialise placement des blobs et ramasse-miettes (gestionnaire partagé entre sessions)
+        self._blob_lock = threading.Lock()
         self._ensure_upload_directory()
         self._init_database_table()
         
@@ -35,6 +90,13 @@ class AttachmentsManager:
         # NOUVEAU : Nettoyer les liens brisés
         self._cleanup_broken_attachments()
         
+        # Fichiers de l'ancien stockage (un fichier par pièce jointe) → blobs
+        self._migrate_legacy_files()
+        
+        # Aperçus précalculés (cache disque borné par empreinte) et compteurs de vues groupés
+        self.preview_cache = PreviewCache(os.path.join(self.base_upload_dir, 'previews'))
+        self.preview_counters = PreviewCounterBuffer(self.db)
+        
         # Types de fichiers autorisés avec leurs catégories
         self.allowed_file_types = {
             # Documents
@@ -200,6 +262,7 @@ class AttachmentsManager:
             current_month = datetime.now().month
             monthly_dir = os.path.join(self.base_upload_dir, str(current_year), f"{current_month:02d}")
             Path(monthly_dir).mkdir(parents=True, exist_ok=True)
+            Path(self.blobs_tmp_dir).mkdir(parents=True, exist_ok=True)
         except Exception as e:
             print(f"❌ Erreur création répertoire upload: {e}")
             st.error(f"❌ Erreur création répertoire upload: {e}")
@@ -237,11 +300,28 @@ class AttachmentsManager:
             except:
                 pass  # Colonne existe déjà
             
+            # Contenus stockés (blobs) et nombre de pièces jointes actives qui les référencent
+            self.db.execute_update("""
+            CREATE TABLE IF NOT EXISTS attachment_blobs (
+                sha256 TEXT PRIMARY KEY,
+                file_size INTEGER NOT NULL,
+                ref_count INTEGER NOT NULL DEFAULT 0,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                zero_ref_since TIMESTAMP
+            )
+            """)
+            
+            for trigger in BLOB_REFCOUNT_TRIGGERS:
+                self.db.execute_update(trigger)
+            
             # Index pour performance
             index_queries = [
                 "CREATE INDEX IF NOT EXISTS idx_project_attachments_project_id ON project_attachments(project_id)",
                 "CREATE INDEX IF NOT EXISTS idx_project_attachments_category ON project_attachments(category)",
-                "CREATE INDEX IF NOT EXISTS idx_project_attachments_upload_date ON project_attachments(upload_date)"
+                "CREATE INDEX IF NOT EXISTS idx_project_attachments_upload_date ON project_attachments(upload_date)",
+                "CREATE INDEX IF NOT EXISTS idx_project_attachments_file_hash ON project_attachments(file_hash)",
+                # Candidats du ramasse-miettes uniquement
+                "CREATE INDEX IF NOT EXISTS idx_attachment_blobs_unreferenced ON attachment_blobs(zero_ref_since) WHERE ref_count <= 0"
             ]
             
             for query in index_queries:
@@ -270,6 +350,7 @@ class AttachmentsManager:
                 if not os.path.exists(file_path):
                     # Essayer de trouver le fichier dans d'anciens répertoires
                     filename = os.path.basename(file_path)
+                    blob_hash = filename if self._is_blob_hash(filename) else None
                     
                     # Chemins potentiels de migration
                     potential_paths = [
@@ -284,7 +365,7 @@ class AttachmentsManager:
                         if os.path.exists(old_path):
                             try:
                                 # Créer le nouveau répertoire si nécessaire
-                                new_path = os.path.join(self.base_upload_dir, filename)
+                                new_path = self._blob_path(blob_hash) if blob_hash else os.path.join(self.base_upload_dir, filename)
                                 os.makedirs(os.path.dirname(new_path), exist_ok=True)
                                 
                                 # Copier le fichier
@@ -330,9 +411,134 @@ class AttachmentsManager:
         except Exception as e:
             print(f"❌ Erreur nettoyage: {e}")
     
-    def _calculate_file_hash(self, file_content: bytes) -> str:
-        """Calcule le hash MD5 du fichier pour détecter les doublons"""
-        return hashlib.md5(file_content).hexdigest()
+    @staticmethod
+    def _is_blob_hash(name: str) -> bool:
+        return len(name) == 64 and all(c in '0123456789abcdef' for c in name)
+    
+    def _blob_path(self, file_hash: str) -> str:
+        """Chemin du blob d'un contenu (SHA-256)"""
+        return os.path.join(self.blobs_dir, file_hash[:2], file_hash[2:4], file_hash)
+    
+    def _write_temp_blob(self, stream, max_size: Optional[int] = None) -> Tuple[str, int, str]:
+        """
+        Copie un flux dans un fichier temporaire par morceaux en calculant son SHA-256
+        (le contenu n'est jamais entièrement en mémoire)
+        
+        Returns:
+            (sha256, taille, chemin temporaire) - l'appelant place ou supprime le fichier
+        """
+        os.makedirs(self.blobs_tmp_dir, exist_ok=True)
+        tmp_path = os.path.join(self.blobs_tmp_dir, f"{uuid.uuid4().hex}.part")
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            with open(tmp_path, 'wb') as f:
+                while True:
+                    chunk = stream.read(BLOB_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    size += len(chunk)
+                    if max_size is not None and size > max_size:
+                        raise ValueError(f"Fichier trop volumineux. Taille max: {max_size / (1024*1024):.0f} MB")
+                    digest.update(chunk)
+                    f.write(chunk)
+        except Exception:
+            os.remove(tmp_path)
+            raise
+        return digest.hexdigest(), size, tmp_path
+    
+    def _place_blob(self, tmp_path: str, blob_path: str):
+        """
+        Place le contenu du fichier temporaire à blob_path (lien physique, sinon copie) :
+        le fichier temporaire reste disponible jusqu'à la fin de _commit_blob.
+        """
+        os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+        staging_path = os.path.join(self.blobs_tmp_dir, f"{uuid.uuid4().hex}.place")
+        try:
+            os.link(tmp_path, staging_path)
+        except OSError:
+            shutil.copyfile(tmp_path, staging_path)
+        os.replace(staging_path, blob_path)
+    
+    def _commit_blob(self, file_hash: str, file_size: int, tmp_path: str, write):
+        """
+        Place le blob s'il n'existe pas encore, puis enregistre le blob et exécute
+        write(conn, blob_path) dans la même transaction (les triggers tiennent ref_count à jour).
+        Un blob placé par cet appel est retiré si la transaction échoue.
+        Le fichier temporaire est supprimé par l'appelant.
+        
+        Returns:
+            Résultat de write
+        """
+        blob_path = self._blob_path(file_hash)
+        with self._blob_lock:
+            created = not os.path.exists(blob_path)
+            if created:
+                self._place_blob(tmp_path, blob_path)
+            try:
+                with self.db.write_transaction('project_attachments', 'attachment_blobs') as conn:
+                    conn.execute(
+                        """INSERT INTO attachment_blobs (sha256, file_size, ref_count, zero_ref_since)
+                           VALUES (?, ?, 0, CURRENT_TIMESTAMP)
+                           ON CONFLICT(sha256) DO NOTHING""",
+                        (file_hash, file_size)
+                    )
+                    result = write(conn, blob_path)
+            except Exception:
+                if created and os.path.exists(blob_path):
+                    os.remove(blob_path)
+                raise
+            
+            # _blob_lock ne protège que ce processus : le ramasse-miettes d'un autre processus
+            # a pu supprimer le blob avant la transaction. La référence est maintenant validée
+            # (le blob ne sera plus ramassé) : le fichier est replacé s'il manque.
+            if not os.path.exists(blob_path):
+                print(f"⚠️ Blob {file_hash[:12]} supprimé pendant l'enregistrement, replacé")
+                self._place_blob(tmp_path, blob_path)
+            return result
+    
+    def _migrate_legacy_files(self):
+        """Déplace les fichiers de l'ancien stockage (un fichier par pièce jointe) vers les blobs"""
+        try:
+            prefix = os.path.join(self.blobs_dir, '')
+            legacy = self.db.execute_query(
+                "SELECT id, file_path FROM project_attachments WHERE is_active = 1 AND substr(file_path, 1, ?) != ?",
+                (len(prefix), prefix)
+            )
+            if not legacy:
+                return
+            
+            migrated = 0
+            for attachment in legacy:
+                old_path = attachment['file_path']
+                if not os.path.exists(old_path):
+                    continue
+                try:
+                    with open(old_path, 'rb') as f:
+                        file_hash, file_size, tmp_path = self._write_temp_blob(f)
+                    try:
+                        self._commit_blob(file_hash, file_size, tmp_path, lambda conn, blob_path: conn.execute(
+                            "UPDATE project_attachments SET file_hash = ?, file_path = ? WHERE id = ?",
+                            (file_hash, blob_path, attachment['id'])
+                        ))
+                    finally:
+                        if os.path.exists(tmp_path):
+                            os.remove(tmp_path)
+                    
+                    still_used = self.db.execute_query(
+                        "SELECT 1 FROM project_attachments WHERE file_path = ? LIMIT 1", (old_path,)
+                    )
+                    if not still_used:
+                        os.remove(old_path)
+                    migrated += 1
+                except Exception as e:
+                    print(f"⚠️ Erreur migration blob {old_path}: {e}")
+            
+            if migrated:
+                print(f"🔄 {migrated} pièce(s) jointe(s) migrée(s) vers le stockage par contenu")
+                
+        except Exception as e:
+            print(f"❌ Erreur migration stockage par contenu: {e}")
     
     def _get_file_category(self, file_extension: str) -> str:
         """Détermine la catégorie d'un fichier selon son extension"""
@@ -358,13 +564,6 @@ class AttachmentsManager:
         
         return safe_filename
     
-    def _get_file_storage_path(self, filename: str) -> str:
-        """Génère le chemin de stockage du fichier"""
-        current_year = datetime.now().year
-        current_month = datetime.now().month
-        monthly_dir = os.path.join(self.base_upload_dir, str(current_year), f"{current_month:02d}")
-        return os.path.join(monthly_dir, filename)
-    
     def is_file_allowed(self, filename: str) -> Tuple[bool, str]:
         """Vérifie si un fichier est autorisé"""
         file_extension = Path(filename).suffix.lower().lstrip('.')
@@ -407,58 +606,62 @@ class AttachmentsManager:
                 st.error(message)
                 return None
             
-            # Lire le contenu du fichier
-            file_content = uploaded_file.read()
-            file_hash = self._calculate_file_hash(file_content)
-            
-            # Vérifier si le fichier existe déjà pour ce projet
-            existing_file = self.db.execute_query(
-                "SELECT id, original_filename FROM project_attachments WHERE project_id = ? AND file_hash = ? AND is_active = 1",
-                (project_id, file_hash)
-            )
-            
-            if existing_file:
-                st.warning(f"Fichier identique déjà attaché: {existing_file[0]['original_filename']}")
-                return existing_file[0]['id']
+            # Copie par morceaux + SHA-256 (le contenu n'est pas chargé en mémoire)
+            if hasattr(uploaded_file, 'seek'):
+                uploaded_file.seek(0)
+            try:
+                file_hash, file_size, tmp_path = self._write_temp_blob(uploaded_file, self.max_file_size)
+            except ValueError as e:
+                st.error(str(e))
+                return None
             
-            # Générer nom de fichier unique et chemin
+            # Nom affiché unique ; le fichier est stocké une seule fois par contenu (tous projets)
             safe_filename = self._generate_unique_filename(uploaded_file.name, project_id)
-            file_path = self._get_file_storage_path(safe_filename)
-            
-            # S'assurer que le répertoire existe
-            os.makedirs(os.path.dirname(file_path), exist_ok=True)
-            
-            # Sauvegarder le fichier
-            with open(file_path, 'wb') as f:
-                f.write(file_content)
             
             # Déterminer catégorie et type MIME
             file_extension = Path(uploaded_file.name).suffix.lower()
             category = self._get_file_category(file_extension)
             mime_type, _ = mimetypes.guess_type(uploaded_file.name)
             
-            # Insérer en base de données
-            insert_query = """
-                INSERT INTO project_attachments 
-                (project_id, filename, original_filename, file_size, file_type, file_extension,
-                 category, description, file_path, file_hash, uploaded_by)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """
+            def attach(conn, blob_path):
+                # Vérifier si le fichier existe déjà pour ce projet
+                existing_file = conn.execute(
+                    "SELECT id, original_filename FROM project_attachments WHERE project_id = ? AND file_hash = ? AND is_active = 1",
+                    (project_id, file_hash)
+                ).fetchone()
+                if existing_file:
+                    return existing_file[0], existing_file[1]
+                
+                # Insérer en base de données
+                cursor = conn.execute("""
+                    INSERT INTO project_attachments 
+                    (project_id, filename, original_filename, file_size, file_type, file_extension,
+                     category, description, file_path, file_hash, uploaded_by)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """, (
+                    project_id, safe_filename, uploaded_file.name, file_size,
+                    mime_type or 'application/octet-stream', file_extension,
+                    category, description, blob_path, file_hash, uploaded_by
+                ))
+                return cursor.lastrowid, None
             
-            attachment_id = self.db.execute_insert(insert_query, (
-                project_id, safe_filename, uploaded_file.name, uploaded_file.size,
-                mime_type or 'application/octet-stream', file_extension,
-                category, description, file_path, file_hash, uploaded_by
-            ))
+            try:
+                attachment_id, existing_name = self._commit_blob(file_hash, file_size, tmp_path, attach)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+            
+            if existing_name:
+                st.warning(f"Fichier identique déjà attaché: {existing_name}")
+                return attachment_id
             
             if attachment_id:
+                # Aperçu généré en arrière-plan dès l'upload
+                self.preview_cache.schedule(file_hash, file_extension, self._blob_path(file_hash))
                 st.success(f"✅ Fichier '{uploaded_file.name}' attaché avec succès!")
                 return attachment_id
             else:
                 st.error("Erreur lors de l'enregistrement en base")
-                # Nettoyer le fichier uploadé en cas d'erreur DB
-                if os.path.exists(file_path):
-                    os.remove(file_path)
                 return None
                 
         except Exception as e:
@@ -476,8 +679,10 @@ class AttachmentsManager:
                 ORDER BY upload_date DESC
             """
             
-            attachments = self.db.execute_query(query, (project_id,))
-            return [dict(attachment) for attachment in attachments] if attachments else []
+            attachments = [dict(attachment) for attachment in self.db.execute_query(query, (project_id,)) or []]
+            for attachment in attachments:
+                attachment['preview_count'] = (attachment['preview_count'] or 0) + self.preview_counters.pending(attachment['id'])
+            return attachments
             
         except Exception as e:
             st.error(f"Erreur récupération pièces jointes: {e}")
@@ -517,11 +722,9 @@ class AttachmentsManager:
             
             file_extension = attachment['file_extension'].lower().lstrip('.')
             
-            # Mettre à jour le compteur de prévisualisations
-            self.db.execute_update(
-                "UPDATE project_attachments SET preview_count = preview_count + 1 WHERE id = ?",
-                (attachment_id,)
-            )
+            # Compteur de prévisualisations (écrit en base par lots)
+            self.preview_counters.record(attachment_id)
+            attachment['preview_count'] = (attachment.get('preview_count') or 0) + self.preview_counters.pending(attachment_id)
             
             preview_data = {
                 'attachment': attachment,
@@ -530,31 +733,27 @@ class AttachmentsManager:
                 'error': None
             }
             
-            # Gestion selon le type de fichier
-            if file_extension in ['jpg', 'jpeg', 'png', 'gif', 'bmp', 'webp']:
-                preview_data['preview_type'] = 'image'
-                preview_data['content'] = file_path
-                
-            elif file_extension in ['txt', 'md', 'csv', 'json', 'xml']:
-                preview_data['preview_type'] = 'text'
-                try:
-                    # Lire le fichier texte (limité à 10KB pour éviter les problèmes)
-                    with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-                        content = f.read(10240)  # 10KB max
-                        if len(content) == 10240:
-                            content += "\n\n... (fichier tronqué pour l'aperçu)"
-                        preview_data['content'] = content
-                except Exception as e:
-                    preview_data['error'] = f"Erreur lecture fichier texte: {e}"
-                    
-            elif file_extension == 'pdf':
-                preview_data['preview_type'] = 'pdf'
-                # Pour PDF, on retourne le chemin du fichier pour téléchargement/affichage
-                preview_data['content'] = file_path
-                
-            else:
+            kind = preview_kind(file_extension)
+            if not kind:
                 preview_data['preview_type'] = 'unsupported'
                 preview_data['error'] = f"Aperçu non supporté pour les fichiers .{file_extension}"
+                return preview_data
+            
+            # Aperçu précalculé (miniature, extrait texte, 1re page PDF), généré si absent
+            file_key = attachment.get('file_hash') or fallback_preview_key(file_path)
+            preview = self.preview_cache.get(file_key, file_extension, file_path)
+            preview_data['preview_type'] = kind
+            
+            if preview['status'] == 'pending':
+                preview_data['preview_type'] = 'pending'
+            elif preview['status'] != 'ok':
+                preview_data['error'] = f"Erreur génération aperçu: {preview['error']}"
+            elif kind == 'text':
+                with open(preview['path'], 'r', encoding='utf-8') as f:
+                    preview_data['content'] = f.read()
+            else:
+                preview_data['content'] = preview['path']
+                preview_data['preview_format'] = Path(preview['path']).suffix.lstrip('.')
             
             return preview_data
             
@@ -610,10 +809,8 @@ class AttachmentsManager:
                 (attachment_id,)
             )
             
-            # Optionnel: supprimer le fichier physique
-            # (commenté pour conserver une trace)
-            # if os.path.exists(attachment['file_path']):
-            #     os.remove(attachment['file_path'])
+            # Le fichier (blob) n'est pas supprimé ici : d'autres pièces jointes peuvent partager
+            # ce contenu ; cleanup_orphaned_files le libère quand plus aucune ne le référence
             
             st.success(f"Pièce jointe '{attachment['original_filename']}' supprimée")
             return True
@@ -718,35 +915,80 @@ class AttachmentsManager:
             health_info['active_attachments'] = 0
             health_info['broken_attachments'] = 0
         
+        # Stockage par contenu : fichiers distincts et blobs en attente du ramasse-miettes
+        try:
+            blobs = self.db.execute_query("""
+                SELECT COUNT(*) as total, COALESCE(SUM(file_size), 0) as total_size,
+                       COUNT(CASE WHEN ref_count <= 0 THEN 1 END) as unreferenced
+                FROM attachment_blobs
+            """)
+            if blobs:
+                health_info['blob_count'] = blobs[0]['total']
+                health_info['blob_size_mb'] = round(blobs[0]['total_size'] / (1024 * 1024), 2)
+                health_info['unreferenced_blobs'] = blobs[0]['unreferenced']
+        except:
+            health_info['blob_count'] = 0
+            health_info['blob_size_mb'] = 0
+            health_info['unreferenced_blobs'] = 0
+        
+        health_info['preview_cache'] = self.preview_cache.get_info()
+        
         return health_info
     
-    def cleanup_orphaned_files(self):
-        """Nettoie les fichiers orphelins (non référencés en base)"""
+    def cleanup_orphaned_files(self, grace_days: Optional[int] = None) -> Dict[str, int]:
+        """
+        Ramasse-miettes des blobs piloté par les compteurs de références : supprime les
+        contenus qu'aucune pièce jointe active ne référence depuis grace_days jours
+        (ATTACHMENTS_GC_GRACE_DAYS, défaut 7), sans parcourir le répertoire d'upload.
+        Supprime aussi les fichiers temporaires d'uploads interrompus.
+        
+        Returns:
+            blobs_deleted, bytes_freed, temp_files_deleted
+        """
+        result = {'blobs_deleted': 0, 'bytes_freed': 0, 'temp_files_deleted': 0}
+        if grace_days is None:
+            grace_days = int(os.environ.get('ATTACHMENTS_GC_GRACE_DAYS', BLOB_GC_GRACE_DAYS))
+        
         try:
-            # Récupérer tous les chemins de fichiers en base
-            query = "SELECT file_path FROM project_attachments WHERE is_active = 1"
-            db_files = self.db.execute_query(query)
-            db_file_paths = {row['file_path'] for row in db_files} if db_files else set()
-            
-            # Scanner le répertoire d'upload
-            orphaned_count = 0
-            for root, dirs, files in os.walk(self.base_upload_dir):
-                for file in files:
-                    file_path = os.path.join(root, file)
-                    if file_path not in db_file_paths:
-                        # Fichier orphelin trouvé
-                        st.warning(f"Fichier orphelin détecté: {file_path}")
-                        orphaned_count += 1
-                        # Optionnel: supprimer automatiquement
-                        # os.remove(file_path)
-            
-            if orphaned_count == 0:
-                st.success("Aucun fichier orphelin détecté")
-            else:
-                st.info(f"{orphaned_count} fichier(s) orphelin(s) détecté(s)")
+            with self._blob_lock:
+                # Ligne et fichier supprimés dans la même transaction (BEGIN IMMEDIATE) : aucun
+                # processus ne peut référencer le blob entre la vérification et la suppression
+                with self.db.write_transaction('attachment_blobs') as conn:
+                    unreferenced = conn.execute(
+                        "SELECT sha256, file_size FROM attachment_blobs "
+                        "WHERE ref_count <= 0 AND zero_ref_since <= datetime('now', ?)",
+                        (f'-{grace_days} days',)
+                    ).fetchall()
+                    
+                    for file_hash, file_size in unreferenced:
+                        deleted = conn.execute(
+                            "DELETE FROM attachment_blobs WHERE sha256 = ? AND ref_count <= 0", (file_hash,)
+                        ).rowcount
+                        if not deleted:
+                            continue
+                        blob_path = self._blob_path(file_hash)
+                        if os.path.exists(blob_path):
+                            os.remove(blob_path)
+                            result['bytes_freed'] += file_size
+                        result['blobs_deleted'] += 1
+                
+                # Uploads interrompus (plus d'un jour)
+                if os.path.isdir(self.blobs_tmp_dir):
+                    cutoff = datetime.now().timestamp() - 86400
+                    for entry in os.scandir(self.blobs_tmp_dir):
+                        if entry.is_file() and entry.stat().st_mtime < cutoff:
+                            os.remove(entry.path)
+                            result['temp_files_deleted'] += 1
+            
+            if result['blobs_deleted'] or result['temp_files_deleted']:
+                print(f"🗑️ Ramasse-miettes pièces jointes: {result['blobs_deleted']} blob(s), "
+                      f"{self.format_file_size(result['bytes_freed'])} libéré(s), "
+                      f"{result['temp_files_deleted']} fichier(s) temporaire(s)")
                 
         except Exception as e:
-            st.error(f"Erreur nettoyage: {e}")
+            print(f"❌ Erreur ramasse-miettes pièces jointes: {e}")
+        
+        return result
 
 
 def show_file_preview_modal(attachments_manager: AttachmentsManager, attachment_id: int):
@@ -786,6 +1028,9 @@ def show_file_preview_modal(attachments_manager: AttachmentsManager, attachment_
     if error:
         st.error(f"❌ {error}")
         
+    elif preview_type == 'pending':
+        st.info("⏳ Aperçu en cours de génération, réessayez dans quelques instants")
+        
     elif preview_type == 'image':
         try:
             st.image(content, caption=attachment['original_filename'], use_column_width=True)
@@ -808,11 +1053,15 @@ def show_file_preview_modal(attachments_manager: AttachmentsManager, attachment_
         
         st.code(content, language=language)
         
+    elif preview_type == 'pdf' and preview_data.get('preview_format') == 'png':
+        st.markdown("**📄 Aperçu de la première page:**")
+        st.image(content, caption=attachment['original_filename'], use_column_width=True)
+        
     elif preview_type == 'pdf':
-        st.markdown("**📄 Aperçu du fichier PDF:**")
+        st.markdown("**📄 Aperçu de la première page:**")
         
         try:
-            # Lire le fichier PDF
+            # Lire la première page extraite (PDF d'une page)
             with open(content, 'rb') as pdf_file:
                 pdf_content = pdf_file.read()
             
@@ -1100,6 +1349,24 @@ def show_attachments_health_dashboard(attachments_manager):
         persistent_status = "✅ OUI" if health['is_persistent'] else "❌ NON"
         st.metric("💾 Persistant", persistent_status)
     
+    # Stockage par contenu (dédupliqué entre projets)
+    st.caption(f"🧬 {health.get('blob_count', 0)} fichier(s) distinct(s) stocké(s) - "
+               f"{health.get('blob_size_mb', 0)} MB sur disque")
+    preview_cache = health.get('preview_cache')
+    if preview_cache:
+        st.caption(f"🖼️ Cache d'aperçus: {preview_cache['size_mb']} / {preview_cache['max_mb']} MB")
+    
+    if health.get('unreferenced_blobs', 0) > 0:
+        if st.button(f"🗑️ Libérer l'espace ({health['unreferenced_blobs']} fichier(s) non référencé(s))",
+                    help="Supprime les fichiers qu'aucune pièce jointe ne référence depuis le délai de grâce (ATTACHMENTS_GC_GRACE_DAYS)",
+                    key="cleanup_unreferenced_blobs"):
+            gc_result = attachments_manager.cleanup_orphaned_files()
+            if gc_result['blobs_deleted']:
+                st.success(f"✅ {gc_result['blobs_deleted']} fichier(s) supprimé(s) - "
+                           f"{attachments_manager.format_file_size(gc_result['bytes_freed'])} libéré(s)")
+            else:
+                st.info("Aucun fichier à supprimer (délai de grâce non écoulé)")
+    
     # Informations détaillées
     with st.expander("📋 Détails Configuration", expanded=broken > 0):
         st.markdown(f"**📁 Répertoire stockage:** `{health['upload_directory']}`")
@@ -0,0 +1,431 @@
+# backup_chunks.py - Sauvegardes incrémentales dédupliquées de la base SQLite
+# ERP Production DG Inc. - Blocs alignés sur les pages, regroupés en paquets, manifeste par instantané
+
+import os
+import json
+import zlib
+import sqlite3
+import hashlib
+import logging
+import tempfile
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Iterator, Tuple, Any
+
+logger = logging.getLogger(__name__)
+
+
+MANIFEST_FORMAT = 'erp-dg-chunks-v1'
+
+# SQLite modifie ses pages sur place : un bloc aligné sur les pages reste identique d'un
+# instantané à l'autre tant qu'aucune de ses pages ne change. Des blocs petits suivent
+# finement les écritures dispersées (index) ; ils sont regroupés en paquets pour limiter
+# le nombre d'objets envoyés.
+DEFAULT_CHUNK_SIZE = 16 * 1024
+
+DEFAULT_COMPRESSION_LEVEL = 6
+
+# Taille maximale d'un paquet (borne la mémoire de restauration et la taille des envois)
+DEFAULT_PACK_SIZE = 32 * 1024 * 1024
+
+# Un paquet dont moins de cette fraction est encore utilisée voit ses blocs vivants
+# réécrits dans le nouveau paquet : il pourra être supprimé à l'expiration des anciens instantanés
+PACK_MIN_LIVE_RATIO = 0.5
+
+
+def chunk_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+# =========================================================================
+# STOCKAGE DES PAQUETS ET MANIFESTES
+# =========================================================================
+
+class ChunkStore:
+    """
+    Stockage distant des sauvegardes : paquets de blocs compressés (objets immuables)
+    et manifestes nommés décrivant chaque instantané.
+    """
+
+    def put_pack(self, pack_id: str, path: str):
+        """Envoie le fichier paquet local path"""
+        raise NotImplementedError
+
+    def get_pack(self, pack_id: str) -> bytes:
+        raise NotImplementedError
+
+    def list_packs(self) -> List[str]:
+        raise NotImplementedError
+
+    def delete_pack(self, pack_id: str):
+        raise NotImplementedError
+
+    def put_manifest(self, name: str, data: bytes):
+        raise NotImplementedError
+
+    def get_manifest(self, name: str) -> bytes:
+        raise NotImplementedError
+
+    def list_manifests(self) -> List[str]:
+        """Noms des manifestes, du plus ancien au plus récent (noms horodatés)"""
+        raise NotImplementedError
+
+    def delete_manifest(self, name: str):
+        raise NotImplementedError
+
+    def describe(self) -> str:
+        return self.__class__.__name__
+
+
+class LocalChunkStore(ChunkStore):
+    """Stockage dans un répertoire local (disque monté, tests, copie hors ligne)"""
+
+    def __init__(self, root: str):
+        self.root = Path(root)
+        self.packs_dir = self.root / 'packs'
+        self.manifests_dir = self.root / 'manifests'
+        self.packs_dir.mkdir(parents=True, exist_ok=True)
+        self.manifests_dir.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def _write_atomic(path: Path, data: bytes):
+        tmp_path = path.with_name(path.name + '.tmp')
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def put_pack(self, pack_id: str, path: str):
+        tmp_path = self.packs_dir / f"{pack_id}.tmp"
+        with open(path, 'rb') as src, open(tmp_path, 'wb') as dst:
+            while True:
+                data = src.read(1024 * 1024)
+                if not data:
+                    break
+                dst.write(data)
+        os.replace(tmp_path, self.packs_dir / pack_id)
+
+    def get_pack(self, pack_id: str) -> bytes:
+        return (self.packs_dir / pack_id).read_bytes()
+
+    def list_packs(self) -> List[str]:
+        return [p.name for p in self.packs_dir.iterdir() if not p.name.endswith('.tmp')]
+
+    def delete_pack(self, pack_id: str):
+        (self.packs_dir / pack_id).unlink(missing_ok=True)
+
+    def put_manifest(self, name: str, data: bytes):
+        self._write_atomic(self.manifests_dir / f"{name}.json.z", data)
+
+    def get_manifest(self, name: str) -> bytes:
+        return (self.manifests_dir / f"{name}.json.z").read_bytes()
+
+    def list_manifests(self) -> List[str]:
+        return sorted(p.name[:-len('.json.z')] for p in self.manifests_dir.glob('*.json.z'))
+
+    def delete_manifest(self, name: str):
+        (self.manifests_dir / f"{name}.json.z").unlink(missing_ok=True)
+
+    def describe(self) -> str:
+        return f"répertoire {self.root}"
+
+
+# =========================================================================
+# INSTANTANÉ ET DÉCOUPAGE
+# =========================================================================
+
+def snapshot_database(db_path: str, dest_path: str) -> int:
+    """
+    Copie cohérente de la base (API backup : inclut les pages encore dans le WAL),
+    repassée en journal DELETE pour être autonome.
+
+    Returns:
+        Taille de page SQLite
+    """
+    source_conn = sqlite3.connect(db_path, timeout=30)
+    backup_conn = sqlite3.connect(dest_path)
+    try:
+        with backup_conn:
+            source_conn.backup(backup_conn)
+        backup_conn.execute("PRAGMA journal_mode = DELETE")
+        page_size = backup_conn.execute("PRAGMA page_size").fetchone()[0]
+
+        # Checkpoint passif de la source pour limiter la croissance du WAL
+        try:
+            source_conn.execute("PRAGMA wal_checkpoint(PASSIVE)")
+        except sqlite3.Error as e:
+            logger.debug(f"Checkpoint WAL source ignoré: {e}")
+        return page_size
+    finally:
+        source_conn.close()
+        backup_conn.close()
+
+
+def aligned_chunk_size(chunk_size: int, page_size: int) -> int:
+    """Taille de bloc arrondie au multiple de la taille de page supérieur"""
+    pages = max(1, -(-chunk_size // page_size))
+    return pages * page_size
+
+
+def iter_file_chunks(path: str, chunk_size: int) -> Iterator[bytes]:
+    with open(path, 'rb') as f:
+        while True:
+            data = f.read(chunk_size)
+            if not data:
+                break
+            yield data
+
+
+def _new_pack_id() -> str:
+    return f"pack_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{os.urandom(4).hex()}"
+
+
+def _live_pack_ratios(manifest: Optional[Dict]) -> Dict[str, float]:
+    """Fraction encore référencée de chaque paquet par le manifeste donné"""
+    if not manifest:
+        return {}
+    live, seen = {}, set()
+    for digest, pack_index, _offset, length in manifest['chunks']:
+        if digest not in seen:
+            seen.add(digest)
+            pack_id = manifest['packs'][pack_index]
+            live[pack_id] = live.get(pack_id, 0) + length
+    return {pack_id: live.get(pack_id, 0) / size for pack_id, size in manifest['pack_sizes'].items() if size}
+
+
+def store_file(store: ChunkStore, path: str, chunk_size: int, previous: Optional[Dict] = None,
+               compression_level: int = DEFAULT_COMPRESSION_LEVEL, pack_size: int = DEFAULT_PACK_SIZE,
+               work_dir: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Découpe un fichier en blocs. Les blocs déjà présents dans l'instantané précédent sont
+    référencés tels quels ; seuls les nouveaux (et ceux des paquets trop peu utilisés)
+    sont compressés et écrits dans de nouveaux paquets.
+
+    Returns:
+        packs, pack_sizes, chunks ([empreinte, paquet, position, longueur]), file_size,
+        sha256, new_chunks, uploaded_bytes
+    """
+    known = {}
+    if previous:
+        ratios = _live_pack_ratios(previous)
+        for digest, pack_index, offset, length in previous['chunks']:
+            pack_id = previous['packs'][pack_index]
+            if ratios.get(pack_id, 0) >= PACK_MIN_LIVE_RATIO:
+                known[digest] = (pack_id, offset, length)
+
+    packs, pack_index_of, pack_sizes = [], {}, {}
+    chunks = []
+    file_digest = hashlib.sha256()
+    file_size, new_chunks, uploaded_bytes = 0, 0, 0
+
+    current = {'id': None, 'path': None, 'file': None, 'size': 0}
+
+    def pack_index(pack_id: str) -> int:
+        if pack_id not in pack_index_of:
+            pack_index_of[pack_id] = len(packs)
+            packs.append(pack_id)
+        return pack_index_of[pack_id]
+
+    def flush_pack():
+        nonlocal uploaded_bytes
+        if current['file'] is None:
+            return
+        current['file'].close()
+        try:
+            store.put_pack(current['id'], current['path'])
+        finally:
+            os.remove(current['path'])
+        pack_sizes[current['id']] = current['size']
+        uploaded_bytes += current['size']
+        current.update(id=None, path=None, file=None, size=0)
+
+    try:
+        for data in iter_file_chunks(path, chunk_size):
+            file_digest.update(data)
+            file_size += len(data)
+            digest = chunk_hash(data)
+
+            if digest not in known:
+                if current['file'] is None:
+                    fd, current['path'] = tempfile.mkstemp(prefix='erp_pack_', dir=work_dir)
+                    current['file'] = os.fdopen(fd, 'wb')
+                    current['id'] = _new_pack_id()
+                compressed = zlib.compress(data, compression_level)
+                known[digest] = (current['id'], current['size'], len(compressed))
+                current['file'].write(compressed)
+                current['size'] += len(compressed)
+                new_chunks += 1
+                if current['size'] >= pack_size:
+                    flush_pack()
+
+            pack_id, offset, length = known[digest]
+            chunks.append([digest, pack_index(pack_id), offset, length])
+
+        flush_pack()
+    finally:
+        if current['file'] is not None:
+            current['file'].close()
+            os.remove(current['path'])
+
+    if previous:
+        for pack_id in packs:
+            if pack_id not in pack_sizes:
+                pack_sizes[pack_id] = previous['pack_sizes'][pack_id]
+
+    return {
+        'packs': packs,
+        'pack_sizes': pack_sizes,
+        'chunks': chunks,
+        'file_size': file_size,
+        'sha256': file_digest.hexdigest(),
+        'new_chunks': new_chunks,
+        'uploaded_bytes': uploaded_bytes,
+    }
+
+
+def create_snapshot(store: ChunkStore, db_path: str, name: Optional[str] = None,
+                    chunk_size: int = DEFAULT_CHUNK_SIZE, compression_level: int = DEFAULT_COMPRESSION_LEVEL,
+                    pack_size: int = DEFAULT_PACK_SIZE, metadata: Optional[Dict] = None,
+                    work_dir: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Sauvegarde incrémentale : instantané cohérent, blocs dédupliqués avec l'instantané
+    précédent, manifeste. Le manifeste est écrit en dernier : un instantané interrompu
+    n'est jamais visible (ses paquets orphelins sont supprimés par prune_snapshots).
+
+    Returns:
+        Manifeste de l'instantané
+    """
+    name = name or f"erp_dg_backup_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+    try:
+        previous = load_manifest(store)
+    except FileNotFoundError:
+        previous = None
+
+    fd, snapshot_path = tempfile.mkstemp(prefix='erp_snapshot_', suffix='.db', dir=work_dir)
+    os.close(fd)
+    try:
+        page_size = snapshot_database(db_path, snapshot_path)
+        chunk_size = aligned_chunk_size(chunk_size, page_size)
+        if previous and previous.get('chunk_size') != chunk_size:
+            previous = None  # Découpage différent : aucun bloc commun
+        result = store_file(store, snapshot_path, chunk_size, previous,
+                            compression_level, pack_size, work_dir)
+    finally:
+        if os.path.exists(snapshot_path):
+            os.remove(snapshot_path)
+
+    manifest = {
+        'format': MANIFEST_FORMAT,
+        'name': name,
+        'created_at': datetime.now().isoformat(),
+        'page_size': page_size,
+        'chunk_size': chunk_size,
+        'compression': 'zlib',
+        'hash': 'sha256',
+        'file_size': result['file_size'],
+        'sha256': result['sha256'],
+        'packs': result['packs'],
+        'pack_sizes': result['pack_sizes'],
+        'chunks': result['chunks'],
+        'new_chunks': result['new_chunks'],
+        'uploaded_bytes': result['uploaded_bytes'],
+        'metadata': metadata or {},
+    }
+    store.put_manifest(name, zlib.compress(json.dumps(manifest, ensure_ascii=False).encode('utf-8')))
+
+    logger.info(f"✅ Instantané {name}: {len(result['chunks'])} blocs, {result['new_chunks']} nouveaux "
+                f"({result['uploaded_bytes'] / (1024*1024):.2f} MB envoyés / "
+                f"{result['file_size'] / (1024*1024):.2f} MB) → {store.describe()}")
+    return manifest
+
+
+# =========================================================================
+# RESTAURATION, RÉTENTION
+# =========================================================================
+
+def load_manifest(store: ChunkStore, name: Optional[str] = None) -> Dict[str, Any]:
+    """Manifeste nommé, ou le plus récent si name est None"""
+    if name is None:
+        manifests = store.list_manifests()
+        if not manifests:
+            raise FileNotFoundError("Aucun instantané dans le stockage de sauvegarde")
+        name = manifests[-1]
+    manifest = json.loads(zlib.decompress(store.get_manifest(name)))
+    if manifest.get('format') != MANIFEST_FORMAT:
+        raise ValueError(f"Format de manifeste inconnu: {manifest.get('format')}")
+    return manifest
+
+
+def restore_snapshot(store: ChunkStore, dest_path: str, name: Optional[str] = None,
+                     work_dir: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Reconstitue la base depuis un manifeste. Chaque paquet est téléchargé une fois
+    (fichier temporaire), chaque bloc et le fichier complet sont vérifiés ; la destination
+    n'est remplacée qu'une fois la reconstitution validée.
+
+    Returns:
+        Manifeste restauré
+    """
+    manifest = load_manifest(store, name)
+    tmp_path = f"{dest_path}.restore_tmp"
+    file_digest = hashlib.sha256()
+
+    with tempfile.TemporaryDirectory(prefix='erp_restore_', dir=work_dir) as packs_dir:
+        pack_paths = {}
+        for pack_id in manifest['packs']:
+            pack_paths[pack_id] = os.path.join(packs_dir, pack_id)
+            with open(pack_paths[pack_id], 'wb') as f:
+                f.write(store.get_pack(pack_id))
+
+        pack_files = {}
+        try:
+            with open(tmp_path, 'wb') as out:
+                for digest, pack_index, offset, length in manifest['chunks']:
+                    pack_id = manifest['packs'][pack_index]
+                    if pack_id not in pack_files:
+                        pack_files[pack_id] = open(pack_paths[pack_id], 'rb')
+                    pack_file = pack_files[pack_id]
+                    pack_file.seek(offset)
+                    data = zlib.decompress(pack_file.read(length))
+                    if chunk_hash(data) != digest:
+                        raise ValueError(f"Bloc corrompu: {digest}")
+                    file_digest.update(data)
+                    out.write(data)
+
+            if file_digest.hexdigest() != manifest['sha256']:
+                raise ValueError("Empreinte du fichier restauré différente du manifeste")
+            os.replace(tmp_path, dest_path)
+        finally:
+            for pack_file in pack_files.values():
+                pack_file.close()
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    logger.info(f"✅ Instantané {manifest['name']} restauré → {dest_path}")
+    return manifest
+
+
+def prune_snapshots(store: ChunkStore, keep: int) -> Tuple[int, int]:
+    """
+    Conserve les `keep` instantanés les plus récents et supprime les paquets
+    qu'aucun manifeste restant ne référence. À exécuter après create_snapshot,
+    jamais en parallèle (les paquets d'un instantané en cours ne sont pas encore référencés).
+
+    Returns:
+        (manifestes supprimés, paquets supprimés)
+    """
+    manifests = store.list_manifests()
+    to_delete = manifests[:-keep] if keep > 0 else manifests
+    for name in to_delete:
+        store.delete_manifest(name)
+
+    referenced = set()
+    for name in store.list_manifests():
+        referenced.update(load_manifest(store, name)['packs'])
+
+    orphans = [pack_id for pack_id in store.list_packs() if pack_id not in referenced]
+    for pack_id in orphans:
+        store.delete_pack(pack_id)
+
+    if to_delete or orphans:
+        logger.info(f"🧹 Rétention sauvegardes: {len(to_delete)} instantané(s), {len(orphans)} paquet(s) supprimé(s)")
+    return len(to_delete), len(orphans)
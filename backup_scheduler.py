@@ -10,10 +10,131 @@ import threading
 import requests
 from datetime import datetime, timedelta
 from pathlib import Path
+from typing import Dict, Optional
+
+from backup_chunks import (
+    ChunkStore, LocalChunkStore, create_snapshot, restore_snapshot, prune_snapshots,
+    DEFAULT_CHUNK_SIZE, DEFAULT_COMPRESSION_LEVEL, DEFAULT_PACK_SIZE
+)
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+
+class GitHubReleaseChunkStore(ChunkStore):
+    """
+    Stockage des sauvegardes incrémentales dans une release GitHub dédiée (tag fixe) :
+    chaque paquet de blocs et chaque manifeste est un asset. GitHub limite une release
+    à 1000 assets ; la rétention (prune_snapshots) supprime les paquets non référencés.
+    """
+    
+    def __init__(self, token: str, repo: str, api_url: str = 'https://api.github.com',
+                 tag: str = 'erp-backup-store'):
+        self.repo = repo
+        self.api_url = api_url
+        self.tag = tag
+        self.headers = {'Authorization': f'token {token}', 'Accept': 'application/vnd.github+json'}
+        
+        release = self._get_or_create_release()
+        self.release_id = release['id']
+        self.upload_url = release['upload_url'].split('{')[0]
+        self.assets = self._list_assets()  # nom → id
+    
+    def _get_or_create_release(self):
+        response = requests.get(f"{self.api_url}/repos/{self.repo}/releases/tags/{self.tag}",
+                                headers=self.headers, timeout=30)
+        if response.status_code == 200:
+            return response.json()
+        if response.status_code != 404:
+            raise RuntimeError(f"Lecture release {self.tag}: {response.status_code} {response.text[:200]}")
+        
+        response = requests.post(
+            f"{self.api_url}/repos/{self.repo}/releases", headers=self.headers, timeout=30,
+            json={
+                'tag_name': self.tag,
+                'name': '🏭 ERP Backup Store (incrémental)',
+                'body': "Blocs dédupliqués et manifestes des sauvegardes incrémentales ERP DG Inc.\n\n"
+                        "Restauration : `backup_scheduler.restore_backup(chemin_destination)`",
+                'draft': False,
+                'prerelease': True
+            }
+        )
+        if response.status_code != 201:
+            raise RuntimeError(f"Création release {self.tag}: {response.status_code} {response.text[:200]}")
+        logger.info(f"📦 Release de stockage créée: {self.tag}")
+        return response.json()
+    
+    def _list_assets(self):
+        assets, page = {}, 1
+        while True:
+            response = requests.get(
+                f"{self.api_url}/repos/{self.repo}/releases/{self.release_id}/assets",
+                headers=self.headers, params={'per_page': 100, 'page': page}, timeout=30
+            )
+            response.raise_for_status()
+            batch = response.json()
+            for asset in batch:
+                assets[asset['name']] = asset['id']
+            if len(batch) < 100:
+                return assets
+            page += 1
+    
+    def _upload(self, asset_name: str, data, content_type: str):
+        response = requests.post(
+            f"{self.upload_url}?name={asset_name}",
+            headers={**self.headers, 'Content-Type': content_type},
+            data=data, timeout=120
+        )
+        if response.status_code != 201:
+            raise RuntimeError(f"Upload {asset_name}: {response.status_code} {response.text[:200]}")
+        self.assets[asset_name] = response.json()['id']
+    
+    def _download(self, asset_name: str) -> bytes:
+        if asset_name not in self.assets:
+            raise FileNotFoundError(asset_name)
+        response = requests.get(
+            f"{self.api_url}/repos/{self.repo}/releases/assets/{self.assets[asset_name]}",
+            headers={**self.headers, 'Accept': 'application/octet-stream'}, timeout=120
+        )
+        response.raise_for_status()
+        return response.content
+    
+    def _delete(self, asset_name: str):
+        asset_id = self.assets.pop(asset_name, None)
+        if asset_id is not None:
+            requests.delete(f"{self.api_url}/repos/{self.repo}/releases/assets/{asset_id}",
+                            headers=self.headers, timeout=30)
+    
+    def put_pack(self, pack_id, path):
+        with open(path, 'rb') as f:
+            self._upload(f"{pack_id}.pack", f, 'application/octet-stream')
+    
+    def get_pack(self, pack_id):
+        return self._download(f"{pack_id}.pack")
+    
+    def list_packs(self):
+        return [name[:-len('.pack')] for name in self.assets if name.endswith('.pack')]
+    
+    def delete_pack(self, pack_id):
+        self._delete(f"{pack_id}.pack")
+    
+    def put_manifest(self, name, data):
+        self._upload(f"manifest-{name}.json.z", data, 'application/octet-stream')
+    
+    def get_manifest(self, name):
+        return self._download(f"manifest-{name}.json.z")
+    
+    def list_manifests(self):
+        return sorted(name[len('manifest-'):-len('.json.z')] for name in self.assets
+                      if name.startswith('manifest-') and name.endswith('.json.z'))
+    
+    def delete_manifest(self, name):
+        self._delete(f"manifest-{name}.json.z")
+    
+    def describe(self):
+        return f"GitHub {self.repo}@{self.tag}"
+
+
 class GitHubBackupManager:
     """Gestionnaire de sauvegardes automatiques vers GitHub Releases - VERSION CORRIGÉE"""
     
@@ -32,6 +153,15 @@ class GitHubBackupManager:
             'keep_github_releases': int(os.environ.get('KEEP_GITHUB_RELEASES', '10')),
             'max_backup_size_mb': int(os.environ.get('MAX_BACKUP_SIZE_MB', '100')),
             
+            # Sauvegarde incrémentale (blocs dédupliqués + manifeste) ou archive ZIP complète
+            'backup_mode': os.environ.get('BACKUP_MODE', 'incremental').lower(),
+            'backup_store_dir': os.environ.get('BACKUP_STORE_DIR'),  # Stockage local au lieu de GitHub
+            'backup_store_tag': os.environ.get('BACKUP_STORE_TAG', 'erp-backup-store'),
+            'chunk_size_kb': int(os.environ.get('BACKUP_CHUNK_KB', str(DEFAULT_CHUNK_SIZE // 1024))),
+            'compression_level': int(os.environ.get('BACKUP_COMPRESSION_LEVEL', str(DEFAULT_COMPRESSION_LEVEL))),
+            'pack_size_mb': int(os.environ.get('BACKUP_PACK_MB', str(DEFAULT_PACK_SIZE // (1024*1024)))),
+            'keep_snapshots': int(os.environ.get('KEEP_BACKUP_SNAPSHOTS', '30')),
+            
             # NOUVELLES VARIABLES DEBUG CORRIGÉES
             'backup_schedule_minutes': int(os.environ.get('BACKUP_SCHEDULE_MINUTES', '120')),
             'immediate_backup_test': os.environ.get('IMMEDIATE_BACKUP_TEST', 'false').lower() == 'true',
@@ -40,7 +170,12 @@ class GitHubBackupManager:
         }
         
         Path(self.config['backup_local_dir']).mkdir(parents=True, exist_ok=True)
-        self._validate_github_config()
+        self._chunk_store = None
+        if self.config['backup_store_dir']:
+            logger.info(f"📁 Sauvegardes incrémentales vers {self.config['backup_store_dir']} (GitHub ignoré)")
+            self.config['github_enabled'] = False
+        else:
+            self._validate_github_config()
         
         # NOUVEAU : Logging debug activé
         if self.config['debug_github_backup']:
@@ -112,12 +247,24 @@ class GitHubBackupManager:
             backup_db_path = os.path.join(self.config['backup_local_dir'], f"{backup_name}.db")
             logger.debug(f"📁 Chemin backup DB: {backup_db_path}")
             
-            source_conn = sqlite3.connect(self.config['db_path'])
+            source_conn = sqlite3.connect(self.config['db_path'], timeout=30)
             backup_conn = sqlite3.connect(backup_db_path)
             
+            # L'API backup lit un instantané cohérent qui inclut les pages encore dans le WAL
             with backup_conn:
                 source_conn.backup(backup_conn)
             
+            # La copie hérite du mode WAL de la source : la repasser en journal DELETE
+            # pour que le fichier .db zippé soit autonome (aucun -wal/-shm à joindre)
+            backup_conn.execute("PRAGMA journal_mode = DELETE")
+            
+            # Checkpoint passif de la source pour limiter la croissance du WAL
+            try:
+                busy, log_frames, checkpointed = source_conn.execute("PRAGMA wal_checkpoint(PASSIVE)").fetchone()
+                logger.debug(f"📋 Checkpoint WAL source: {checkpointed}/{log_frames} pages (busy={busy})")
+            except sqlite3.Error as e:
+                logger.debug(f"Checkpoint WAL source ignoré: {e}")
+            
             source_conn.close()
             backup_conn.close()
             logger.info("✅ Backup SQLite terminé")
@@ -144,7 +291,8 @@ class GitHubBackupManager:
             
             # Compression optimisée
             zip_path = os.path.join(self.config['backup_local_dir'], f"{backup_name}.zip")
-            with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED, compresslevel=9) as zipf:
+            with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED,
+                                 compresslevel=self.config['compression_level']) as zipf:
                 zipf.write(backup_db_path, f"{backup_name}.db")
                 zipf.write(metadata_path, f"{backup_name}_info.json")
                 
@@ -168,6 +316,70 @@ class GitHubBackupManager:
             logger.error(f"📋 Traceback: {traceback.format_exc()}")
             return None
     
+    def get_chunk_store(self) -> Optional[ChunkStore]:
+        """Stockage des sauvegardes incrémentales : répertoire local si configuré, sinon GitHub"""
+        if self._chunk_store is None:
+            if self.config['backup_store_dir']:
+                self._chunk_store = LocalChunkStore(self.config['backup_store_dir'])
+            elif self.config['github_enabled']:
+                self._chunk_store = GitHubReleaseChunkStore(
+                    self.config['github_token'], self.config['github_repo'],
+                    self.config['github_api_url'], self.config['backup_store_tag']
+                )
+        return self._chunk_store
+    
+    def create_incremental_backup(self) -> Optional[Dict]:
+        """
+        Sauvegarde incrémentale : seuls les blocs modifiés depuis les instantanés
+        précédents sont compressés et envoyés, puis un manifeste décrit l'instantané.
+        """
+        try:
+            if not os.path.exists(self.config['db_path']):
+                logger.error(f"❌ Base de données non trouvée: {self.config['db_path']}")
+                return None
+            
+            store = self.get_chunk_store()
+            if store is None:
+                logger.warning("⚠️ Aucun stockage de sauvegarde disponible (GitHub désactivé, BACKUP_STORE_DIR absent)")
+                return None
+            
+            metadata = {
+                'company': 'Desmarais & Gagné Inc.',
+                'database_stats': self._get_database_stats(self.config['db_path']),
+                'render_info': {
+                    'service_id': os.environ.get('RENDER_SERVICE_ID', 'unknown'),
+                    'git_commit': os.environ.get('RENDER_GIT_COMMIT', 'unknown')[:8],
+                    'deploy_id': os.environ.get('RENDER_DEPLOY_ID', 'unknown')
+                }
+            }
+            manifest = create_snapshot(
+                store, self.config['db_path'],
+                chunk_size=self.config['chunk_size_kb'] * 1024,
+                compression_level=self.config['compression_level'],
+                pack_size=self.config['pack_size_mb'] * 1024 * 1024,
+                metadata=metadata, work_dir=self.config['backup_local_dir']
+            )
+            prune_snapshots(store, self.config['keep_snapshots'])
+            return manifest
+            
+        except Exception as e:
+            logger.error(f"❌ Erreur sauvegarde incrémentale: {e}")
+            import traceback
+            logger.error(f"📋 Traceback: {traceback.format_exc()}")
+            return None
+    
+    def restore_incremental_backup(self, dest_path: str, name: Optional[str] = None) -> Optional[Dict]:
+        """Reconstitue la base depuis un instantané (le plus récent par défaut)"""
+        try:
+            store = self.get_chunk_store()
+            if store is None:
+                logger.error("❌ Aucun stockage de sauvegarde disponible")
+                return None
+            return restore_snapshot(store, dest_path, name, work_dir=self.config['backup_local_dir'])
+        except Exception as e:
+            logger.error(f"❌ Erreur restauration: {e}")
+            return None
+    
     def _get_database_stats(self, db_path):
         """Récupère les statistiques complètes de la base"""
         try:
@@ -462,6 +674,14 @@ Sauvegarde automatique de la base de données ERP Production.
         logger.info("🚀 ===== DÉBUT CYCLE SAUVEGARDE GITHUB =====")
         
         try:
+            if self.config['backup_mode'] == 'incremental':
+                manifest = self.create_incremental_backup()
+                if manifest:
+                    logger.info("✅ ===== CYCLE TERMINÉ AVEC SUCCÈS =====")
+                    return True
+                logger.error("❌ ===== CYCLE ÉCHOUÉ =====")
+                return False
+            
             # AMÉLIORATION : Test de validité avant backup
             if not self.config['github_enabled']:
                 logger.warning("⚠️ GitHub backup désactivé - cycle annulé")
@@ -551,6 +771,9 @@ def setup_github_backup_info():
         'GITHUB_REPO': os.environ.get('GITHUB_REPO', 'NON DÉFINI'),
         'KEEP_GITHUB_RELEASES': os.environ.get('KEEP_GITHUB_RELEASES', '10'),
         'BACKUP_SCHEDULE_MINUTES': os.environ.get('BACKUP_SCHEDULE_MINUTES', '120'),
+        'BACKUP_MODE': os.environ.get('BACKUP_MODE', 'incremental'),
+        'BACKUP_STORE_DIR': os.environ.get('BACKUP_STORE_DIR', 'NON DÉFINI'),
+        'KEEP_BACKUP_SNAPSHOTS': os.environ.get('KEEP_BACKUP_SNAPSHOTS', '30'),
         'IMMEDIATE_BACKUP_TEST': os.environ.get('IMMEDIATE_BACKUP_TEST', 'false'),
         'FORCE_BACKUP_ON_START': os.environ.get('FORCE_BACKUP_ON_START', 'false'),
         'DEBUG_GITHUB_BACKUP': os.environ.get('DEBUG_GITHUB_BACKUP', 'false')
@@ -560,22 +783,46 @@ def setup_github_backup_info():
     for var, value in config_vars.items():
         logger.info(f"   {var}: {value}")
     
-    if not os.environ.get('GITHUB_TOKEN'):
+    if not os.environ.get('GITHUB_TOKEN') and not os.environ.get('BACKUP_STORE_DIR'):
         logger.error("🚨 CONFIGURATION REQUISE:")
         logger.error("   1. Créer Personal Access Token sur GitHub")
         logger.error("   2. Ajouter GITHUB_TOKEN sur Render")
         logger.error("   3. Redémarrer le service")
 
-# CORRECTION 6 : Auto-start amélioré
-if __name__ != "__main__":  # Quand importé par app.py
-    # Afficher les infos de configuration
+# Intégration à l'exécuteur de jobs ERP (remplace le thread schedule lancé à l'import)
+def register_backup_job(runner):
+    """
+    Déclare la sauvegarde GitHub comme job périodique de erp_jobs.JobRunner :
+    une seule sauvegarde à la fois (tous processus), statut et durée consultables.
+    """
     setup_github_backup_info()
+    state = {}
+    
+    def run_backup(db):
+        # Gestionnaire créé au premier cycle (validation GitHub hors du démarrage de l'app)
+        if 'manager' not in state:
+            state['manager'] = GitHubBackupManager()
+        if not state['manager'].run_backup_cycle():
+            raise RuntimeError("Cycle de sauvegarde échoué (voir les logs)")
+        return True
     
-    # CORRECTION MAJEURE : Thread NON daemon pour persistence
-    backup_thread = threading.Thread(target=start_backup_scheduler, daemon=False)
-    backup_thread.start()
+    schedule_minutes = int(os.environ.get('BACKUP_SCHEDULE_MINUTES', '120'))
+    runner.register(
+        'sauvegarde_github', run_backup,
+        intervalle=schedule_minutes * 60, timeout=2 * 60 * 60,
+        description=f"Sauvegarde incrémentale de la base (toutes les {schedule_minutes} min)"
+    )
     
-    logger.info("🎯 GitHub Backup System CORRIGÉ démarré !")
+    if (os.environ.get('IMMEDIATE_BACKUP_TEST', 'false').lower() == 'true'
+            or os.environ.get('FORCE_BACKUP_ON_START', 'false').lower() == 'true'):
+        logger.info("🧪 Sauvegarde immédiate demandée")
+        runner.submit('sauvegarde_github')
+    
+    logger.info("🎯 GitHub Backup System enregistré dans l'exécuteur de jobs")
+
+def restore_backup(dest_path: str, name: str = None):
+    """Restaure un instantané incrémental (le plus récent par défaut) vers dest_path"""
+    return GitHubBackupManager().restore_incremental_backup(dest_path, name)
 
 # NOUVEAU : Fonction de test direct
 def test_backup_immediate():
@@ -7,9 +7,25 @@ from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph,
 from reportlab.lib.enums import TA_LEFT, TA_CENTER, TA_RIGHT, TA_JUSTIFY
 from reportlab.pdfgen import canvas
 from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Callable, Dict, List, Optional
+import multiprocessing
+import tempfile
+import threading
+import zipfile
+import hashlib
+import atexit
+import json
+import os
 import io
 import logging
 
+try:
+    from PyPDF2 import PdfWriter
+    PDF_MERGE_AVAILABLE = True
+except ImportError:
+    PDF_MERGE_AVAILABLE = False
+
 logger = logging.getLogger(__name__)
 
 # Couleurs DG Inc.
@@ -19,6 +35,86 @@ DG_LIGHT_GREEN = colors.Color(220/255, 252/255, 231/255)  # #DCFCE7
 DG_GRAY = colors.Color(55/255, 65/255, 81/255)      # #374151
 DG_LIGHT_GRAY = colors.Color(107/255, 114/255, 128/255)  # #6B7280
 
+def _create_compact_styles(styles):
+    """Créer des styles ultra-compacts avec hauteur de texte réduite"""
+    
+    # COMPACITÉ MAXIMALE : Tailles réduites pour tout
+    CONTENT_FONT_SIZE = 7   # Réduit de 9 à 7
+    SECTION_FONT_SIZE = 10  # Réduit de 12 à 10
+    
+    # Style titre principal - plus compact
+    styles.add(ParagraphStyle(
+        name='DGTitle',
+        parent=styles['Heading1'],
+        fontSize=20,  # Réduit de 22 à 20
+        textColor=DG_PRIMARY_DARK,
+        spaceAfter=12,  # Réduit de 18 à 12
+        alignment=TA_CENTER,
+        fontName='Helvetica-Bold',
+        leading=22  # Réduit de 26 à 22
+    ))
+    
+    # Style section - plus compact
+    styles.add(ParagraphStyle(
+        name='DGSection',
+        parent=styles['Heading3'],
+        fontSize=SECTION_FONT_SIZE,  # Réduit de 12 à 10
+        textColor=DG_PRIMARY_DARK,
+        spaceAfter=6,   # Réduit de 8 à 6
+        spaceBefore=8,  # Réduit de 12 à 8
+        fontName='Helvetica-Bold',
+        leading=12  # Réduit de 16 à 12
+    ))
+    
+    # Style normal DG - ultra compact
+    styles.add(ParagraphStyle(
+        name='DGNormal',
+        parent=styles['Normal'],
+        fontSize=CONTENT_FONT_SIZE,  # 7pt au lieu de 9pt
+        textColor=DG_GRAY,
+        spaceAfter=2,  # Réduit de 4 à 2
+        fontName='Helvetica',
+        leading=9   # Réduit de 12 à 9
+    ))
+    
+    # Style info importante - ultra compact
+    styles.add(ParagraphStyle(
+        name='DGImportant',
+        parent=styles['Normal'],
+        fontSize=CONTENT_FONT_SIZE,  # 7pt au lieu de 9pt
+        textColor=DG_PRIMARY_DARK,
+        fontName='Helvetica-Bold',
+        spaceAfter=2,  # Réduit de 4 à 2
+        leading=9   # Réduit de 12 à 9
+    ))
+    
+    # Style petite info - plus petit
+    styles.add(ParagraphStyle(
+        name='DGSmall',
+        parent=styles['Normal'],
+        fontSize=6,  # Réduit de 8 à 6
+        textColor=DG_LIGHT_GRAY,
+        fontName='Helvetica',
+        leading=8   # Réduit de 10 à 8
+    ))
+
+
+_COMPACT_STYLES = None
+_COMPACT_STYLES_LOCK = threading.Lock()
+
+def get_compact_styles():
+    """
+    Feuille de styles compacte, construite une seule fois par processus
+    et partagée par tous les générateurs (lecture seule pendant le rendu)
+    """
+    global _COMPACT_STYLES
+    with _COMPACT_STYLES_LOCK:
+        if _COMPACT_STYLES is None:
+            styles = getSampleStyleSheet()
+            _create_compact_styles(styles)
+            _COMPACT_STYLES = styles
+        return _COMPACT_STYLES
+
 class BTPDFGenerator:
     """Générateur de PDF compact pour les Bons de Travail"""
     
@@ -31,72 +127,11 @@ class BTPDFGenerator:
         # LARGEUR UNIFORME POUR TOUS LES TABLEAUX
         self.table_width = self.content_width - 10  # Largeur standard pour tous
         
-        # Styles uniformisés
-        self.styles = getSampleStyleSheet()
-        self._create_compact_styles()
-    
-    def _create_compact_styles(self):
-        """Créer des styles ultra-compacts avec hauteur de texte réduite"""
-        
-        # COMPACITÉ MAXIMALE : Tailles réduites pour tout
-        CONTENT_FONT_SIZE = 7   # Réduit de 9 à 7
-        SECTION_FONT_SIZE = 10  # Réduit de 12 à 10
-        
-        # Style titre principal - plus compact
-        self.styles.add(ParagraphStyle(
-            name='DGTitle',
-            parent=self.styles['Heading1'],
-            fontSize=20,  # Réduit de 22 à 20
-            textColor=DG_PRIMARY_DARK,
-            spaceAfter=12,  # Réduit de 18 à 12
-            alignment=TA_CENTER,
-            fontName='Helvetica-Bold',
-            leading=22  # Réduit de 26 à 22
-        ))
-        
-        # Style section - plus compact
-        self.styles.add(ParagraphStyle(
-            name='DGSection',
-            parent=self.styles['Heading3'],
-            fontSize=SECTION_FONT_SIZE,  # Réduit de 12 à 10
-            textColor=DG_PRIMARY_DARK,
-            spaceAfter=6,   # Réduit de 8 à 6
-            spaceBefore=8,  # Réduit de 12 à 8
-            fontName='Helvetica-Bold',
-            leading=12  # Réduit de 16 à 12
-        ))
-        
-        # Style normal DG - ultra compact
-        self.styles.add(ParagraphStyle(
-            name='DGNormal',
-            parent=self.styles['Normal'],
-            fontSize=CONTENT_FONT_SIZE,  # 7pt au lieu de 9pt
-            textColor=DG_GRAY,
-            spaceAfter=2,  # Réduit de 4 à 2
-            fontName='Helvetica',
-            leading=9   # Réduit de 12 à 9
-        ))
-        
-        # Style info importante - ultra compact
-        self.styles.add(ParagraphStyle(
-            name='DGImportant',
-            parent=self.styles['Normal'],
-            fontSize=CONTENT_FONT_SIZE,  # 7pt au lieu de 9pt
-            textColor=DG_PRIMARY_DARK,
-            fontName='Helvetica-Bold',
-            spaceAfter=2,  # Réduit de 4 à 2
-            leading=9   # Réduit de 12 à 9
-        ))
-        
-        # Style petite info - plus petit
-        self.styles.add(ParagraphStyle(
-            name='DGSmall',
-            parent=self.styles['Normal'],
-            fontSize=6,  # Réduit de 8 à 6
-            textColor=DG_LIGHT_GRAY,
-            fontName='Helvetica',
-            leading=8   # Réduit de 10 à 8
-        ))
+        # Styles uniformisés (construits une fois par processus)
+        self.styles = get_compact_styles()
+        
+        # Mention du pied de page (None = date et heure du rendu)
+        self.date_impression = None
     
     def _get_compact_table_style(self, has_header=True):
         """Style de tableau ultra-compact avec bordures fines"""
@@ -185,7 +220,7 @@ class BTPDFGenerator:
         canvas.setFillColor(DG_LIGHT_GRAY)
         canvas.setFont('Helvetica', 7)  # Réduit de 8 à 7
         
-        date_impression = f"Imprimé le {datetime.now().strftime('%d/%m/%Y à %H:%M')}"
+        date_impression = self.date_impression or f"Imprimé le {datetime.now().strftime('%d/%m/%Y à %H:%M')}"
         canvas.drawString(self.margin, 20, date_impression)  # Réduit de 25 à 20
         
         page_num = f"Page {doc.page}"
@@ -479,8 +514,10 @@ class BTPDFGenerator:
         }
         return availability_map.get(availability, availability)
     
-    def generate_pdf(self, form_data):
+    def generate_pdf(self, form_data, date_impression=None):
         """Générer le PDF complet - VERSION ULTRA COMPACTE"""
+        self.date_impression = date_impression
+        
         # Créer un buffer pour le PDF
         buffer = io.BytesIO()
         
@@ -535,9 +572,7 @@ def export_bt_pdf_streamlit(form_data):
         
         # Nom du fichier
         numero_doc = form_data.get('numero_document', 'BT')
-        projet = form_data.get('project_name', 'Projet')[:30]
-        projet_clean = "".join(c for c in projet if c.isalnum() or c in (' ', '-', '_')).strip()
-        filename = f"BT_{numero_doc}_{projet_clean}_{datetime.now().strftime('%Y%m%d')}.pdf"
+        filename = bt_pdf_filename(form_data)
         
         # Bouton de téléchargement
         st.download_button(
@@ -582,6 +617,292 @@ def export_bt_pdf_streamlit(form_data):
         st.error(f"❌ Erreur lors de la génération du PDF: {str(e)}")
         st.info("💡 Vérifiez que ReportLab est installé: `pip install reportlab`")
 
+# =========================================================================
+# EXPORT GROUPÉ : POOL DE PROCESSUS ET CACHE DE RENDU
+# =========================================================================
+
+# Incrémenté quand la mise en page change : les PDF en cache ne sont plus relus
+BT_PDF_RENDER_VERSION = 2
+
+DEFAULT_BT_PDF_CACHE_MB = 200
+
+# En dessous de ce nombre de PDF à générer, rendu dans le processus courant
+# (le démarrage du pool coûte plus que le rendu lui-même)
+BT_PDF_POOL_MIN_BATCH = 4
+
+def bt_print_date_label(moment: Optional[datetime] = None) -> str:
+    """Mention « Imprimé le » des PDF mis en cache : au jour près, un PDF n'est relu que le jour de son rendu"""
+    return f"Imprimé le {(moment or datetime.now()).strftime('%d/%m/%Y')}"
+
+def bt_content_hash(form_data, date_impression: str = '') -> str:
+    """Empreinte du contenu d'un BT et de sa mention d'impression (clé du cache de rendu)"""
+    contenu = json.dumps(form_data, sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.sha256(f"v{BT_PDF_RENDER_VERSION}:{date_impression}:{contenu}".encode('utf-8')).hexdigest()
+
+def bt_pdf_filename(form_data) -> str:
+    """Nom du fichier PDF d'un BT"""
+    numero_doc = form_data.get('numero_document', 'BT')
+    projet = (form_data.get('project_name') or 'Projet')[:30]
+    projet_clean = "".join(c for c in projet if c.isalnum() or c in (' ', '-', '_')).strip()
+    return f"BT_{numero_doc}_{projet_clean}_{datetime.now().strftime('%Y%m%d')}.pdf"
+
+def render_bt_pdf(form_data, date_impression: Optional[str] = None) -> bytes:
+    """Rendu d'un BT en PDF (exécuté dans le processus courant ou dans un worker du pool)"""
+    return BTPDFGenerator().generate_pdf(form_data, date_impression).getvalue()
+
+class BTPDFRenderCache:
+    """
+    PDF rendus stockés sur disque par empreinte de contenu : un BT inchangé n'est pas
+    régénéré. Taille totale bornée, les PDF les moins récemment utilisés sont supprimés.
+    La mention « Imprimé le » (au jour près) fait partie de la clé : un PDF rendu
+    un autre jour n'est jamais relu.
+    """
+
+    def __init__(self, cache_dir: Optional[str] = None, max_bytes: Optional[int] = None):
+        self.cache_dir = cache_dir or os.environ.get(
+            'BT_PDF_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'erp_bt_pdf_cache'))
+        if max_bytes is None:
+            max_bytes = int(os.environ.get('BT_PDF_CACHE_MB', DEFAULT_BT_PDF_CACHE_MB)) * 1024 * 1024
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'rendered': 0, 'evicted': 0}
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.pdf")
+
+    def get(self, key: str) -> Optional[bytes]:
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path)
+        except OSError:
+            return None
+        self.stats['hits'] += 1
+        return data
+
+    def put(self, key: str, data: bytes):
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"⚠️ Cache PDF BT: écriture impossible ({e})")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+        self.stats['rendered'] += 1
+        self._evict()
+
+    def _evict(self):
+        """Supprime les PDF les moins récemment utilisés jusqu'à 90 % de la limite"""
+        with self._lock:
+            entries = []
+            for entry in os.scandir(self.cache_dir):
+                if entry.is_file() and entry.name.endswith('.pdf'):
+                    stat = entry.stat()
+                    entries.append((entry.path, stat.st_mtime, stat.st_size))
+            total = sum(size for _, _, size in entries)
+            if total <= self.max_bytes:
+                return
+            target = self.max_bytes * 0.9
+            evicted = 0
+            for path, _, size in sorted(entries, key=lambda entry: entry[1]):
+                if total <= target:
+                    break
+                try:
+                    os.remove(path)
+                    total -= size
+                    evicted += 1
+                except OSError:
+                    pass
+            self.stats['evicted'] += evicted
+        if evicted:
+            logger.info(f"🧹 Cache PDF BT: {evicted} PDF supprimé(s) ({total / (1024*1024):.1f} MB)")
+
+_RENDER_CACHE: Optional[BTPDFRenderCache] = None
+_RENDER_POOL: Optional[ProcessPoolExecutor] = None
+_RENDER_POOL_BROKEN = False
+_RENDER_LOCK = threading.Lock()
+
+def get_render_cache() -> BTPDFRenderCache:
+    global _RENDER_CACHE
+    with _RENDER_LOCK:
+        if _RENDER_CACHE is None:
+            _RENDER_CACHE = BTPDFRenderCache()
+        return _RENDER_CACHE
+
+def _init_render_worker():
+    """Initialisation d'un worker : styles construits une fois par processus"""
+    get_compact_styles()
+
+def _get_render_pool() -> Optional[ProcessPoolExecutor]:
+    """
+    Pool de processus partagé, créé au premier export groupé et conservé entre les exports.
+    Démarrage « spawn » : les workers n'héritent pas des threads ni des connexions SQLite
+    du serveur Streamlit.
+    """
+    global _RENDER_POOL
+    with _RENDER_LOCK:
+        if _RENDER_POOL_BROKEN:
+            return None
+        if _RENDER_POOL is None:
+            workers = int(os.environ.get('BT_PDF_WORKERS', min(4, os.cpu_count() or 1)))
+            if workers < 2:
+                return None
+            _RENDER_POOL = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_render_worker,
+            )
+            atexit.register(_shutdown_render_pool)
+            logger.info(f"🖨️ Pool de rendu PDF démarré ({workers} processus)")
+        return _RENDER_POOL
+
+def _shutdown_render_pool():
+    global _RENDER_POOL
+    with _RENDER_LOCK:
+        pool, _RENDER_POOL = _RENDER_POOL, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+def render_bt_pdfs(forms: List[Dict], use_cache: bool = True,
+                   progress_callback: Optional[Callable[[int, int], None]] = None) -> List[bytes]:
+    """
+    Rendu d'une série de BT. Les PDF en cache sont relus ; les autres sont générés
+    en parallèle dans le pool de processus (ou ici même pour un petit lot ou si le pool
+    est indisponible), puis mis en cache.
+
+    Args:
+        progress_callback: Appelée avec (PDF prêts, total) à chaque PDF terminé
+
+    Returns:
+        PDF dans l'ordre de forms
+    """
+    global _RENDER_POOL_BROKEN
+    total = len(forms)
+    results: List[Optional[bytes]] = [None] * total
+    cache = get_render_cache() if use_cache else None
+
+    date_impression = bt_print_date_label()
+    keys = [bt_content_hash(form_data, date_impression) for form_data in forms]
+    a_rendre: Dict[str, List[int]] = {}
+    for index, key in enumerate(keys):
+        data = cache.get(key) if cache and key not in a_rendre else None
+        if data is not None:
+            results[index] = data
+        else:
+            a_rendre.setdefault(key, []).append(index)
+
+    done = total - sum(len(indexes) for indexes in a_rendre.values())
+    if progress_callback:
+        progress_callback(done, total)
+
+    def store(key: str, data: bytes):
+        nonlocal done
+        for index in a_rendre.pop(key):
+            results[index] = data
+            done += 1
+        if cache:
+            cache.put(key, data)
+        if progress_callback:
+            progress_callback(done, total)
+
+    pool = _get_render_pool() if len(a_rendre) >= BT_PDF_POOL_MIN_BATCH else None
+    if pool is not None:
+        try:
+            futures = {pool.submit(render_bt_pdf, forms[indexes[0]], date_impression): key for key, indexes in a_rendre.items()}
+            for future in as_completed(futures):
+                store(futures[future], future.result())
+        except Exception as e:
+            # Pool cassé (worker tué, spawn impossible) : le reste est rendu ici
+            logger.warning(f"⚠️ Pool de rendu PDF indisponible, rendu séquentiel: {e}")
+            with _RENDER_LOCK:
+                _RENDER_POOL_BROKEN = True
+            _shutdown_render_pool()
+
+    for key in list(a_rendre):
+        store(key, render_bt_pdf(forms[a_rendre[key][0]], date_impression))
+
+    return results
+
+def export_bts_zip(forms: List[Dict], pdfs: List[bytes]) -> bytes:
+    """Archive ZIP des PDF (noms de fichiers rendus uniques)"""
+    buffer = io.BytesIO()
+    noms = set()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for form_data, data in zip(forms, pdfs):
+            nom = bt_pdf_filename(form_data)
+            base, numero = nom[:-4], 2
+            while nom in noms:
+                nom = f"{base}_{numero}.pdf"
+                numero += 1
+            noms.add(nom)
+            archive.writestr(nom, data)
+    return buffer.getvalue()
+
+def export_bts_merged_pdf(pdfs: List[bytes]) -> bytes:
+    """PDF unique regroupant les BT dans l'ordre (PyPDF2)"""
+    if not PDF_MERGE_AVAILABLE:
+        raise RuntimeError("PyPDF2 requis pour la fusion des PDF")
+    writer = PdfWriter()
+    for data in pdfs:
+        writer.append(io.BytesIO(data))
+    buffer = io.BytesIO()
+    writer.write(buffer)
+    return buffer.getvalue()
+
+def export_bt_batch_streamlit(forms: List[Dict], format: str = 'zip'):
+    """
+    Export groupé de BT pour Streamlit : archive ZIP ('zip') ou PDF fusionné ('merged')
+    """
+    try:
+        valides = [f for f in forms if f.get('numero_document') and f.get('project_name')]
+        if len(valides) < len(forms):
+            st.warning(f"⚠️ {len(forms) - len(valides)} BT ignoré(s) : numéro de document ou projet manquant")
+        if not valides:
+            st.error("❌ Aucun bon de travail à exporter")
+            return
+
+        if format == 'merged' and not PDF_MERGE_AVAILABLE:
+            st.warning("⚠️ PyPDF2 non disponible : export en archive ZIP")
+            format = 'zip'
+
+        progress = st.progress(0.0, text="📄 Génération des PDF...")
+
+        def on_progress(done, total):
+            progress.progress(done / total if total else 1.0, text=f"📄 Génération des PDF... {done}/{total}")
+
+        pdfs = render_bt_pdfs(valides, progress_callback=on_progress)
+        progress.empty()
+
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M')
+        if format == 'merged':
+            data = export_bts_merged_pdf(pdfs)
+            filename, mime = f"BT_export_{timestamp}.pdf", "application/pdf"
+        else:
+            data = export_bts_zip(valides, pdfs)
+            filename, mime = f"BT_export_{timestamp}.zip", "application/zip"
+
+        st.download_button(
+            label=f"📥 Télécharger {len(valides)} BT ({filename})",
+            data=data,
+            file_name=filename,
+            mime=mime,
+            type="primary",
+        )
+        stats = get_render_cache().stats
+        st.success(f"✅ {len(valides)} PDF prêts ({len(data) / 1024:.0f} KB) — "
+                   f"cache: {stats['hits']} relu(s), {stats['rendered']} généré(s) depuis le démarrage")
+
+    except Exception as e:
+        logger.error(f"Erreur export groupé PDF: {e}")
+        st.error(f"❌ Erreur lors de l'export groupé: {str(e)}")
+
+
 def test_pdf_generation():
     """Fonction de test pour la version ultra-compacte"""
     test_data = {
@@ -8,7 +8,7 @@ from datetime import datetime, timedelta, date
 import calendar
 
 # NOUVELLE ARCHITECTURE : Import SQLite Database et Gestionnaires
-from erp_database import ERPDatabase
+from erp_database import get_shared_database
 from app import GestionnaireProjetSQL  # Import depuis app.py
 
 def load_external_css():
@@ -312,7 +312,7 @@ def app():
     
     # INITIALISATION SQLITE
     if 'erp_db' not in st.session_state:
-        st.session_state.erp_db = ERPDatabase("erp_production_dg.db")
+        st.session_state.erp_db = get_shared_database("erp_production_dg.db")
     
     if 'gestionnaire' not in st.session_state:
         st.session_state.gestionnaire = GestionnaireProjetSQL(st.session_state.erp_db)
@@ -3,18 +3,105 @@
 # Configuration automatique du stockage persistant pour Render
 
 import os
+import re
+import time
 import shutil
 import sqlite3
 import logging
 import json
+import threading
 from datetime import datetime
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Optional, List, Tuple
 
 # Configuration du logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
+# Sauvegarde en ligne : pages copiées par lot et pause entre deux lots
+DEFAULT_BACKUP_PAGES_PER_STEP = 256
+DEFAULT_BACKUP_STEP_SLEEP = 0.05
+
+# Reprises tolérées (écritures concurrentes) avant de terminer la copie en un seul lot
+BACKUP_MAX_RESTARTS = 3
+
+# Rétention : sauvegardes conservées par heure, jour et semaine
+DEFAULT_BACKUP_RETENTION = {'hourly': 24, 'daily': 7, 'weekly': 8}
+
+BACKUP_TIMESTAMP_RE = re.compile(r'(\d{8}_\d{6})\.db$')
+
+_RETENTION_PERIODS = {
+    'hourly': lambda d: d.strftime('%Y%m%d%H'),
+    'daily': lambda d: d.strftime('%Y%m%d'),
+    'weekly': lambda d: d.isocalendar()[:2],
+}
+
+
+def select_backups_to_keep(backups: List[Tuple[str, datetime]], policy: Dict[str, int]) -> set:
+    """
+    Sauvegardes conservées par la politique de rétention : pour chaque période
+    (hourly, daily, weekly), la plus récente de chacune des N dernières périodes
+    qui contiennent une sauvegarde. La plus récente est toujours conservée.
+    
+    Args:
+        backups: (chemin, date) des sauvegardes
+        policy: Nombre de périodes conservées par type de période
+    """
+    ordered = sorted(backups, key=lambda b: b[1], reverse=True)
+    keep = {ordered[0][0]} if ordered else set()
+    
+    for period, count in policy.items():
+        bucket_of = _RETENTION_PERIODS[period]
+        seen = set()
+        for path, backup_date in ordered:
+            if len(seen) >= count:
+                break
+            bucket = bucket_of(backup_date)
+            if bucket not in seen:
+                seen.add(bucket)
+                keep.add(path)
+    return keep
+
+
+class _BackupRestarted(Exception):
+    """Copie en ligne relancée trop souvent par des écritures concurrentes"""
+
+
+class BackupTask:
+    """Sauvegarde exécutée en arrière-plan (PersistentERPDatabase.start_backup)"""
+    
+    def __init__(self, backup_suffix: Optional[str] = None):
+        self.backup_suffix = backup_suffix
+        self.status = 'EN_COURS'
+        self.path = None
+        self.error = None
+        self.pages_copied = 0
+        self.pages_total = 0
+        self.started_at = datetime.now()
+        self.finished_at = None
+        self.thread = None
+        self.done = threading.Event()
+    
+    def update_progress(self, copied: int, total: int):
+        self.pages_copied = copied
+        self.pages_total = total
+    
+    @property
+    def progress(self) -> float:
+        """Fraction copiée (0 à 1)"""
+        if self.done.is_set():
+            return 1.0
+        return self.pages_copied / self.pages_total if self.pages_total else 0.0
+    
+    def is_running(self) -> bool:
+        return not self.done.is_set()
+    
+    def wait(self, timeout: Optional[float] = None) -> Optional[str]:
+        """Attend la fin de la sauvegarde ; retourne son chemin (None si échec ou délai dépassé)"""
+        self.done.wait(timeout)
+        return self.path
+
+
 class PersistentERPDatabase:
     """
     Gestionnaire de stockage persistant pour ERP Production DG Inc.
@@ -27,6 +114,11 @@ class PersistentERPDatabase:
     
     def __init__(self):
         """Initialise le gestionnaire de stockage persistant"""
+        # Une seule sauvegarde à la fois ; current_backup : dernière tâche d'arrière-plan
+        self._backup_lock = threading.Lock()
+        self._backup_task_lock = threading.Lock()
+        self.current_backup = None
+        
         self.setup_environment_detection()
         self.setup_persistent_paths()
         self.migrate_existing_data()
@@ -128,6 +220,9 @@ class PersistentERPDatabase:
                 try:
                     # Vérifier que l'ancien fichier est valide
                     if self._verify_database_file(old_path):
+                        # Reporter le WAL dans le fichier principal avant copie
+                        self._checkpoint_wal(old_path)
+                        
                         # Copier vers le stockage persistant
                         shutil.copy2(old_path, self.db_path)
                         logger.info(f"✅ Données migrées avec succès:")
@@ -164,6 +259,36 @@ class PersistentERPDatabase:
         else:
             logger.info("📊 Nouvelle base de données sera créée")
     
+    def _checkpoint_wal(self, db_path: str) -> bool:
+        """
+        Reporte le contenu du journal WAL dans le fichier principal
+        
+        En mode WAL, les transactions validées peuvent encore se trouver dans
+        le fichier -wal : une copie du seul fichier .db serait incomplète.
+        
+        Returns:
+            True si le checkpoint est complet (aucun lecteur/écrivain bloquant)
+        """
+        try:
+            conn = sqlite3.connect(db_path, timeout=30)
+            try:
+                journal_mode = conn.execute("PRAGMA journal_mode").fetchone()[0]
+                if str(journal_mode).lower() != 'wal':
+                    return True
+                busy, log_frames, checkpointed = conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchone()
+            finally:
+                conn.close()
+            
+            if busy:
+                logger.warning(f"⚠️ Checkpoint WAL partiel ({checkpointed}/{log_frames} pages) - base occupée")
+                return False
+            logger.debug(f"Checkpoint WAL terminé: {checkpointed} pages reportées")
+            return True
+            
+        except Exception as e:
+            logger.warning(f"Checkpoint WAL impossible pour {db_path}: {e}")
+            return False
+    
     def _verify_database_file(self, db_path: str) -> bool:
         """Vérifie qu'un fichier de base de données est valide"""
         try:
@@ -256,6 +381,11 @@ class PersistentERPDatabase:
                 backup_files = [f for f in os.listdir(self.backup_dir) if f.endswith('.db')]
                 info['backup_count'] = len(backup_files)
             
+            # Sauvegarde d'arrière-plan en cours
+            task = self.current_backup
+            if task is not None and task.is_running():
+                info['backup_in_progress'] = round(task.progress * 100)
+            
             # Usage du disque (Render uniquement)
             if self.is_render and self.has_persistent_disk:
                 total, used, free = shutil.disk_usage(self.data_dir)
@@ -297,21 +427,72 @@ class PersistentERPDatabase:
         
         return info
     
-    def create_backup(self, backup_suffix: str = None) -> Optional[str]:
+    def create_backup(self, backup_suffix: str = None, progress_callback=None,
+                      pages_per_step: int = None, step_sleep: float = None) -> Optional[str]:
         """
-        Crée une sauvegarde timestampée de la base de données
+        Crée une sauvegarde timestampée de la base de données (API backup en ligne de SQLite)
+        
+        La copie avance par lots de pages_per_step pages avec une pause entre deux lots :
+        les écrivains ne sont jamais bloqués longtemps et la copie est toujours cohérente.
+        Pour ne pas bloquer la page appelante, utiliser start_backup().
         
         Args:
             backup_suffix: Suffixe optionnel pour le nom de fichier
+            progress_callback: Appelé avec (pages copiées, pages totales) après chaque lot
+            pages_per_step: Pages copiées par lot (BACKUP_PAGES_PER_STEP, défaut 256)
+            step_sleep: Pause en secondes entre deux lots (BACKUP_STEP_SLEEP, défaut 0.05)
             
         Returns:
             Chemin du fichier de sauvegarde créé, ou None si erreur
         """
+        with self._backup_lock:
+            return self._run_online_backup(backup_suffix, progress_callback, pages_per_step, step_sleep)
+    
+    def start_backup(self, backup_suffix: str = None, pages_per_step: int = None,
+                     step_sleep: float = None) -> 'BackupTask':
+        """
+        Lance create_backup dans un thread d'arrière-plan
+        
+        Une seule sauvegarde à la fois : si une sauvegarde est en cours, sa tâche est retournée.
+        
+        Returns:
+            BackupTask (statut, progression, chemin une fois terminée)
+        """
+        with self._backup_task_lock:
+            task = self.current_backup
+            if task is not None and task.is_running():
+                return task
+            
+            task = BackupTask(backup_suffix)
+            
+            def run():
+                try:
+                    task.path = self.create_backup(backup_suffix, task.update_progress,
+                                                   pages_per_step, step_sleep)
+                    task.status = 'TERMINE' if task.path else 'ECHEC'
+                except Exception as e:
+                    task.error = str(e)
+                    task.status = 'ECHEC'
+                finally:
+                    task.finished_at = datetime.now()
+                    task.done.set()
+            
+            task.thread = threading.Thread(target=run, name=f"erp-backup-{backup_suffix or 'manual'}", daemon=True)
+            self.current_backup = task
+            task.thread.start()
+            return task
+    
+    def _run_online_backup(self, backup_suffix, progress_callback, pages_per_step, step_sleep) -> Optional[str]:
         try:
             if not os.path.exists(self.db_path):
                 logger.warning("Impossible de créer une sauvegarde - base de données introuvable")
                 return None
             
+            if pages_per_step is None:
+                pages_per_step = int(os.environ.get('BACKUP_PAGES_PER_STEP', DEFAULT_BACKUP_PAGES_PER_STEP))
+            if step_sleep is None:
+                step_sleep = float(os.environ.get('BACKUP_STEP_SLEEP', DEFAULT_BACKUP_STEP_SLEEP))
+            
             # Génération du nom de fichier
             timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
             if backup_suffix:
@@ -320,61 +501,151 @@ class PersistentERPDatabase:
                 backup_filename = f"backup_{timestamp}.db"
             
             backup_path = os.path.join(self.backup_dir, backup_filename)
+            # Copie dans un fichier temporaire : une sauvegarde incomplète n'est jamais listée
+            tmp_path = backup_path + '.partial'
             
-            # Copie de la base de données
-            shutil.copy2(self.db_path, backup_path)
-            
-            # Vérification de la sauvegarde
-            if os.path.exists(backup_path) and self._verify_database_file(backup_path):
-                backup_size = round(os.path.getsize(backup_path) / (1024*1024), 2)
-                logger.info(f"✅ Sauvegarde créée: {backup_filename} ({backup_size} MB)")
-                
-                # Nettoyage des anciennes sauvegardes
-                self._cleanup_old_backups()
+            start = time.monotonic()
+            try:
+                self._copy_online(tmp_path, pages_per_step, step_sleep, progress_callback)
                 
-                return backup_path
-            else:
-                logger.error("❌ Sauvegarde créée mais vérification échouée")
-                return None
+                # Vérification de la sauvegarde
+                if not self._quick_check(tmp_path):
+                    logger.error("❌ Sauvegarde créée mais vérification échouée")
+                    return None
+                os.replace(tmp_path, backup_path)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+            
+            backup_size = round(os.path.getsize(backup_path) / (1024*1024), 2)
+            logger.info(f"✅ Sauvegarde créée: {backup_filename} ({backup_size} MB, "
+                        f"{time.monotonic() - start:.1f}s)")
+            
+            # Rétention des anciennes sauvegardes
+            self._cleanup_old_backups()
+            
+            return backup_path
                 
         except Exception as e:
             logger.error(f"❌ Erreur création sauvegarde: {e}")
             return None
     
-    def _cleanup_old_backups(self, max_backups: int = 10):
+    def _copy_online(self, dest_path: str, pages_per_step: int, step_sleep: float, progress_callback=None):
+        """
+        Copie la base par l'API backup de SQLite, lot par lot
+        
+        Chaque lot ne tient qu'une courte transaction de lecture sur la source. Si une autre
+        connexion écrit entre deux lots, SQLite recommence la copie : après
+        BACKUP_MAX_RESTARTS reprises, la copie se termine en un seul lot (en mode WAL,
+        la lecture ne bloque pas les écrivains).
+        """
+        state = {'copied': -1, 'restarts': 0}
+        
+        def on_step(status, remaining, total):
+            copied = total - remaining
+            if copied <= state['copied']:
+                state['restarts'] += 1
+                if state['restarts'] > BACKUP_MAX_RESTARTS:
+                    raise _BackupRestarted()
+            state['copied'] = copied
+            if progress_callback:
+                progress_callback(copied, total)
+            # sqlite3 ne fait de pause qu'en cas de verrou : la pause entre lots se fait ici
+            if remaining and step_sleep > 0:
+                time.sleep(step_sleep)
+        
+        source_conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            dest_conn = sqlite3.connect(dest_path)
+            try:
+                try:
+                    source_conn.backup(dest_conn, pages=max(1, pages_per_step), progress=on_step)
+                except _BackupRestarted:
+                    logger.info(f"ℹ️ Sauvegarde relancée {state['restarts']} fois par des écritures - copie en un lot")
+                    state['copied'] = -1
+                    source_conn.backup(dest_conn, pages=-1, progress=on_step)
+                # Copie autonome : pas de fichier -wal à conserver avec la sauvegarde
+                dest_conn.execute("PRAGMA journal_mode = DELETE")
+            finally:
+                dest_conn.close()
+        finally:
+            source_conn.close()
+    
+    def _quick_check(self, db_path: str) -> bool:
+        """Vérifie une sauvegarde avec PRAGMA quick_check"""
+        try:
+            conn = sqlite3.connect(db_path)
+            try:
+                result = conn.execute("PRAGMA quick_check").fetchone()
+            finally:
+                conn.close()
+            if result and result[0] == 'ok':
+                return True
+            logger.error(f"❌ quick_check {os.path.basename(db_path)}: {result[0] if result else 'aucun résultat'}")
+            return False
+        except Exception as e:
+            logger.error(f"❌ Erreur vérification sauvegarde {db_path}: {e}")
+            return False
+    
+    def _list_backups(self):
+        """Sauvegardes (chemin, date, nom), de la plus récente à la plus ancienne"""
+        backup_files = []
+        for filename in os.listdir(self.backup_dir):
+            if filename.startswith('backup_') and filename.endswith('.db'):
+                file_path = os.path.join(self.backup_dir, filename)
+                match = BACKUP_TIMESTAMP_RE.search(filename)
+                try:
+                    backup_date = datetime.strptime(match.group(1), '%Y%m%d_%H%M%S') if match else None
+                except ValueError:
+                    backup_date = None
+                if backup_date is None:
+                    backup_date = datetime.fromtimestamp(os.path.getmtime(file_path))
+                backup_files.append((file_path, backup_date, filename))
+        
+        backup_files.sort(key=lambda x: x[1], reverse=True)
+        return backup_files
+    
+    def _cleanup_old_backups(self, keep_hourly: int = None, keep_daily: int = None, keep_weekly: int = None):
         """
-        Nettoie les anciennes sauvegardes pour éviter l'accumulation
+        Applique la politique de rétention des sauvegardes
+        
+        Conserve la sauvegarde la plus récente de chacune des keep_hourly dernières heures,
+        keep_daily derniers jours et keep_weekly dernières semaines (qui en ont une) ;
+        la sauvegarde la plus récente est toujours conservée.
         
         Args:
-            max_backups: Nombre maximum de sauvegardes à conserver
+            keep_hourly: Heures conservées (BACKUP_KEEP_HOURLY, défaut 24)
+            keep_daily: Jours conservés (BACKUP_KEEP_DAILY, défaut 7)
+            keep_weekly: Semaines conservées (BACKUP_KEEP_WEEKLY, défaut 8)
         """
         try:
             if not os.path.exists(self.backup_dir):
                 return
             
-            # Lister tous les fichiers de sauvegarde
-            backup_files = []
-            for filename in os.listdir(self.backup_dir):
-                if filename.startswith('backup_') and filename.endswith('.db'):
-                    file_path = os.path.join(self.backup_dir, filename)
-                    file_mtime = os.path.getmtime(file_path)
-                    backup_files.append((file_path, file_mtime, filename))
+            policy = {
+                'hourly': keep_hourly if keep_hourly is not None else int(os.environ.get('BACKUP_KEEP_HOURLY', DEFAULT_BACKUP_RETENTION['hourly'])),
+                'daily': keep_daily if keep_daily is not None else int(os.environ.get('BACKUP_KEEP_DAILY', DEFAULT_BACKUP_RETENTION['daily'])),
+                'weekly': keep_weekly if keep_weekly is not None else int(os.environ.get('BACKUP_KEEP_WEEKLY', DEFAULT_BACKUP_RETENTION['weekly'])),
+            }
             
-            # Trier par date de modification (plus récent en premier)
-            backup_files.sort(key=lambda x: x[1], reverse=True)
+            backup_files = self._list_backups()
+            keep = select_backups_to_keep([(file_path, backup_date) for file_path, backup_date, _ in backup_files], policy)
             
-            # Supprimer les anciens au-delà de la limite
-            files_to_delete = backup_files[max_backups:]
+            files_to_delete = [(file_path, filename) for file_path, _, filename in backup_files if file_path not in keep]
             
-            for file_path, _, filename in files_to_delete:
+            for file_path, filename in files_to_delete:
                 try:
                     os.remove(file_path)
+                    for suffix in ('-wal', '-shm'):
+                        if os.path.exists(file_path + suffix):
+                            os.remove(file_path + suffix)
                     logger.info(f"🗑️ Ancienne sauvegarde supprimée: {filename}")
                 except Exception as e:
                     logger.warning(f"Impossible de supprimer {filename}: {e}")
             
             if len(files_to_delete) > 0:
-                logger.info(f"📁 Nettoyage terminé - {len(files_to_delete)} ancienne(s) sauvegarde(s) supprimée(s)")
+                logger.info(f"📁 Rétention ({policy['hourly']}h / {policy['daily']}j / {policy['weekly']}sem) - "
+                            f"{len(files_to_delete)} ancienne(s) sauvegarde(s) supprimée(s), {len(keep)} conservée(s)")
                 
         except Exception as e:
             logger.warning(f"Erreur nettoyage sauvegardes: {e}")
@@ -0,0 +1,282 @@
+# database_pool.py - Pool de connexions SQLite pour ERPDatabase
+# ERP Production DG Inc. - Connexions persistantes par thread Streamlit
+
+import os
+import re
+import sqlite3
+import threading
+import time
+import logging
+from typing import Dict, List, Any
+from urllib.parse import quote
+
+logger = logging.getLogger(__name__)
+
+
+# =========================================================================
+# PROFILS SQLITE (journal + synchronisation)
+# =========================================================================
+
+SQLITE_PROFILES = {
+    # Production : lecteurs et écrivains ne se bloquent plus (pointages vs dashboards)
+    'WAL': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'mmap_size': 268435456,  # 256MB
+        'cache_size': -32000,    # ~32MB
+        'busy_timeout': 5000,
+        'temp_store': 'MEMORY',
+    },
+    # WAL avec fsync à chaque commit (durabilité maximale)
+    'WAL_SAFE': {
+        'journal_mode': 'WAL',
+        'synchronous': 'FULL',
+        'mmap_size': 268435456,
+        'cache_size': -32000,
+        'busy_timeout': 5000,
+        'temp_store': 'MEMORY',
+    },
+    # Mode historique (rollback journal)
+    'ROLLBACK': {
+        'journal_mode': 'DELETE',
+        'synchronous': 'FULL',
+        'mmap_size': 0,
+        'cache_size': -2000,
+        'busy_timeout': 5000,
+        'temp_store': 'DEFAULT',
+    },
+}
+
+# Statements autorisés sur une connexion lecteur (lecture seule)
+READ_ONLY_VERBS = ('SELECT', 'EXPLAIN', 'VALUES')
+
+# Littéraux, identifiants cités, commentaires, parenthèses et mots : découpage d'un WITH
+_SQL_TOKEN_RE = re.compile(
+    r"'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"|\[[^\]]*\]|`[^`]*`|--[^\n]*|/\*.*?\*/|[()]|\w+",
+    re.DOTALL
+)
+_DML_VERBS = {'INSERT', 'UPDATE', 'DELETE', 'REPLACE'}
+
+
+def build_pragmas(profile: str = 'WAL', overrides: Dict[str, Any] = None,
+                  read_only: bool = False) -> List[str]:
+    """
+    Construit la liste des PRAGMA à appliquer à l'ouverture d'une connexion.
+
+    Args:
+        profile: Nom du profil dans SQLITE_PROFILES
+        overrides: Valeurs PRAGMA qui remplacent celles du profil
+        read_only: Connexion lecteur (pas de changement de journal_mode)
+    """
+    settings = dict(SQLITE_PROFILES.get((profile or 'WAL').upper(), SQLITE_PROFILES['WAL']))
+    if overrides:
+        settings.update(overrides)
+
+    # busy_timeout en premier : les PRAGMA suivants peuvent déjà attendre un verrou
+    pragmas = [f"PRAGMA busy_timeout = {int(settings.pop('busy_timeout', 5000))}"]
+    journal_mode = settings.pop('journal_mode', None)
+    if journal_mode and not read_only:
+        pragmas.append(f"PRAGMA journal_mode = {journal_mode}")
+    for name, value in settings.items():
+        pragmas.append(f"PRAGMA {name} = {value}")
+
+    pragmas.append("PRAGMA foreign_keys = ON")
+    if read_only:
+        pragmas.append("PRAGMA query_only = ON")
+    return pragmas
+
+
+def _with_has_dml(query: str) -> bool:
+    """
+    Indique si un WITH se termine par un INSERT / UPDATE / DELETE / REPLACE :
+    le verbe principal est le premier mot de niveau 0 qui suit les CTE.
+    """
+    tokens = [token.upper() for token in _SQL_TOKEN_RE.findall(query)]
+    depth = 0
+    for index, token in enumerate(tokens):
+        if token == '(':
+            depth += 1
+        elif token == ')':
+            depth -= 1
+        elif depth == 0 and token in _DML_VERBS:
+            # replace(...) est aussi une fonction : seul REPLACE INTO est un verbe
+            if token != 'REPLACE' or tokens[index + 1:index + 2] == ['INTO']:
+                return True
+    return False
+
+
+def is_read_statement(query: str) -> bool:
+    """Indique si une requête peut être servie par une connexion lecteur"""
+    stripped = query.lstrip().lstrip('(').lstrip()
+    head = stripped[:7].upper()
+    if head.startswith('WITH'):
+        return not _with_has_dml(stripped)
+    return head.startswith(READ_ONLY_VERBS)
+
+
+class SQLiteConnectionPool:
+    """
+    Pool de connexions SQLite thread-safe pour ERPDatabase.
+
+    Chaque thread (ex: thread de script Streamlit) reçoit une connexion
+    persistante qu'il réutilise pour tous ses appels execute_query /
+    execute_update / execute_insert. Les PRAGMA sont appliqués une seule
+    fois à l'ouverture de la connexion.
+
+    Lorsqu'un thread se termine, sa connexion est récupérée et remise dans
+    la réserve (idle) pour le prochain thread. pool_size borne le nombre de
+    connexions conservées ouvertes : au-delà, les connexions récupérées sont
+    fermées plutôt que conservées.
+
+    Avec read_only=True, les connexions sont ouvertes en mode URI ro
+    (lecteurs dédiés, séparés de la connexion écrivain).
+    """
+
+    DEFAULT_PRAGMAS = [
+        "PRAGMA foreign_keys = ON",
+    ]
+
+    def __init__(self, db_path: str, pool_size: int = 8, timeout: float = 30.0,
+                 health_check_interval: float = 60.0, pragmas: List[str] = None,
+                 read_only: bool = False):
+        self.db_path = db_path
+        self.read_only = read_only
+        self.pool_size = max(1, int(pool_size))
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+        self.pragmas = list(pragmas) if pragmas is not None else list(self.DEFAULT_PRAGMAS)
+
+        self._lock = threading.RLock()
+        # ident du thread → (objet thread, connexion, dernier contrôle de santé)
+        self._assigned: Dict[int, tuple] = {}
+        # connexions libres : (connexion, dernier contrôle de santé)
+        self._idle: List[tuple] = []
+
+        self.stats = {
+            'opened': 0,
+            'reused': 0,
+            'reclaimed': 0,
+            'closed': 0,
+            'health_check_failures': 0,
+        }
+
+    # =========================================================================
+    # OUVERTURE / FERMETURE
+    # =========================================================================
+
+    def _open_connection(self) -> sqlite3.Connection:
+        """Ouvre une nouvelle connexion et applique les PRAGMA une seule fois"""
+        if self.read_only:
+            uri = f"file:{quote(os.path.abspath(self.db_path))}?mode=ro"
+            conn = sqlite3.connect(uri, uri=True, timeout=self.timeout, check_same_thread=False)
+        else:
+            conn = sqlite3.connect(self.db_path, timeout=self.timeout, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        for pragma in self.pragmas:
+            conn.execute(pragma)
+        self.stats['opened'] += 1
+        return conn
+
+    def _close_connection(self, conn: sqlite3.Connection):
+        """Ferme une connexion en ignorant les erreurs"""
+        try:
+            conn.close()
+        except Exception as e:
+            logger.debug(f"Fermeture connexion pool: {e}")
+        self.stats['closed'] += 1
+
+    def _is_healthy(self, conn: sqlite3.Connection) -> bool:
+        """Contrôle de santé léger d'une connexion"""
+        try:
+            conn.execute("SELECT 1").fetchone()
+            return True
+        except Exception as e:
+            logger.warning(f"Connexion pool invalide, remplacement: {e}")
+            self.stats['health_check_failures'] += 1
+            return False
+
+    def _release(self, conn: sqlite3.Connection, last_check: float):
+        """Remet une connexion dans la réserve (ou la ferme si la réserve est pleine)"""
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except Exception:
+            self._close_connection(conn)
+            return
+
+        if len(self._idle) + len(self._assigned) < self.pool_size:
+            self._idle.append((conn, last_check))
+        else:
+            self._close_connection(conn)
+
+    def _reclaim_dead_threads(self):
+        """Récupère les connexions des threads terminés"""
+        for ident, (thread, conn, last_check) in list(self._assigned.items()):
+            if not thread.is_alive():
+                del self._assigned[ident]
+                self.stats['reclaimed'] += 1
+                self._release(conn, last_check)
+
+    # =========================================================================
+    # API PUBLIQUE
+    # =========================================================================
+
+    def get_connection(self) -> sqlite3.Connection:
+        """Retourne la connexion persistante du thread courant"""
+        current = threading.current_thread()
+        ident = current.ident
+
+        with self._lock:
+            entry = self._assigned.get(ident)
+            if entry and entry[0] is current:
+                self.stats['reused'] += 1
+                return entry[1]
+
+            self._reclaim_dead_threads()
+
+            now = time.monotonic()
+            conn = None
+            while self._idle:
+                candidate, last_check = self._idle.pop()
+                if now - last_check < self.health_check_interval or self._is_healthy(candidate):
+                    conn = candidate
+                    self.stats['reused'] += 1
+                    break
+                self._close_connection(candidate)
+
+            if conn is None:
+                conn = self._open_connection()
+
+            self._assigned[ident] = (current, conn, now)
+            return conn
+
+    def release_current(self):
+        """Libère explicitement la connexion du thread courant (fin de tâche de fond)"""
+        current = threading.current_thread()
+        with self._lock:
+            entry = self._assigned.get(current.ident)
+            if entry and entry[0] is current:
+                del self._assigned[current.ident]
+                self._release(entry[1], entry[2])
+
+    def close_all(self):
+        """Ferme toutes les connexions du pool"""
+        with self._lock:
+            for _, conn, _ in self._assigned.values():
+                self._close_connection(conn)
+            for conn, _ in self._idle:
+                self._close_connection(conn)
+            self._assigned.clear()
+            self._idle.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Statistiques d'utilisation : connexions ouvertes vs réutilisées"""
+        with self._lock:
+            stats = dict(self.stats)
+            stats['active'] = len(self._assigned)
+            stats['idle'] = len(self._idle)
+            stats['pool_size'] = self.pool_size
+            stats['read_only'] = self.read_only
+            total_checkouts = stats['opened'] + stats['reused']
+            stats['reuse_rate'] = round(stats['reused'] / total_checkouts, 4) if total_checkouts else 0.0
+            return stats
@@ -2,11 +2,33 @@ import streamlit as st
 import pandas as pd
 from datetime import datetime, timedelta
 import json
+import re
 from typing import Dict, List, Optional, Any
 
 # --- Constantes partagées ---
 STATUTS_DEVIS = ["BROUILLON", "VALIDÉ", "ENVOYÉ", "APPROUVÉ", "TERMINÉ", "ANNULÉ"]
 UNITES_VENTE = ["kg", "tonne", "m", "m²", "m³", "pièce", "lot", "heure"]
+TAUX_TVA_DEFAUT = 14.975  # Défaut QC
+
+# Filtre des devis : colonne générée indexée (schéma v9) ou ancien filtre LIKE
+FILTRE_DEVIS_INDEXE = "f.est_devis = 1"
+FILTRE_DEVIS_LEGACY = """(f.type_formulaire = 'DEVIS' OR (f.type_formulaire = 'ESTIMATION' AND f.metadonnees_json LIKE '%"type_reel": "DEVIS"%'))"""
+
+# Totaux HT par devis en une seule agrégation sur formulaire_lignes + taux TVA des métadonnées.
+# L'agrégation est limitée aux lignes des devis ({filtre} = filtre des devis sur l'alias f2) :
+# SQLite matérialise la sous-requête sans y propager le WHERE de la requête englobante.
+TOTAUX_DEVIS_JOIN = '''
+    LEFT JOIN (
+        SELECT formulaire_id, COALESCE(SUM(quantite * prix_unitaire), 0) as total_ht
+        FROM formulaire_lignes
+        WHERE formulaire_id IN (SELECT f2.id FROM formulaires f2 WHERE {filtre})
+        GROUP BY formulaire_id
+    ) tl ON tl.formulaire_id = f.id
+'''
+TAUX_TVA_SQL = f"""
+    COALESCE(CASE WHEN json_valid(f.metadonnees_json)
+                  THEN json_extract(f.metadonnees_json, '$.taux_tva') END, {TAUX_TVA_DEFAUT})
+"""
 
 class GestionnaireDevis:
     """
@@ -36,6 +58,16 @@ class GestionnaireDevis:
         self._devis_compatibility_mode = False
         self._devis_type_db = 'DEVIS'
         
+        # Colonne générée est_devis disponible → filtre indexé au lieu du LIKE sur metadonnees_json
+        self._filtre_devis = FILTRE_DEVIS_LEGACY
+        try:
+            colonnes = [row['name'] for row in self.db.execute_query("PRAGMA table_xinfo(formulaires)")]
+            if 'est_devis' in colonnes:
+                self._filtre_devis = FILTRE_DEVIS_INDEXE
+        except Exception:
+            pass
+        self._totaux_devis_join = TOTAUX_DEVIS_JOIN.format(filtre=re.sub(r'\bf\.', 'f2.', self._filtre_devis))
+        
         try:
             # Tente d'insérer une ligne test pour vérifier la contrainte
             test_query = "INSERT INTO formulaires (type_formulaire, numero_document, statut) VALUES ('DEVIS', 'TEST-DEVIS-COMPATIBILITY-UNIQUE', 'BROUILLON')"
@@ -61,27 +93,13 @@ class GestionnaireDevis:
     # --- MÉTHODES MÉTIER (Déplacées de GestionnaireCRM) ---
     
     def generer_numero_devis(self) -> str:
-        """Génère un numéro de devis/estimation automatique."""
-        try:
-            annee = datetime.now().year
-            prefix = "EST" if self._devis_compatibility_mode else "DEVIS"
-            query = "SELECT numero_document FROM formulaires WHERE numero_document LIKE ? ORDER BY id DESC LIMIT 1"
-            pattern = f"{prefix}-{annee}-%"
-            result = self.db.execute_query(query, (pattern,))
-            
-            sequence = 1
-            if result:
-                last_num = result[0]['numero_document']
-                try:
-                    sequence = int(last_num.split('-')[-1]) + 1
-                except (ValueError, IndexError):
-                    sequence = 1
-            
-            return f"{prefix}-{annee}-{sequence:03d}"
-        except Exception as e:
-            st.error(f"Erreur génération numéro devis: {e}")
-            prefix_fallback = "EST" if self._devis_compatibility_mode else "DEVIS"
-            return f"{prefix_fallback}-{datetime.now().strftime('%Y%m%d%H%M%S')}"
+        """Génère un numéro de devis/estimation automatique (séquence atomique)."""
+        prefix = "EST" if self._devis_compatibility_mode else "DEVIS"
+        numero = self.db.prochain_numero_document(prefix)
+        if numero:
+            return numero
+        st.error("Erreur génération numéro devis")
+        return f"{prefix}-{datetime.now().strftime('%Y%m%d%H%M%S')}"
 
     def create_devis(self, devis_data: Dict[str, Any]) -> Optional[int]:
         """Crée un nouveau devis dans la table formulaires."""
@@ -218,7 +236,7 @@ class GestionnaireDevis:
     def get_devis_complet(self, devis_id: int) -> Dict[str, Any]:
         """Récupère un devis avec tous ses détails."""
         try:
-            query = '''
+            query = f'''
                 SELECT f.*, 
                        c.nom as client_nom, 
                        c.adresse, c.ville, c.province, c.code_postal, c.pays,
@@ -231,7 +249,7 @@ class GestionnaireDevis:
                 LEFT JOIN contacts co ON c.contact_principal_id = co.id
                 LEFT JOIN employees e ON f.employee_id = e.id
                 LEFT JOIN projects p ON f.project_id = p.id
-                WHERE f.id = ? AND (f.type_formulaire = 'DEVIS' OR (f.type_formulaire = 'ESTIMATION' AND f.metadonnees_json LIKE '%"type_reel": "DEVIS"%'))
+                WHERE f.id = ? AND {self._filtre_devis}
             '''
             
             result = self.db.execute_query(query, (devis_id,))
@@ -274,34 +292,36 @@ class GestionnaireDevis:
             st.error(f"Erreur récupération devis complet: {e}")
             return {}
 
+    @staticmethod
+    def _totaux_depuis(total_ht: float, taux_tva: float) -> Dict[str, float]:
+        """Construit le dictionnaire de totaux (HT, TVA, TTC) à partir du HT et du taux."""
+        total_ht = total_ht or 0.0
+        tva = total_ht * (taux_tva / 100)
+        total_ttc = total_ht + tva
+        
+        return {
+            'total_ht': round(total_ht, 2),
+            'taux_tva': taux_tva,
+            'montant_tva': round(tva, 2),
+            'total_ttc': round(total_ttc, 2)
+        }
+
     def calculer_totaux_devis(self, devis_id: int) -> Dict[str, float]:
         """Calcule les totaux d'un devis (HT, TVA, TTC)."""
         try:
-            query = 'SELECT quantite, prix_unitaire FROM formulaire_lignes WHERE formulaire_id = ?'
-            lignes = self.db.execute_query(query, (devis_id,))
-            
-            total_ht = sum((ligne['quantite'] * ligne['prix_unitaire']) for ligne in lignes)
-            
-            # Récupérer le taux TVA des métadonnées
-            devis_info = self.db.execute_query("SELECT metadonnees_json FROM formulaires WHERE id = ?", (devis_id,))
-            
-            taux_tva = 14.975  # Défaut QC
-            if devis_info:
-                try:
-                    metadonnees = json.loads(devis_info[0]['metadonnees_json'] or '{}')
-                    taux_tva = metadonnees.get('taux_tva', 14.975)
-                except:
-                    pass
-            
-            tva = total_ht * (taux_tva / 100)
-            total_ttc = total_ht + tva
+            # Lignes du seul devis demandé : recherche indexée sur formulaire_id
+            query = f'''
+                SELECT (SELECT COALESCE(SUM(quantite * prix_unitaire), 0)
+                        FROM formulaire_lignes WHERE formulaire_id = f.id) as total_ht,
+                       {TAUX_TVA_SQL} as taux_tva
+                FROM formulaires f
+                WHERE f.id = ?
+            '''
+            result = self.db.execute_query(query, (devis_id,))
+            if not result:
+                return self._totaux_depuis(0.0, TAUX_TVA_DEFAUT)
             
-            return {
-                'total_ht': round(total_ht, 2),
-                'taux_tva': taux_tva,
-                'montant_tva': round(tva, 2),
-                'total_ttc': round(total_ttc, 2)
-            }
+            return self._totaux_depuis(result[0]['total_ht'], result[0]['taux_tva'])
         except Exception as e:
             st.error(f"Erreur calcul totaux devis: {e}")
             return {'total_ht': 0, 'taux_tva': 0, 'montant_tva': 0, 'total_ttc': 0}
@@ -447,12 +467,15 @@ class GestionnaireDevis:
                        f.date_echeance,
                        c.nom as client_nom,
                        e.prenom || ' ' || e.nom as responsable_nom,
-                       p.nom_projet
+                       p.nom_projet,
+                       COALESCE(tl.total_ht, 0) as _total_ht,
+                       {TAUX_TVA_SQL} as _taux_tva
                 FROM formulaires f
                 LEFT JOIN companies c ON f.company_id = c.id
                 LEFT JOIN employees e ON f.employee_id = e.id
                 LEFT JOIN projects p ON f.project_id = p.id
-                WHERE (f.type_formulaire = 'DEVIS' OR (f.type_formulaire = 'ESTIMATION' AND f.metadonnees_json LIKE '%"type_reel": "DEVIS"%'))
+                {self._totaux_devis_join}
+                WHERE {self._filtre_devis}
             '''
             
             params = []
@@ -478,15 +501,15 @@ class GestionnaireDevis:
                     query += " AND DATE(f.date_creation) <= ?"
                     params.append(filters['date_fin'])
             
-            query += " ORDER BY f.date_creation DESC"
+            query += " ORDER BY f.date_creation DESC, f.id"
             
             rows = self.db.execute_query(query, tuple(params) if params else None)
             
-            # Enrichir avec les totaux
+            # Totaux déjà agrégés par la requête (plus de requête par devis)
             devis_list = []
             for row in rows:
                 devis = dict(row)
-                devis['totaux'] = self.calculer_totaux_devis(devis['id'])
+                devis['totaux'] = self._totaux_depuis(devis.pop('_total_ht'), devis.pop('_taux_tva'))
                 devis_list.append(devis)
             
             return devis_list
@@ -506,18 +529,26 @@ class GestionnaireDevis:
                 'en_attente': 0
             }
             
-            all_devis = self.get_all_devis()
-            
-            stats['total_devis'] = len(all_devis)
+            # Agrégation entièrement en SQL : comptes, montants HT et devis expirés par statut
+            query = f'''
+                SELECT f.statut,
+                       COUNT(*) as count,
+                       COALESCE(SUM(ROUND(COALESCE(tl.total_ht, 0), 2)), 0) as montant,
+                       COUNT(CASE WHEN f.date_echeance < DATE('now')
+                                   AND f.statut NOT IN ('ACCEPTÉ', 'REFUSÉ', 'EXPIRÉ', 'ANNULÉ')
+                                  THEN 1 END) as expires
+                FROM formulaires f
+                {self._totaux_devis_join}
+                WHERE {self._filtre_devis}
+                GROUP BY f.statut
+            '''
+            for row in self.db.execute_query(query):
+                stats['par_statut'][row['statut']] = {'count': row['count'], 'montant': row['montant']}
+                stats['total_devis'] += row['count']
+                stats['montant_total'] += row['montant']
+                stats['devis_expires'] += row['expires']
             
-            for devis in all_devis:
-                statut = devis['statut']
-                if statut not in stats['par_statut']:
-                    stats['par_statut'][statut] = {'count': 0, 'montant': 0.0}
-                
-                stats['par_statut'][statut]['count'] += 1
-                stats['par_statut'][statut]['montant'] += devis.get('totaux', {}).get('total_ht', 0.0)
-                stats['montant_total'] += devis.get('totaux', {}).get('total_ht', 0.0)
+            stats['montant_total'] = round(stats['montant_total'], 2)
             
             # Taux d'acceptation
             accepted_count = stats['par_statut'].get('ACCEPTÉ', {}).get('count', 0)
@@ -529,16 +560,6 @@ class GestionnaireDevis:
             if total_decides > 0:
                 stats['taux_acceptation'] = (accepted_count / total_decides) * 100
             
-            # Devis expirés
-            query_expires = '''
-                SELECT COUNT(*) as count FROM formulaires 
-                WHERE (type_formulaire = 'DEVIS' OR (type_formulaire = 'ESTIMATION' AND metadonnees_json LIKE '%"type_reel": "DEVIS"%'))
-                AND date_echeance < DATE('now') 
-                AND statut NOT IN ('ACCEPTÉ', 'REFUSÉ', 'EXPIRÉ', 'ANNULÉ')
-            '''
-            result = self.db.execute_query(query_expires)
-            stats['devis_expires'] = result[0]['count'] if result else 0
-            
             # En attente
             stats['en_attente'] = stats['par_statut'].get('ENVOYÉ', {}).get('count', 0) + \
                                  stats['par_statut'].get('BROUILLON', {}).get('count', 0)
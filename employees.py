@@ -118,65 +118,25 @@ class GestionnaireEmployes:
         else:
             self.db = db
         
-        self.employes = []  # Cache des employés (pour compatibilité interface)
-        
         if self.db:
-            self._load_employes_from_db()
-            
             # Vérifier si données employés existent, sinon initialiser DG Inc.
             if not self.employes:
                 self._initialiser_donnees_employes_dg_inc()
     
-    def _load_employes_from_db(self):
-        """Charge les employés depuis SQLite avec leurs compétences"""
+    @property
+    def employes(self) -> List[Dict]:
+        """
+        Employés avec leurs compétences, relus à chaque accès (cache versionné : aucune
+        requête tant que les tables employés sont inchangées). Le gestionnaire est partagé
+        entre les sessions : pas de copie locale qui ignorerait les modifications des autres.
+        """
         if not self.db:
-            return
-            
+            return []
         try:
-            # Récupérer employés avec informations manager
-            employes_rows = self.db.execute_query("""
-                SELECT e.*, 
-                       m.prenom as manager_prenom, 
-                       m.nom as manager_nom
-                FROM employees e
-                LEFT JOIN employees m ON e.manager_id = m.id
-                ORDER BY e.id
-            """)
-            
-            self.employes = []
-            for emp_row in employes_rows:
-                employe = dict(emp_row)
-                
-                # Récupérer compétences de l'employé
-                competences_rows = self.db.execute_query("""
-                    SELECT nom_competence, niveau, certifie, date_obtention 
-                    FROM employee_competences 
-                    WHERE employee_id = ?
-                    ORDER BY nom_competence
-                """, (employe['id'],))
-                
-                employe['competences'] = [
-                    {
-                        'nom': row['nom_competence'],
-                        'niveau': row['niveau'],
-                        'certifie': bool(row['certifie']),
-                        'date_obtention': row['date_obtention']
-                    }
-                    for row in competences_rows
-                ]
-                
-                # Récupérer projets assignés
-                projets_rows = self.db.execute_query("""
-                    SELECT project_id FROM project_assignments WHERE employee_id = ?
-                """, (employe['id'],))
-                
-                employe['projets_assignes'] = [row['project_id'] for row in projets_rows]
-                
-                self.employes.append(employe)
-                
+            return self.db.get_employes_complets()
         except Exception as e:
             st.error(f"Erreur chargement employés SQLite: {e}")
-            self.employes = []
+            return []
 
     def _calculer_salaire_metallurgie(self, poste, experience_annees=5):
         """Calcule le salaire selon les standards québécois métallurgie 2024"""
@@ -598,8 +558,6 @@ class GestionnaireEmployes:
             if emp_id:
                 print(f"✅ Employé {emp_data['prenom']} {emp_data['nom']} initialisé (ID: {emp_id})")
         
-        # Recharger depuis SQLite
-        self._load_employes_from_db()
         st.success(f"🎉 {len(employes_data)} employés DG Inc. initialisés en SQLite !")
 
     # --- Méthodes CRUD SQLite ---
@@ -669,10 +627,7 @@ class GestionnaireEmployes:
 
     def ajouter_employe(self, data_employe):
         """Interface de compatibilité pour ajouter employé"""
-        emp_id = self.ajouter_employe_sql(data_employe)
-        if emp_id:
-            self._load_employes_from_db()  # Recharger cache
-        return emp_id
+        return self.ajouter_employe_sql(data_employe)
 
     def modifier_employe(self, id_employe, data_employe):
         """Modifie un employé existant en SQLite"""
@@ -735,7 +690,6 @@ class GestionnaireEmployes:
                         VALUES (?, ?, ?)
                     ''', (proj_id, id_employe, 'Membre équipe'))
             
-            self._load_employes_from_db()  # Recharger cache
             return True
             
         except Exception as e:
@@ -759,7 +713,6 @@ class GestionnaireEmployes:
             # Supprimer l'employé
             self.db.execute_update("DELETE FROM employees WHERE id = ?", (id_employe,))
             
-            self._load_employes_from_db()  # Recharger cache
             return True
             
         except Exception as e:
@@ -945,8 +898,8 @@ class GestionnaireEmployes:
 
     # Méthodes de compatibilité (legacy)
     def charger_donnees_employes(self):
-        """Méthode de compatibilité - charge depuis SQLite maintenant"""
-        self._load_employes_from_db()
+        """Méthode de compatibilité - les employés sont relus depuis SQLite à chaque accès"""
+        pass
     
     def sauvegarder_donnees_employes(self):
         """Méthode de compatibilité - sauvegarde automatique SQLite"""
@@ -5,12 +5,45 @@ from datetime import datetime, timedelta
 from typing import Dict, List, Optional, Tuple, Any
 import logging
 import shutil
+import hashlib
+import threading
+import time
+import types
+import zlib
+from contextlib import contextmanager
 from pathlib import Path
 
+from database_pool import SQLiteConnectionPool, build_pragmas, is_read_statement
+from query_cache import QUERY_CACHE, cached_query, extract_written_tables, extract_trigger_targets
+from timetracker_rollups import create_rollup_schema, rebuild_rollups, ROLLUP_TABLES
+import erp_search
+import erp_jobs
+from erp_search import SEARCH_TABLE, SEARCH_SOURCES, build_match_query, build_search_sql
+
 # Configuration du logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+
+def _stable_repr(const) -> str:
+    """repr indépendant du hachage aléatoire des chaînes (frozenset des tests « in {...} »)"""
+    if isinstance(const, (frozenset, set)):
+        return 'frozenset(' + repr(sorted(_stable_repr(item) for item in const)) + ')'
+    if isinstance(const, tuple):
+        return '(' + ', '.join(_stable_repr(item) for item in const) + ')'
+    return repr(const)
+
+
+def _update_code_digest(digest, code: types.CodeType):
+    """Empreinte d'une fonction : bytecode, noms et constantes (DDL), fonctions internes comprises"""
+    digest.update(code.co_code)
+    digest.update(repr(code.co_names).encode('utf-8'))
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            _update_code_digest(digest, const)
+        else:
+            digest.update(_stable_repr(const).encode('utf-8'))
+
 class ERPDatabase:
     """
     Gestionnaire de base de données SQLite unifié pour ERP Production DG Inc.
@@ -71,23 +104,123 @@ class ERPDatabase:
     - Toutes les améliorations de fix_database.py
     """
     
-    def __init__(self, db_path: str = "erp_production_dg.db"):
+    def __init__(self, db_path: str = "erp_production_dg.db", pool_size: int = None,
+                 sqlite_profile: str = None, pragma_overrides: Dict[str, Any] = None,
+                 read_split: bool = None):
         self.db_path = db_path
         self.backup_dir = "backup_json"
-        self.init_database()
-        logger.info(f"ERPDatabase consolidé + Interface Unifiée + Production + Operations↔BT + Communication TT initialisé : {db_path}")
         
-        # 🆕 REMPLACEZ LA LIGNE 89 PAR CECI :
-        logger.info("🔧 DEBUG: Avant appel check_and_upgrade_schema()")
+        # Profil SQLite : journal_mode, synchronous, mmap_size, cache_size, busy_timeout
+        if pool_size is None:
+            pool_size = int(os.environ.get('ERP_DB_POOL_SIZE', '8'))
+        self.sqlite_profile = (sqlite_profile or os.environ.get('ERP_DB_PROFILE', 'WAL')).upper()
+        if read_split is None:
+            read_split = os.environ.get('ERP_DB_READ_SPLIT', 'true').lower() == 'true'
+        # Une base :memory: n'existe que dans sa propre connexion → pas de lecteurs séparés
+        self.read_split = read_split and db_path != ":memory:"
+        
+        # Pool écrivain (lecture/écriture) + verrou qui sérialise les écritures de cette instance
+        self._pool = SQLiteConnectionPool(
+            db_path, pool_size=pool_size,
+            pragmas=build_pragmas(self.sqlite_profile, pragma_overrides)
+        )
+        self._write_lock = threading.RLock()
+        # Imbrication des write_transaction() du thread courant (points de sauvegarde)
+        self._write_tx_state = threading.local()
+        
+        # Pool lecteurs (mode ro) : les dashboards ne bloquent plus les pointages en WAL
+        if self.read_split:
+            self._read_pool = SQLiteConnectionPool(
+                db_path, pool_size=pool_size, read_only=True,
+                pragmas=build_pragmas(self.sqlite_profile, pragma_overrides, read_only=True)
+            )
+        else:
+            self._read_pool = self._pool
+        
+        # Cache des requêtes lourdes, invalidé par version de table à chaque écriture
+        self.query_cache = QUERY_CACHE
+        self._cache_db_key = os.path.abspath(db_path) if db_path != ":memory:" else f":memory:{id(self)}"
+        self._trigger_cascade: Dict[str, set] = {}
+        
+        start = time.perf_counter()
+        force_init = os.environ.get('ERP_DB_FORCE_SCHEMA_INIT', 'false').lower() == 'true'
+        # Démarrage à chaud : empreinte du schéma identique → DDL, corrections et migrations ignorées
+        self.schema_fast_path = not force_init and self._schema_is_current()
+        
+        if not self.schema_fast_path:
+            self.init_database()
+            logger.info(f"ERPDatabase consolidé + Interface Unifiée + Production + Operations↔BT + Communication TT initialisé : {db_path}")
+            
+            try:
+                self.check_and_upgrade_schema()
+                # Empreinte enregistrée seulement si la mise à jour a réussi : sinon elle est retentée au prochain démarrage
+                self._store_schema_fingerprint()
+            except Exception as e:
+                logger.error(f"❌ Erreur dans check_and_upgrade_schema(): {e}")
+                import traceback
+                logger.error(f"Traceback: {traceback.format_exc()}")
+        
+        # Schéma à jour : entrées éventuelles d'une instance précédente périmées
+        self._load_trigger_cascade()
+        self.search_index_available = self._detect_search_index()
+        self.query_cache.bump_all(self._cache_db_key)
+        
+        self.init_duration_ms = (time.perf_counter() - start) * 1000
+        logger.info(f"{'⚡ Démarrage à chaud' if self.schema_fast_path else '🧱 Initialisation complète du schéma'} "
+                    f"en {self.init_duration_ms:.0f} ms : {db_path}")
+
+    # Dernière migration de upgrade_schema()
+    LATEST_SCHEMA_VERSION = 12  # v12 : tâche BT des pointages + index (employee_id, punch_in)
+    
+    _schema_fingerprint: Optional[int] = None
+    
+    @classmethod
+    def schema_fingerprint(cls) -> int:
+        """
+        Empreinte du schéma attendu par le code : DDL et corrections de init_database(),
+        migrations, synthèses TimeTracker, index de recherche et table des jobs.
+        Toute modification de ces définitions change l'empreinte (aucun numéro à tenir à jour).
+        Stockée dans PRAGMA user_version (entier signé 32 bits, jamais 0).
+        """
+        if cls._schema_fingerprint is None:
+            import timetracker_rollups
+            digest = zlib.crc32(str(cls.LATEST_SCHEMA_VERSION).encode('utf-8'))
+            for fonction in (cls.init_database, cls._apply_automatic_fixes, cls.upgrade_schema,
+                             timetracker_rollups.create_rollup_schema, erp_search.create_search_schema,
+                             erp_jobs.create_jobs_schema):
+                code_digest = hashlib.sha1()
+                _update_code_digest(code_digest, fonction.__code__)
+                digest = zlib.crc32(code_digest.digest(), digest)
+            module_ddl = (timetracker_rollups.ROLLUP_TABLES_DDL, timetracker_rollups.ROLLUP_TRIGGERS_DDL,
+                          erp_search.SEARCH_TABLE_DDL, erp_search.SEARCH_KEYS_DDL,
+                          [erp_search.search_triggers_ddl(t) for t in SEARCH_SOURCES],
+                          [erp_search.search_link_triggers_ddl(t) for t in SEARCH_SOURCES],
+                          erp_jobs.JOBS_TABLE_DDL, erp_jobs.JOBS_INDEXES_DDL)
+            digest = zlib.crc32(repr(module_ddl).encode('utf-8'), digest)
+            cls._schema_fingerprint = (digest & 0x7FFFFFFF) or 1
+        return cls._schema_fingerprint
+    
+    def _schema_is_current(self) -> bool:
+        """Lecture unique de PRAGMA user_version (connexion écrivain : la base peut ne pas exister)"""
+        if self.db_path == ":memory:":
+            return False
         try:
-            self.check_and_upgrade_schema()
-            logger.info("🔧 DEBUG: Après appel check_and_upgrade_schema() - SUCCÈS")
+            row = self.get_connection().execute("PRAGMA user_version").fetchone()
+            return bool(row) and row[0] == self.schema_fingerprint()
         except Exception as e:
-            logger.error(f"🔧 DEBUG: ERREUR dans check_and_upgrade_schema(): {e}")
-            import traceback
-            logger.error(f"🔧 DEBUG: Traceback: {traceback.format_exc()}")
-
-    # 🆕 NOUVELLE MÉTHODE À AJOUTER ICI
+            logger.warning(f"⚠️ Lecture de l'empreinte du schéma impossible: {e}")
+            return False
+    
+    def _store_schema_fingerprint(self):
+        """Enregistre l'empreinte après une initialisation complète réussie"""
+        try:
+            with self._write_lock:
+                conn = self.get_connection()
+                conn.execute(f"PRAGMA user_version = {self.schema_fingerprint()}")
+                conn.commit()
+        except Exception as e:
+            logger.warning(f"⚠️ Enregistrement de l'empreinte du schéma impossible: {e}")
+    
     def get_schema_version(self):
         """Récupère la version actuelle du schéma de base de données"""
         try:
@@ -123,16 +256,11 @@ class ERPDatabase:
 
     def check_and_upgrade_schema(self):
         """Vérifie et met à jour le schéma de base de données"""
-        logger.info("🔧 DEBUG: check_and_upgrade_schema() appelé")
-        
-        LATEST_SCHEMA_VERSION = 6  # 🎯 CHANGÉ pour ajouter les fonctionnalités Insightly
-        
         current_version = self.get_schema_version()
-        logger.info(f"🔧 DEBUG: Version actuelle = {current_version}")
         
-        if current_version < LATEST_SCHEMA_VERSION:
-            logger.info(f"🔄 Migration nécessaire: v{current_version} → v{LATEST_SCHEMA_VERSION}")
-            self.upgrade_schema(current_version, LATEST_SCHEMA_VERSION)
+        if current_version < self.LATEST_SCHEMA_VERSION:
+            logger.info(f"🔄 Migration nécessaire: v{current_version} → v{self.LATEST_SCHEMA_VERSION}")
+            self.upgrade_schema(current_version, self.LATEST_SCHEMA_VERSION)
         else:
             logger.info(f"✅ Schéma à jour: v{current_version}")
 
@@ -488,6 +616,108 @@ class ERPDatabase:
                     import traceback
                     logger.error(f"Traceback: {traceback.format_exc()}")
             
+            if from_version < 7:
+                logger.info("📝 Migration v7: Synthèses TimeTracker (tables tt_rollup_*)...")
+                try:
+                    # Tables et triggers déjà créés par init_database() : alimenter depuis l'historique
+                    counts = self.rebuild_timetracker_rollups()
+                    logger.info(f"✅ Migration v7 terminée - Synthèses: {counts}")
+                except Exception as e:
+                    logger.error(f"❌ Erreur migration v7: {e}")
+            
+            if from_version < 8:
+                logger.info("📝 Migration v8: Avancement global unique par BT (upsert)...")
+                try:
+                    # Supprimer les doublons d'avancement global avant l'index unique partiel
+                    removed = self.execute_update('''
+                        DELETE FROM bt_avancement
+                        WHERE operation_id IS NULL
+                        AND id NOT IN (
+                            SELECT MAX(id) FROM bt_avancement
+                            WHERE operation_id IS NULL
+                            GROUP BY bt_id
+                        )
+                    ''')
+                    self.execute_update('''
+                        CREATE UNIQUE INDEX IF NOT EXISTS idx_bt_avancement_global
+                        ON bt_avancement(bt_id) WHERE operation_id IS NULL
+                    ''')
+                    logger.info(f"✅ Migration v8 terminée - {removed} doublons d'avancement supprimés")
+                except Exception as e:
+                    logger.error(f"❌ Erreur migration v8: {e}")
+            
+            if from_version < 9:
+                logger.info("📝 Migration v9: Colonne générée est_devis sur formulaires...")
+                try:
+                    # Devis natifs ou ESTIMATION en mode compatibilité (type_reel = DEVIS dans les métadonnées)
+                    columns = [row['name'] for row in self.execute_query("PRAGMA table_xinfo(formulaires)")]
+                    if 'est_devis' not in columns:
+                        self.execute_update('''
+                            ALTER TABLE formulaires ADD COLUMN est_devis INTEGER
+                            GENERATED ALWAYS AS (
+                                CASE WHEN type_formulaire = 'DEVIS'
+                                       OR (type_formulaire = 'ESTIMATION'
+                                           AND json_valid(metadonnees_json)
+                                           AND json_extract(metadonnees_json, '$.type_reel') = 'DEVIS')
+                                     THEN 1 ELSE 0 END
+                            ) VIRTUAL
+                        ''')
+                    self.execute_update(
+                        "CREATE INDEX IF NOT EXISTS idx_formulaires_est_devis ON formulaires(est_devis, date_creation)"
+                    )
+                    logger.info("✅ Migration v9 terminée - Filtre devis indexé")
+                except Exception as e:
+                    logger.error(f"❌ Erreur migration v9: {e}")
+            
+            if from_version < 10:
+                logger.info("📝 Migration v10: Index de recherche plein texte (FTS5)...")
+                try:
+                    # Table FTS5 et triggers déjà créés par init_database() : indexer l'existant
+                    counts = self.rebuild_search_index()
+                    logger.info(f"✅ Migration v10 terminée - Entités indexées: {counts}")
+                except Exception as e:
+                    logger.error(f"❌ Erreur migration v10: {e}")
+            
+            if from_version < 11:
+                logger.info("📝 Migration v11: Code interne unique pour les articles d'inventaire...")
+                try:
+                    # Doublons existants : le plus ancien garde le code, les autres sont suffixés par leur id
+                    renamed = self.execute_update('''
+                        UPDATE inventory_items
+                        SET code_interne = code_interne || '-' || id
+                        WHERE code_interne IS NOT NULL AND code_interne != ''
+                        AND id NOT IN (
+                            SELECT MIN(id) FROM inventory_items
+                            WHERE code_interne IS NOT NULL AND code_interne != ''
+                            GROUP BY code_interne
+                        )
+                    ''')
+                    if renamed:
+                        logger.warning(f"⚠️ Migration v11: {renamed} codes internes en double renommés (suffixe -id)")
+                    self.execute_update('''
+                        CREATE UNIQUE INDEX IF NOT EXISTS idx_inventory_code_interne
+                        ON inventory_items(code_interne)
+                        WHERE code_interne IS NOT NULL AND code_interne != ''
+                    ''')
+                    logger.info("✅ Migration v11 terminée - Upsert par code_interne disponible")
+                except Exception as e:
+                    logger.error(f"❌ Erreur migration v11: {e}")
+            
+            if from_version < 12:
+                logger.info("📝 Migration v12: Tâche BT des pointages et index d'historique...")
+                try:
+                    columns = [row['name'] for row in self.execute_query("PRAGMA table_info(time_entries)")]
+                    if 'formulaire_ligne_id' not in columns:
+                        self.execute_update(
+                            "ALTER TABLE time_entries ADD COLUMN formulaire_ligne_id INTEGER REFERENCES formulaire_lignes(id)"
+                        )
+                    self.execute_update(
+                        "CREATE INDEX IF NOT EXISTS idx_time_entries_employee_punch_in ON time_entries(employee_id, punch_in)"
+                    )
+                    logger.info("✅ Migration v12 terminée - Historique des pointages paginable")
+                except Exception as e:
+                    logger.error(f"❌ Erreur migration v12: {e}")
+            
             # Marquer comme migré
             self.set_schema_version(to_version)
             logger.info(f"✅ Migration terminée: schéma v{to_version}")
@@ -496,19 +726,14 @@ class ERPDatabase:
             logger.error(f"❌ Erreur migration schéma: {e}")
             import traceback
             logger.error(f"Traceback complet: {traceback.format_exc()}")
+            raise  # L'empreinte du schéma ne doit pas être enregistrée
     
     def init_database(self):
         """Initialise toutes les tables de la base de données ERP avec corrections automatiques intégrées"""
-        with sqlite3.connect(self.db_path) as conn:
+        # Connexion écrivain : journal_mode, synchronous, mmap_size... déjà appliqués par le profil
+        with self._write_lock, self.get_connection() as conn:
             cursor = conn.cursor()
             
-            # Activer les clés étrangères et optimisations SQLite
-            cursor.execute("PRAGMA foreign_keys = ON")
-            cursor.execute("PRAGMA journal_mode = WAL")
-            cursor.execute("PRAGMA synchronous = NORMAL")
-            cursor.execute("PRAGMA temp_store = memory")
-            cursor.execute("PRAGMA mmap_size = 268435456")  # 256MB
-            
             # 1. ENTREPRISES (CRM)
             cursor.execute('''
                 CREATE TABLE IF NOT EXISTS companies (
@@ -1028,6 +1253,7 @@ class ERPDatabase:
             cursor.execute('CREATE INDEX IF NOT EXISTS idx_materials_project ON materials(project_id)')
             cursor.execute('CREATE INDEX IF NOT EXISTS idx_time_entries_employee ON time_entries(employee_id)')
             cursor.execute('CREATE INDEX IF NOT EXISTS idx_time_entries_project ON time_entries(project_id)')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_time_entries_punch_in ON time_entries(punch_in)')
             cursor.execute('CREATE INDEX IF NOT EXISTS idx_contacts_company ON contacts(company_id)')
             cursor.execute('CREATE INDEX IF NOT EXISTS idx_competences_employee ON employee_competences(employee_id)')
             cursor.execute('CREATE INDEX IF NOT EXISTS idx_companies_secteur ON companies(secteur)')
@@ -1545,6 +1771,54 @@ class ERPDatabase:
                 END;
             ''')
             
+            # Synthèses TimeTracker (par BT, opération, employé-jour, poste-jour) tenues à jour par triggers
+            create_rollup_schema(cursor)
+            
+            # Index de recherche plein texte (FTS5) tenu à jour par triggers
+            erp_search.create_search_schema(cursor)
+            
+            # Suivi des jobs de maintenance exécutés en arrière-plan (erp_jobs.JobRunner)
+            erp_jobs.create_jobs_schema(cursor)
+            
+            # BTs dont la progression est à recalculer (heures pointées ou estimation modifiées)
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS bt_progression_a_recalculer (
+                    bt_id INTEGER PRIMARY KEY,
+                    marque_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            
+            cursor.execute('''
+                CREATE TRIGGER IF NOT EXISTS trigger_bt_progression_heures_insert
+                AFTER INSERT ON tt_rollup_bt
+                FOR EACH ROW
+                BEGIN
+                    INSERT INTO bt_progression_a_recalculer (bt_id)
+                    SELECT NEW.formulaire_bt_id WHERE NOT EXISTS (SELECT 1 FROM bt_progression_a_recalculer WHERE bt_id = NEW.formulaire_bt_id);
+                END;
+            ''')
+            
+            cursor.execute('''
+                CREATE TRIGGER IF NOT EXISTS trigger_bt_progression_heures_update
+                AFTER UPDATE OF total_heures ON tt_rollup_bt
+                FOR EACH ROW
+                BEGIN
+                    INSERT INTO bt_progression_a_recalculer (bt_id)
+                    SELECT NEW.formulaire_bt_id WHERE NOT EXISTS (SELECT 1 FROM bt_progression_a_recalculer WHERE bt_id = NEW.formulaire_bt_id);
+                END;
+            ''')
+            
+            cursor.execute('''
+                CREATE TRIGGER IF NOT EXISTS trigger_bt_progression_estimation
+                AFTER UPDATE OF metadonnees_json ON formulaires
+                FOR EACH ROW
+                WHEN NEW.type_formulaire = 'BON_TRAVAIL'
+                BEGIN
+                    INSERT INTO bt_progression_a_recalculer (bt_id)
+                    SELECT NEW.id WHERE NOT EXISTS (SELECT 1 FROM bt_progression_a_recalculer WHERE bt_id = NEW.id);
+                END;
+            ''')
+            
             # 26. MOUVEMENTS DE STOCK (Inventaire)
             cursor.execute('''
                 CREATE TABLE IF NOT EXISTS mouvements_stock (
@@ -1629,6 +1903,20 @@ class ERPDatabase:
                 )
             ''')
             
+            # Saisie et validation d'inventaire par lot (recherche des lignes par inventaire/produit)
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_inventaire_lignes_inventaire ON inventaire_lignes(inventaire_id, produit_id)')
+            
+            # 30. SÉQUENCES DE NUMÉROTATION DES DOCUMENTS (BT, DP, BA, EST...)
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS document_sequences (
+                    prefixe TEXT NOT NULL,
+                    annee INTEGER NOT NULL,
+                    dernier_numero INTEGER NOT NULL DEFAULT 0,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (prefixe, annee)
+                ) WITHOUT ROWID
+            ''')
+            
             conn.commit()
             
             # =========================================================================
@@ -1866,6 +2154,7 @@ class ERPDatabase:
             logger.error(f"Erreur suppression poste {work_center_id}: {e}")
             return False
 
+    @cached_query('work_centers', 'operations', 'time_entries', max_age=300)
     def get_work_centers_statistics(self) -> Dict[str, Any]:
         """Statistiques complètes des postes de travail pour interface unifiée"""
         try:
@@ -1958,33 +2247,43 @@ class ERPDatabase:
         try:
             start_date = (datetime.now() - timedelta(days=period_days)).strftime('%Y-%m-%d')
             
+            # Synthèses poste-jour : coût proportionnel au nombre de jours, pas à l'historique
             query = '''
                 SELECT 
                     wc.id, wc.nom, wc.departement, wc.categorie, wc.type_machine,
                     wc.capacite_theorique, wc.cout_horaire, wc.operateurs_requis,
-                    COALESCE(SUM(te.total_hours), 0) as heures_reelles,
-                    COALESCE(SUM(te.total_cost), 0) as revenus_generes,
-                    COALESCE(AVG(te.hourly_rate), wc.cout_horaire) as taux_horaire_reel,
-                    COUNT(DISTINCT te.id) as nombre_pointages,
-                    COUNT(DISTINCT te.employee_id) as employes_distincts,
-                    COUNT(DISTINCT o.project_id) as projets_touches,
+                    COALESCE(r.heures, 0) as heures_reelles,
+                    COALESCE(r.cout, 0) as revenus_generes,
+                    COALESCE(r.somme_taux / NULLIF(r.nb_taux, 0), wc.cout_horaire) as taux_horaire_reel,
+                    COALESCE(r.nb_pointages, 0) as nombre_pointages,
+                    (SELECT COUNT(DISTINCT m.membre_id) FROM tt_rollup_membres m
+                     WHERE m.portee = 'POSTE' AND m.portee_id = wc.id
+                     AND m.type_membre = 'EMPLOYE' AND m.jour >= ?) as employes_distincts,
+                    (SELECT COUNT(DISTINCT o.project_id) FROM operations o
+                     WHERE o.work_center_id = wc.id) as projets_touches,
                     -- Calcul du taux d'utilisation
                     CASE 
                         WHEN wc.capacite_theorique > 0 THEN
-                            ROUND((COALESCE(SUM(te.total_hours), 0) / (wc.capacite_theorique * ?)) * 100, 2)
+                            ROUND((COALESCE(r.heures, 0) / (wc.capacite_theorique * ?)) * 100, 2)
                         ELSE 0
                     END as taux_utilisation_pct
                 FROM work_centers wc
-                LEFT JOIN operations o ON wc.id = o.work_center_id
-                LEFT JOIN time_entries te ON o.id = te.operation_id 
-                    AND te.total_cost IS NOT NULL 
-                    AND DATE(te.punch_in) >= ?
+                LEFT JOIN (
+                    SELECT work_center_id,
+                           SUM(nb_pointages) as nb_pointages,
+                           SUM(total_heures) as heures,
+                           SUM(total_cout) as cout,
+                           SUM(somme_taux) as somme_taux,
+                           SUM(nb_taux) as nb_taux
+                    FROM tt_rollup_poste_jour
+                    WHERE jour >= ?
+                    GROUP BY work_center_id
+                ) r ON r.work_center_id = wc.id
                 WHERE wc.statut = 'ACTIF'
-                GROUP BY wc.id
                 ORDER BY heures_reelles DESC
             '''
             
-            rows = self.execute_query(query, (period_days, start_date))
+            rows = self.execute_query(query, (start_date, period_days, start_date))
             
             analysis = []
             for row in rows:
@@ -2393,6 +2692,179 @@ class ERPDatabase:
             logger.error(f"Erreur récupération BTs avec opérations: {e}")
             return []
 
+    # Ordres de tri disponibles pour get_bons_travail_bulk()
+    BT_BULK_ORDER_BY = {
+        'recent': 'f.id DESC',
+        'creation': 'f.created_at DESC',
+        'priorite': '''
+            CASE f.priorite 
+                WHEN 'CRITIQUE' THEN 1
+                WHEN 'URGENT' THEN 2
+                WHEN 'NORMAL' THEN 3
+                ELSE 4
+            END,
+            f.date_echeance ASC NULLS LAST,
+            f.date_creation DESC
+        ''',
+    }
+
+    def get_bons_travail_bulk(self, bt_ids: List[int] = None, statuts: List[str] = None,
+                              include_operations: bool = True, include_assignations: bool = True,
+                              include_reservations: bool = True, include_timetracker: bool = True,
+                              include_lignes: bool = False, order_by: str = 'recent') -> List[Dict]:
+        """
+        Charge les Bons de Travail et leurs données liées en un nombre fixe de requêtes
+        (1 requête BT + 1 par type de données liées), quel que soit le nombre de BTs.
+        
+        Chaque BT contient les colonnes de formulaires + company_nom, nom_projet, employee_nom,
+        nb_lignes, total_heures_prevues, nb_employes_assignes et, selon les options :
+        operations, assignations, reservations_postes, timetracker_stats
+        (même forme que get_statistiques_bt_timetracker(bt_id)), lignes (formulaire_lignes
+        par sequence_ligne).
+        """
+        try:
+            conditions = ["f.type_formulaire = 'BON_TRAVAIL'"]
+            params = []
+            if bt_ids is not None:
+                conditions.append("f.id IN (SELECT value FROM json_each(?))")
+                params.append(json.dumps([int(bt_id) for bt_id in bt_ids]))
+            if statuts:
+                conditions.append("f.statut IN (SELECT value FROM json_each(?))")
+                params.append(json.dumps(list(statuts)))
+            where_clause = " AND ".join(conditions)
+            # Sous-ensemble de BTs réutilisé par les requêtes des données liées
+            bt_subquery = f"SELECT f.id FROM formulaires f WHERE {where_clause}"
+            params = tuple(params)
+            
+            bts_query = f'''
+                SELECT f.*, 
+                       c.nom as company_nom,
+                       p.nom_projet,
+                       e.prenom || ' ' || e.nom as employee_nom,
+                       COALESCE(fl_agg.nb_lignes, 0) as nb_lignes,
+                       COALESCE(fl_agg.total_heures_prevues, 0) as total_heures_prevues,
+                       COALESCE(bta_agg.nb_employes_assignes, 0) as nb_employes_assignes
+                FROM formulaires f
+                LEFT JOIN companies c ON f.company_id = c.id
+                LEFT JOIN projects p ON f.project_id = p.id
+                LEFT JOIN employees e ON f.employee_id = e.id
+                LEFT JOIN (
+                    SELECT formulaire_id,
+                           COUNT(*) as nb_lignes,
+                           SUM(CASE WHEN sequence_ligne < 1000 THEN prix_unitaire ELSE 0 END) as total_heures_prevues
+                    FROM formulaire_lignes
+                    WHERE formulaire_id IN ({bt_subquery})
+                    GROUP BY formulaire_id
+                ) fl_agg ON fl_agg.formulaire_id = f.id
+                LEFT JOIN (
+                    SELECT bt_id, COUNT(DISTINCT employe_id) as nb_employes_assignes
+                    FROM bt_assignations
+                    WHERE statut = 'ASSIGNÉ'
+                    GROUP BY bt_id
+                ) bta_agg ON bta_agg.bt_id = f.id
+                WHERE {where_clause}
+                ORDER BY {self.BT_BULK_ORDER_BY.get(order_by, self.BT_BULK_ORDER_BY['recent'])}
+            '''
+            bts = self.execute_query(bts_query, params + params)
+            if not bts:
+                return []
+            
+            def group_by_bt(rows: List[Dict], key: str) -> Dict[int, List[Dict]]:
+                grouped = {}
+                for row in rows:
+                    grouped.setdefault(row[key], []).append(row)
+                return grouped
+            
+            operations_par_bt = {}
+            if include_operations:
+                operations_par_bt = group_by_bt(self.execute_query(f'''
+                    SELECT o.*, 
+                           wc.nom as work_center_name,
+                           wc.departement as work_center_departement,
+                           wc.capacite_theorique as work_center_capacite,
+                           wc.cout_horaire as work_center_cout_horaire
+                    FROM operations o
+                    LEFT JOIN work_centers wc ON o.work_center_id = wc.id
+                    WHERE o.formulaire_bt_id IN ({bt_subquery})
+                    ORDER BY o.formulaire_bt_id, o.sequence_number, o.id
+                ''', params), 'formulaire_bt_id')
+            
+            assignations_par_bt = {}
+            if include_assignations:
+                assignations_par_bt = group_by_bt(self.execute_query(f'''
+                    SELECT bta.*, 
+                           e.prenom || ' ' || e.nom as employe_nom,
+                           e.poste as employe_poste
+                    FROM bt_assignations bta
+                    LEFT JOIN employees e ON bta.employe_id = e.id
+                    WHERE bta.bt_id IN ({bt_subquery})
+                    ORDER BY bta.bt_id, bta.date_assignation DESC
+                ''', params), 'bt_id')
+            
+            reservations_par_bt = {}
+            if include_reservations:
+                reservations_par_bt = group_by_bt(self.execute_query(f'''
+                    SELECT btr.*, 
+                           wc.nom as poste_nom,
+                           wc.departement as poste_departement
+                    FROM bt_reservations_postes btr
+                    LEFT JOIN work_centers wc ON btr.work_center_id = wc.id
+                    WHERE btr.bt_id IN ({bt_subquery})
+                    ORDER BY btr.bt_id, btr.date_reservation DESC
+                ''', params), 'bt_id')
+            
+            lignes_par_bt = {}
+            if include_lignes:
+                lignes_par_bt = group_by_bt(self.execute_query(f'''
+                    SELECT fl.*
+                    FROM formulaire_lignes fl
+                    WHERE fl.formulaire_id IN ({bt_subquery})
+                    ORDER BY fl.formulaire_id, fl.sequence_ligne
+                ''', params), 'formulaire_id')
+            
+            timetracker_par_bt = {}
+            if include_timetracker:
+                for row in self.execute_query(f'''
+                    SELECT 
+                        r.formulaire_bt_id,
+                        r.nb_pointages,
+                        (SELECT COUNT(*) FROM tt_rollup_membres m
+                         WHERE m.portee = 'BT' AND m.portee_id = r.formulaire_bt_id
+                         AND m.jour = '' AND m.type_membre = 'EMPLOYE') as nb_employes_distinct,
+                        r.total_heures,
+                        r.total_cout,
+                        CASE WHEN r.nb_pointages > 0 THEN r.total_heures / r.nb_pointages ELSE 0 END as moyenne_heures_session,
+                        r.premier_pointage,
+                        r.dernier_pointage
+                    FROM tt_rollup_bt r
+                    WHERE r.formulaire_bt_id IN ({bt_subquery})
+                ''', params):
+                    timetracker_par_bt[row.pop('formulaire_bt_id')] = row
+            
+            stats_vides = {
+                'nb_pointages': 0, 'nb_employes_distinct': 0, 'total_heures': 0,
+                'total_cout': 0, 'moyenne_heures_session': 0,
+                'premier_pointage': None, 'dernier_pointage': None
+            }
+            
+            for bt in bts:
+                if include_operations:
+                    bt['operations'] = operations_par_bt.get(bt['id'], [])
+                if include_assignations:
+                    bt['assignations'] = assignations_par_bt.get(bt['id'], [])
+                if include_reservations:
+                    bt['reservations_postes'] = reservations_par_bt.get(bt['id'], [])
+                if include_timetracker:
+                    bt['timetracker_stats'] = timetracker_par_bt.get(bt['id'], dict(stats_vides))
+                if include_lignes:
+                    bt['lignes'] = lignes_par_bt.get(bt['id'], [])
+            
+            return bts
+            
+        except Exception as e:
+            logger.error(f"Erreur chargement groupé des BTs: {e}")
+            return []
+
     # =========================================================================
     # MÉTHODES SPÉCIFIQUES À L'INTÉGRATION TIMETRACKER ↔ BONS DE TRAVAIL (ÉTAPE 2)
     # =========================================================================
@@ -2546,36 +3018,57 @@ class ERPDatabase:
             logger.error(f"Erreur fermeture pointage BT: {e}")
             return False
     
+    def rebuild_timetracker_rollups(self) -> Dict[str, int]:
+        """
+        Reconstruit les synthèses TimeTracker (tt_rollup_*) depuis time_entries.
+        Les triggers les tiennent à jour ; cette commande sert à la réparation
+        (import massif sans triggers, dérive d'arrondi, restauration...).
+        """
+        with self._write_lock, self.get_connection() as conn:
+            counts = rebuild_rollups(conn.cursor())
+        self.invalidate_tables(*ROLLUP_TABLES)
+        logger.info(f"🔄 Synthèses TimeTracker reconstruites: {counts}")
+        return counts
+    
     def get_statistiques_bt_timetracker(self, bt_id: int = None) -> Dict:
-        """Statistiques TimeTracker pour les BTs (global ou spécifique)"""
+        """Statistiques TimeTracker pour les BTs (global ou spécifique) - lues dans tt_rollup_bt"""
         try:
             if bt_id:
                 # Stats pour un BT spécifique
                 query = '''
                     SELECT 
-                        COUNT(*) as nb_pointages,
-                        COUNT(DISTINCT employee_id) as nb_employes_distinct,
-                        COALESCE(SUM(total_hours), 0) as total_heures,
-                        COALESCE(SUM(total_cost), 0) as total_cout,
-                        COALESCE(AVG(total_hours), 0) as moyenne_heures_session,
-                        MIN(punch_in) as premier_pointage,
-                        MAX(punch_out) as dernier_pointage
-                    FROM time_entries 
-                    WHERE formulaire_bt_id = ? AND total_cost IS NOT NULL
+                        r.nb_pointages,
+                        (SELECT COUNT(*) FROM tt_rollup_membres m
+                         WHERE m.portee = 'BT' AND m.portee_id = r.formulaire_bt_id
+                         AND m.jour = '' AND m.type_membre = 'EMPLOYE') as nb_employes_distinct,
+                        r.total_heures,
+                        r.total_cout,
+                        CASE WHEN r.nb_pointages > 0 THEN r.total_heures / r.nb_pointages ELSE 0 END as moyenne_heures_session,
+                        r.premier_pointage,
+                        r.dernier_pointage
+                    FROM tt_rollup_bt r
+                    WHERE r.formulaire_bt_id = ?
                 '''
                 result = self.execute_query(query, (bt_id,))
+                if not result:
+                    return {
+                        'nb_pointages': 0, 'nb_employes_distinct': 0, 'total_heures': 0,
+                        'total_cout': 0, 'moyenne_heures_session': 0,
+                        'premier_pointage': None, 'dernier_pointage': None
+                    }
             else:
                 # Stats globales des BTs
                 query = '''
                     SELECT 
-                        COUNT(*) as nb_pointages,
-                        COUNT(DISTINCT employee_id) as nb_employes_distinct,
-                        COUNT(DISTINCT formulaire_bt_id) as nb_bts_avec_pointages,
-                        COALESCE(SUM(total_hours), 0) as total_heures,
-                        COALESCE(SUM(total_cost), 0) as total_cout,
-                        COALESCE(AVG(total_hours), 0) as moyenne_heures_session
-                    FROM time_entries 
-                    WHERE formulaire_bt_id IS NOT NULL AND total_cost IS NOT NULL
+                        COALESCE(SUM(nb_pointages), 0) as nb_pointages,
+                        (SELECT COUNT(*) FROM tt_rollup_membres
+                         WHERE portee = 'BT_GLOBAL' AND portee_id = 0
+                         AND jour = '' AND type_membre = 'EMPLOYE') as nb_employes_distinct,
+                        COUNT(CASE WHEN nb_pointages > 0 THEN 1 END) as nb_bts_avec_pointages,
+                        COALESCE(SUM(total_heures), 0) as total_heures,
+                        COALESCE(SUM(total_cout), 0) as total_cout,
+                        COALESCE(SUM(total_heures) / NULLIF(SUM(nb_pointages), 0), 0) as moyenne_heures_session
+                    FROM tt_rollup_bt
                 '''
                 result = self.execute_query(query)
             
@@ -2589,22 +3082,64 @@ class ERPDatabase:
     # MÉTHODES COMMUNICATION TIMETRACKER UNIFIÉES - NOUVELLES AJOUTÉES
     # =========================================================================
     
+    @cached_query('employees', 'employee_competences', 'project_assignments')
+    def get_employes_complets(self) -> List[Dict]:
+        """
+        Charge tous les employés avec manager, compétences et projets assignés
+        en trois requêtes (regroupement en mémoire).
+        Le résultat est servi par le cache tant que employees, employee_competences
+        et project_assignments n'ont pas été modifiées.
+        """
+        employes = [dict(row) for row in self.execute_query('''
+            SELECT e.*, 
+                   m.prenom as manager_prenom, 
+                   m.nom as manager_nom
+            FROM employees e
+            LEFT JOIN employees m ON e.manager_id = m.id
+            ORDER BY e.id
+        ''')]
+        
+        competences_par_employe = {}
+        for row in self.execute_query('''
+            SELECT employee_id, nom_competence, niveau, certifie, date_obtention 
+            FROM employee_competences 
+            ORDER BY employee_id, nom_competence
+        '''):
+            competences_par_employe.setdefault(row['employee_id'], []).append({
+                'nom': row['nom_competence'],
+                'niveau': row['niveau'],
+                'certifie': bool(row['certifie']),
+                'date_obtention': row['date_obtention']
+            })
+        
+        projets_par_employe = {}
+        for row in self.execute_query("SELECT employee_id, project_id FROM project_assignments"):
+            projets_par_employe.setdefault(row['employee_id'], []).append(row['project_id'])
+        
+        for employe in employes:
+            employe['competences'] = competences_par_employe.get(employe['id'], [])
+            employe['projets_assignes'] = projets_par_employe.get(employe['id'], [])
+        
+        return employes
+
     def get_employee_productivity_stats(self, employee_id: int) -> Dict:
-        """Statistiques de productivité d'un employé avec BTs"""
+        """Statistiques de productivité d'un employé avec BTs (synthèses employé-jour)"""
         try:
             query = '''
                 SELECT 
-                    COALESCE(SUM(te.total_hours), 0) as total_hours,
-                    COALESCE(SUM(CASE WHEN te.formulaire_bt_id IS NOT NULL THEN te.total_hours ELSE 0 END), 0) as bt_hours,
-                    COALESCE(SUM(te.total_cost), 0) as total_revenue,
-                    COALESCE(SUM(CASE WHEN te.formulaire_bt_id IS NOT NULL THEN te.total_cost ELSE 0 END), 0) as bt_revenue,
-                    COUNT(DISTINCT te.formulaire_bt_id) as bt_count,
-                    COALESCE(AVG(te.total_hours), 0) as avg_hours_per_session,
-                    COUNT(DISTINCT te.project_id) as projects_worked
-                FROM time_entries te
-                WHERE te.employee_id = ? AND te.total_cost IS NOT NULL
+                    COALESCE(SUM(r.total_heures), 0) as total_hours,
+                    COALESCE(SUM(r.heures_bt), 0) as bt_hours,
+                    COALESCE(SUM(r.total_cout), 0) as total_revenue,
+                    COALESCE(SUM(r.cout_bt), 0) as bt_revenue,
+                    (SELECT COUNT(*) FROM tt_rollup_membres m
+                     WHERE m.portee = 'EMPLOYE' AND m.portee_id = ? AND m.jour = '' AND m.type_membre = 'BT') as bt_count,
+                    COALESCE(SUM(r.total_heures) / NULLIF(SUM(r.nb_pointages), 0), 0) as avg_hours_per_session,
+                    (SELECT COUNT(*) FROM tt_rollup_membres m
+                     WHERE m.portee = 'EMPLOYE' AND m.portee_id = ? AND m.jour = '' AND m.type_membre = 'PROJET') as projects_worked
+                FROM tt_rollup_employe_jour r
+                WHERE r.employee_id = ?
             '''
-            result = self.execute_query(query, (employee_id,))
+            result = self.execute_query(query, (employee_id, employee_id, employee_id))
             
             if result:
                 stats = dict(result[0])
@@ -2748,63 +3283,73 @@ class ERPDatabase:
             logger.error(f"Erreur marquage BT terminé: {e}")
             return False
 
-    def recalculate_all_bt_progress(self) -> int:
+    # Progression d'un BT : heures pointées (tt_rollup_bt) / temps_estime_total des métadonnées,
+    # ou 8h = 100% sans estimation numérique
+    BT_PROGRESSION_SQL = '''
+        SELECT
+            f.id as bt_id,
+            av.pourcentage_realise as ancien_pourcentage,
+            CASE
+                WHEN est.temps_estime > 0 THEN MIN(100, COALESCE(r.total_heures, 0) / est.temps_estime * 100)
+                ELSE MIN(100, COALESCE(r.total_heures, 0) * 12.5)
+            END as nouveau_pourcentage
+        FROM formulaires f
+        JOIN (
+            SELECT id,
+                   CASE WHEN json_valid(metadonnees_json)
+                        AND json_type(metadonnees_json, '$.temps_estime_total') IN ('integer', 'real')
+                        THEN json_extract(metadonnees_json, '$.temps_estime_total')
+                        ELSE 0
+                   END as temps_estime
+            FROM formulaires
+        ) est ON est.id = f.id
+        LEFT JOIN tt_rollup_bt r ON r.formulaire_bt_id = f.id
+        LEFT JOIN bt_avancement av ON av.bt_id = f.id AND av.operation_id IS NULL
+        WHERE f.type_formulaire = 'BON_TRAVAIL' AND f.statut != 'TERMINÉ'
+    '''
+
+    def recalculate_bt_progress_bulk(self, dirty_only: bool = False) -> List[Dict]:
+        """
+        Recalcule la progression des BTs non terminés en une seule transaction
+        (lecture ensembliste + upsert dans bt_avancement).
+        
+        Args:
+            dirty_only: Ne traiter que les BTs marqués dans bt_progression_a_recalculer
+                        (nouvelles heures pointées ou estimation modifiée depuis le dernier calcul)
+        
+        Returns:
+            Écarts par BT : bt_id, ancien_pourcentage, nouveau_pourcentage, delta
+        """
+        query = self.BT_PROGRESSION_SQL
+        if dirty_only:
+            query += " AND f.id IN (SELECT bt_id FROM bt_progression_a_recalculer)"
+        
+        with self.write_transaction('bt_avancement', 'bt_progression_a_recalculer') as conn:
+            rows = [dict(row) for row in conn.execute(query).fetchall()]
+            
+            conn.execute(f'''
+                INSERT INTO bt_avancement (bt_id, pourcentage_realise)
+                SELECT bt_id, nouveau_pourcentage FROM ({query}) WHERE true
+                ON CONFLICT(bt_id) WHERE operation_id IS NULL DO UPDATE SET
+                    pourcentage_realise = excluded.pourcentage_realise,
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE bt_avancement.pourcentage_realise IS NOT excluded.pourcentage_realise
+            ''')
+            
+            # Les BTs marqués sont traités (ou terminés) : la file repart de zéro
+            conn.execute("DELETE FROM bt_progression_a_recalculer")
+        
+        for row in rows:
+            row['delta'] = row['nouveau_pourcentage'] - (row['ancien_pourcentage'] or 0)
+        return rows
+
+    def recalculate_all_bt_progress(self, dirty_only: bool = False) -> int:
         """Recalcule la progression de tous les BTs basée sur TimeTracker"""
         try:
-            count = 0
-            # Récupérer tous les BTs non terminés
-            bts = self.execute_query(
-                "SELECT id, metadonnees_json FROM formulaires WHERE type_formulaire = 'BON_TRAVAIL' AND statut != 'TERMINÉ'"
-            )
-            
-            for bt in bts:
-                bt_id = bt['id']
-                
-                # Récupérer temps total pointé sur ce BT
-                time_result = self.execute_query(
-                    "SELECT COALESCE(SUM(total_hours), 0) as total_worked FROM time_entries WHERE formulaire_bt_id = ? AND total_cost IS NOT NULL",
-                    (bt_id,)
-                )
-                
-                if time_result:
-                    total_worked = time_result[0]['total_worked']
-                    
-                    # Récupérer temps estimé
-                    temps_estime = 0
-                    try:
-                        metadonnees = json.loads(bt['metadonnees_json'] or '{}')
-                        temps_estime = metadonnees.get('temps_estime_total', 0)
-                    except:
-                        pass
-                    
-                    # Calculer progression
-                    if temps_estime > 0:
-                        progression = min(100, (total_worked / temps_estime) * 100)
-                    else:
-                        # Si pas d'estimation, utiliser un calcul basique
-                        progression = min(100, total_worked * 12.5)  # 8h = 100%
-                    
-                    # Mettre à jour ou créer l'avancement global
-                    existing = self.execute_query(
-                        "SELECT id FROM bt_avancement WHERE bt_id = ? AND operation_id IS NULL",
-                        (bt_id,)
-                    )
-                    
-                    if existing:
-                        self.execute_update(
-                            "UPDATE bt_avancement SET pourcentage_realise = ?, updated_at = CURRENT_TIMESTAMP WHERE bt_id = ? AND operation_id IS NULL",
-                            (progression, bt_id)
-                        )
-                    else:
-                        self.execute_insert(
-                            "INSERT INTO bt_avancement (bt_id, pourcentage_realise) VALUES (?, ?)",
-                            (bt_id, progression)
-                        )
-                    
-                    count += 1
-            
-            logger.info(f"✅ {count} progressions BT recalculées")
-            return count
+            deltas = self.recalculate_bt_progress_bulk(dirty_only=dirty_only)
+            changed = sum(1 for d in deltas if d['ancien_pourcentage'] is None or abs(d['delta']) > 1e-9)
+            logger.info(f"✅ {len(deltas)} progressions BT recalculées ({changed} modifiées)")
+            return len(deltas)
         except Exception as e:
             logger.error(f"Erreur recalcul progressions: {e}")
             return 0
@@ -2829,8 +3374,8 @@ class ERPDatabase:
                 AND hourly_rate IS NULL
             """)
             
-            # 3. Mettre à jour les progressions
-            updated_progress = self.recalculate_all_bt_progress()
+            # 3. Mettre à jour les progressions (BTs ayant reçu des heures depuis la dernière sync)
+            updated_progress = self.recalculate_all_bt_progress(dirty_only=True)
             
             # 4. Synchroniser les statuts de BT
             bt_status_updates = self.execute_update("""
@@ -3148,48 +3693,45 @@ class ERPDatabase:
             return []
     
     def update_inventory_from_bom_consumption(self, project_id: int, consumption_data: List[Dict]) -> bool:
-        """Met à jour l'inventaire après consommation pour un projet (simulation)"""
+        """Met à jour l'inventaire après consommation pour un projet (lot atomique)"""
         try:
-            with self.get_connection() as conn:
-                cursor = conn.cursor()
-                
+            with self.write_transaction('inventory_items', 'inventory_history') as conn:
                 for consumption in consumption_data:
                     material_code = consumption.get('material_code')
                     quantity_consumed = consumption.get('quantity_consumed', 0)
                     
-                    # Trouver l'article d'inventaire correspondant
-                    inventory_item = self.execute_query(
-                        "SELECT * FROM inventory_items WHERE code_interne = ? OR nom LIKE ?",
+                    # Trouver l'article d'inventaire correspondant (dans la transaction)
+                    item = conn.execute(
+                        "SELECT id, quantite_metric FROM inventory_items WHERE code_interne = ? OR nom LIKE ? LIMIT 1",
                         (material_code, f"%{material_code}%")
-                    )
+                    ).fetchone()
                     
-                    if inventory_item:
-                        item = dict(inventory_item[0])
-                        current_qty_metric = item['quantite_metric']
+                    if item:
+                        current_qty_metric = item['quantite_metric'] or 0
                         new_qty_metric = max(0, current_qty_metric - quantity_consumed)
                         
                         # Mettre à jour la quantité
-                        cursor.execute(
+                        conn.execute(
                             "UPDATE inventory_items SET quantite_metric = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?",
                             (new_qty_metric, item['id'])
                         )
                         
                         # Enregistrer dans l'historique
-                        cursor.execute(
+                        conn.execute(
                             '''INSERT INTO inventory_history 
                                (inventory_item_id, action, quantite_avant, quantite_apres, notes)
                                VALUES (?, ?, ?, ?, ?)''',
                             (item['id'], 'CONSOMMATION_PROJET', str(current_qty_metric), 
                              str(new_qty_metric), f"Consommation projet #{project_id}")
                         )
-                
-                conn.commit()
-                return True
+            
+            return True
                 
         except Exception as e:
             logger.error(f"Erreur mise à jour inventaire consommation: {e}")
             return False
     
+    @cached_query('inventory_items', 'materials', 'operations')
     def get_production_dashboard_metrics(self) -> Dict[str, Any]:
         """Métriques spécifiques pour le dashboard du module production unifié"""
         try:
@@ -3281,15 +3823,127 @@ class ERPDatabase:
         logger.info(f"Sauvegarde JSON complète dans {self.backup_dir}")
     
     def get_connection(self) -> sqlite3.Connection:
-        """Retourne une connexion à la base de données"""
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
-        conn.execute("PRAGMA foreign_keys = ON")
-        return conn
+        """Retourne la connexion écrivain persistante du thread courant (via le pool)"""
+        return self._pool.get_connection()
+    
+    def get_read_connection(self) -> sqlite3.Connection:
+        """Retourne une connexion lecteur (lecture seule) du thread courant"""
+        return self._read_pool.get_connection()
+    
+    @contextmanager
+    def read_snapshot(self):
+        """
+        Connexion lecteur dans une transaction de lecture explicite :
+        toutes les requêtes exécutées dans le bloc voient le même instantané.
+        """
+        conn = self.get_read_connection()
+        if conn.in_transaction:
+            # Transaction déjà ouverte par l'appelant : elle fournit l'instantané
+            yield conn
+            return
+        conn.execute("BEGIN")
+        try:
+            yield conn
+        finally:
+            conn.rollback()
+    
+    @contextmanager
+    def write_transaction(self, *tables: str):
+        """
+        Transaction d'écriture atomique sur la connexion écrivain (BEGIN IMMEDIATE) :
+        lectures, contrôles et écritures du bloc sont validés ensemble ou annulés.
+        Un bloc imbriqué devient un SAVEPOINT de la transaction englobante : son échec
+        n'annule que ses propres écritures, le commit reste celui du bloc extérieur.
+        Les tables indiquées sont invalidées dans le cache après le commit extérieur.
+        
+        Raises:
+            sqlite3.ProgrammingError: transaction implicite laissée ouverte sur la
+                connexion écrivain hors de tout write_transaction (écritures non validées)
+        """
+        state = self._write_tx_state
+        with self._write_lock:
+            conn = self.get_connection()
+            depth = getattr(state, 'depth', 0)
+            if depth:
+                savepoint = f"write_transaction_{depth}"
+                conn.execute(f"SAVEPOINT {savepoint}")
+            else:
+                if conn.in_transaction:
+                    raise sqlite3.ProgrammingError(
+                        "Transaction déjà ouverte sur la connexion écrivain : écritures non validées "
+                        "d'un appelant (commit ou rollback manquant)"
+                    )
+                conn.execute("BEGIN IMMEDIATE")
+                state.tables = set()
+            state.depth = depth + 1
+            try:
+                yield conn
+                if depth:
+                    conn.execute(f"RELEASE {savepoint}")
+                else:
+                    conn.commit()
+            except BaseException:
+                if depth:
+                    conn.execute(f"ROLLBACK TO {savepoint}")
+                    conn.execute(f"RELEASE {savepoint}")
+                else:
+                    conn.rollback()
+                raise
+            finally:
+                state.depth = depth
+            
+            # Invalidation différée au commit : avant, d'autres connexions relisent l'ancien état
+            state.tables.update(tables)
+            if depth:
+                return
+            tables, state.tables = state.tables, set()
+        if tables:
+            self.invalidate_tables(*tables)
+    
+    def get_connection_stats(self) -> Dict[str, Any]:
+        """Retourne les compteurs du pool : connexions ouvertes vs réutilisées"""
+        stats = self._pool.get_stats()
+        if self.read_split:
+            stats['readers'] = self._read_pool.get_stats()
+        stats['profile'] = self.sqlite_profile
+        return stats
+    
+    def checkpoint_wal(self, mode: str = "PASSIVE") -> Dict[str, int]:
+        """
+        Exécute un checkpoint WAL (PASSIVE, FULL, RESTART ou TRUNCATE).
+        
+        Returns:
+            busy, log_frames, checkpointed_frames (tels que retournés par SQLite)
+        """
+        mode = mode.upper()
+        if mode not in ('PASSIVE', 'FULL', 'RESTART', 'TRUNCATE'):
+            raise ValueError(f"Mode de checkpoint invalide: {mode}")
+        with self._write_lock:
+            row = self.get_connection().execute(f"PRAGMA wal_checkpoint({mode})").fetchone()
+        return {
+            'busy': row[0] if row else 0,
+            'log_frames': row[1] if row else 0,
+            'checkpointed_frames': row[2] if row else 0
+        }
+    
+    def close(self):
+        """Ferme toutes les connexions (lecteurs et écrivain)"""
+        if self.read_split:
+            self._read_pool.close_all()
+        self._pool.close_all()
     
     def execute_query(self, query: str, params: tuple = None) -> List[Dict[str, Any]]:
         """Exécute une requête SELECT et retourne les résultats sous forme de dictionnaires"""
-        with self.get_connection() as conn:
+        # Certains modules passent encore des UPDATE/DELETE par execute_query → écrivain
+        if not is_read_statement(query):
+            with self._write_lock, self.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(query, params or ())
+                rows = [dict(row) for row in cursor.fetchall()]
+            self._invalidate_for_query(query)
+            return rows
+        
+        with self.get_read_connection() as conn:
             cursor = conn.cursor()
             if params:
                 cursor.execute(query, params)
@@ -3301,26 +3955,171 @@ class ERPDatabase:
     
     def execute_update(self, query: str, params: tuple = None) -> int:
         """Exécute une requête INSERT/UPDATE/DELETE et retourne le nombre de lignes affectées"""
-        with self.get_connection() as conn:
+        with self._write_lock, self.get_connection() as conn:
             cursor = conn.cursor()
             if params:
                 cursor.execute(query, params)
             else:
                 cursor.execute(query)
             conn.commit()
-            return cursor.rowcount
+            rowcount = cursor.rowcount
+        self._invalidate_for_query(query)
+        return rowcount
     
     def execute_insert(self, query: str, params: tuple = None) -> int:
         """Exécute un INSERT et retourne l'ID de la nouvelle ligne"""
-        with self.get_connection() as conn:
+        with self._write_lock, self.get_connection() as conn:
             cursor = conn.cursor()
             if params:
                 cursor.execute(query, params)
             else:
                 cursor.execute(query)
             conn.commit()
-            return cursor.lastrowid
+            lastrowid = cursor.lastrowid
+        self._invalidate_for_query(query)
+        return lastrowid
     
+    # =========================================================================
+    # CACHE DES REQUÊTES (invalidation par table)
+    # =========================================================================
+    
+    def _load_trigger_cascade(self):
+        """Construit la carte table → tables écrites par ses triggers (cascade d'invalidation)"""
+        try:
+            rows = self.execute_query(
+                "SELECT tbl_name, sql FROM sqlite_master WHERE type = 'trigger' AND sql IS NOT NULL"
+            )
+            cascade: Dict[str, set] = {}
+            for row in rows:
+                targets = extract_trigger_targets(row['sql'])
+                if targets:
+                    cascade.setdefault(row['tbl_name'].lower(), set()).update(targets)
+            self._trigger_cascade = cascade
+        except Exception as e:
+            logger.warning(f"⚠️ Lecture des triggers pour le cache impossible: {e}")
+            self._trigger_cascade = {}
+    
+    def _expand_with_triggers(self, tables) -> set:
+        """Ajoute les tables modifiées indirectement par les triggers"""
+        expanded = set()
+        pending = [table.lower() for table in tables]
+        while pending:
+            table = pending.pop()
+            if table in expanded:
+                continue
+            expanded.add(table)
+            pending.extend(self._trigger_cascade.get(table, ()))
+        return expanded
+    
+    def _invalidate_for_query(self, query: str):
+        """Invalide les entrées du cache qui dépendent de la table écrite par la requête"""
+        tables = extract_written_tables(query)
+        if tables is None:
+            # Changement de schéma : triggers à relire, tout le cache est périmé
+            self._load_trigger_cascade()
+            self.query_cache.bump_all(self._cache_db_key)
+        elif tables:
+            self.query_cache.bump(self._cache_db_key, self._expand_with_triggers(tables))
+    
+    def invalidate_tables(self, *tables: str):
+        """
+        Invalide explicitement des tables du cache.
+        À appeler après une écriture faite directement sur get_connection().
+        """
+        if tables:
+            self.query_cache.bump(self._cache_db_key, self._expand_with_triggers(tables))
+        else:
+            self.query_cache.bump_all(self._cache_db_key)
+    
+    def get_query_cache_stats(self) -> Dict[str, Any]:
+        """Compteurs hits/misses/évictions du cache des requêtes"""
+        return self.query_cache.get_stats()
+
+    # =========================================================================
+    # RECHERCHE GLOBALE (INDEX FTS5)
+    # =========================================================================
+
+    def _detect_search_index(self) -> bool:
+        """Vérifie que l'index FTS5 existe (SQLite compilé avec FTS5)"""
+        try:
+            return bool(self.execute_query(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (SEARCH_TABLE,)
+            ))
+        except Exception:
+            return False
+
+    def rebuild_search_index(self) -> Dict[str, int]:
+        """
+        Reconstruit l'index de recherche depuis les tables sources.
+        Les triggers le tiennent à jour ; cette commande sert à la réparation
+        (import massif, restauration, changement des colonnes indexées...).
+        """
+        with self._write_lock, self.get_connection() as conn:
+            counts = erp_search.rebuild_search_index(conn.cursor())
+        self.invalidate_tables(SEARCH_TABLE)
+        logger.info(f"🔎 Index de recherche reconstruit: {counts}")
+        return counts
+
+    def ensure_search_source(self, table: str) -> bool:
+        """
+        Branche sur l'index une table source créée après l'initialisation
+        (ex: produits, créée par GestionnaireProduits) : triggers + indexation.
+        """
+        if table not in SEARCH_SOURCES or not getattr(self, 'search_index_available', False):
+            return False
+        try:
+            with self._write_lock, self.get_connection() as conn:
+                count = erp_search.create_search_source(conn.cursor(), table)
+            # Nouveaux triggers : cascade d'invalidation à relire
+            self._load_trigger_cascade()
+            self.invalidate_tables(SEARCH_TABLE)
+            logger.info(f"🔎 Table {table} ajoutée à l'index de recherche ({count} lignes)")
+            return True
+        except Exception as e:
+            logger.error(f"Erreur ajout {table} à l'index de recherche: {e}")
+            return False
+
+    def search_global(self, terme: str, entites: Optional[List[str]] = None,
+                      limit: Optional[int] = 20, offset: int = 0) -> List[Dict[str, Any]]:
+        """
+        Recherche classée (BM25) et par préfixe dans toutes les entités indexées.
+
+        Args:
+            terme: Saisie utilisateur (chaque mot est un préfixe, tous requis)
+            entites: Restreindre à certaines entités (projects, operations, materials,
+                     formulaires, companies, contacts, produits, inventory_items)
+            limit: Taille de page (None = tous les résultats)
+            offset: Décalage de pagination
+
+        Returns:
+            Liste de {entite, entite_id, projet_id, titre, reference, extrait, score}
+        """
+        match = build_match_query(terme)
+        if not match or not getattr(self, 'search_index_available', False):
+            return []
+        entites = list(entites or [])
+        try:
+            return self.execute_query(
+                build_search_sql(entites),
+                (match, *entites, -1 if limit is None else limit, offset)
+            )
+        except Exception as e:
+            logger.error(f"Erreur recherche globale '{terme}': {e}")
+            return []
+
+    def count_search_results(self, terme: str, entites: Optional[List[str]] = None) -> int:
+        """Nombre total de résultats d'une recherche (pagination)"""
+        match = build_match_query(terme)
+        if not match or not getattr(self, 'search_index_available', False):
+            return 0
+        entites = list(entites or [])
+        try:
+            result = self.execute_query(build_search_sql(entites, count_only=True), (match, *entites))
+            return result[0]['total'] if result else 0
+        except Exception as e:
+            logger.error(f"Erreur comptage recherche '{terme}': {e}")
+            return 0
+
     def get_table_count(self, table_name: str) -> int:
         """Retourne le nombre d'enregistrements dans une table"""
         result = self.execute_query(f"SELECT COUNT(*) as count FROM {table_name}")
@@ -4076,40 +4875,80 @@ class ERPDatabase:
             logger.error(f"Erreur duplication formulaire: {e}")
             return None
     
-    def _generer_numero_document(self, type_formulaire: str) -> str:
-        """Génère un numéro de document automatique"""
+    # Préfixe de numérotation par type de formulaire
+    DOCUMENT_PREFIXES = {
+        'BON_TRAVAIL': 'BT',
+        'BON_ACHAT': 'BA',
+        'BON_COMMANDE': 'BC',
+        'DEMANDE_PRIX': 'DP',
+        'ESTIMATION': 'EST'
+    }
+    
+    def reserver_numeros_document(self, prefixe: str, quantite: int = 1, annee: int = None) -> List[str]:
+        """
+        Alloue atomiquement un bloc de numéros PREFIXE-ANNEE-NNN (création en lot).
+        
+        La séquence (prefixe, annee) est incrémentée dans une transaction BEGIN IMMEDIATE :
+        deux sessions ou processus ne reçoivent jamais le même numéro. À la première
+        utilisation d'une année, la séquence part du plus grand numéro existant dans
+        formulaires. Un numéro alloué puis non utilisé laisse un trou (jamais réattribué).
+        
+        Returns:
+            Liste des numéros réservés (vide en cas d'erreur)
+        """
+        if quantite < 1:
+            return []
+        annee = annee or datetime.now().year
         try:
-            prefixes = {
-                'BON_TRAVAIL': 'BT',
-                'BON_ACHAT': 'BA',
-                'BON_COMMANDE': 'BC',
-                'DEMANDE_PRIX': 'DP',
-                'ESTIMATION': 'EST'
-            }
-            
-            prefix = prefixes.get(type_formulaire, 'DOC')
-            annee = datetime.now().year
-            
-            # Récupérer le dernier numéro pour ce type et cette année
-            query = '''
-                SELECT numero_document FROM formulaires 
-                WHERE type_formulaire = ? AND numero_document LIKE ?
-                ORDER BY id DESC LIMIT 1
-            '''
-            pattern = f"{prefix}-{annee}-%"
-            result = self.execute_query(query, (type_formulaire, pattern))
-            
-            if result:
-                last_num = result[0]['numero_document']
-                sequence = int(last_num.split('-')[-1]) + 1
-            else:
-                sequence = 1
-            
-            return f"{prefix}-{annee}-{sequence:03d}"
+            with self.write_transaction() as conn:
+                # Initialisation unique par année depuis les documents existants
+                conn.execute('''
+                    INSERT OR IGNORE INTO document_sequences (prefixe, annee, dernier_numero)
+                    SELECT ?, ?, COALESCE(MAX(CAST(substr(numero_document, ?) AS INTEGER)), 0)
+                    FROM formulaires WHERE numero_document LIKE ?
+                ''', (prefixe, annee, len(prefixe) + 7, f"{prefixe}-{annee}-%"))
+                conn.execute('''
+                    UPDATE document_sequences
+                    SET dernier_numero = dernier_numero + ?, updated_at = CURRENT_TIMESTAMP
+                    WHERE prefixe = ? AND annee = ?
+                ''', (quantite, prefixe, annee))
+                dernier = conn.execute(
+                    "SELECT dernier_numero FROM document_sequences WHERE prefixe = ? AND annee = ?",
+                    (prefixe, annee)
+                ).fetchone()[0]
+            
+            return [f"{prefixe}-{annee}-{numero:03d}" for numero in range(dernier - quantite + 1, dernier + 1)]
             
         except Exception as e:
-            logger.error(f"Erreur génération numéro document: {e}")
-            return f"ERR-{datetime.now().strftime('%Y%m%d%H%M%S')}"
+            logger.error(f"Erreur réservation numéros {prefixe}-{annee}: {e}")
+            return []
+    
+    def apercu_numero_document(self, prefixe: str) -> str:
+        """Numéro qui serait alloué ensuite (affichage d'un formulaire, sans réservation)"""
+        annee = datetime.now().year
+        try:
+            result = self.execute_query('''
+                SELECT COALESCE(
+                    (SELECT dernier_numero FROM document_sequences WHERE prefixe = ? AND annee = ?),
+                    (SELECT MAX(CAST(substr(numero_document, ?) AS INTEGER)) FROM formulaires
+                     WHERE numero_document LIKE ?),
+                    0
+                ) as dernier
+            ''', (prefixe, annee, len(prefixe) + 7, f"{prefixe}-{annee}-%"))
+            return f"{prefixe}-{annee}-{result[0]['dernier'] + 1:03d}"
+        except Exception as e:
+            logger.error(f"Erreur aperçu numéro {prefixe}: {e}")
+            return f"{prefixe}-{annee}-???"
+    
+    def prochain_numero_document(self, prefixe: str) -> Optional[str]:
+        """Alloue le prochain numéro de la séquence d'un préfixe pour l'année courante"""
+        numeros = self.reserver_numeros_document(prefixe)
+        return numeros[0] if numeros else None
+    
+    def _generer_numero_document(self, type_formulaire: str) -> str:
+        """Génère un numéro de document automatique"""
+        prefix = self.DOCUMENT_PREFIXES.get(type_formulaire, 'DOC')
+        return self.prochain_numero_document(prefix) or f"ERR-{datetime.now().strftime('%Y%m%d%H%M%S')}"
     
     def _enregistrer_validation(self, formulaire_id: int, employee_id: int, type_validation: str, commentaires: str):
         """Enregistre une validation dans l'historique"""
@@ -4553,6 +5392,7 @@ class ERPDatabase:
             logger.error(f"Erreur récupération activités CRM: {e}")
             return []
     
+    @cached_query('opportunities')
     def get_opportunity_pipeline_stats(self) -> Dict:
         """Récupère les statistiques du pipeline de vente"""
         try:
@@ -4673,41 +5513,60 @@ class ERPDatabase:
     # MÉTHODES INVENTAIRE ET MOUVEMENTS DE STOCK
     # =========================================================================
     
-    def enregistrer_mouvement_stock(self, data: Dict) -> int:
-        """Enregistre un mouvement de stock avec mise à jour automatique du stock produit"""
-        try:
-            # Récupérer le stock actuel
-            produit = self.execute_query("SELECT stock_disponible FROM produits WHERE id = ?", (data['produit_id'],))
-            if not produit:
-                logger.error(f"Produit {data['produit_id']} non trouvé")
-                return None
+    MOUVEMENTS_ENTRANTS = ('ENTREE', 'LIBERATION')
+    MOUVEMENTS_SORTANTS = ('SORTIE', 'RESERVATION')
+    
+    def _appliquer_mouvements_stock(self, conn: sqlite3.Connection, mouvements: List[Dict],
+                                    controle_stock: bool = False) -> List[int]:
+        """
+        Applique des mouvements de stock dans la transaction ouverte de conn :
+        lecture groupée des stocks, calcul séquentiel, insertion des mouvements
+        puis une mise à jour par produit. Lève ValueError (produit introuvable,
+        stock insuffisant) pour annuler toute la transaction.
+        """
+        produit_ids = list(dict.fromkeys(m['produit_id'] for m in mouvements))
+        stocks = {}
+        for i in range(0, len(produit_ids), 500):
+            chunk = produit_ids[i:i + 500]
+            placeholders = ','.join('?' for _ in chunk)
+            for row in conn.execute(
+                f"SELECT id, stock_disponible FROM produits WHERE id IN ({placeholders})", chunk
+            ):
+                stocks[row['id']] = row['stock_disponible'] or 0
+        
+        mouvement_ids = []
+        for data in mouvements:
+            produit_id = data['produit_id']
+            if produit_id not in stocks:
+                raise ValueError(f"Produit {produit_id} non trouvé")
             
-            stock_avant = produit[0]['stock_disponible']
+            stock_avant = stocks[produit_id]
+            type_mouvement = data['type_mouvement']
             
             # Calculer le nouveau stock selon le type de mouvement
-            if data['type_mouvement'] in ['ENTREE', 'LIBERATION']:
-                stock_apres = stock_avant + data['quantite']
-            elif data['type_mouvement'] in ['SORTIE', 'RESERVATION']:
-                stock_apres = stock_avant - data['quantite']
-            elif data['type_mouvement'] == 'AJUSTEMENT':
-                stock_apres = data['quantite']  # Pour ajustement, la quantité est la nouvelle valeur
-                data['quantite'] = stock_apres - stock_avant  # Calculer la différence
-            else:  # INVENTAIRE
+            if type_mouvement in self.MOUVEMENTS_ENTRANTS:
+                quantite = data['quantite']
+                stock_apres = stock_avant + quantite
+            elif type_mouvement in self.MOUVEMENTS_SORTANTS:
+                quantite = data['quantite']
+                stock_apres = stock_avant - quantite
+                if controle_stock and stock_apres < 0:
+                    raise ValueError(
+                        f"Stock insuffisant pour produit {produit_id}: {stock_avant} < {quantite}"
+                    )
+            else:  # AJUSTEMENT / INVENTAIRE : la quantité est la nouvelle valeur
                 stock_apres = data['quantite']
-                data['quantite'] = stock_apres - stock_avant
+                quantite = stock_apres - stock_avant
             
-            # Enregistrer le mouvement
-            query = '''
+            cursor = conn.execute('''
                 INSERT INTO mouvements_stock
                 (produit_id, type_mouvement, quantite, quantite_avant, quantite_apres,
                  reference_document, reference_type, motif, employee_id, cout_unitaire, cout_total)
                 VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            '''
-            
-            mouvement_id = self.execute_insert(query, (
-                data['produit_id'],
-                data['type_mouvement'],
-                data['quantite'],
+            ''', (
+                produit_id,
+                type_mouvement,
+                quantite,
                 stock_avant,
                 stock_apres,
                 data.get('reference_document'),
@@ -4717,18 +5576,42 @@ class ERPDatabase:
                 data.get('cout_unitaire'),
                 data.get('cout_total')
             ))
-            
-            # Mettre à jour le stock du produit
-            self.execute_update(
-                "UPDATE produits SET stock_disponible = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?",
-                (stock_apres, data['produit_id'])
-            )
-            
-            return mouvement_id
-            
+            mouvement_ids.append(cursor.lastrowid)
+            stocks[produit_id] = stock_apres
+        
+        # Une seule mise à jour par produit touché (stock final du lot)
+        touches = dict.fromkeys(m['produit_id'] for m in mouvements)
+        conn.executemany(
+            "UPDATE produits SET stock_disponible = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?",
+            [(stocks[produit_id], produit_id) for produit_id in touches]
+        )
+        return mouvement_ids
+    
+    def enregistrer_mouvements_stock(self, mouvements: List[Dict], controle_stock: bool = False) -> List[int]:
+        """
+        Enregistre un lot de mouvements de stock (réceptions, consommations,
+        ajustements...) en une seule transaction : tout ou rien.
+        
+        Args:
+            mouvements: Dictionnaires au format de enregistrer_mouvement_stock
+            controle_stock: Refuser le lot si une sortie/réservation rend un stock négatif
+        
+        Returns:
+            IDs des mouvements créés (dans l'ordre du lot), liste vide en cas d'échec
+        """
+        if not mouvements:
+            return []
+        try:
+            with self.write_transaction('produits', 'mouvements_stock') as conn:
+                return self._appliquer_mouvements_stock(conn, mouvements, controle_stock)
         except Exception as e:
-            logger.error(f"Erreur enregistrement mouvement stock: {e}")
-            return None
+            logger.error(f"Erreur enregistrement lot de {len(mouvements)} mouvements stock: {e}")
+            return []
+    
+    def enregistrer_mouvement_stock(self, data: Dict, controle_stock: bool = False) -> int:
+        """Enregistre un mouvement de stock avec mise à jour atomique du stock produit"""
+        mouvement_ids = self.enregistrer_mouvements_stock([data], controle_stock=controle_stock)
+        return mouvement_ids[0] if mouvement_ids else None
     
     def get_mouvements_stock(self, produit_id: int = None, limit: int = 100) -> List[Dict]:
         """Récupère l'historique des mouvements de stock"""
@@ -4762,34 +5645,31 @@ class ERPDatabase:
             return []
     
     def creer_inventaire_physique(self, data: Dict) -> int:
-        """Crée un nouvel inventaire physique"""
+        """Crée un nouvel inventaire physique (lignes générées par un seul INSERT ... SELECT)"""
         try:
             # Générer un code unique
             code = f"INV-{datetime.now().strftime('%Y%m%d')}-{datetime.now().strftime('%H%M%S')}"
             
-            query = '''
-                INSERT INTO inventaires_physiques
-                (code_inventaire, date_inventaire, type_inventaire, created_by, notes)
-                VALUES (?, ?, ?, ?, ?)
-            '''
-            
-            inventaire_id = self.execute_insert(query, (
-                code,
-                data.get('date_inventaire', datetime.now().date()),
-                data.get('type_inventaire', 'COMPLET'),
-                data.get('created_by'),
-                data.get('notes')
-            ))
-            
-            # Si inventaire complet, créer les lignes pour tous les produits actifs
-            if data.get('type_inventaire', 'COMPLET') == 'COMPLET':
-                produits = self.execute_query("SELECT id, stock_disponible FROM produits WHERE actif = 1")
-                for produit in produits:
-                    self.execute_insert('''
-                        INSERT INTO inventaire_lignes
-                        (inventaire_id, produit_id, quantite_theorique)
-                        VALUES (?, ?, ?)
-                    ''', (inventaire_id, produit['id'], produit['stock_disponible']))
+            with self.write_transaction('inventaires_physiques', 'inventaire_lignes') as conn:
+                cursor = conn.execute('''
+                    INSERT INTO inventaires_physiques
+                    (code_inventaire, date_inventaire, type_inventaire, created_by, notes)
+                    VALUES (?, ?, ?, ?, ?)
+                ''', (
+                    code,
+                    data.get('date_inventaire', datetime.now().date()),
+                    data.get('type_inventaire', 'COMPLET'),
+                    data.get('created_by'),
+                    data.get('notes')
+                ))
+                inventaire_id = cursor.lastrowid
+                
+                # Si inventaire complet, créer les lignes pour tous les produits actifs
+                if data.get('type_inventaire', 'COMPLET') == 'COMPLET':
+                    conn.execute('''
+                        INSERT INTO inventaire_lignes (inventaire_id, produit_id, quantite_theorique)
+                        SELECT ?, id, COALESCE(stock_disponible, 0) FROM produits WHERE actif = 1
+                    ''', (inventaire_id,))
             
             return inventaire_id
             
@@ -4797,81 +5677,164 @@ class ERPDatabase:
             logger.error(f"Erreur création inventaire: {e}")
             return None
     
+    # Écart et valorisation calculés en SQL à partir du stock théorique et du prix du produit
+    COMPTAGE_LIGNE_SQL = '''
+        UPDATE inventaire_lignes
+        SET quantite_physique = :quantite,
+            ecart = :quantite - quantite_theorique,
+            ecart_valeur = (:quantite - quantite_theorique) *
+                COALESCE((SELECT prix_unitaire FROM produits WHERE id = inventaire_lignes.produit_id), 0),
+            statut_ligne = 'COMPTE', compte_par = :employee_id, compte_at = CURRENT_TIMESTAMP
+        WHERE id = :ligne_id AND statut_ligne != 'VALIDE'
+    '''
+    
     def saisir_comptage_inventaire(self, ligne_id: int, quantite_physique: float, employee_id: int) -> bool:
         """Saisit le comptage physique d'une ligne d'inventaire"""
         try:
-            # Récupérer les infos de la ligne
-            ligne = self.execute_query('''
-                SELECT il.*, p.prix_unitaire
-                FROM inventaire_lignes il
-                JOIN produits p ON il.produit_id = p.id
-                WHERE il.id = ?
-            ''', (ligne_id,))[0]
-            
-            ecart = quantite_physique - ligne['quantite_theorique']
-            ecart_valeur = ecart * ligne['prix_unitaire']
-            
-            # Mettre à jour la ligne
-            self.execute_update('''
-                UPDATE inventaire_lignes
-                SET quantite_physique = ?, ecart = ?, ecart_valeur = ?,
-                    statut_ligne = 'COMPTE', compte_par = ?, compte_at = CURRENT_TIMESTAMP
-                WHERE id = ?
-            ''', (quantite_physique, ecart, ecart_valeur, employee_id, ligne_id))
-            
-            return True
+            with self.write_transaction('inventaire_lignes') as conn:
+                cursor = conn.execute(self.COMPTAGE_LIGNE_SQL, {
+                    'quantite': quantite_physique, 'employee_id': employee_id, 'ligne_id': ligne_id
+                })
+            return cursor.rowcount > 0
             
         except Exception as e:
             logger.error(f"Erreur saisie comptage: {e}")
             return False
     
-    def valider_inventaire(self, inventaire_id: int, validated_by: int) -> bool:
-        """Valide un inventaire et applique les ajustements de stock"""
+    def saisir_comptages_inventaire(self, inventaire_id: int, comptages: List[Dict], employee_id: int) -> Dict[str, Any]:
+        """
+        Saisit un lot de comptages (formulaire, import CSV de scanner) en une transaction.
+        
+        Args:
+            inventaire_id: Inventaire concerné
+            comptages: Dictionnaires avec 'quantite_physique' et une clé parmi
+                       'ligne_id', 'produit_id' ou 'code_produit'
+            employee_id: Employé ayant compté
+        
+        Returns:
+            {'comptees': nombre de lignes mises à jour, 'inconnus': clés sans ligne correspondante}
+        """
+        resultat = {'comptees': 0, 'inconnus': []}
         try:
-            # Vérifier que toutes les lignes sont comptées
-            non_comptees = self.execute_query('''
-                SELECT COUNT(*) as count
-                FROM inventaire_lignes
-                WHERE inventaire_id = ? AND statut_ligne = 'A_COMPTER'
-            ''', (inventaire_id,))[0]['count']
-            
-            if non_comptees > 0:
-                logger.error(f"Inventaire {inventaire_id} a {non_comptees} lignes non comptées")
-                return False
-            
-            # Récupérer toutes les lignes avec écart
-            lignes_ecart = self.execute_query('''
-                SELECT il.*, p.nom as produit_nom
-                FROM inventaire_lignes il
-                JOIN produits p ON il.produit_id = p.id
-                WHERE il.inventaire_id = ? AND il.ecart != 0
-            ''', (inventaire_id,))
-            
-            # Appliquer les ajustements pour chaque écart
-            for ligne in lignes_ecart:
-                self.enregistrer_mouvement_stock({
-                    'produit_id': ligne['produit_id'],
-                    'type_mouvement': 'INVENTAIRE',
-                    'quantite': ligne['quantite_physique'],
-                    'reference_document': f"INV-{inventaire_id}",
-                    'reference_type': 'INVENTAIRE',
-                    'motif': f"Ajustement inventaire - Écart: {ligne['ecart']}",
-                    'employee_id': validated_by
-                })
+            with self.write_transaction('inventaire_lignes') as conn:
+                # Résolution des clés en mémoire : une seule lecture des lignes de l'inventaire
+                par_ligne, par_produit, par_code = set(), {}, {}
+                for row in conn.execute('''
+                    SELECT il.id, il.produit_id, p.code_produit
+                    FROM inventaire_lignes il
+                    LEFT JOIN produits p ON il.produit_id = p.id
+                    WHERE il.inventaire_id = ?
+                ''', (inventaire_id,)):
+                    par_ligne.add(row['id'])
+                    par_produit[row['produit_id']] = row['id']
+                    if row['code_produit']:
+                        par_code[str(row['code_produit']).strip().upper()] = row['id']
                 
-                # Marquer la ligne comme validée
-                self.execute_update(
-                    "UPDATE inventaire_lignes SET statut_ligne = 'VALIDE' WHERE id = ?",
-                    (ligne['id'],)
-                )
+                params = []
+                for comptage in comptages:
+                    if comptage.get('ligne_id') is not None:
+                        ligne_id = comptage['ligne_id'] if comptage['ligne_id'] in par_ligne else None
+                        cle = comptage['ligne_id']
+                    elif comptage.get('produit_id') is not None:
+                        cle = comptage['produit_id']
+                        ligne_id = par_produit.get(cle)
+                    else:
+                        cle = comptage.get('code_produit')
+                        ligne_id = par_code.get(str(cle or '').strip().upper())
+                    
+                    if ligne_id is None:
+                        resultat['inconnus'].append(cle)
+                        continue
+                    params.append({
+                        'quantite': float(comptage['quantite_physique']),
+                        'employee_id': employee_id,
+                        'ligne_id': ligne_id
+                    })
+                
+                if params:
+                    resultat['comptees'] = conn.executemany(self.COMPTAGE_LIGNE_SQL, params).rowcount
             
-            # Valider l'inventaire
-            self.execute_update('''
-                UPDATE inventaires_physiques
-                SET statut = 'VALIDE', validated_by = ?, validated_at = CURRENT_TIMESTAMP
-                WHERE id = ?
-            ''', (validated_by, inventaire_id))
+            logger.info(f"📝 Inventaire {inventaire_id}: {resultat['comptees']} comptages enregistrés, "
+                        f"{len(resultat['inconnus'])} inconnus")
+            return resultat
             
+        except Exception as e:
+            logger.error(f"Erreur saisie comptages inventaire {inventaire_id}: {e}")
+            return {'comptees': 0, 'inconnus': [], 'erreur': str(e)}
+    
+    def valider_inventaire(self, inventaire_id: int, validated_by: int) -> bool:
+        """
+        Valide un inventaire et applique les ajustements de stock en une seule
+        transaction : mouvements INVENTAIRE, stocks produits et statuts en SQL ensembliste.
+        """
+        try:
+            with self.write_transaction('produits', 'mouvements_stock', 'inventaire_lignes',
+                                        'inventaires_physiques') as conn:
+                inventaire = conn.execute(
+                    "SELECT statut FROM inventaires_physiques WHERE id = ?", (inventaire_id,)
+                ).fetchone()
+                if not inventaire:
+                    logger.error(f"Inventaire {inventaire_id} non trouvé")
+                    return False
+                if inventaire['statut'] == 'VALIDE':
+                    logger.error(f"Inventaire {inventaire_id} déjà validé")
+                    return False
+                
+                # Vérifier que toutes les lignes sont comptées
+                non_comptees = conn.execute('''
+                    SELECT COUNT(*) FROM inventaire_lignes
+                    WHERE inventaire_id = ? AND statut_ligne = 'A_COMPTER'
+                ''', (inventaire_id,)).fetchone()[0]
+                
+                if non_comptees > 0:
+                    logger.error(f"Inventaire {inventaire_id} a {non_comptees} lignes non comptées")
+                    return False
+                
+                # Mouvements d'ajustement pour toutes les lignes avec écart (stock courant → compté)
+                cursor = conn.execute('''
+                    INSERT INTO mouvements_stock
+                    (produit_id, type_mouvement, quantite, quantite_avant, quantite_apres,
+                     reference_document, reference_type, motif, employee_id)
+                    SELECT il.produit_id, 'INVENTAIRE',
+                           il.quantite_physique - COALESCE(p.stock_disponible, 0),
+                           p.stock_disponible, il.quantite_physique,
+                           'INV-' || il.inventaire_id, 'INVENTAIRE',
+                           'Ajustement inventaire - Écart: ' || il.ecart, ?
+                    FROM inventaire_lignes il
+                    JOIN produits p ON il.produit_id = p.id
+                    WHERE il.inventaire_id = ? AND il.ecart != 0
+                ''', (validated_by, inventaire_id))
+                nb_ajustements = cursor.rowcount
+                
+                conn.execute('''
+                    UPDATE produits
+                    SET stock_disponible = (
+                            SELECT il.quantite_physique FROM inventaire_lignes il
+                            WHERE il.inventaire_id = :inventaire_id AND il.produit_id = produits.id
+                            AND il.ecart != 0
+                            ORDER BY il.id DESC LIMIT 1
+                        ),
+                        updated_at = CURRENT_TIMESTAMP
+                    WHERE id IN (
+                        SELECT produit_id FROM inventaire_lignes
+                        WHERE inventaire_id = :inventaire_id AND ecart != 0
+                    )
+                ''', {'inventaire_id': inventaire_id})
+                
+                # Marquer les lignes ajustées comme validées
+                conn.execute(
+                    "UPDATE inventaire_lignes SET statut_ligne = 'VALIDE' WHERE inventaire_id = ? AND ecart != 0",
+                    (inventaire_id,)
+                )
+                
+                # Valider l'inventaire
+                conn.execute('''
+                    UPDATE inventaires_physiques
+                    SET statut = 'VALIDE', validated_by = ?, validated_at = CURRENT_TIMESTAMP
+                    WHERE id = ?
+                ''', (validated_by, inventaire_id))
+            
+            logger.info(f"✅ Inventaire {inventaire_id} validé - {nb_ajustements} ajustements de stock")
             return True
             
         except Exception as e:
@@ -4879,84 +5842,68 @@ class ERPDatabase:
             return False
     
     def reserver_stock(self, data: Dict) -> int:
-        """Crée une réservation de stock"""
+        """Crée une réservation de stock (contrôle, réservation et mouvement atomiques)"""
         try:
-            # Vérifier la disponibilité
-            produit = self.execute_query(
-                "SELECT stock_disponible FROM produits WHERE id = ?",
-                (data['produit_id'],)
-            )[0]
-            
-            if produit['stock_disponible'] < data['quantite_reservee']:
-                logger.error(f"Stock insuffisant pour réservation: {produit['stock_disponible']} < {data['quantite_reservee']}")
-                return None
-            
-            # Créer la réservation
-            query = '''
-                INSERT INTO reservations_stock
-                (produit_id, quantite_reservee, reference_document, reference_type,
-                 date_expiration, created_by, notes)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            '''
-            
-            reservation_id = self.execute_insert(query, (
-                data['produit_id'],
-                data['quantite_reservee'],
-                data['reference_document'],
-                data['reference_type'],
-                data.get('date_expiration'),
-                data.get('created_by'),
-                data.get('notes')
-            ))
-            
-            # Enregistrer le mouvement de réservation
-            self.enregistrer_mouvement_stock({
-                'produit_id': data['produit_id'],
-                'type_mouvement': 'RESERVATION',
-                'quantite': data['quantite_reservee'],
-                'reference_document': data['reference_document'],
-                'reference_type': data['reference_type'],
-                'motif': f"Réservation stock - {data.get('notes', '')}",
-                'employee_id': data.get('created_by')
-            })
-            
-            return reservation_id
+            with self.write_transaction('produits', 'mouvements_stock', 'reservations_stock') as conn:
+                # Vérification de la disponibilité dans la même transaction que la réservation
+                self._appliquer_mouvements_stock(conn, [{
+                    'produit_id': data['produit_id'],
+                    'type_mouvement': 'RESERVATION',
+                    'quantite': data['quantite_reservee'],
+                    'reference_document': data['reference_document'],
+                    'reference_type': data['reference_type'],
+                    'motif': f"Réservation stock - {data.get('notes', '')}",
+                    'employee_id': data.get('created_by')
+                }], controle_stock=True)
+                
+                cursor = conn.execute('''
+                    INSERT INTO reservations_stock
+                    (produit_id, quantite_reservee, reference_document, reference_type,
+                     date_expiration, created_by, notes)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                ''', (
+                    data['produit_id'],
+                    data['quantite_reservee'],
+                    data['reference_document'],
+                    data['reference_type'],
+                    data.get('date_expiration'),
+                    data.get('created_by'),
+                    data.get('notes')
+                ))
+                return cursor.lastrowid
             
         except Exception as e:
             logger.error(f"Erreur création réservation: {e}")
             return None
     
     def liberer_reservation(self, reservation_id: int, employee_id: int = None) -> bool:
-        """Libère une réservation de stock"""
+        """Libère une réservation de stock (une seule fois, même en cas d'appels concurrents)"""
         try:
-            # Récupérer la réservation
-            reservation = self.execute_query(
-                "SELECT * FROM reservations_stock WHERE id = ? AND statut = 'ACTIVE'",
-                (reservation_id,)
-            )
-            
-            if not reservation:
-                logger.error(f"Réservation {reservation_id} non trouvée ou inactive")
-                return False
-            
-            reservation = reservation[0]
-            
-            # Libérer la réservation
-            self.execute_update(
-                "UPDATE reservations_stock SET statut = 'LIBEREE' WHERE id = ?",
-                (reservation_id,)
-            )
-            
-            # Enregistrer le mouvement de libération
-            self.enregistrer_mouvement_stock({
-                'produit_id': reservation['produit_id'],
-                'type_mouvement': 'LIBERATION',
-                'quantite': reservation['quantite_reservee'],
-                'reference_document': reservation['reference_document'],
-                'reference_type': reservation['reference_type'],
-                'motif': f"Libération réservation #{reservation_id}",
-                'employee_id': employee_id
-            })
+            with self.write_transaction('produits', 'mouvements_stock', 'reservations_stock') as conn:
+                reservation = conn.execute(
+                    "SELECT * FROM reservations_stock WHERE id = ? AND statut = 'ACTIVE'",
+                    (reservation_id,)
+                ).fetchone()
+                
+                if not reservation:
+                    logger.error(f"Réservation {reservation_id} non trouvée ou inactive")
+                    return False
+                
+                conn.execute(
+                    "UPDATE reservations_stock SET statut = 'LIBEREE' WHERE id = ?",
+                    (reservation_id,)
+                )
+                
+                # Enregistrer le mouvement de libération
+                self._appliquer_mouvements_stock(conn, [{
+                    'produit_id': reservation['produit_id'],
+                    'type_mouvement': 'LIBERATION',
+                    'quantite': reservation['quantite_reservee'],
+                    'reference_document': reservation['reference_document'],
+                    'reference_type': reservation['reference_type'],
+                    'motif': f"Libération réservation #{reservation_id}",
+                    'employee_id': employee_id
+                }])
             
             return True
             
@@ -5446,187 +6393,199 @@ class ERPDatabase:
             logger.debug(f"Erreur formatage date: {e}")
             return str(date_str)
     
-    def get_dashboard_metrics(self) -> Dict[str, Any]:
-        """Retourne les métriques principales pour le dashboard unifié"""
+    # Agrégats mono-ligne par table : chaque table n'est parcourue qu'une fois,
+    # les colonnes sont préfixées pour être combinées dans un seul SELECT
+    DASHBOARD_SOURCES = {
+        'projects': '''
+            SELECT COUNT(*) AS p_total,
+                   SUM(prix_estime) AS p_ca,
+                   COUNT(CASE WHEN statut NOT IN ('TERMINÉ', 'ANNULÉ') THEN 1 END) AS p_actifs
+            FROM projects
+        ''',
+        'formulaires': '''
+            SELECT COUNT(*) AS f_total,
+                   SUM(montant_total) AS f_montant,
+                   COUNT(CASE WHEN statut IN ('BROUILLON', 'VALIDÉ') THEN 1 END) AS f_en_attente,
+                   COUNT(CASE WHEN type_formulaire = 'BON_TRAVAIL' THEN 1 END) AS f_bt_total
+            FROM formulaires
+        ''',
+        'inventory_items': '''
+            SELECT COUNT(*) AS inv_total,
+                   COUNT(CASE WHEN statut IN ('CRITIQUE', 'FAIBLE', 'ÉPUISÉ') THEN 1 END) AS inv_critiques
+            FROM inventory_items
+        ''',
+        'companies': '''
+            SELECT COUNT(*) AS comp_fournisseurs FROM companies WHERE type_company = 'FOURNISSEUR'
+        ''',
+        'fournisseurs': '''
+            SELECT COUNT(*) AS fourn_actifs FROM fournisseurs WHERE est_actif = TRUE
+        ''',
+        'employees': '''
+            SELECT COUNT(*) AS emp_total,
+                   COUNT(CASE WHEN statut = 'ACTIF' THEN 1 END) AS emp_actifs
+            FROM employees
+        ''',
+        'bt_assignations': '''
+            SELECT COUNT(*) AS bta_total FROM bt_assignations
+        ''',
+        'bt_reservations_postes': '''
+            SELECT COUNT(*) AS btr_reserves FROM bt_reservations_postes WHERE statut = 'RÉSERVÉ'
+        ''',
+        'time_entries': '''
+            SELECT COUNT(*) AS te_pointages_bt,
+                   COALESCE(SUM(total_hours), 0) AS te_heures_bt,
+                   COALESCE(SUM(total_cost), 0) AS te_cout_bt
+            FROM time_entries
+            WHERE formulaire_bt_id IS NOT NULL
+        ''',
+        'work_centers': '''
+            SELECT COUNT(*) AS wc_total,
+                   COUNT(CASE WHEN statut = 'ACTIF' THEN 1 END) AS wc_actifs,
+                   COALESCE(SUM(capacite_theorique), 0) AS wc_capacite,
+                   COALESCE(AVG(CASE WHEN utilization_rate_30d > 0 THEN utilization_rate_30d END), 0) AS wc_utilisation,
+                   COALESCE(SUM(total_revenue_generated), 0) AS wc_revenus
+            FROM view_work_centers_with_stats
+        ''',
+        'bottlenecks': '''
+            SELECT COUNT(*) AS bn_goulots
+            FROM view_bottlenecks_realtime
+            WHERE bottleneck_level IN ('CRITIQUE', 'ÉLEVÉ')
+        ''',
+        'materials': '''
+            SELECT COUNT(DISTINCT project_id) AS mat_projets,
+                   COUNT(*) AS mat_total,
+                   COALESCE(AVG(quantite * prix_unitaire), 0) AS mat_valeur_moyenne
+            FROM materials
+            WHERE project_id IS NOT NULL
+        ''',
+        'operations': '''
+            SELECT COUNT(DISTINCT project_id) AS op_projets,
+                   COUNT(project_id) AS op_total,
+                   COALESCE(SUM(CASE WHEN project_id IS NOT NULL THEN temps_estime END), 0) AS op_temps_planifie,
+                   COUNT(formulaire_bt_id) AS op_liees_bt,
+                   COUNT(DISTINCT formulaire_bt_id) AS op_bt_distincts,
+                   COALESCE(SUM(CASE WHEN formulaire_bt_id IS NOT NULL THEN temps_estime END), 0) AS op_temps_bt,
+                   COUNT(DISTINCT CASE WHEN formulaire_bt_id IS NOT NULL THEN work_center_id END) AS op_postes_bt
+            FROM operations
+        ''',
+    }
+
+    # Section du dashboard → agrégats nécessaires
+    DASHBOARD_SECTIONS = {
+        'projects': ('projects',),
+        'formulaires': ('formulaires',),
+        'inventory': ('inventory_items',),
+        'fournisseurs': ('companies', 'fournisseurs'),
+        'employees': ('employees',),
+        'bt_specialise': ('formulaires', 'bt_assignations', 'bt_reservations_postes'),
+        'timetracker_bt_integration': ('time_entries',),
+        'work_centers_unified': ('work_centers', 'bottlenecks'),
+        'production_unified': ('materials', 'operations'),
+        'operations_bt_integration': ('operations',),
+        'communication_tt_integration': (),
+    }
+
+    def get_dashboard_metrics(self, sections: List[str] = None) -> Dict[str, Any]:
+        """
+        Retourne les métriques principales pour le dashboard unifié.
+        
+        Args:
+            sections: Sections à calculer (clés de DASHBOARD_SECTIONS), toutes par défaut
+        """
+        if sections is None:
+            requested = tuple(self.DASHBOARD_SECTIONS)
+        else:
+            requested = tuple(s for s in self.DASHBOARD_SECTIONS if s in sections)
+            unknown = set(sections) - set(self.DASHBOARD_SECTIONS)
+            if unknown:
+                logger.warning(f"Sections dashboard inconnues ignorées: {sorted(unknown)}")
+        return self._compute_dashboard_metrics(requested)
+
+    @cached_query('projects', 'formulaires', 'inventory_items', 'companies', 'fournisseurs',
+                  'employees', 'bt_assignations', 'bt_reservations_postes', 'time_entries',
+                  'operations', 'work_centers', 'materials', max_age=300)
+    def _compute_dashboard_metrics(self, sections: Tuple[str, ...]) -> Dict[str, Any]:
+        """Calcule les sections demandées en un seul SELECT dans une transaction de lecture"""
         try:
-            metrics = {
-                'projects': {'total': 0, 'actifs': 0, 'ca_total': 0.0},
-                'formulaires': {'total': 0, 'en_attente': 0, 'montant_total': 0.0},
-                'inventory': {'total_items': 0, 'stocks_critiques': 0},
-                'fournisseurs': {'total': 0, 'actifs': 0},
-                'employees': {'total': 0, 'actifs': 0},
-                'bt_specialise': {'total': 0, 'assignations': 0, 'postes_reserves': 0},
-                'timetracker_bt_integration': {'total_pointages_bt': 0, 'heures_bt': 0.0, 'cout_bt': 0.0},
-                # NOUVEAU: Métriques postes de travail unifiées
-                'work_centers_unified': {
-                    'total_postes': 0,
-                    'postes_actifs': 0,
-                    'capacite_totale_jour': 0.0,
-                    'utilisation_moyenne': 0.0,
-                    'revenus_generes': 0.0,
-                    'goulots_detectes': 0
+            sources = []
+            for section in sections:
+                for source in self.DASHBOARD_SECTIONS[section]:
+                    if source not in sources:
+                        sources.append(source)
+            
+            row = {}
+            if sources:
+                # Une sous-requête mono-ligne par table, jointes en produit cartésien (1 ligne)
+                query = "SELECT * FROM " + ",\n".join(
+                    f"({self.DASHBOARD_SOURCES[source]}) AS s_{source}" for source in sources
+                )
+                with self.read_snapshot() as conn:
+                    result = conn.execute(query).fetchone()
+                row = dict(result) if result else {}
+            
+            builders = {
+                'projects': lambda: {
+                    'total': row['p_total'],
+                    'actifs': row['p_actifs'],
+                    'ca_total': row['p_ca'] or 0.0
                 },
-                # ÉTAPE 3: Métriques production
-                'production_unified': {
-                    'projets_avec_bom': 0,
-                    'projets_avec_itineraires': 0,
-                    'materiaux_total': 0,
-                    'operations_total': 0,
-                    'valeur_bom_total': 0.0,
-                    'temps_planifie_total': 0.0
+                'formulaires': lambda: {
+                    'total': row['f_total'],
+                    'en_attente': row['f_en_attente'],
+                    'montant_total': row['f_montant'] or 0.0
+                },
+                'inventory': lambda: {
+                    'total_items': row['inv_total'],
+                    'stocks_critiques': row['inv_critiques']
+                },
+                'fournisseurs': lambda: {
+                    'total': row['comp_fournisseurs'],
+                    'actifs': row['fourn_actifs']
+                },
+                'employees': lambda: {
+                    'total': row['emp_total'],
+                    'actifs': row['emp_actifs']
+                },
+                'bt_specialise': lambda: {
+                    'total': row['f_bt_total'],
+                    'assignations': row['bta_total'],
+                    'postes_reserves': row['btr_reserves']
                 },
-                # NOUVEAU: Métriques Operations ↔ BT
-                'operations_bt_integration': {
-                    'operations_liees_bt': 0,
-                    'bt_avec_operations': 0,
-                    'temps_operations_bt': 0.0,
-                    'postes_utilises_bt': 0
+                'timetracker_bt_integration': lambda: {
+                    'total_pointages_bt': row['te_pointages_bt'],
+                    'heures_bt': round(row['te_heures_bt'], 1),
+                    'cout_bt': round(row['te_cout_bt'], 2)
                 },
-                # NOUVEAU: Métriques Communication TimeTracker
-                'communication_tt_integration': {
+                'work_centers_unified': lambda: {
+                    'total_postes': row['wc_total'],
+                    'postes_actifs': row['wc_actifs'],
+                    'capacite_totale_jour': row['wc_capacite'],
+                    'utilisation_moyenne': row['wc_utilisation'],
+                    'revenus_generes': row['wc_revenus'],
+                    'goulots_detectes': row['bn_goulots']
+                },
+                'production_unified': lambda: {
+                    'projets_avec_bom': row['mat_projets'],
+                    'projets_avec_itineraires': row['op_projets'],
+                    'materiaux_total': row['mat_total'],
+                    'operations_total': row['op_total'],
+                    'valeur_bom_total': row['mat_valeur_moyenne'],
+                    'temps_planifie_total': row['op_temps_planifie']
+                },
+                'operations_bt_integration': lambda: {
+                    'operations_liees_bt': row['op_liees_bt'],
+                    'bt_avec_operations': row['op_bt_distincts'],
+                    'temps_operations_bt': row['op_temps_bt'],
+                    'postes_utilises_bt': row['op_postes_bt']
+                },
+                'communication_tt_integration': lambda: {
                     'methodes_disponibles': 6,
                     'integration_active': True,
                     'derniere_sync': datetime.now().isoformat()
-                }
+                },
             }
             
-            # Métriques projets
-            result = self.execute_query("SELECT COUNT(*) as total, SUM(prix_estime) as ca FROM projects")
-            if result:
-                metrics['projects']['total'] = result[0]['total']
-                metrics['projects']['ca_total'] = result[0]['ca'] or 0.0
-            
-            result = self.execute_query("SELECT COUNT(*) as actifs FROM projects WHERE statut NOT IN ('TERMINÉ', 'ANNULÉ')")
-            if result:
-                metrics['projects']['actifs'] = result[0]['actifs']
-            
-            # Métriques formulaires
-            result = self.execute_query("SELECT COUNT(*) as total, SUM(montant_total) as montant FROM formulaires")
-            if result:
-                metrics['formulaires']['total'] = result[0]['total']
-                metrics['formulaires']['montant_total'] = result[0]['montant'] or 0.0
-            
-            result = self.execute_query("SELECT COUNT(*) as en_attente FROM formulaires WHERE statut IN ('BROUILLON', 'VALIDÉ')")
-            if result:
-                metrics['formulaires']['en_attente'] = result[0]['en_attente']
-            
-            # Métriques inventaire
-            result = self.execute_query("SELECT COUNT(*) as total FROM inventory_items")
-            if result:
-                metrics['inventory']['total_items'] = result[0]['total']
-            
-            result = self.execute_query("SELECT COUNT(*) as critiques FROM inventory_items WHERE statut IN ('CRITIQUE', 'FAIBLE', 'ÉPUISÉ')")
-            if result:
-                metrics['inventory']['stocks_critiques'] = result[0]['critiques']
-            
-            # Métriques fournisseurs
-            result = self.execute_query("SELECT COUNT(*) as total FROM companies WHERE type_company = 'FOURNISSEUR'")
-            if result:
-                metrics['fournisseurs']['total'] = result[0]['total']
-            
-            result = self.execute_query("SELECT COUNT(*) as actifs FROM fournisseurs WHERE est_actif = TRUE")
-            if result:
-                metrics['fournisseurs']['actifs'] = result[0]['actifs']
-            
-            # Métriques employés
-            result = self.execute_query("SELECT COUNT(*) as total FROM employees")
-            if result:
-                metrics['employees']['total'] = result[0]['total']
-            
-            result = self.execute_query("SELECT COUNT(*) as actifs FROM employees WHERE statut = 'ACTIF'")
-            if result:
-                metrics['employees']['actifs'] = result[0]['actifs']
-            
-            # Métriques BT spécialisées
-            result = self.execute_query("SELECT COUNT(*) as total FROM formulaires WHERE type_formulaire = 'BON_TRAVAIL'")
-            if result:
-                metrics['bt_specialise']['total'] = result[0]['total']
-            
-            result = self.execute_query("SELECT COUNT(*) as assignations FROM bt_assignations")
-            if result:
-                metrics['bt_specialise']['assignations'] = result[0]['assignations']
-            
-            result = self.execute_query("SELECT COUNT(*) as reservations FROM bt_reservations_postes WHERE statut = 'RÉSERVÉ'")
-            if result:
-                metrics['bt_specialise']['postes_reserves'] = result[0]['reservations']
-            
-            # ÉTAPE 2 : Métriques intégration TimeTracker ↔ BT
-            result = self.execute_query('''
-                SELECT 
-                    COUNT(*) as total_pointages_bt,
-                    COALESCE(SUM(total_hours), 0) as heures_bt,
-                    COALESCE(SUM(total_cost), 0) as cout_bt
-                FROM time_entries 
-                WHERE formulaire_bt_id IS NOT NULL
-            ''')
-            if result:
-                metrics['timetracker_bt_integration']['total_pointages_bt'] = result[0]['total_pointages_bt']
-                metrics['timetracker_bt_integration']['heures_bt'] = round(result[0]['heures_bt'], 1)
-                metrics['timetracker_bt_integration']['cout_bt'] = round(result[0]['cout_bt'], 2)
-            
-            # NOUVEAU: Métriques postes de travail unifiées
-            wc_stats_result = self.execute_query('''
-                SELECT 
-                    COUNT(*) as total_postes,
-                    COUNT(CASE WHEN statut = 'ACTIF' THEN 1 END) as postes_actifs,
-                    COALESCE(SUM(capacite_theorique), 0) as capacite_totale,
-                    COALESCE(AVG(CASE WHEN utilization_rate_30d > 0 THEN utilization_rate_30d END), 0) as utilisation_moyenne
-                FROM view_work_centers_with_stats
-            ''')
-            
-            if wc_stats_result:
-                wc_data = dict(wc_stats_result[0])
-                metrics['work_centers_unified'].update({
-                    'total_postes': wc_data['total_postes'],
-                    'postes_actifs': wc_data['postes_actifs'],
-                    'capacite_totale_jour': wc_data['capacite_totale'],
-                    'utilisation_moyenne': wc_data['utilisation_moyenne']
-                })
-            
-            # Revenus générés par les postes
-            revenue_result = self.execute_query('''
-                SELECT COALESCE(SUM(total_revenue_generated), 0) as total_revenue
-                FROM view_work_centers_with_stats
-            ''')
-            if revenue_result:
-                metrics['work_centers_unified']['revenus_generes'] = revenue_result[0]['total_revenue']
-            
-            # Goulots détectés
-            bottlenecks_result = self.execute_query('''
-                SELECT COUNT(*) as goulots_count
-                FROM view_bottlenecks_realtime
-                WHERE bottleneck_level IN ('CRITIQUE', 'ÉLEVÉ')
-            ''')
-            if bottlenecks_result:
-                metrics['work_centers_unified']['goulots_detectes'] = bottlenecks_result[0]['goulots_count']
-            
-            # ÉTAPE 3: Métriques production unifiées
-            production_metrics = self.get_production_dashboard_metrics()
-            if production_metrics:
-                metrics['production_unified'] = {
-                    'projets_avec_bom': production_metrics.get('nomenclatures', {}).get('projets_avec_bom', 0),
-                    'projets_avec_itineraires': production_metrics.get('itineraires', {}).get('projets_avec_operations', 0),
-                    'materiaux_total': production_metrics.get('nomenclatures', {}).get('materiaux_total', 0),
-                    'operations_total': production_metrics.get('itineraires', {}).get('operations_total', 0),
-                    'valeur_bom_total': production_metrics.get('nomenclatures', {}).get('valeur_moyenne_bom', 0.0),
-                    'temps_planifie_total': production_metrics.get('itineraires', {}).get('temps_total_planifie', 0.0)
-                }
-            
-            # NOUVEAU: Métriques Operations ↔ BT
-            operations_bt_result = self.execute_query('''
-                SELECT 
-                    COUNT(*) as operations_liees_bt,
-                    COUNT(DISTINCT formulaire_bt_id) as bt_avec_operations,
-                    COALESCE(SUM(temps_estime), 0) as temps_operations_bt,
-                    COUNT(DISTINCT work_center_id) as postes_utilises_bt
-                FROM operations 
-                WHERE formulaire_bt_id IS NOT NULL
-            ''')
-            if operations_bt_result:
-                ops_bt_data = dict(operations_bt_result[0])
-                metrics['operations_bt_integration'].update(ops_bt_data)
-            
-            return metrics
+            return {section: builders[section]() for section in sections}
             
         except Exception as e:
             logger.error(f"Erreur métriques dashboard unifié: {e}")
@@ -6330,7 +7289,31 @@ class ERPDatabase:
         except Exception as e:
             logger.error(f"Erreur récupération postes: {e}")
             return []
-    
+
+
+# =========================================================================
+# INSTANCE PARTAGÉE PAR LE PROCESSUS
+# =========================================================================
+
+_SHARED_DATABASES: Dict[str, ERPDatabase] = {}
+_SHARED_DATABASES_LOCK = threading.Lock()
+
+
+def get_shared_database(db_path: str = "erp_production_dg.db") -> ERPDatabase:
+    """
+    Instance ERPDatabase unique par fichier pour tout le processus.
+    Les pools de connexions et le cache de requêtes sont thread-safe : les sessions
+    Streamlit partagent cette instance au lieu de relancer init_database chacune.
+    """
+    key = os.path.abspath(db_path)
+    with _SHARED_DATABASES_LOCK:
+        db = _SHARED_DATABASES.get(key)
+        if db is None:
+            db = ERPDatabase(db_path)
+            _SHARED_DATABASES[key] = db
+        return db
+
+
 def show_kanban_unified_improved():
     """Version améliorée du Kanban utilisant uniquement erp_db"""
     if 'erp_db' not in st.session_state:
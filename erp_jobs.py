@@ -0,0 +1,373 @@
+# erp_jobs.py - Exécution en arrière-plan des tâches de maintenance ERP
+# ERP Production DG Inc. - Pool de threads, table de suivi persistante, planification et reprises
+
+import os
+import json
+import time
+import socket
+import logging
+import threading
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Any
+
+logger = logging.getLogger(__name__)
+
+
+JOBS_TABLE = 'erp_jobs'
+
+STATUTS_ACTIFS = ('EN_ATTENTE', 'EN_COURS')
+
+JOBS_TABLE_DDL = f'''
+    CREATE TABLE IF NOT EXISTS {JOBS_TABLE} (
+        id INTEGER PRIMARY KEY,
+        nom TEXT NOT NULL,
+        statut TEXT NOT NULL DEFAULT 'EN_ATTENTE' CHECK(statut IN
+            ('EN_ATTENTE', 'EN_COURS', 'TERMINE', 'ECHEC')),
+        tentative INTEGER NOT NULL DEFAULT 0,
+        max_tentatives INTEGER NOT NULL DEFAULT 1,
+        planifie_pour TIMESTAMP NOT NULL,
+        debut TIMESTAMP,
+        fin TIMESTAMP,
+        duree_ms INTEGER,
+        resultat_json TEXT,
+        erreur TEXT,
+        worker TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+'''
+
+# Une seule instance active (en attente ou en cours) par job, tous processus confondus
+JOBS_INDEXES_DDL = [
+    f'''CREATE UNIQUE INDEX IF NOT EXISTS idx_erp_jobs_actif ON {JOBS_TABLE}(nom)
+        WHERE statut IN ('EN_ATTENTE', 'EN_COURS')''',
+    f"CREATE INDEX IF NOT EXISTS idx_erp_jobs_nom ON {JOBS_TABLE}(nom, id)",
+    f"CREATE INDEX IF NOT EXISTS idx_erp_jobs_statut ON {JOBS_TABLE}(statut, planifie_pour)",
+]
+
+
+def create_jobs_schema(cursor):
+    """Crée la table de suivi des jobs (idempotent)"""
+    cursor.execute(JOBS_TABLE_DDL)
+    for ddl in JOBS_INDEXES_DDL:
+        cursor.execute(ddl)
+
+
+def _now() -> str:
+    return datetime.now().isoformat(sep=' ', timespec='seconds')
+
+
+def _in(seconds: float) -> str:
+    return (datetime.now() + timedelta(seconds=seconds)).isoformat(sep=' ', timespec='seconds')
+
+
+class JobRunner:
+    """
+    Exécuteur de jobs en arrière-plan partagé par le processus.
+
+    Chaque exécution est une ligne de erp_jobs : EN_ATTENTE → EN_COURS → TERMINE / ECHEC.
+    L'index unique partiel sur les statuts actifs garantit qu'un même job ne peut être
+    en attente ou en cours qu'une fois, même avec plusieurs processus sur la même base.
+    Les pages lisent les statuts et résultats ; elles n'exécutent plus les traitements.
+    """
+
+    def __init__(self, db, max_workers: int = 2, tick_seconds: float = 15.0):
+        self.db = db
+        self.tick_seconds = tick_seconds
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+        self._running: Dict[int, str] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='erp-job')
+
+    # =========================================================================
+    # DÉCLARATION ET SOUMISSION
+    # =========================================================================
+
+    def register(self, nom: str, fonction: Callable, intervalle: Optional[float] = None,
+                 max_tentatives: int = 1, delai_retry: float = 60, timeout: float = 3600,
+                 description: str = ''):
+        """
+        Déclare un job.
+
+        Args:
+            fonction: Appelée avec la base de données ; son retour (JSON) est conservé
+            intervalle: Période en secondes (None = exécution à la demande seulement)
+            max_tentatives: Nombre total d'essais en cas d'exception
+            delai_retry: Délai avant la 1re reprise (doublé à chaque essai)
+            timeout: Au-delà, une exécution EN_COURS d'un autre processus est considérée abandonnée
+        """
+        self._jobs[nom] = {
+            'fonction': fonction,
+            'intervalle': intervalle,
+            'max_tentatives': max(1, max_tentatives),
+            'delai_retry': delai_retry,
+            'timeout': timeout,
+            'description': description,
+        }
+
+    def submit(self, nom: str, delai: float = 0) -> Optional[int]:
+        """
+        Demande l'exécution d'un job. Si une instance est déjà en attente ou en cours,
+        aucune nouvelle n'est créée et son identifiant est retourné.
+        """
+        job = self._jobs.get(nom)
+        if not job:
+            logger.error(f"Job inconnu: {nom}")
+            return None
+        try:
+            self.db.execute_update(
+                f"INSERT OR IGNORE INTO {JOBS_TABLE} (nom, planifie_pour, max_tentatives) VALUES (?, ?, ?)",
+                (nom, _in(delai), job['max_tentatives'])
+            )
+            result = self.db.execute_query(
+                f"SELECT id FROM {JOBS_TABLE} WHERE nom = ? AND statut IN ('EN_ATTENTE', 'EN_COURS')",
+                (nom,)
+            )
+            self._wake.set()  # Lancement sans attendre le prochain cycle
+            return result[0]['id'] if result else None
+        except Exception as e:
+            logger.error(f"Erreur soumission job {nom}: {e}")
+            return None
+
+    # =========================================================================
+    # BOUCLE DE PLANIFICATION
+    # =========================================================================
+
+    def start(self):
+        """Démarre le thread de planification (daemon)"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name='erp-job-scheduler', daemon=True)
+        self._thread.start()
+        logger.info(f"⏰ Exécuteur de jobs démarré ({len(self._jobs)} jobs déclarés)")
+
+    def stop(self, wait: bool = True):
+        """Arrête la planification ; les jobs en cours se terminent si wait"""
+        self._stop.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout=self.tick_seconds + 5)
+        self._executor.shutdown(wait=wait)
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                self.run_pending()
+            except Exception as e:
+                logger.error(f"Erreur boucle de jobs: {e}")
+            self._wake.wait(self.tick_seconds)
+            self._wake.clear()
+
+    def run_pending(self):
+        """Un cycle : planification périodique, reprise des abandons, lancement des jobs échus"""
+        self._schedule_periodic()
+        self._recover_abandoned()
+
+        due = self.db.execute_query(
+            f"SELECT id, nom FROM {JOBS_TABLE} WHERE statut = 'EN_ATTENTE' AND planifie_pour <= ? ORDER BY planifie_pour",
+            (_now(),)
+        )
+        for row in due:
+            if row['nom'] not in self._jobs:
+                continue  # Job déclaré par un autre processus
+            # Réservation atomique : un seul processus passe EN_ATTENTE → EN_COURS
+            claimed = self.db.execute_update(
+                f'''UPDATE {JOBS_TABLE}
+                    SET statut = 'EN_COURS', tentative = tentative + 1, debut = ?, worker = ?
+                    WHERE id = ? AND statut = 'EN_ATTENTE' ''',
+                (_now(), self.worker_id, row['id'])
+            )
+            if claimed:
+                with self._lock:
+                    self._running[row['id']] = row['nom']
+                self._executor.submit(self._execute, row['id'], row['nom'])
+
+    def _schedule_periodic(self):
+        for nom, job in list(self._jobs.items()):
+            if not job['intervalle']:
+                continue
+            last = self.db.execute_query(
+                f"SELECT statut, planifie_pour FROM {JOBS_TABLE} WHERE nom = ? ORDER BY id DESC LIMIT 1",
+                (nom,)
+            )
+            if not last:
+                self.submit(nom)
+            elif last[0]['statut'] not in STATUTS_ACTIFS and last[0]['planifie_pour'] <= _in(-job['intervalle']):
+                self.submit(nom)
+
+    def _recover_abandoned(self):
+        """Exécutions EN_COURS dépassant leur timeout hors de ce processus (arrêt, crash)"""
+        with self._lock:
+            locaux = list(self._running)
+        for nom, job in list(self._jobs.items()):
+            params = [_now(), nom, _in(-job['timeout'])] + locaux
+            exclusion = f" AND id NOT IN ({', '.join('?' for _ in locaux)})" if locaux else ""
+            abandoned = self.db.execute_update(
+                f'''UPDATE {JOBS_TABLE}
+                    SET statut = 'ECHEC', fin = ?, erreur = 'Exécution abandonnée (timeout dépassé)'
+                    WHERE nom = ? AND statut = 'EN_COURS' AND debut < ?{exclusion}''',
+                tuple(params)
+            )
+            if abandoned:
+                logger.warning(f"⚠️ Job {nom}: {abandoned} exécution(s) abandonnée(s) marquée(s) en échec")
+
+    # =========================================================================
+    # EXÉCUTION
+    # =========================================================================
+
+    def _execute(self, job_id: int, nom: str):
+        job = self._jobs[nom]
+        start = time.monotonic()
+        try:
+            resultat = job['fonction'](self.db)
+            duree_ms = int((time.monotonic() - start) * 1000)
+            self.db.execute_update(
+                f'''UPDATE {JOBS_TABLE}
+                    SET statut = 'TERMINE', fin = ?, duree_ms = ?, resultat_json = ?, erreur = NULL
+                    WHERE id = ?''',
+                (_now(), duree_ms, json.dumps(resultat, default=str), job_id)
+            )
+            logger.info(f"✅ Job {nom} terminé en {duree_ms} ms")
+
+        except Exception as e:
+            duree_ms = int((time.monotonic() - start) * 1000)
+            row = self.db.execute_query(
+                f"SELECT tentative, max_tentatives FROM {JOBS_TABLE} WHERE id = ?", (job_id,)
+            )
+            tentative = row[0]['tentative'] if row else 1
+            max_tentatives = row[0]['max_tentatives'] if row else 1
+
+            if tentative < max_tentatives:
+                delai = job['delai_retry'] * (2 ** (tentative - 1))
+                self.db.execute_update(
+                    f'''UPDATE {JOBS_TABLE}
+                        SET statut = 'EN_ATTENTE', planifie_pour = ?, duree_ms = ?, erreur = ?
+                        WHERE id = ?''',
+                    (_in(delai), duree_ms, str(e), job_id)
+                )
+                logger.warning(f"⚠️ Job {nom} en erreur (essai {tentative}/{max_tentatives}), reprise dans {delai:.0f}s: {e}")
+            else:
+                self.db.execute_update(
+                    f'''UPDATE {JOBS_TABLE}
+                        SET statut = 'ECHEC', fin = ?, duree_ms = ?, erreur = ?
+                        WHERE id = ?''',
+                    (_now(), duree_ms, str(e), job_id)
+                )
+                logger.error(f"❌ Job {nom} en échec après {tentative} essai(s): {e}")
+        finally:
+            with self._lock:
+                self._running.pop(job_id, None)
+
+    # =========================================================================
+    # CONSULTATION
+    # =========================================================================
+
+    def get_jobs_status(self) -> List[Dict]:
+        """Dernière exécution de chaque job déclaré"""
+        try:
+            rows = self.db.execute_query(f'''
+                SELECT j.* FROM {JOBS_TABLE} j
+                JOIN (SELECT nom, MAX(id) as id FROM {JOBS_TABLE} GROUP BY nom) d ON d.id = j.id
+            ''')
+            derniers = {row['nom']: row for row in rows}
+            status = []
+            for nom, job in list(self._jobs.items()):
+                entry = dict(derniers.get(nom) or {'nom': nom, 'statut': None})
+                entry['description'] = job['description']
+                entry['intervalle'] = job['intervalle']
+                status.append(entry)
+            return status
+        except Exception as e:
+            logger.error(f"Erreur statut des jobs: {e}")
+            return []
+
+    def get_job_history(self, nom: str = None, limit: int = 50) -> List[Dict]:
+        """Historique des exécutions (plus récentes d'abord)"""
+        try:
+            if nom:
+                return self.db.execute_query(
+                    f"SELECT * FROM {JOBS_TABLE} WHERE nom = ? ORDER BY id DESC LIMIT ?", (nom, limit)
+                )
+            return self.db.execute_query(f"SELECT * FROM {JOBS_TABLE} ORDER BY id DESC LIMIT ?", (limit,))
+        except Exception as e:
+            logger.error(f"Erreur historique des jobs: {e}")
+            return []
+
+    def get_last_result(self, nom: str) -> Optional[Any]:
+        """Résultat de la dernière exécution réussie d'un job"""
+        try:
+            result = self.db.execute_query(
+                f"SELECT resultat_json FROM {JOBS_TABLE} WHERE nom = ? AND statut = 'TERMINE' ORDER BY id DESC LIMIT 1",
+                (nom,)
+            )
+            return json.loads(result[0]['resultat_json']) if result and result[0]['resultat_json'] else None
+        except Exception as e:
+            logger.error(f"Erreur résultat job {nom}: {e}")
+            return None
+
+
+# =========================================================================
+# JOBS DE MAINTENANCE ERP
+# =========================================================================
+
+def _sync_bt_tasks_to_operations(db):
+    from timetracker_unified import TimeTrackerUnified
+    return TimeTrackerUnified(db).sync_bt_tasks_to_operations()
+
+
+def register_erp_jobs(runner: JobRunner):
+    """Déclare les traitements de maintenance de ERPDatabase et du TimeTracker"""
+    runner.register(
+        'sync_bt_timetracker', lambda db: db.sync_bt_timetracker_data(),
+        intervalle=15 * 60, max_tentatives=3,
+        description="Synchronisation BT ↔ TimeTracker (coûts, taux, progressions, statuts)"
+    )
+    runner.register(
+        'statuts_inventaire', lambda db: db.update_inventory_status_all(),
+        intervalle=60 * 60, max_tentatives=3,
+        description="Recalcul des statuts de stock de l'inventaire"
+    )
+    runner.register(
+        'recalcul_progression_bt', lambda db: db.recalculate_all_bt_progress(),
+        intervalle=24 * 60 * 60, max_tentatives=2,
+        description="Recalcul complet de la progression des BT"
+    )
+    # Traitements destructifs ou structurants : à la demande seulement
+    runner.register(
+        'nettoyage_sessions_bt', lambda db: db.cleanup_empty_bt_sessions(),
+        description="Suppression des sessions BT vides, orphelines ou ouvertes depuis plus de 24h"
+    )
+    runner.register(
+        'sync_taches_bt_operations', _sync_bt_tasks_to_operations,
+        description="Création des opérations manquantes depuis les tâches BT"
+    )
+
+
+_RUNNERS: Dict[str, JobRunner] = {}
+_RUNNERS_LOCK = threading.Lock()
+
+
+def get_job_runner(db, setup: Optional[Callable[[JobRunner], None]] = None) -> JobRunner:
+    """
+    Exécuteur unique par base de données pour tout le processus (démarré au premier appel).
+
+    Args:
+        setup: Enregistrement de jobs supplémentaires (ex: sauvegarde), appelé une seule fois
+    """
+    key = os.path.abspath(db.db_path)
+    with _RUNNERS_LOCK:
+        runner = _RUNNERS.get(key)
+        if runner is None:
+            runner = JobRunner(db, max_workers=int(os.environ.get('ERP_JOB_WORKERS', '2')))
+            register_erp_jobs(runner)
+            if setup:
+                setup(runner)
+            runner.start()
+            _RUNNERS[key] = runner
+        return runner
@@ -0,0 +1,366 @@
+# erp_search.py - Index de recherche plein texte (SQLite FTS5) des entités ERP
+# ERP Production DG Inc. - Projets, opérations, matériaux, formulaires, CRM, produits, inventaire
+
+import re
+import logging
+from typing import Dict, List, Optional, Iterable
+
+logger = logging.getLogger(__name__)
+
+
+SEARCH_TABLE = 'erp_search_index'
+
+# Rowid attribué à chaque (entité, id source) : les ids source peuvent être TEXT (projets
+# alphanumériques), l'index est donc adressé par cette table plutôt que par un rowid calculé
+SEARCH_KEYS_TABLE = 'erp_search_keys'
+
+
+def _concat(*exprs: str) -> str:
+    """Concatène des colonnes texte (valeurs NULL ignorées)"""
+    return " || ' ' || ".join(f"COALESCE({expr}, '')" for expr in exprs)
+
+
+# Entités indexées : projet de rattachement, colonnes titre / référence / contenu,
+# colonnes source dont la modification déclenche la réindexation et liens vers les tables
+# dont des colonnes sont recopiées dans le contenu (table liée → (colonnes, clé étrangère))
+SEARCH_SOURCES = {
+    'projects': {
+        'projet_id': "{r}.id",
+        'titre': "{r}.nom_projet",
+        'reference': _concat("{r}.id", "{r}.po_client"),
+        'contenu': _concat(
+            "{r}.description", "{r}.tache", "{r}.statut", "{r}.priorite",
+            "{r}.client_nom_cache", "{r}.client_legacy",
+            "(SELECT nom FROM companies WHERE id = {r}.client_company_id)"
+        ),
+        'colonnes': ['nom_projet', 'po_client', 'description', 'tache', 'statut', 'priorite',
+                     'client_nom_cache', 'client_legacy', 'client_company_id'],
+        'liens': {'companies': (['nom'], 'client_company_id')},
+    },
+    'operations': {
+        'projet_id': "{r}.project_id",
+        'titre': "{r}.description",
+        'reference': "{r}.poste_travail",
+        'contenu': _concat("{r}.ressource", "{r}.statut"),
+        'colonnes': ['project_id', 'description', 'poste_travail', 'ressource', 'statut'],
+    },
+    'materials': {
+        'projet_id': "{r}.project_id",
+        'titre': "{r}.designation",
+        'reference': "{r}.code_materiau",
+        'contenu': _concat("{r}.fournisseur", "{r}.unite"),
+        'colonnes': ['project_id', 'designation', 'code_materiau', 'fournisseur', 'unite'],
+    },
+    'formulaires': {
+        'projet_id': "{r}.project_id",
+        'titre': "{r}.numero_document",
+        'reference': "{r}.type_formulaire",
+        'contenu': _concat(
+            "{r}.statut", "{r}.priorite", "{r}.notes",
+            "(SELECT nom FROM companies WHERE id = {r}.company_id)"
+        ),
+        'colonnes': ['project_id', 'numero_document', 'type_formulaire', 'statut', 'priorite',
+                     'notes', 'company_id'],
+        'liens': {'companies': (['nom'], 'company_id')},
+    },
+    'companies': {
+        'projet_id': "NULL",
+        'titre': "{r}.nom",
+        'reference': "{r}.secteur",
+        'contenu': _concat("{r}.type_company", "{r}.adresse", "{r}.site_web", "{r}.notes"),
+        'colonnes': ['nom', 'secteur', 'type_company', 'adresse', 'site_web', 'notes'],
+    },
+    'contacts': {
+        'projet_id': "NULL",
+        'titre': _concat("{r}.prenom", "{r}.nom_famille"),
+        'reference': "{r}.email",
+        'contenu': _concat(
+            "{r}.telephone", "{r}.role_poste", "{r}.notes",
+            "(SELECT nom FROM companies WHERE id = {r}.company_id)"
+        ),
+        'colonnes': ['prenom', 'nom_famille', 'email', 'telephone', 'role_poste', 'notes', 'company_id'],
+        'liens': {'companies': (['nom'], 'company_id')},
+    },
+    'produits': {
+        'projet_id': "NULL",
+        'titre': "{r}.nom",
+        'reference': "{r}.code_produit",
+        'contenu': _concat(
+            "{r}.description", "{r}.categorie", "{r}.materiau", "{r}.nuance",
+            "{r}.dimensions", "{r}.fournisseur_principal"
+        ),
+        'colonnes': ['nom', 'code_produit', 'description', 'categorie', 'materiau', 'nuance',
+                     'dimensions', 'fournisseur_principal'],
+    },
+    'inventory_items': {
+        'projet_id': "NULL",
+        'titre': "{r}.nom",
+        'reference': "{r}.code_interne",
+        'contenu': _concat(
+            "{r}.description", "{r}.type_produit", "{r}.fournisseur_principal", "{r}.notes"
+        ),
+        'colonnes': ['nom', 'code_interne', 'description', 'type_produit', 'fournisseur_principal', 'notes'],
+    },
+}
+
+# Pondération BM25 : titre > référence > contenu
+BM25_WEIGHTS = (10.0, 5.0, 1.0)
+
+SEARCH_TABLE_DDL = f'''
+    CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5(
+        titre,
+        reference,
+        contenu,
+        entite UNINDEXED,
+        entite_id UNINDEXED,
+        projet_id UNINDEXED,
+        tokenize = "unicode61 remove_diacritics 2",
+        prefix = '2 3'
+    )
+'''
+
+SEARCH_KEYS_DDL = f'''
+    CREATE TABLE IF NOT EXISTS {SEARCH_KEYS_TABLE} (
+        rowid INTEGER PRIMARY KEY,
+        entite TEXT NOT NULL,
+        entite_id TEXT NOT NULL,
+        UNIQUE (entite, entite_id)
+    )
+'''
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+# =========================================================================
+# REQUÊTES DE RECHERCHE
+# =========================================================================
+
+def build_match_query(terme: str) -> str:
+    """
+    Convertit une saisie utilisateur en expression MATCH FTS5 :
+    chaque mot devient un préfixe ("acier"*), tous les mots sont requis.
+    Retourne une chaîne vide si la saisie ne contient aucun mot.
+    """
+    tokens = _TOKEN_RE.findall(terme or '')
+    return ' '.join(f'"{token}"*' for token in tokens)
+
+
+def build_search_sql(entites: Optional[Iterable[str]] = None, count_only: bool = False) -> str:
+    """Requête de recherche classée (paramètres : match, entités..., limite, décalage)"""
+    where = f"{SEARCH_TABLE} MATCH ?"
+    if entites:
+        where += f" AND entite IN ({', '.join('?' for _ in entites)})"
+
+    if count_only:
+        return f"SELECT COUNT(*) as total FROM {SEARCH_TABLE} WHERE {where}"
+
+    weights = ', '.join(str(w) for w in BM25_WEIGHTS)
+    return f'''
+        SELECT entite, entite_id, projet_id, titre, reference,
+               snippet({SEARCH_TABLE}, 2, '[', ']', '…', 12) as extrait,
+               bm25({SEARCH_TABLE}, {weights}) as score
+        FROM {SEARCH_TABLE}
+        WHERE {where}
+        ORDER BY score
+        LIMIT ? OFFSET ?
+    '''
+
+
+def entity_match_subquery(entite: str) -> str:
+    """
+    Sous-requête (entite_id, score) d'une entité pour une expression MATCH
+    (paramètre unique), à joindre sur la table source : JOIN (...) s ON s.entite_id = t.id
+    """
+    weights = ', '.join(str(w) for w in BM25_WEIGHTS)
+    return (
+        f"SELECT entite_id, bm25({SEARCH_TABLE}, {weights}) as score FROM {SEARCH_TABLE} "
+        f"WHERE {SEARCH_TABLE} MATCH ? AND entite = '{entite}'"
+    )
+
+
+# =========================================================================
+# TRIGGERS DE SYNCHRONISATION
+# =========================================================================
+
+def _key_match(table: str, r: str, k: str = SEARCH_KEYS_TABLE) -> str:
+    """Condition qui relie une ligne source à sa clé d'index (ids comparés en texte)"""
+    return f"{k}.entite = '{table}' AND {k}.entite_id = CAST({r}.id AS TEXT)"
+
+
+def _rowid_lookup(table: str, r: str) -> str:
+    """Rowid de l'index attribué à une ligne source (NULL si jamais indexée)"""
+    return f"(SELECT rowid FROM {SEARCH_KEYS_TABLE} WHERE {_key_match(table, r)})"
+
+
+def _index_select(table: str, r: str, rowid: str) -> str:
+    """Valeurs (rowid, titre, référence, contenu, entité, id, projet) d'une ligne source"""
+    spec = SEARCH_SOURCES[table]
+    return (
+        f"SELECT {rowid}, {spec['titre'].format(r=r)}, "
+        f"{spec['reference'].format(r=r)}, {spec['contenu'].format(r=r)}, "
+        f"'{table}', {r}.id, {spec['projet_id'].format(r=r)}"
+    )
+
+
+_INSERT_COLUMNS = f"INSERT INTO {SEARCH_TABLE} (rowid, titre, reference, contenu, entite, entite_id, projet_id)"
+
+
+def _register_keys(table: str, r: str) -> str:
+    """Attribue un rowid aux lignes source qui n'en ont pas encore (à compléter par FROM/WHERE)"""
+    return (
+        f"INSERT OR IGNORE INTO {SEARCH_KEYS_TABLE} (entite, entite_id) "
+        f"SELECT '{table}', CAST({r}.id AS TEXT)"
+    )
+
+
+def _indexed_rows(table: str, r: str) -> str:
+    """Lignes source jointes à leur clé d'index (à compléter par WHERE)"""
+    return f"FROM {table} {r} JOIN {SEARCH_KEYS_TABLE} k ON {_key_match(table, r, 'k')}"
+
+
+def search_triggers_ddl(table: str) -> List[str]:
+    """Triggers INSERT / UPDATE / DELETE qui tiennent l'index à jour pour une table source"""
+    spec = SEARCH_SOURCES[table]
+    # Suppression préalable : tolère INSERT OR REPLACE et les index déjà peuplés
+    delete_new = f"DELETE FROM {SEARCH_TABLE} WHERE rowid = {_rowid_lookup(table, 'NEW')}"
+    delete_old = f"DELETE FROM {SEARCH_TABLE} WHERE rowid = {_rowid_lookup(table, 'OLD')}"
+    forget_old = f"DELETE FROM {SEARCH_KEYS_TABLE} WHERE {_key_match(table, 'OLD')}"
+    register_new = f"{_register_keys(table, 'NEW')}"
+    insert_new = f"{_INSERT_COLUMNS} {_index_select(table, 'NEW', _rowid_lookup(table, 'NEW'))}"
+
+    return [
+        f'''CREATE TRIGGER IF NOT EXISTS trigger_search_{table}_insert
+            AFTER INSERT ON {table}
+            FOR EACH ROW
+            BEGIN
+                {delete_new};
+                {register_new};
+                {insert_new};
+            END''',
+        f'''CREATE TRIGGER IF NOT EXISTS trigger_search_{table}_update
+            AFTER UPDATE OF id, {', '.join(spec['colonnes'])} ON {table}
+            FOR EACH ROW
+            BEGIN
+                {delete_old};
+                {forget_old};
+                {delete_new};
+                {register_new};
+                {insert_new};
+            END''',
+        f'''CREATE TRIGGER IF NOT EXISTS trigger_search_{table}_delete
+            AFTER DELETE ON {table}
+            FOR EACH ROW
+            BEGIN
+                {delete_old};
+                {forget_old};
+            END''',
+    ]
+
+
+def search_link_triggers_ddl(table: str) -> List[str]:
+    """
+    Triggers UPDATE sur les tables liées (ex: renommage d'une entreprise) qui réindexent
+    les lignes de la table source dont le contenu recopie les colonnes modifiées
+    """
+    ddl = []
+    for linked, (colonnes, fk) in SEARCH_SOURCES[table].get('liens', {}).items():
+        dependants = f"{_indexed_rows(table, 'r')} WHERE r.{fk} = NEW.id"
+        changed = ' OR '.join(f"OLD.{col} IS NOT NEW.{col}" for col in colonnes)
+        ddl.append(f'''CREATE TRIGGER IF NOT EXISTS trigger_search_{table}_{linked}_update
+            AFTER UPDATE OF {', '.join(colonnes)} ON {linked}
+            FOR EACH ROW WHEN {changed}
+            BEGIN
+                DELETE FROM {SEARCH_TABLE} WHERE rowid IN (SELECT k.rowid {dependants});
+                {_INSERT_COLUMNS} {_index_select(table, 'r', 'k.rowid')} {dependants};
+            END''')
+    return ddl
+
+
+# =========================================================================
+# CRÉATION ET RECONSTRUCTION
+# =========================================================================
+
+def _existing_tables(cursor) -> set:
+    return {row[0] for row in cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+
+
+def create_search_schema(cursor) -> bool:
+    """
+    Crée l'index FTS5 et les triggers des tables sources existantes (idempotent).
+    Les tables créées plus tard (ex: produits) s'ajoutent via create_search_source().
+    Un index créé avant la table des clés (rowid calculé depuis l'id) est reconstruit.
+
+    Returns:
+        False si SQLite n'est pas compilé avec FTS5 (recherche LIKE conservée)
+    """
+    existing = _existing_tables(cursor)
+    legacy = SEARCH_TABLE in existing and SEARCH_KEYS_TABLE not in existing
+    try:
+        cursor.execute(SEARCH_TABLE_DDL)
+    except Exception as e:
+        logger.warning(f"⚠️ FTS5 indisponible, index de recherche désactivé: {e}")
+        return False
+    cursor.execute(SEARCH_KEYS_DDL)
+
+    if legacy:
+        # Anciens triggers (rowid = id * 16 + code) : remplacés par les triggers adressés par clé
+        triggers = [row[0] for row in cursor.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'trigger' AND name LIKE 'trigger_search_%'"
+        ).fetchall()]
+        for name in triggers:
+            cursor.execute(f"DROP TRIGGER IF EXISTS {name}")
+
+    for table in SEARCH_SOURCES:
+        if table in existing:
+            for ddl in search_triggers_ddl(table):
+                cursor.execute(ddl)
+            if all(linked in existing for linked in SEARCH_SOURCES[table].get('liens', {})):
+                for ddl in search_link_triggers_ddl(table):
+                    cursor.execute(ddl)
+
+    if legacy:
+        rebuild_search_index(cursor)
+    return True
+
+
+def index_source(cursor, table: str) -> int:
+    """(Ré)indexe toutes les lignes d'une table source"""
+    cursor.execute(f"DELETE FROM {SEARCH_TABLE} WHERE entite = ?", (table,))
+    cursor.execute(f"DELETE FROM {SEARCH_KEYS_TABLE} WHERE entite = ?", (table,))
+    return _index_all_rows(cursor, table)
+
+
+def _index_all_rows(cursor, table: str) -> int:
+    """Attribue un rowid à chaque ligne d'une table source puis l'indexe"""
+    cursor.execute(f"{_register_keys(table, 'r')} FROM {table} r")
+    cursor.execute(f"{_INSERT_COLUMNS} {_index_select(table, 'r', 'k.rowid')} {_indexed_rows(table, 'r')}")
+    return cursor.rowcount
+
+
+def create_search_source(cursor, table: str) -> int:
+    """Ajoute une table source créée après l'initialisation : triggers + indexation initiale"""
+    for ddl in search_triggers_ddl(table) + search_link_triggers_ddl(table):
+        cursor.execute(ddl)
+    return index_source(cursor, table)
+
+
+def rebuild_search_index(cursor) -> Dict[str, int]:
+    """
+    Reconstruit entièrement l'index depuis les tables sources (réparation, migration).
+    À exécuter dans une transaction.
+
+    Returns:
+        Nombre de lignes indexées par entité
+    """
+    cursor.execute(f"DELETE FROM {SEARCH_TABLE}")
+    cursor.execute(f"DELETE FROM {SEARCH_KEYS_TABLE}")
+    existing = _existing_tables(cursor)
+
+    counts = {}
+    for table in SEARCH_SOURCES:
+        if table in existing:
+            counts[table] = _index_all_rows(cursor, table)
+
+    # Fusion des segments FTS5 après un chargement massif
+    cursor.execute(f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}) VALUES ('optimize')")
+    return counts
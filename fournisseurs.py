@@ -458,42 +458,28 @@ class GestionnaireFournisseurs:
     # MÉTHODES POUR FORMULAIRES DEMANDE DE PRIX ET BON D'ACHAT
     # =========================================================================
     
+    DOCUMENT_PREFIXES = {
+        'DEMANDE_PRIX': 'DP',
+        'BON_ACHAT': 'BA'
+    }
+    
     def generate_document_number(self, type_formulaire: str) -> str:
-        """Génère un numéro de document automatique"""
-        try:
-            prefixes = {
-                'DEMANDE_PRIX': 'DP',
-                'BON_ACHAT': 'BA'
-            }
-            
-            prefix = prefixes.get(type_formulaire, 'DOC')
-            annee = datetime.now().year
-            
-            # Récupérer le dernier numéro pour ce type et cette année
-            query = '''
-                SELECT numero_document FROM formulaires 
-                WHERE type_formulaire = ? AND numero_document LIKE ?
-                ORDER BY id DESC LIMIT 1
-            '''
-            pattern = f"{prefix}-{annee}-%"
-            result = self.db.execute_query(query, (type_formulaire, pattern))
-            
-            if result:
-                last_num = result[0]['numero_document']
-                sequence = int(last_num.split('-')[-1]) + 1
-            else:
-                sequence = 1
-            
-            return f"{prefix}-{annee}-{sequence:03d}"
-            
-        except Exception as e:
-            st.error(f"Erreur génération numéro: {e}")
-            return f"ERR-{datetime.now().strftime('%Y%m%d%H%M%S')}"
+        """Génère un numéro de document automatique (séquence atomique par préfixe et année)"""
+        numero = self.db.prochain_numero_document(self.DOCUMENT_PREFIXES.get(type_formulaire, 'DOC'))
+        if numero:
+            return numero
+        st.error("Erreur génération numéro")
+        return f"ERR-{datetime.now().strftime('%Y%m%d%H%M%S')}"
+    
+    def preview_document_number(self, type_formulaire: str) -> str:
+        """Prochain numéro affiché dans le formulaire (alloué seulement à la création)"""
+        return self.db.apercu_numero_document(self.DOCUMENT_PREFIXES.get(type_formulaire, 'DOC'))
     
     def create_formulaire_with_lines(self, formulaire_data: Dict, lignes_data: List[Dict]) -> int:
         """Crée un formulaire avec ses lignes de détail"""
         try:
-            with self.db.get_connection() as conn:
+            # Transaction écrivain : verrou d'écriture + invalidation du cache après le commit
+            with self.db.write_transaction('formulaires', 'formulaire_lignes', 'formulaire_validations') as conn:
                 cursor = conn.cursor()
                 
                 # Créer le formulaire principal
@@ -544,9 +530,8 @@ class GestionnaireFournisseurs:
                     (formulaire_id, employee_id, type_validation, commentaires)
                     VALUES (?, ?, 'CREATION', ?)
                 ''', (formulaire_id, formulaire_data.get('employee_id'), f"Création {formulaire_data['type_formulaire']}"))
-                
-                conn.commit()
-                return formulaire_id
+            
+            return formulaire_id
                 
         except Exception as e:
             st.error(f"Erreur création formulaire: {e}")
@@ -2200,7 +2185,7 @@ def render_create_demande_prix_form(gestionnaire):
             )
         
         with col2:
-            numero_dp = gestionnaire.generate_document_number('DEMANDE_PRIX')
+            numero_dp = gestionnaire.preview_document_number('DEMANDE_PRIX')
             st.text_input("Numéro DP:", value=numero_dp, disabled=True)
             
             date_echeance = st.date_input(
@@ -2241,6 +2226,7 @@ def render_create_demande_prix_form(gestionnaire):
                 produits_catalog = [l for l in st.session_state.dp_lines if l.get('produit_crm_id')]
                 produits_manuels = [l for l in st.session_state.dp_lines if not l.get('produit_crm_id')]
                 
+                numero_dp = gestionnaire.generate_document_number('DEMANDE_PRIX')
                 formulaire_data = {
                     'type_formulaire': 'DEMANDE_PRIX',
                     'numero_document': numero_dp,
@@ -2546,7 +2532,7 @@ def render_create_bon_achat_form(gestionnaire):
             )
         
         with col2:
-            numero_ba = gestionnaire.generate_document_number('BON_ACHAT')
+            numero_ba = gestionnaire.preview_document_number('BON_ACHAT')
             st.text_input("Numéro BA:", value=numero_ba, disabled=True)
             
             date_echeance = st.date_input(
@@ -2588,6 +2574,7 @@ def render_create_bon_achat_form(gestionnaire):
                 produits_catalog = [l for l in st.session_state.ba_lines if l.get('produit_crm_id')]
                 produits_manuels = [l for l in st.session_state.ba_lines if not l.get('produit_crm_id')]
                 
+                numero_ba = gestionnaire.generate_document_number('BON_ACHAT')
                 formulaire_data = {
                     'type_formulaire': 'BON_ACHAT',
                     'numero_document': numero_ba,
@@ -782,76 +782,8 @@ def display_selected_bt_details(bt_data, erp_db, is_mobile=False):
 def get_bons_travail_with_operations(erp_db):
     """Récupère tous les Bons de Travail avec leurs opérations depuis la base SQLite."""
     try:
-        # Récupérer tous les Bons de Travail avec détails complets
-        bts_query = '''
-            SELECT f.*, 
-                   c.nom as company_nom,
-                   p.nom_projet,
-                   e.prenom || ' ' || e.nom as employee_nom
-            FROM formulaires f
-            LEFT JOIN companies c ON f.company_id = c.id
-            LEFT JOIN projects p ON f.project_id = p.id
-            LEFT JOIN employees e ON f.employee_id = e.id
-            WHERE f.type_formulaire = 'BON_TRAVAIL'
-            ORDER BY f.id DESC
-        '''
-        
-        bts_rows = erp_db.execute_query(bts_query)
-        bts_list = []
-        
-        for bt_row in bts_rows:
-            bt_dict = dict(bt_row)
-            
-            # Récupérer les opérations avec détails des postes de travail
-            operations_query = '''
-                SELECT o.*, 
-                       wc.nom as work_center_name,
-                       wc.departement as work_center_departement,
-                       wc.capacite_theorique as work_center_capacite,
-                       wc.cout_horaire as work_center_cout_horaire
-                FROM operations o
-                LEFT JOIN work_centers wc ON o.work_center_id = wc.id
-                WHERE o.formulaire_bt_id = ?
-                ORDER BY o.sequence_number, o.id
-            '''
-            
-            operations_rows = erp_db.execute_query(operations_query, (bt_dict['id'],))
-            bt_dict['operations'] = [dict(op_row) for op_row in operations_rows]
-            
-            # Récupérer les assignations d'employés
-            assignations_query = '''
-                SELECT bta.*, 
-                       e.prenom || ' ' || e.nom as employe_nom,
-                       e.poste as employe_poste
-                FROM bt_assignations bta
-                LEFT JOIN employees e ON bta.employe_id = e.id
-                WHERE bta.bt_id = ?
-                ORDER BY bta.date_assignation DESC
-            '''
-            
-            assignations_rows = erp_db.execute_query(assignations_query, (bt_dict['id'],))
-            bt_dict['assignations'] = [dict(assign_row) for assign_row in assignations_rows]
-            
-            # Récupérer les réservations de postes
-            reservations_query = '''
-                SELECT btr.*, 
-                       wc.nom as poste_nom,
-                       wc.departement as poste_departement
-                FROM bt_reservations_postes btr
-                LEFT JOIN work_centers wc ON btr.work_center_id = wc.id
-                WHERE btr.bt_id = ?
-                ORDER BY btr.date_reservation DESC
-            '''
-            
-            reservations_rows = erp_db.execute_query(reservations_query, (bt_dict['id'],))
-            bt_dict['reservations_postes'] = [dict(res_row) for res_row in reservations_rows]
-            
-            # Récupérer les statistiques TimeTracker
-            bt_dict['timetracker_stats'] = erp_db.get_statistiques_bt_timetracker(bt_dict['id'])
-            
-            bts_list.append(bt_dict)
-        
-        return bts_list
+        # Chargement groupé : nombre de requêtes constant quel que soit le nombre de BTs
+        return erp_db.get_bons_travail_bulk(order_by='recent')
         
     except Exception as e:
         st.error(f"Erreur lors de la récupération des Bons de Travail: {e}")
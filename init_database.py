@@ -17,10 +17,10 @@ def init_database_connection():
         print(f"[Init DB] Fichier existe: {os.path.exists(DATABASE_PATH)}")
         
         try:
-            from erp_database import ERPDatabase
+            from erp_database import get_shared_database
             
             if os.path.exists(DATABASE_PATH):
-                st.session_state.erp_db = ERPDatabase(DATABASE_PATH)
+                st.session_state.erp_db = get_shared_database(DATABASE_PATH)
                 print(f"[Init DB] ✓ Base de données initialisée dans session_state")
                 
                 # Test de connexion
@@ -6,9 +6,12 @@ from datetime import datetime, timedelta
 import json
 import io
 import csv
+import uuid
 from typing import Dict, List, Optional, Any
 import logging
 
+from erp_search import build_match_query, entity_match_subquery
+
 # Configuration du logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -371,14 +374,22 @@ class GestionnaireInventaire:
     def search_items(self, search_term: str = "", filters: Dict = None) -> List[Dict]:
         """Recherche d'articles avec filtres"""
         try:
-            query = "SELECT * FROM inventory_items WHERE 1=1"
+            query = "SELECT i.* FROM inventory_items i"
             params = []
-            
-            # Recherche textuelle
-            if search_term:
-                query += " AND (nom LIKE ? OR code_interne LIKE ? OR description LIKE ?)"
+            order_by = "nom ASC"
+            
+            # Recherche textuelle : index FTS5 (préfixes, classement BM25) ou LIKE en repli
+            match = build_match_query(search_term) if search_term else ''
+            if match and getattr(self.db, 'search_index_available', False):
+                query += f" JOIN ({entity_match_subquery('inventory_items')}) s ON s.entite_id = i.id WHERE 1=1"
+                params.append(match)
+                order_by = "s.score, nom ASC"
+            elif search_term:
+                query += " WHERE (nom LIKE ? OR code_interne LIKE ? OR description LIKE ?)"
                 pattern = f"%{search_term}%"
                 params.extend([pattern, pattern, pattern])
+            else:
+                query += " WHERE 1=1"
             
             # Filtres
             if filters:
@@ -397,7 +408,7 @@ class GestionnaireInventaire:
                 if filters.get('stock_critique_only'):
                     query += " AND statut IN ('CRITIQUE', 'FAIBLE', 'ÉPUISÉ')"
             
-            query += " ORDER BY nom ASC"
+            query += f" ORDER BY {order_by}"
             
             rows = self.db.execute_query(query, tuple(params) if params else None)
             return [dict(row) for row in rows]
@@ -439,77 +450,191 @@ class GestionnaireInventaire:
             return ""
     
     def import_from_csv(self, csv_content: str) -> Dict[str, int]:
-        """Importe des articles depuis un CSV"""
+        """Importe des articles depuis un CSV (upsert par lots sur code_interne)"""
+        return self.import_from_csv_stream(io.StringIO(csv_content))
+    
+    # Colonnes écrites par l'import ; les autres (impérial, réservé, notes) sont conservées.
+    # idx_inventory_code_interne est partiel : les recherches par code doivent répéter
+    # "code_interne != ''" pour que SQLite l'utilise.
+    IMPORT_UPSERT_SQL = '''
+        INSERT INTO inventory_items
+        (nom, type_produit, code_interne, quantite_metric, limite_minimale_metric,
+         description, fournisseur_principal, statut,
+         quantite_imperial, limite_minimale_imperial, quantite_reservee_imperial,
+         quantite_reservee_metric, notes)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, '', '', '', 0, '')
+        ON CONFLICT(code_interne) WHERE code_interne IS NOT NULL AND code_interne != '' DO UPDATE SET
+            nom = excluded.nom,
+            type_produit = excluded.type_produit,
+            quantite_metric = excluded.quantite_metric,
+            limite_minimale_metric = excluded.limite_minimale_metric,
+            description = excluded.description,
+            fournisseur_principal = excluded.fournisseur_principal,
+            statut = excluded.statut,
+            updated_at = CURRENT_TIMESTAMP
+    '''
+    
+    def import_from_csv_stream(self, csv_file, chunk_size: int = 1000,
+                               progress_callback=None, max_error_details: int = 100) -> Dict[str, Any]:
+        """
+        Importe un CSV en flux : lecture par lots de chunk_size lignes, validation,
+        puis upsert (executemany + ON CONFLICT(code_interne)) dans une transaction par lot.
+        La mémoire utilisée ne dépend que de la taille d'un lot.
+        
+        Args:
+            csv_file: Fichier texte ouvert (ou binaire, ex: fichier téléversé Streamlit)
+            chunk_size: Nombre de lignes par transaction
+            progress_callback: Appelée après chaque lot avec le dictionnaire de résultat courant
+            max_error_details: Nombre maximal de messages d'erreur conservés
+        
+        Returns:
+            success, errors, skipped, lignes_lues, chunks (bilan par lot), error_details
+        """
+        result = {'success': 0, 'errors': 0, 'skipped': 0, 'lignes_lues': 0,
+                  'chunks': [], 'error_details': []}
+        
+        def add_error(message: str):
+            if len(result['error_details']) < max_error_details:
+                result['error_details'].append(message)
+        
         try:
-            result = {'success': 0, 'errors': 0, 'skipped': 0}
-            
-            csv_file = io.StringIO(csv_content)
+            if not isinstance(csv_file, io.TextIOBase):
+                csv_file = io.TextIOWrapper(csv_file, encoding='utf-8-sig', newline='')
             reader = csv.DictReader(csv_file)
             
-            for row in reader:
+            # Identifiant de l'import (horodatage complet + aléa) : les codes générés ne
+            # peuvent pas rejoindre par l'upsert un article existant d'un autre import
+            import_id = f"{datetime.now().strftime('%Y%m%d%H%M%S')}{uuid.uuid4().hex[:6].upper()}"
+            chunk = []
+            for line_number, row in enumerate(reader, start=2):
+                result['lignes_lues'] += 1
                 try:
-                    # Préparer les données
-                    item_data = {
-                        'nom': row.get('nom', '').strip(),
-                        'type_produit': row.get('type_produit', '').strip(),
-                        'code_interne': row.get('code_interne', '').strip(),
-                        'quantite_metric': float(row.get('quantite_metric', 0)),
-                        'limite_minimale_metric': float(row.get('limite_minimale_metric', 0)),
-                        'description': row.get('description', '').strip(),
-                        'fournisseur_principal': row.get('fournisseur_principal', '').strip()
-                    }
-                    
-                    if not item_data['nom']:
-                        result['skipped'] += 1
-                        continue
-                    
-                    # Vérifier si l'article existe déjà (par code ou nom)
-                    existing = None
-                    if item_data['code_interne']:
-                        existing_rows = self.db.execute_query(
-                            "SELECT id FROM inventory_items WHERE code_interne = ?",
-                            (item_data['code_interne'],)
-                        )
-                        if existing_rows:
-                            existing = existing_rows[0]['id']
-                    
-                    if existing:
-                        # Mise à jour
-                        if self.update_item(existing, item_data):
-                            result['success'] += 1
-                        else:
-                            result['errors'] += 1
-                    else:
-                        # Création
-                        if self.add_item(item_data):
-                            result['success'] += 1
-                        else:
-                            result['errors'] += 1
-                
+                    item = self._validate_import_row(row, line_number, import_id)
                 except Exception as e:
-                    logger.error(f"Erreur import ligne: {e}")
                     result['errors'] += 1
-            
+                    add_error(f"Ligne {line_number}: {e}")
+                    continue
+                
+                if item is None:
+                    result['skipped'] += 1
+                    continue
+                
+                chunk.append(item)
+                if len(chunk) >= chunk_size:
+                    self._upsert_import_chunk(chunk, result, add_error)
+                    chunk = []
+                    if progress_callback:
+                        progress_callback(result)
+            
+            if chunk:
+                self._upsert_import_chunk(chunk, result, add_error)
+                if progress_callback:
+                    progress_callback(result)
+            
+            logger.info(f"📥 Import CSV inventaire: {result['success']} succès, {result['errors']} erreurs, "
+                        f"{result['skipped']} ignorés ({len(result['chunks'])} lots)")
             return result
             
         except Exception as e:
             logger.error(f"Erreur import CSV: {e}")
-            return {'success': 0, 'errors': 1, 'skipped': 0}
+            result['errors'] += 1
+            add_error(str(e))
+            return result
+    
+    def _validate_import_row(self, row: Dict, line_number: int, import_id: str) -> Optional[Dict]:
+        """Valide et normalise une ligne d'import (None = ligne ignorée, ValueError = erreur)"""
+        nom = (row.get('nom') or '').strip()
+        if not nom:
+            return None
+        
+        quantite = float(row.get('quantite_metric') or 0)
+        limite = float(row.get('limite_minimale_metric') or 0)
+        code = (row.get('code_interne') or '').strip()
+        if not code:
+            # Code généré unique : identifiant de l'import + numéro de ligne
+            code = f"{self._code_prefix(nom)}-{import_id}-{line_number}"
+        
+        return {
+            'nom': nom,
+            'type_produit': (row.get('type_produit') or '').strip(),
+            'code_interne': code,
+            'quantite_metric': quantite,
+            'limite_minimale_metric': limite,
+            'description': (row.get('description') or '').strip(),
+            'fournisseur_principal': (row.get('fournisseur_principal') or '').strip(),
+            'statut': self._calculate_status(quantite, limite)
+        }
+    
+    def _upsert_import_chunk(self, chunk: List[Dict], result: Dict, add_error):
+        """Upsert d'un lot et historique de création en une seule transaction"""
+        numero = len(result['chunks']) + 1
+        try:
+            # Un code répété dans le lot : la dernière ligne l'emporte (un seul upsert par code,
+            # sinon la MODIFICATION du trigger précéderait la CREATION écrite après l'upsert)
+            items = list({item['code_interne']: item for item in chunk}.values())
+            with self.db.write_transaction('inventory_items', 'inventory_history') as conn:
+                codes = [item['code_interne'] for item in items]
+                existing = set()
+                for i in range(0, len(codes), 500):
+                    part = codes[i:i + 500]
+                    for row in conn.execute(
+                        f"SELECT code_interne FROM inventory_items "
+                        f"WHERE code_interne IN ({','.join('?' for _ in part)}) AND code_interne != ''", part
+                    ):
+                        existing.add(row['code_interne'])
+                
+                conn.executemany(self.IMPORT_UPSERT_SQL, [(
+                    item['nom'], item['type_produit'], item['code_interne'],
+                    item['quantite_metric'], item['limite_minimale_metric'],
+                    item['description'], item['fournisseur_principal'], item['statut']
+                ) for item in items])
+                
+                # Historique de création des nouveaux codes (les changements de
+                # quantité sont journalisés par trigger_inventory_history)
+                history = [(item['code_interne'], 'CREATION', '0', str(item['quantite_metric']),
+                            f"Création article: {item['nom']}")
+                           for item in items if item['code_interne'] not in existing]
+                
+                conn.executemany('''
+                    INSERT INTO inventory_history
+                    (inventory_item_id, action, quantite_avant, quantite_apres, notes)
+                    SELECT id, ?, ?, ?, ? FROM inventory_items WHERE code_interne = ? AND code_interne != ''
+                ''', [(action, avant, apres, notes, code) for code, action, avant, apres, notes in history])
+            
+            result['success'] += len(chunk)
+            result['chunks'].append({'lot': numero, 'lignes': len(chunk), 'success': len(chunk), 'errors': 0})
+        
+        except Exception as e:
+            logger.error(f"Erreur import lot {numero}: {e}")
+            result['errors'] += len(chunk)
+            result['chunks'].append({'lot': numero, 'lignes': len(chunk), 'success': 0, 'errors': len(chunk)})
+            add_error(f"Lot {numero} annulé ({len(chunk)} lignes): {e}")
     
     # =========================================================================
     # MÉTHODES UTILITAIRES PRIVÉES
     # =========================================================================
     
+    @staticmethod
+    def _code_prefix(nom: str) -> str:
+        """3 premières lettres du nom (complétées par des X)"""
+        return ''.join([c.upper() for c in nom if c.isalpha()])[:3].ljust(3, 'X')
+    
     def _generate_internal_code(self, nom: str) -> str:
         """Génère un code interne automatique"""
         try:
             # Prendre les 3 premières lettres + timestamp
-            prefix = ''.join([c.upper() for c in nom if c.isalpha()])[:3]
-            if len(prefix) < 3:
-                prefix = prefix.ljust(3, 'X')
+            prefix = self._code_prefix(nom)
             
             timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-            return f"{prefix}-{timestamp[-6:]}"
+            code = f"{prefix}-{timestamp[-6:]}"
+            
+            # code_interne est unique (upsert d'import) : suffixer en cas de collision
+            candidate, suffix = code, 1
+            while self.db.execute_query("SELECT 1 FROM inventory_items WHERE code_interne = ? AND code_interne != ''",
+                                         (candidate,)):
+                suffix += 1
+                candidate = f"{code}-{suffix}"
+            return candidate
         except:
             return f"ART-{datetime.now().strftime('%Y%m%d%H%M%S')}"
     
@@ -1102,18 +1227,26 @@ def render_import_export_tab(inventory_manager):
     
     if uploaded_file is not None:
         try:
-            # Lire le fichier
-            csv_content = uploaded_file.getvalue().decode('utf-8')
-            
-            # Prévisualisation
+            # Prévisualisation (seules les premières lignes sont lues)
             st.markdown("###### 👀 Prévisualisation (5 premières lignes)")
-            df_preview = pd.read_csv(io.StringIO(csv_content))
-            st.dataframe(df_preview.head(), use_container_width=True)
+            df_preview = pd.read_csv(uploaded_file, nrows=5)
+            st.dataframe(df_preview, use_container_width=True)
             
             # Bouton d'import
             if st.button("📥 Importer les Données", type="primary"):
-                with st.spinner("Import en cours..."):
-                    result = inventory_manager.import_from_csv(csv_content)
+                progress_bar = st.progress(0.0, text="Import en cours...")
+                total_size = max(uploaded_file.size, 1)
+                
+                def update_progress(current):
+                    progress_bar.progress(
+                        min(uploaded_file.tell() / total_size, 1.0),
+                        text=f"Import en cours... {current['lignes_lues']} lignes lues, "
+                             f"{current['success']} importées, {current['errors']} erreurs"
+                    )
+                
+                uploaded_file.seek(0)
+                result = inventory_manager.import_from_csv_stream(uploaded_file, progress_callback=update_progress)
+                progress_bar.progress(1.0, text="Import terminé")
                 
                 # Afficher les résultats
                 col_res1, col_res2, col_res3 = st.columns(3)
@@ -1129,6 +1262,11 @@ def render_import_export_tab(inventory_manager):
                     st.rerun()
                 elif result.get('errors', 0) > 0:
                     st.error(f"❌ Erreurs lors de l'import. {result['errors']} erreur(s) détectée(s).")
+                
+                if result.get('error_details'):
+                    with st.expander(f"Détail des erreurs ({len(result['error_details'])} premières)"):
+                        for message in result['error_details']:
+                            st.write(f"• {message}")
         
         except Exception as e:
             st.error(f"Erreur lors de la lecture du fichier: {e}")
@@ -153,32 +153,14 @@ def afficher_css_kanban_simple():
 def get_bons_travail_for_kanban(erp_db) -> List[Dict]:
     """Récupère tous les Bons de Travail pour le kanban"""
     try:
-        query = '''
-            SELECT f.*, 
-                   p.nom_projet,
-                   c.nom as company_nom,
-                   e.prenom || ' ' || e.nom as employee_nom,
-                   COUNT(DISTINCT bta.employe_id) as nb_employes_assignes
-            FROM formulaires f
-            LEFT JOIN projects p ON f.project_id = p.id
-            LEFT JOIN companies c ON f.company_id = c.id
-            LEFT JOIN employees e ON f.employee_id = e.id
-            LEFT JOIN bt_assignations bta ON f.id = bta.bt_id AND bta.statut = 'ASSIGNÉ'
-            WHERE f.type_formulaire = 'BON_TRAVAIL'
-            GROUP BY f.id
-            ORDER BY 
-                CASE f.priorite 
-                    WHEN 'CRITIQUE' THEN 1
-                    WHEN 'URGENT' THEN 2
-                    WHEN 'NORMAL' THEN 3
-                    ELSE 4
-                END,
-                f.date_echeance ASC NULLS LAST,
-                f.date_creation DESC
-        '''
-        
-        result = erp_db.execute_query(query)
-        return [dict(row) for row in result] if result else []
+        # Les cartes n'affichent que l'en-tête BT et le nombre d'employés assignés
+        return erp_db.get_bons_travail_bulk(
+            include_operations=False,
+            include_assignations=False,
+            include_reservations=False,
+            include_timetracker=False,
+            order_by='priorite'
+        )
         
     except Exception as e:
         logger.error(f"Erreur récupération BTs pour kanban: {e}")
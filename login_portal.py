@@ -320,8 +320,9 @@ def get_system_stats():
     """Récupère quelques statistiques système pour l'affichage"""
     try:
         # Essayer de récupérer des stats de base si possible
-        from erp_database import ERPDatabase
-        db = ERPDatabase("erp_production_dg.db")
+        # Instance partagée du processus (pas de nouvelle initialisation du schéma)
+        from erp_database import get_shared_database
+        db = st.session_state.get('erp_db') or get_shared_database("erp_production_dg.db")
         
         stats = {
             'projets': db.get_table_count('projects'),
@@ -11,6 +11,13 @@ import logging
 # Export HTML disponible par défaut
 HTML_EXPORT_AVAILABLE = True
 
+# Export PDF groupé (ReportLab)
+try:
+    from bt_pdf_export import export_bt_batch_streamlit
+    PDF_EXPORT_AVAILABLE = True
+except ImportError:
+    PDF_EXPORT_AVAILABLE = False
+
 # Configuration logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -774,7 +781,7 @@ class GestionnaireBonsTravail:
         """Retourne un formulaire BT vide - MODIFIÉ pour supporter l'auto-sélection"""
         today = datetime.now().strftime('%Y-%m-%d')
         return {
-            'numero_document': self.generate_bt_number(),
+            'numero_document': self.db.apercu_numero_document('BT'),  # Alloué à la sauvegarde
             'project_id': '',  # AJOUT : ID du projet sélectionné
             'project_name': '',
             'client_name': '',
@@ -851,26 +858,12 @@ class GestionnaireBonsTravail:
             ]
     
     def generate_bt_number(self) -> str:
-        """Génère un numéro de BT automatique"""
-        try:
-            year = datetime.now().year
-            
-            # Compter les BT existants pour cette année
-            count_result = self.db.execute_query(
-                "SELECT COUNT(*) as count FROM formulaires WHERE type_formulaire = 'BON_TRAVAIL' AND numero_document LIKE ?",
-                (f"BT-{year}-%",)
-            )
-            
-            if count_result:
-                count = count_result[0]['count'] + 1
-            else:
-                count = 1
-            
-            return f"BT-{year}-{count:03d}"
-            
-        except Exception as e:
-            logger.error(f"Erreur génération numéro BT: {e}")
-            return f"BT-{datetime.now().strftime('%Y%m%d%H%M%S')}"
+        """Génère un numéro de BT automatique (séquence atomique)"""
+        numero = self.db.prochain_numero_document('BT')
+        if numero:
+            return numero
+        logger.error("Erreur génération numéro BT")
+        return f"BT-{datetime.now().strftime('%Y%m%d%H%M%S')}"
     
     def save_bon_travail(self, form_data: Dict) -> Optional[int]:
         """
@@ -880,6 +873,9 @@ class GestionnaireBonsTravail:
         VERSION KANBAN : Synchronisation automatique avec table operations
         """
         try:
+            # Numéro définitif alloué à la sauvegarde (le formulaire affiche un aperçu)
+            form_data['numero_document'] = self.generate_bt_number()
+            
             # Créer le formulaire principal
             formulaire_data = {
                 'type_formulaire': 'BON_TRAVAIL',
@@ -1267,15 +1263,6 @@ class GestionnaireBonsTravail:
             if not bt_result:
                 return None
             
-            bt_data = dict(bt_result[0])
-            
-            # Parser les métadonnées
-            metadonnees = {}
-            try:
-                metadonnees = json.loads(bt_data.get('metadonnees_json', '{}'))
-            except:
-                pass
-            
             # Récupérer les lignes (tâches et matériaux)
             lignes_result = self.db.execute_query('''
                 SELECT * FROM formulaire_lignes 
@@ -1283,113 +1270,149 @@ class GestionnaireBonsTravail:
                 ORDER BY sequence_ligne
             ''', (bt_id,))
             
-            tasks = []
-            materials = []
+            return self._build_bon_travail_form(dict(bt_result[0]), lignes_result)
             
-            for ligne in lignes_result:
-                ligne_data = dict(ligne)
-                notes_data = {}
+        except Exception as e:
+            logger.error(f"Erreur chargement BT {bt_id}: {e}")
+            return None
+    
+    def load_bons_travail(self, bt_ids: List[int]) -> List[Dict]:
+        """
+        Charge plusieurs bons de travail (export groupé) : BTs et lignes en deux requêtes
+        via get_bons_travail_bulk, même forme que load_bon_travail, ordre de bt_ids conservé
+        """
+        if not bt_ids:
+            return []
+        try:
+            results = self.db.get_bons_travail_bulk(
+                bt_ids=bt_ids,
+                include_operations=False,
+                include_assignations=False,
+                include_reservations=False,
+                include_timetracker=False,
+                include_lignes=True
+            )
+            forms_par_id = {}
+            for row in results:
                 try:
-                    notes_data = json.loads(ligne_data.get('notes_ligne', '{}'))
-                except:
-                    pass
+                    forms_par_id[row['id']] = self._build_bon_travail_form(row, row['lignes'])
+                except Exception as e:
+                    logger.error(f"Erreur chargement BT {row['id']}: {e}")
+            return [forms_par_id[bt_id] for bt_id in bt_ids if bt_id in forms_par_id]
+            
+        except Exception as e:
+            logger.error(f"Erreur chargement groupé des BTs: {e}")
+            return []
+    
+    def _build_bon_travail_form(self, bt_data: Dict, lignes_result: List[Dict]) -> Dict:
+        """Construit le formulaire d'un BT depuis sa ligne formulaires et ses formulaire_lignes"""
+        # Parser les métadonnées
+        metadonnees = {}
+        try:
+            metadonnees = json.loads(bt_data.get('metadonnees_json', '{}'))
+        except:
+            pass
+        
+        tasks = []
+        materials = []
+        
+        for ligne in lignes_result:
+            ligne_data = dict(ligne)
+            notes_data = {}
+            try:
+                notes_data = json.loads(ligne_data.get('notes_ligne', '{}'))
+            except:
+                pass
+            
+            if ligne_data['sequence_ligne'] >= 1000:  # Matériaux
+                # Extraire le nom du matériau de la description
+                desc = ligne_data['description']
+                if desc.startswith('MATERIAU: '):
+                    desc = desc[10:]  # Enlever "MATERIAU: "
+                
+                name_desc = desc.split(' - ', 1)
+                material = {
+                    'name': name_desc[0] if name_desc else desc,
+                    'description': name_desc[1] if len(name_desc) > 1 else '',
+                    'quantity': ligne_data.get('quantite', 1.0),
+                    'unit': ligne_data.get('unite', 'pcs'),
+                    'fournisseur': notes_data.get('fournisseur', '-- Interne --'),  # NOUVEAU
+                    'available': notes_data.get('available', 'yes'),
+                    'notes': notes_data.get('notes', '')
+                }
+                materials.append(material)
                 
-                if ligne_data['sequence_ligne'] >= 1000:  # Matériaux
-                    # Extraire le nom du matériau de la description
+            else:  # Tâches - LOGIQUE CORRIGÉE
+                # CORRECTION: Récupérer depuis notes_data en priorité
+                if 'operation' in notes_data and 'description' in notes_data:
+                    # Nouveau format avec données explicites
+                    operation = notes_data.get('operation', '')
+                    description = notes_data.get('description', '')
+                else:
+                    # Fallback: parser l'ancienne description
                     desc = ligne_data['description']
-                    if desc.startswith('MATERIAU: '):
-                        desc = desc[10:]  # Enlever "MATERIAU: "
-                    
-                    name_desc = desc.split(' - ', 1)
-                    material = {
-                        'name': name_desc[0] if name_desc else desc,
-                        'description': name_desc[1] if len(name_desc) > 1 else '',
-                        'quantity': ligne_data.get('quantite', 1.0),
-                        'unit': ligne_data.get('unite', 'pcs'),
-                        'fournisseur': notes_data.get('fournisseur', '-- Interne --'),  # NOUVEAU
-                        'available': notes_data.get('available', 'yes'),
-                        'notes': notes_data.get('notes', '')
-                    }
-                    materials.append(material)
-                    
-                else:  # Tâches - LOGIQUE CORRIGÉE
-                    # CORRECTION: Récupérer depuis notes_data en priorité
-                    if 'operation' in notes_data and 'description' in notes_data:
-                        # Nouveau format avec données explicites
-                        operation = notes_data.get('operation', '')
-                        description = notes_data.get('description', '')
+                    if ' - ' in desc:
+                        op_desc = desc.split(' - ', 1)
+                        operation = op_desc[0]
+                        description = op_desc[1] if len(op_desc) > 1 else ''
                     else:
-                        # Fallback: parser l'ancienne description
-                        desc = ligne_data['description']
-                        if ' - ' in desc:
-                            op_desc = desc.split(' - ', 1)
-                            operation = op_desc[0]
-                            description = op_desc[1] if len(op_desc) > 1 else ''
+                        # Cas simple
+                        if desc.startswith('TÂCHE - '):
+                            operation = ''
+                            description = desc.replace('TÂCHE - ', '')
                         else:
-                            # Cas simple
-                            if desc.startswith('TÂCHE - '):
-                                operation = ''
-                                description = desc.replace('TÂCHE - ', '')
-                            else:
-                                operation = desc
-                                description = ''
-                    
-                    task = {
-                        'operation': operation,
-                        'description': description,
-                        'quantity': ligne_data.get('quantite', 1),
-                        'planned_hours': ligne_data.get('prix_unitaire', 0.0),
-                        'actual_hours': notes_data.get('actual_hours', 0.0),
-                        'assigned_to': notes_data.get('assigned_to', ''),
-                        'fournisseur': notes_data.get('fournisseur', '-- Interne --'),  # NOUVEAU
-                        'status': notes_data.get('status', 'pending'),
-                        'start_date': notes_data.get('start_date', ''),
-                        'end_date': notes_data.get('end_date', '')
-                    }
-                    tasks.append(task)
-            
-            # Construire le formulaire complet
-            form_data = {
-                'id': bt_data['id'],
-                'numero_document': bt_data['numero_document'],
-                'project_id': metadonnees.get('project_id', ''),  # AJOUT
-                'project_name': metadonnees.get('project_name', ''),
-                'client_name': metadonnees.get('client_name', ''),
-                'client_company_id': metadonnees.get('client_company_id'),  # AJOUT
-                'project_manager': metadonnees.get('project_manager', ''),
-                'priority': bt_data.get('priorite', 'NORMAL'),
-                'start_date': metadonnees.get('start_date', ''),
-                'end_date': bt_data.get('date_echeance', ''),
-                'work_instructions': bt_data.get('notes', ''),
-                'safety_notes': metadonnees.get('safety_notes', ''),
-                'quality_requirements': metadonnees.get('quality_requirements', ''),
-                'tasks': tasks if tasks else [self.get_empty_task()],
-                'materials': materials if materials else [self.get_empty_material()],
-                'created_by': metadonnees.get('created_by', 'Utilisateur'),
-                'statut': bt_data.get('statut', 'BROUILLON'),
-                'date_creation': bt_data.get('created_at', ''),
-                'date_modification': bt_data.get('updated_at', '')
-            }
-            
-            return form_data
-            
-        except Exception as e:
-            logger.error(f"Erreur chargement BT {bt_id}: {e}")
-            return None
+                            operation = desc
+                            description = ''
+                
+                task = {
+                    'operation': operation,
+                    'description': description,
+                    'quantity': ligne_data.get('quantite', 1),
+                    'planned_hours': ligne_data.get('prix_unitaire', 0.0),
+                    'actual_hours': notes_data.get('actual_hours', 0.0),
+                    'assigned_to': notes_data.get('assigned_to', ''),
+                    'fournisseur': notes_data.get('fournisseur', '-- Interne --'),  # NOUVEAU
+                    'status': notes_data.get('status', 'pending'),
+                    'start_date': notes_data.get('start_date', ''),
+                    'end_date': notes_data.get('end_date', '')
+                }
+                tasks.append(task)
+        
+        # Construire le formulaire complet
+        form_data = {
+            'id': bt_data['id'],
+            'numero_document': bt_data['numero_document'],
+            'project_id': metadonnees.get('project_id', ''),  # AJOUT
+            'project_name': metadonnees.get('project_name', ''),
+            'client_name': metadonnees.get('client_name', ''),
+            'client_company_id': metadonnees.get('client_company_id'),  # AJOUT
+            'project_manager': metadonnees.get('project_manager', ''),
+            'priority': bt_data.get('priorite', 'NORMAL'),
+            'start_date': metadonnees.get('start_date', ''),
+            'end_date': bt_data.get('date_echeance', ''),
+            'work_instructions': bt_data.get('notes', ''),
+            'safety_notes': metadonnees.get('safety_notes', ''),
+            'quality_requirements': metadonnees.get('quality_requirements', ''),
+            'tasks': tasks if tasks else [self.get_empty_task()],
+            'materials': materials if materials else [self.get_empty_material()],
+            'created_by': metadonnees.get('created_by', 'Utilisateur'),
+            'statut': bt_data.get('statut', 'BROUILLON'),
+            'date_creation': bt_data.get('created_at', ''),
+            'date_modification': bt_data.get('updated_at', '')
+        }
+        
+        return form_data
     
     def get_all_bons_travail(self) -> List[Dict]:
         """Récupère tous les bons de travail"""
         try:
-            results = self.db.execute_query('''
-                SELECT f.*, 
-                       COUNT(fl.id) as nb_lignes,
-                       COALESCE(SUM(CASE WHEN fl.sequence_ligne < 1000 THEN fl.prix_unitaire ELSE 0 END), 0) as total_heures_prevues
-                FROM formulaires f
-                LEFT JOIN formulaire_lignes fl ON f.id = fl.formulaire_id
-                WHERE f.type_formulaire = 'BON_TRAVAIL'
-                GROUP BY f.id
-                ORDER BY f.created_at DESC
-            ''')
+            results = self.db.get_bons_travail_bulk(
+                include_operations=False,
+                include_assignations=False,
+                include_reservations=False,
+                include_timetracker=False,
+                order_by='creation'
+            )
             
             bons = []
             for row in results:
@@ -2818,7 +2841,25 @@ def show_bt_management():
         ]
     
     st.markdown(f"**{len(filtered_bons)} bon(s) trouvé(s)**")
-    
+
+    # Export PDF groupé des BT filtrés
+    if filtered_bons and PDF_EXPORT_AVAILABLE:
+        with st.expander("📦 Export groupé PDF", expanded=False):
+            export_col1, export_col2 = st.columns(2)
+            with export_col1:
+                exclure_clos = st.checkbox("Exclure les BT terminés et annulés", value=True, key="bt_batch_exclure_clos")
+            with export_col2:
+                format_export = st.radio(
+                    "Format:", ['zip', 'merged'], horizontal=True, key="bt_batch_format",
+                    format_func=lambda f: "Archive ZIP (un PDF par BT)" if f == 'zip' else "PDF unique fusionné"
+                )
+
+            bons_export = [b for b in filtered_bons if not (exclure_clos and b['statut'] in ('TERMINÉ', 'ANNULÉ'))]
+            if st.button(f"📄 Exporter {len(bons_export)} BT", key="bt_batch_export", disabled=not bons_export):
+                with st.spinner("Chargement des bons de travail..."):
+                    forms = gestionnaire.load_bons_travail([b['id'] for b in bons_export])
+                export_bt_batch_streamlit(forms, format_export)
+
     # Affichage en tableau
     if filtered_bons:
         for bon in filtered_bons:
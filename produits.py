@@ -2,8 +2,12 @@ import streamlit as st
 import pandas as pd
 from datetime import datetime
 import json
+import csv
+import io
 from typing import Dict, List, Optional, Any
 
+from erp_search import build_match_query, entity_match_subquery
+
 # Constantes pour les produits métallurgiques (migrées depuis crm.py)
 CATEGORIES_PRODUITS = ["Acier", "Aluminium", "Inox", "Cuivre", "Laiton", "Autres métaux", "Fournitures", "Services"]
 UNITES_VENTE = ["kg", "tonne", "m", "m²", "m³", "pièce", "lot", "heure"]
@@ -15,6 +19,10 @@ NUANCES_MATERIAUX = {
     "Autres": ["Standard", "Spécial", "Sur mesure"]
 }
 
+def get_current_employee_id() -> Optional[int]:
+    """Employé connecté de la session ; None si inconnu (saisie non attribuée)"""
+    return st.session_state.get('current_employee_id')
+
 class GestionnaireProduits:
     """
     Gestionnaire dédié au catalogue de produits, stock, et prix.
@@ -74,6 +82,8 @@ class GestionnaireProduits:
                 )
                 '''
                 self.db.execute_update(create_table_query)
+                # Triggers de l'index de recherche (table créée après init_database)
+                self.db.ensure_search_source('produits')
                 st.success("✅ Table 'produits' créée avec succès")
                 
                 # Ajouter des données de démonstration
@@ -420,6 +430,18 @@ class GestionnaireProduits:
                       terme in p.get('description', '').lower()]
         
         try:
+            # Index FTS5 (préfixes, classement BM25) si disponible
+            match = build_match_query(terme_recherche)
+            if match and getattr(self.db, 'search_index_available', False):
+                query = f'''
+                    SELECT p.* FROM produits p
+                    JOIN ({entity_match_subquery('produits')}) s ON s.entite_id = p.id
+                    WHERE p.actif = 1
+                    ORDER BY s.score, p.nom
+                '''
+                rows = self.db.execute_query(query, (match,))
+                return [dict(row) for row in rows]
+            
             query = '''
                 SELECT * FROM produits 
                 WHERE actif = 1 AND (
@@ -556,7 +578,7 @@ class GestionnaireProduits:
                 'reference_type': 'BON_LIVRAISON',
                 'employee_id': employee_id,
                 'motif': motif or 'Sortie stock'
-            })
+            }, controle_stock=True)
             
             return mouvement_id is not None
             
@@ -596,6 +618,39 @@ class GestionnaireProduits:
             st.error(f"Erreur récupération historique: {e}")
             return []
     
+    def importer_comptages_csv(self, inventaire_id, contenu_csv, employee_id=None):
+        """
+        Importe les comptages d'un scanner (CSV code_produit;quantite ou code_produit,quantite)
+        en un seul lot sur l'inventaire physique.
+        """
+        if not self.use_sqlite:
+            return {'comptees': 0, 'inconnus': []}
+        
+        try:
+            if isinstance(contenu_csv, bytes):
+                contenu_csv = contenu_csv.decode('utf-8-sig')
+            
+            premiere_ligne = contenu_csv.split('\n', 1)[0]
+            delimiteur = ';' if premiere_ligne.count(';') > premiere_ligne.count(',') else ','
+            reader = csv.DictReader(io.StringIO(contenu_csv), delimiter=delimiteur)
+            
+            comptages = []
+            for row in reader:
+                row = {(k or '').strip().lower(): (v or '').strip() for k, v in row.items()}
+                code = row.get('code_produit') or row.get('code')
+                quantite = row.get('quantite') or row.get('quantite_physique')
+                if code and quantite:
+                    comptages.append({
+                        'code_produit': code,
+                        'quantite_physique': float(quantite.replace(',', '.'))
+                    })
+            
+            return self.db.saisir_comptages_inventaire(inventaire_id, comptages, employee_id)
+            
+        except Exception as e:
+            st.error(f"Erreur import comptages: {e}")
+            return {'comptees': 0, 'inconnus': []}
+    
     def get_reservations_actives(self, produit_id=None):
         """Récupère les réservations actives"""
         if not self.use_sqlite:
@@ -1742,7 +1797,7 @@ def render_new_inventaire_form(gestionnaire_produits: GestionnaireProduits):
             
             with col1:
                 if st.form_submit_button("✅ Créer l'inventaire", type="primary", use_container_width=True):
-                    employee_id = 1  # À remplacer par l'employé connecté
+                    employee_id = get_current_employee_id()
                     
                     inventaire_id = gestionnaire_produits.db.creer_inventaire_physique({
                         'type_inventaire': type_inventaire,
@@ -1782,6 +1837,19 @@ def render_saisie_comptage_form(gestionnaire_produits: GestionnaireProduits):
         LIMIT 20
     ''', (inventaire_id,))
     
+    # Import des comptages d'un scanner (toutes les lignes en un lot)
+    fichier_scanner = st.file_uploader(
+        "📥 Importer les comptages du scanner (CSV : code_produit, quantite)",
+        type=['csv'], key=f"comptage_csv_{inventaire_id}"
+    )
+    if fichier_scanner is not None and st.button("Importer les comptages", key="import_comptages_csv"):
+        resultat = gestionnaire_produits.importer_comptages_csv(
+            inventaire_id, fichier_scanner.getvalue(), get_current_employee_id()
+        )
+        st.success(f"✅ {resultat['comptees']} comptages importés")
+        if resultat['inconnus']:
+            st.warning(f"⚠️ Codes absents de l'inventaire : {', '.join(str(c) for c in resultat['inconnus'][:20])}")
+    
     if lignes:
         st.info(f"📋 {len(lignes)} produits à compter (max 20 affichés)")
         
@@ -1820,15 +1888,16 @@ def render_saisie_comptage_form(gestionnaire_produits: GestionnaireProduits):
             
             with col1:
                 if st.form_submit_button("✅ Valider les comptages", type="primary", use_container_width=True):
-                    employee_id = 1  # À remplacer par l'employé connecté
+                    employee_id = get_current_employee_id()
                     
-                    # Enregistrer tous les comptages
-                    success_count = 0
-                    for ligne_id, quantite in comptages.items():
-                        if gestionnaire_produits.db.saisir_comptage_inventaire(ligne_id, quantite, employee_id):
-                            success_count += 1
+                    # Enregistrer tous les comptages en un seul lot
+                    resultat = gestionnaire_produits.db.saisir_comptages_inventaire(
+                        inventaire_id,
+                        [{'ligne_id': ligne_id, 'quantite_physique': quantite} for ligne_id, quantite in comptages.items()],
+                        employee_id
+                    )
                     
-                    st.success(f"✅ {success_count} comptages enregistrés")
+                    st.success(f"✅ {resultat['comptees']} comptages enregistrés")
                     st.session_state.inventory_action = None
                     st.rerun()
             
@@ -1925,7 +1994,7 @@ def render_validation_inventaire(gestionnaire_produits: GestionnaireProduits):
     
     with col1:
         if st.button("✅ Valider et Appliquer les Ajustements", type="primary", use_container_width=True):
-            employee_id = 1  # À remplacer par l'employé connecté
+            employee_id = get_current_employee_id()
             
             if gestionnaire_produits.db.valider_inventaire(inventaire_id, employee_id):
                 st.success("✅ Inventaire validé et ajustements appliqués")
@@ -0,0 +1,267 @@
+# query_cache.py - Cache des résultats de requêtes lourdes pour ERPDatabase
+# ERP Production DG Inc. - Invalidation par version de table (pas de TTL aveugle)
+
+import os
+import re
+import time
+import pickle
+import logging
+import threading
+import functools
+from collections import OrderedDict
+from typing import Dict, Optional, Any, Iterable, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+# Détection de la table écrite par une requête DML
+_WRITE_TARGET_RE = re.compile(
+    r'^\s*(?:INSERT(?:\s+OR\s+\w+)?\s+INTO|REPLACE\s+INTO|UPDATE(?:\s+OR\s+\w+)?|DELETE\s+FROM)\s+'
+    r'(?:["`\[]?\w+["`\]]?\.)?["`\[]?(\w+)["`\]]?',
+    re.IGNORECASE
+)
+# Requêtes qui modifient le schéma → tout le cache de la base devient périmé
+_DDL_RE = re.compile(r'^\s*(?:CREATE|ALTER|DROP|VACUUM|REINDEX)\b', re.IGNORECASE)
+# Commentaires, espaces et parenthèses en tête de requête
+_LEADING_NOISE_RE = re.compile(r'(?:\s+|--[^\n]*(?:\n|$)|/\*.*?\*/|\()*', re.DOTALL)
+# Littéraux, identifiants cités, commentaires, parenthèses et mots : recherche du verbe d'un WITH
+_SQL_TOKEN_RE = re.compile(
+    r"'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"|\[[^\]]*\]|`[^`]*`|--[^\n]*|/\*.*?\*/|[()]|\w+",
+    re.DOTALL
+)
+_DML_VERBS = {'INSERT', 'UPDATE', 'DELETE', 'REPLACE'}
+# Verbes qui ne modifient aucune table (lecture, transaction, réglages)
+_NON_WRITING_VERBS = {'SELECT', 'VALUES', 'EXPLAIN', 'PRAGMA', 'BEGIN', 'COMMIT', 'END',
+                      'ROLLBACK', 'SAVEPOINT', 'RELEASE', 'ANALYZE'}
+# Tables écrites dans le corps d'un trigger
+_TRIGGER_BODY_TARGET_RE = re.compile(
+    r'(?:INSERT(?:\s+OR\s+\w+)?\s+INTO|REPLACE\s+INTO|UPDATE(?:\s+OR\s+\w+)?|DELETE\s+FROM)\s+["`\[]?(\w+)',
+    re.IGNORECASE
+)
+
+
+def extract_written_tables(query: str) -> Optional[Set[str]]:
+    """
+    Retourne les tables modifiées par une requête.
+
+    Les commentaires de tête et les CTE (WITH ... INSERT/UPDATE/DELETE) sont ignorés.
+
+    Returns:
+        Ensemble des tables écrites, ensemble vide pour une lecture,
+        ou None si la requête modifie le schéma ou si sa table cible
+        n'est pas reconnue (invalidation complète).
+    """
+    statement = query[_LEADING_NOISE_RE.match(query).end():]
+    if _DDL_RE.match(statement):
+        return None
+
+    verb_match = re.match(r'\w+', statement)
+    verb = verb_match.group(0).upper() if verb_match else ''
+    if verb == 'WITH':
+        statement = _statement_after_ctes(statement)
+        if statement is None:
+            return set()
+    elif verb in _NON_WRITING_VERBS:
+        return set()
+
+    match = _WRITE_TARGET_RE.match(statement)
+    return {match.group(1).lower()} if match else None
+
+
+def _statement_after_ctes(query: str) -> Optional[str]:
+    """Texte à partir du verbe DML qui suit les CTE d'un WITH (None pour un WITH ... SELECT)"""
+    depth = 0
+    tokens = list(_SQL_TOKEN_RE.finditer(query))
+    for index, token in enumerate(tokens):
+        word = token.group(0).upper()
+        if word == '(':
+            depth += 1
+        elif word == ')':
+            depth -= 1
+        elif depth == 0 and word in _DML_VERBS:
+            # replace(...) est aussi une fonction : seul REPLACE INTO est un verbe
+            if word != 'REPLACE' or (index + 1 < len(tokens) and tokens[index + 1].group(0).upper() == 'INTO'):
+                return query[token.start():]
+    return None
+
+
+def extract_trigger_targets(trigger_sql: str) -> Set[str]:
+    """Tables écrites par le corps d'un trigger (après BEGIN)"""
+    body = trigger_sql.split('BEGIN', 1)[-1] if trigger_sql else ''
+    return {name.lower() for name in _TRIGGER_BODY_TARGET_RE.findall(body)}
+
+
+class VersionedQueryCache:
+    """
+    Cache LRU partagé par tout le processus, borné en nombre d'entrées et en mémoire.
+
+    Chaque table porte un compteur de version (par base de données) incrémenté
+    à chaque écriture. Une entrée mémorise les versions des tables dont elle
+    dépend au moment du calcul : elle devient périmée dès que l'une d'elles change.
+
+    Les valeurs sont stockées sérialisées (pickle) : la taille est connue
+    exactement et chaque lecture retourne une copie indépendante.
+    """
+
+    def __init__(self, max_entries: int = 512, max_bytes: int = 64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+
+        self._lock = threading.RLock()
+        # clé → (versions des dépendances, horodatage, valeur sérialisée)
+        self._entries: "OrderedDict[tuple, Tuple[tuple, float, bytes]]" = OrderedDict()
+        self._versions: Dict[Tuple[str, str], int] = {}
+        self._epochs: Dict[str, int] = {}
+        self._current_bytes = 0
+
+        self.stats = {
+            'hits': 0,
+            'misses': 0,
+            'stale': 0,
+            'evictions': 0,
+            'invalidations': 0,
+        }
+
+    # =========================================================================
+    # VERSIONS DE TABLES
+    # =========================================================================
+
+    def table_versions(self, db_key: str, tables: Iterable[str]) -> tuple:
+        """Instantané des versions (époque de la base + version de chaque table)"""
+        with self._lock:
+            return (self._epochs.get(db_key, 0),) + tuple(
+                self._versions.get((db_key, table), 0) for table in tables
+            )
+
+    def bump(self, db_key: str, tables: Iterable[str]):
+        """Incrémente la version des tables écrites"""
+        with self._lock:
+            for table in tables:
+                key = (db_key, table.lower())
+                self._versions[key] = self._versions.get(key, 0) + 1
+            self.stats['invalidations'] += 1
+
+    def bump_all(self, db_key: str):
+        """Périme toutes les entrées d'une base (changement de schéma, restauration...)"""
+        with self._lock:
+            self._epochs[db_key] = self._epochs.get(db_key, 0) + 1
+            self.stats['invalidations'] += 1
+
+    # =========================================================================
+    # LECTURE / ÉCRITURE
+    # =========================================================================
+
+    def get(self, key: tuple, versions: tuple, max_age: float = None) -> Tuple[bool, Any]:
+        """Retourne (trouvé, valeur) si l'entrée existe et est à jour"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.stats['misses'] += 1
+                return False, None
+
+            entry_versions, created_at, payload = entry
+            expired = max_age is not None and (time.monotonic() - created_at) > max_age
+            if entry_versions != versions or expired:
+                self._drop(key)
+                self.stats['stale'] += 1
+                self.stats['misses'] += 1
+                return False, None
+
+            self._entries.move_to_end(key)
+            self.stats['hits'] += 1
+
+        return True, pickle.loads(payload)
+
+    def put(self, key: tuple, versions: tuple, value: Any):
+        """Mémorise une valeur calculée avec les versions lues AVANT le calcul"""
+        try:
+            payload = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        except Exception as e:
+            logger.debug(f"Valeur non cacheable pour {key[1] if len(key) > 1 else key}: {e}")
+            return
+
+        if len(payload) > self.max_bytes:
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (versions, time.monotonic(), payload)
+            self._current_bytes += len(payload)
+
+            while self._entries and (len(self._entries) > self.max_entries
+                                     or self._current_bytes > self.max_bytes):
+                oldest_key = next(iter(self._entries))
+                self._drop(oldest_key)
+                self.stats['evictions'] += 1
+
+    def _drop(self, key: tuple):
+        _, _, payload = self._entries.pop(key)
+        self._current_bytes -= len(payload)
+
+    def clear(self):
+        """Vide complètement le cache"""
+        with self._lock:
+            self._entries.clear()
+            self._current_bytes = 0
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Compteurs hits/misses et occupation mémoire"""
+        with self._lock:
+            stats = dict(self.stats)
+            lookups = stats['hits'] + stats['misses']
+            stats['hit_rate'] = round(stats['hits'] / lookups, 4) if lookups else 0.0
+            stats['entries'] = len(self._entries)
+            stats['bytes'] = self._current_bytes
+            stats['max_entries'] = self.max_entries
+            stats['max_bytes'] = self.max_bytes
+            return stats
+
+
+# Instance unique partagée par toutes les sessions Streamlit du processus
+QUERY_CACHE = VersionedQueryCache(
+    max_entries=int(os.environ.get('ERP_QUERY_CACHE_MAX_ENTRIES', '512')),
+    max_bytes=int(os.environ.get('ERP_QUERY_CACHE_MAX_MB', '64')) * 1024 * 1024
+)
+
+
+def cached_query(*tables: str, max_age: float = None, cache_empty: bool = False):
+    """
+    Décorateur pour les méthodes de lecture lourdes d'ERPDatabase.
+
+    Args:
+        tables: Tables dont dépend le résultat (vues : lister les tables sous-jacentes)
+        max_age: Durée de vie maximale en secondes, pour les résultats qui
+                 dépendent aussi de l'heure courante (DATE('now'), datetime.now())
+        cache_empty: Mémoriser aussi les résultats vides (par défaut non : les
+                     méthodes retournent {} ou [] en cas d'erreur)
+    """
+    dependencies = tuple(table.lower() for table in tables)
+
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            cache = getattr(self, 'query_cache', None)
+            if cache is None:
+                return method(self, *args, **kwargs)
+
+            key = (self._cache_db_key, method.__name__, args, tuple(sorted(kwargs.items())))
+            try:
+                hash(key)
+            except TypeError:
+                return method(self, *args, **kwargs)
+
+            versions = cache.table_versions(self._cache_db_key, dependencies)
+            found, value = cache.get(key, versions, max_age)
+            if found:
+                return value
+
+            value = method(self, *args, **kwargs)
+            if value or cache_empty:
+                cache.put(key, versions, value)
+            return value
+
+        wrapper.cache_dependencies = dependencies
+        return wrapper
+
+    return decorator
@@ -46,8 +46,8 @@ def init_render_database():
             return None
     else:
         # SQLite local (développement)
-        from erp_database import ERPDatabase
-        return ERPDatabase()
+        from erp_database import get_shared_database
+        return get_shared_database()
 
 def check_database_access():
     """
@@ -0,0 +1,202 @@
+# tests/test_stock_movements.py - Mouvements de stock concurrents (ERPDatabase)
+# ERP Production DG Inc. - Atomicité des lots, continuité du registre, annulation complète
+
+import sys
+import threading
+import multiprocessing
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from erp_database import ERPDatabase
+
+
+STOCK_INITIAL = 1000.0
+NB_PRODUITS = 3
+NB_THREADS = 6
+LOTS_PAR_WORKER = 25
+
+# Table minimale : la table complète est créée par GestionnaireProduits (module Streamlit)
+PRODUITS_DDL = '''
+    CREATE TABLE IF NOT EXISTS produits (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        code_produit TEXT UNIQUE NOT NULL,
+        nom TEXT NOT NULL,
+        stock_disponible REAL DEFAULT 0.0,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+'''
+
+
+def _lot(worker: int, numero: int, produit_ids):
+    """Lot déterministe d'entrées et de sorties sur tous les produits"""
+    mouvements = []
+    for index, produit_id in enumerate(produit_ids):
+        mouvements.append({'produit_id': produit_id, 'type_mouvement': 'ENTREE',
+                           'quantite': float(1 + (worker + numero + index) % 5),
+                           'reference_type': 'AUTRE', 'motif': f"w{worker}-l{numero}"})
+        mouvements.append({'produit_id': produit_id, 'type_mouvement': 'SORTIE',
+                           'quantite': float(1 + (worker * numero + index) % 3),
+                           'reference_type': 'AUTRE', 'motif': f"w{worker}-l{numero}"})
+    return mouvements
+
+
+def _poster_lots(db: ERPDatabase, worker: int, produit_ids, erreurs: list):
+    for numero in range(LOTS_PAR_WORKER):
+        if not db.enregistrer_mouvements_stock(_lot(worker, numero, produit_ids)):
+            erreurs.append((worker, numero))
+
+
+def _processus_lots(db_path: str, worker: int, produit_ids):
+    """Second processus : sa propre instance ERPDatabase sur le même fichier"""
+    db = ERPDatabase(db_path)
+    erreurs = []
+    try:
+        _poster_lots(db, worker, produit_ids, erreurs)
+    finally:
+        db.close()
+    if erreurs:
+        raise RuntimeError(f"Lots refusés: {erreurs}")
+
+
+def _attendu(workers, produit_ids):
+    """Stock final attendu par produit : somme des mouvements de tous les lots"""
+    stocks = {produit_id: STOCK_INITIAL for produit_id in produit_ids}
+    for worker in workers:
+        for numero in range(LOTS_PAR_WORKER):
+            for mouvement in _lot(worker, numero, produit_ids):
+                signe = 1 if mouvement['type_mouvement'] == 'ENTREE' else -1
+                stocks[mouvement['produit_id']] += signe * mouvement['quantite']
+    return stocks
+
+
+@pytest.fixture
+def db(tmp_path):
+    database = ERPDatabase(str(tmp_path / 'stock.db'))
+    database.execute_update(PRODUITS_DDL)
+    for index in range(NB_PRODUITS):
+        database.execute_insert(
+            "INSERT INTO produits (code_produit, nom, stock_disponible) VALUES (?, ?, ?)",
+            (f"P-{index}", f"Produit {index}", STOCK_INITIAL)
+        )
+    yield database
+    database.close()
+
+
+def _produit_ids(db):
+    return [row['id'] for row in db.execute_query("SELECT id FROM produits ORDER BY id")]
+
+
+def _stocks(db):
+    return {row['id']: row['stock_disponible']
+            for row in db.execute_query("SELECT id, stock_disponible FROM produits")}
+
+
+def test_lots_concurrents_threads_et_processus(db):
+    produit_ids = _produit_ids(db)
+    erreurs = []
+
+    context = multiprocessing.get_context('spawn')
+    processus = context.Process(target=_processus_lots, args=(db.db_path, NB_THREADS, produit_ids))
+    processus.start()
+
+    threads = [threading.Thread(target=_poster_lots, args=(db, worker, produit_ids, erreurs))
+               for worker in range(NB_THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    processus.join(timeout=120)
+
+    assert erreurs == []
+    assert processus.exitcode == 0
+
+    # Stock final = stock initial + somme des mouvements
+    attendu = _attendu(range(NB_THREADS + 1), produit_ids)
+    assert _stocks(db) == pytest.approx(attendu)
+
+    # Registre continu : chaque mouvement part du stock laissé par le précédent
+    for produit_id in produit_ids:
+        registre = db.execute_query(
+            "SELECT quantite_avant, quantite_apres FROM mouvements_stock WHERE produit_id = ? ORDER BY id",
+            (produit_id,)
+        )
+        assert len(registre) == 2 * LOTS_PAR_WORKER * (NB_THREADS + 1)
+        assert registre[0]['quantite_avant'] == STOCK_INITIAL
+        for precedent, mouvement in zip(registre, registre[1:]):
+            assert mouvement['quantite_avant'] == pytest.approx(precedent['quantite_apres'])
+        assert registre[-1]['quantite_apres'] == pytest.approx(attendu[produit_id])
+
+
+def test_lot_refuse_par_controle_stock_annule_entierement(db):
+    produit_ids = _produit_ids(db)
+    stocks_avant = _stocks(db)
+
+    # Les premiers mouvements sont valides ; la dernière sortie rend le stock négatif
+    lot = [
+        {'produit_id': produit_ids[0], 'type_mouvement': 'ENTREE', 'quantite': 10.0},
+        {'produit_id': produit_ids[1], 'type_mouvement': 'SORTIE', 'quantite': 5.0},
+        {'produit_id': produit_ids[2], 'type_mouvement': 'SORTIE', 'quantite': STOCK_INITIAL + 1},
+    ]
+    assert db.enregistrer_mouvements_stock(lot, controle_stock=True) == []
+
+    assert _stocks(db) == stocks_avant
+    assert db.execute_query("SELECT COUNT(*) as total FROM mouvements_stock")[0]['total'] == 0
+
+    # Le même lot sans la sortie excédentaire passe
+    assert len(db.enregistrer_mouvements_stock(lot[:2], controle_stock=True)) == 2
+    assert _stocks(db)[produit_ids[0]] == STOCK_INITIAL + 10
+
+
+def _lot_reception_et_nomenclature(produit_ids, nb_receptions: int = 100, nb_sorties: int = 200):
+    """Gros lot : réceptions puis consommations de nomenclature (BOM) d'un BT"""
+    lot = [{'produit_id': produit_ids[i % len(produit_ids)], 'type_mouvement': 'ENTREE',
+            'quantite': float(1 + i % 7), 'reference_type': 'BON_RECEPTION',
+            'reference_document': f"BR-{i // 10}"}
+           for i in range(nb_receptions)]
+    lot += [{'produit_id': produit_ids[i % len(produit_ids)], 'type_mouvement': 'SORTIE',
+             'quantite': float(1 + i % 3), 'reference_type': 'BON_TRAVAIL',
+             'reference_document': 'BT-2026-001', 'motif': 'Consommation nomenclature'}
+            for i in range(nb_sorties)]
+    return lot
+
+
+def test_gros_lot_valide_en_une_seule_transaction(db):
+    # Débit non mesuré (dépend de la machine) : on vérifie qu'un lot de plusieurs centaines
+    # de mouvements coûte une seule transaction, ce qui fixe le nombre de fsync par lot
+    produit_ids = _produit_ids(db)
+    lot = _lot_reception_et_nomenclature(produit_ids)
+
+    instructions = []
+    conn = db.get_connection()
+    conn.set_trace_callback(instructions.append)
+    try:
+        mouvement_ids = db.enregistrer_mouvements_stock(lot, controle_stock=True)
+    finally:
+        conn.set_trace_callback(None)
+
+    assert len(mouvement_ids) == len(lot)
+    assert [sql for sql in instructions if sql.startswith('BEGIN')] == ['BEGIN IMMEDIATE']
+    assert [sql for sql in instructions if sql == 'COMMIT'] == ['COMMIT']
+
+    attendu = {produit_id: STOCK_INITIAL for produit_id in produit_ids}
+    for mouvement in lot:
+        signe = 1 if mouvement['type_mouvement'] == 'ENTREE' else -1
+        attendu[mouvement['produit_id']] += signe * mouvement['quantite']
+    assert _stocks(db) == pytest.approx(attendu)
+    assert db.execute_query("SELECT COUNT(*) as total FROM mouvements_stock")[0]['total'] == len(lot)
+
+
+def test_gros_lot_annule_sur_echec_de_la_derniere_ligne(db):
+    produit_ids = _produit_ids(db)
+    stocks_avant = _stocks(db)
+
+    lot = _lot_reception_et_nomenclature(produit_ids)
+    lot.append({'produit_id': produit_ids[0], 'type_mouvement': 'SORTIE',
+                'quantite': 10 * STOCK_INITIAL, 'reference_type': 'BON_TRAVAIL'})
+    assert db.enregistrer_mouvements_stock(lot, controle_stock=True) == []
+
+    assert _stocks(db) == stocks_avant
+    assert db.execute_query("SELECT COUNT(*) as total FROM mouvements_stock")[0]['total'] == 0
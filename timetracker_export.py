@@ -0,0 +1,186 @@
+# timetracker_export.py - Exports en flux de l'historique des pointages
+# ERP Production DG Inc. - NDJSON / CSV / JSON, compression gzip, lecture par lots (fetchmany)
+
+import os
+import io
+import csv
+import json
+import zlib
+import logging
+import tempfile
+from datetime import datetime
+from typing import Dict, List, Optional, Iterator, Iterable, Tuple, Any
+
+logger = logging.getLogger(__name__)
+
+
+# Format → (extension, type MIME)
+EXPORT_FORMATS = {
+    'ndjson': ('.ndjson', 'application/x-ndjson'),
+    'csv': ('.csv', 'text/csv'),
+    'json': ('.json', 'application/json'),
+}
+
+GZIP_MIME = 'application/gzip'
+
+# Lignes lues par fetchmany : borne la mémoire indépendamment de la taille de l'historique
+DEFAULT_BATCH_SIZE = 1000
+
+EXPORT_BASE_QUERY = '''
+    SELECT te.*,
+           p.nom_projet,
+           e.prenom || ' ' || e.nom as employee_name,
+           o.description as operation_description,
+           f.numero_document as bt_numero
+    FROM time_entries te
+    LEFT JOIN projects p ON te.project_id = p.id
+    LEFT JOIN employees e ON te.employee_id = e.id
+    LEFT JOIN operations o ON te.operation_id = o.id
+    LEFT JOIN formulaires f ON te.formulaire_bt_id = f.id
+'''
+
+
+def build_export_query(date_debut: Optional[str] = None, date_fin: Optional[str] = None,
+                       employee_ids: Optional[Iterable[int]] = None) -> Tuple[str, List[Any]]:
+    """
+    Requête d'export filtrée (dates incluses, format YYYY-MM-DD).
+    Les bornes portent directement sur punch_in (pas de DATE()) pour utiliser l'index.
+    """
+    conditions, params = [], []
+    if date_debut:
+        conditions.append("te.punch_in >= ?")
+        params.append(str(date_debut))
+    if date_fin:
+        conditions.append("te.punch_in < DATE(?, '+1 day')")
+        params.append(str(date_fin))
+    if employee_ids:
+        employee_ids = list(employee_ids)
+        conditions.append(f"te.employee_id IN ({', '.join('?' for _ in employee_ids)})")
+        params.extend(employee_ids)
+
+    query = EXPORT_BASE_QUERY
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    query += " ORDER BY te.punch_in DESC, te.id DESC"
+    return query, params
+
+
+def iter_export_text(conn, format: str = 'ndjson', entete: Optional[Dict] = None,
+                     stats: Optional[Dict] = None, batch_size: int = DEFAULT_BATCH_SIZE,
+                     **filtres) -> Iterator[str]:
+    """
+    Génère l'export par morceaux de texte (un morceau par lot fetchmany).
+
+    Args:
+        conn: Connexion SQLite (idéalement dans un read_snapshot)
+        format: 'ndjson', 'csv' ou 'json' (document {..., time_entries})
+        entete: Clés placées avant time_entries dans le document JSON (ignoré pour NDJSON / CSV)
+        stats: Dictionnaire complété avec le nombre de lignes exportées ('lignes')
+        filtres: date_debut, date_fin, employee_ids
+    """
+    if format not in EXPORT_FORMATS:
+        raise ValueError(f"Format d'export inconnu: {format}")
+
+    query, params = build_export_query(**filtres)
+    cursor = conn.execute(query, params)
+    columns = [description[0] for description in cursor.description]
+    if stats is not None:
+        stats['lignes'] = 0
+
+    csv_buffer = io.StringIO()
+    csv_writer = csv.writer(csv_buffer)
+
+    if format == 'csv':
+        csv_writer.writerow(columns)
+        yield csv_buffer.getvalue()
+    elif format == 'json':
+        champs = [f'{json.dumps(cle)}: {json.dumps(valeur, default=str)}' for cle, valeur in (entete or {}).items()]
+        yield '{' + ''.join(f'{champ}, ' for champ in champs) + '"time_entries": ['
+
+    premier = True
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+
+        if format == 'csv':
+            csv_buffer.seek(0)
+            csv_buffer.truncate()
+            csv_writer.writerows(rows)
+            chunk = csv_buffer.getvalue()
+        else:
+            lignes = [json.dumps(dict(zip(columns, row)), default=str, ensure_ascii=False) for row in rows]
+            if format == 'ndjson':
+                chunk = '\n'.join(lignes) + '\n'
+            else:
+                chunk = ('\n' if premier else ',\n') + ',\n'.join(lignes)
+        premier = False
+
+        if stats is not None:
+            stats['lignes'] += len(rows)
+        yield chunk
+
+    if format == 'json':
+        yield '\n]}\n'
+
+
+def iter_export_bytes(conn, format: str = 'ndjson', compress: bool = False, **kwargs) -> Iterator[bytes]:
+    """Export encodé en UTF-8, compressé au fil de l'eau (gzip) si demandé"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+    for chunk in iter_export_text(conn, format, **kwargs):
+        data = chunk.encode('utf-8')
+        if compressor:
+            data = compressor.compress(data)
+        if data:
+            yield data
+    if compressor:
+        yield compressor.flush()
+
+
+def export_filename(prefix: str, format: str, compress: bool) -> str:
+    """Nom de fichier horodaté avec l'extension du format"""
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    extension = EXPORT_FORMATS[format][0] + ('.gz' if compress else '')
+    return f"{prefix}_{timestamp}{extension}"
+
+
+def export_mime(format: str, compress: bool) -> str:
+    return GZIP_MIME if compress else EXPORT_FORMATS[format][1]
+
+
+def export_to_file(db, fichier, format: str = 'ndjson', compress: bool = False, **kwargs) -> int:
+    """
+    Écrit l'export dans un fichier binaire ouvert, dans un instantané de lecture cohérent.
+
+    Returns:
+        Nombre de pointages exportés
+    """
+    stats = {}
+    with db.read_snapshot() as conn:
+        for data in iter_export_bytes(conn, format, compress, stats=stats, **kwargs):
+            fichier.write(data)
+    return stats.get('lignes', 0)
+
+
+def export_to_tempfile(db, format: str = 'ndjson', compress: bool = False,
+                       prefix: str = 'timetracker_export', **kwargs) -> Tuple[Optional[str], Optional[str], int]:
+    """
+    Écrit l'export dans un fichier temporaire (pour st.download_button ou une archive).
+    L'appelant supprime le fichier après usage.
+
+    Returns:
+        (chemin du fichier temporaire, nom de téléchargement, nombre de pointages)
+    """
+    filename = export_filename(prefix, format, compress)
+    fd, path = tempfile.mkstemp(prefix=f"{prefix}_", suffix=os.path.splitext(filename)[1])
+    try:
+        with os.fdopen(fd, 'wb') as fichier:
+            count = export_to_file(db, fichier, format, compress, **kwargs)
+        logger.info(f"📤 Export TimeTracker {format}{' gzip' if compress else ''}: {count} pointages → {path}")
+        return path, filename, count
+    except Exception as e:
+        logger.error(f"❌ Erreur export TimeTracker: {e}")
+        if os.path.exists(path):
+            os.remove(path)
+        return None, None, 0
+
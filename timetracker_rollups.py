@@ -0,0 +1,352 @@
+# timetracker_rollups.py - Tables de synthèse TimeTracker maintenues par triggers
+# ERP Production DG Inc. - Agrégats par BT, opération, employé-jour et poste-jour
+
+import logging
+from typing import Dict, List
+
+logger = logging.getLogger(__name__)
+
+
+# Un pointage est comptabilisé dès qu'il est fermé et valorisé (même règle
+# que les statistiques historiques : total_cost IS NOT NULL)
+COUNTED = "{r}.total_cost IS NOT NULL"
+
+# Mesures additives communes (incrément +1 / -1 pour chaque pointage)
+BASE_MEASURES = [
+    ('nb_pointages', "1"),
+    ('total_heures', "COALESCE({r}.total_hours, 0)"),
+    ('total_cout', "COALESCE({r}.total_cost, 0)"),
+]
+
+BT_MEASURES = [
+    ('nb_pointages_bt', "CASE WHEN {r}.formulaire_bt_id IS NOT NULL THEN 1 ELSE 0 END"),
+    ('heures_bt', "CASE WHEN {r}.formulaire_bt_id IS NOT NULL THEN COALESCE({r}.total_hours, 0) ELSE 0 END"),
+    ('cout_bt', "CASE WHEN {r}.formulaire_bt_id IS NOT NULL THEN COALESCE({r}.total_cost, 0) ELSE 0 END"),
+]
+
+TAUX_MEASURES = [
+    ('somme_taux', "COALESCE({r}.hourly_rate, 0)"),
+    ('nb_taux', "CASE WHEN {r}.hourly_rate IS NOT NULL THEN 1 ELSE 0 END"),
+]
+
+POSTE_EXPR = "(SELECT work_center_id FROM operations WHERE id = {r}.operation_id)"
+JOUR_EXPR = "DATE({r}.punch_in)"
+
+# Tables de synthèse additives : clés (colonne, expression) + mesures
+ROLLUP_SPECS = [
+    {
+        'table': 'tt_rollup_bt',
+        'keys': [('formulaire_bt_id', "{r}.formulaire_bt_id")],
+        'measures': BASE_MEASURES,
+        'bornes': True,
+    },
+    {
+        'table': 'tt_rollup_operations',
+        'keys': [('operation_id', "{r}.operation_id")],
+        'measures': BASE_MEASURES,
+        'bornes': True,
+    },
+    {
+        'table': 'tt_rollup_employe_jour',
+        'keys': [('employee_id', "{r}.employee_id"), ('jour', JOUR_EXPR)],
+        'measures': BASE_MEASURES + BT_MEASURES,
+        'bornes': False,
+    },
+    {
+        'table': 'tt_rollup_poste_jour',
+        'keys': [('work_center_id', POSTE_EXPR), ('jour', JOUR_EXPR)],
+        'measures': BASE_MEASURES + TAUX_MEASURES,
+        'bornes': False,
+    },
+]
+
+# Comptes distincts (employés d'un BT, BTs d'un employé...) :
+# (portée, expression portée_id, expression jour, type de membre, expression membre_id)
+MEMBER_SPECS = [
+    ('BT', "{r}.formulaire_bt_id", "''", 'EMPLOYE', "{r}.employee_id"),
+    ('BT_GLOBAL', "CASE WHEN {r}.formulaire_bt_id IS NOT NULL THEN 0 END", "''", 'EMPLOYE', "{r}.employee_id"),
+    ('OPERATION', "{r}.operation_id", "''", 'EMPLOYE', "{r}.employee_id"),
+    ('EMPLOYE', "{r}.employee_id", "''", 'BT', "{r}.formulaire_bt_id"),
+    ('EMPLOYE', "{r}.employee_id", "''", 'PROJET', "{r}.project_id"),
+    ('POSTE', POSTE_EXPR, JOUR_EXPR, 'EMPLOYE', "{r}.employee_id"),
+]
+
+ROLLUP_TABLES = [spec['table'] for spec in ROLLUP_SPECS] + ['tt_rollup_membres']
+
+ROLLUP_TABLES_DDL = [
+    '''
+    CREATE TABLE IF NOT EXISTS tt_rollup_bt (
+        formulaire_bt_id INTEGER PRIMARY KEY,
+        nb_pointages INTEGER NOT NULL DEFAULT 0,
+        total_heures REAL NOT NULL DEFAULT 0,
+        total_cout REAL NOT NULL DEFAULT 0,
+        premier_pointage TIMESTAMP,
+        dernier_pointage TIMESTAMP
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS tt_rollup_operations (
+        operation_id INTEGER PRIMARY KEY,
+        nb_pointages INTEGER NOT NULL DEFAULT 0,
+        total_heures REAL NOT NULL DEFAULT 0,
+        total_cout REAL NOT NULL DEFAULT 0,
+        premier_pointage TIMESTAMP,
+        dernier_pointage TIMESTAMP
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS tt_rollup_employe_jour (
+        employee_id INTEGER NOT NULL,
+        jour DATE NOT NULL,
+        nb_pointages INTEGER NOT NULL DEFAULT 0,
+        total_heures REAL NOT NULL DEFAULT 0,
+        total_cout REAL NOT NULL DEFAULT 0,
+        nb_pointages_bt INTEGER NOT NULL DEFAULT 0,
+        heures_bt REAL NOT NULL DEFAULT 0,
+        cout_bt REAL NOT NULL DEFAULT 0,
+        PRIMARY KEY (employee_id, jour)
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS tt_rollup_poste_jour (
+        work_center_id INTEGER NOT NULL,
+        jour DATE NOT NULL,
+        nb_pointages INTEGER NOT NULL DEFAULT 0,
+        total_heures REAL NOT NULL DEFAULT 0,
+        total_cout REAL NOT NULL DEFAULT 0,
+        somme_taux REAL NOT NULL DEFAULT 0,
+        nb_taux INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (work_center_id, jour)
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS tt_rollup_membres (
+        portee TEXT NOT NULL,
+        portee_id INTEGER NOT NULL,
+        jour TEXT NOT NULL DEFAULT '',
+        type_membre TEXT NOT NULL,
+        membre_id INTEGER NOT NULL,
+        nb_pointages INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (portee, portee_id, jour, type_membre, membre_id)
+    ) WITHOUT ROWID
+    ''',
+]
+
+
+# =========================================================================
+# GÉNÉRATION DES INSTRUCTIONS DE TRIGGER
+# =========================================================================
+
+def _add_statements(r: str) -> List[str]:
+    """Instructions qui ajoutent la ligne {r} (NEW) aux synthèses"""
+    statements = []
+    counted = COUNTED.format(r=r)
+
+    for spec in ROLLUP_SPECS:
+        key_cols = [col for col, _ in spec['keys']]
+        key_exprs = [expr.format(r=r) for _, expr in spec['keys']]
+        cols = key_cols + [col for col, _ in spec['measures']]
+        exprs = key_exprs + [expr.format(r=r) for _, expr in spec['measures']]
+        updates = [f"{col} = {col} + excluded.{col}" for col, _ in spec['measures']]
+
+        if spec['bornes']:
+            cols += ['premier_pointage', 'dernier_pointage']
+            exprs += [f"{r}.punch_in", f"{r}.punch_out"]
+            updates += [
+                "premier_pointage = CASE WHEN premier_pointage IS NULL "
+                "OR excluded.premier_pointage < premier_pointage "
+                "THEN excluded.premier_pointage ELSE premier_pointage END",
+                "dernier_pointage = CASE WHEN dernier_pointage IS NULL "
+                "OR excluded.dernier_pointage > dernier_pointage "
+                "THEN excluded.dernier_pointage ELSE dernier_pointage END",
+            ]
+
+        not_null = " AND ".join(f"{expr} IS NOT NULL" for expr in key_exprs)
+        statements.append(
+            f"INSERT INTO {spec['table']} ({', '.join(cols)}) "
+            f"SELECT {', '.join(exprs)} WHERE {counted} AND {not_null} "
+            f"ON CONFLICT({', '.join(key_cols)}) DO UPDATE SET {', '.join(updates)}"
+        )
+
+    for portee, portee_expr, jour_expr, type_membre, membre_expr in MEMBER_SPECS:
+        portee_expr, jour_expr, membre_expr = (e.format(r=r) for e in (portee_expr, jour_expr, membre_expr))
+        statements.append(
+            "INSERT INTO tt_rollup_membres (portee, portee_id, jour, type_membre, membre_id, nb_pointages) "
+            f"SELECT '{portee}', {portee_expr}, {jour_expr}, '{type_membre}', {membre_expr}, 1 "
+            f"WHERE {counted} AND {portee_expr} IS NOT NULL AND {jour_expr} IS NOT NULL "
+            f"AND {membre_expr} IS NOT NULL "
+            "ON CONFLICT(portee, portee_id, jour, type_membre, membre_id) "
+            "DO UPDATE SET nb_pointages = nb_pointages + 1"
+        )
+
+    return statements
+
+
+def _remove_statements(r: str) -> List[str]:
+    """Instructions qui retirent la ligne {r} (OLD) des synthèses"""
+    statements = []
+    counted = COUNTED.format(r=r)
+
+    for spec in ROLLUP_SPECS:
+        key_match = " AND ".join(f"{col} = {expr.format(r=r)}" for col, expr in spec['keys'])
+        updates = [f"{col} = {col} - ({expr.format(r=r)})" for col, expr in spec['measures']]
+        statements.append(
+            f"UPDATE {spec['table']} SET {', '.join(updates)} WHERE {key_match} AND {counted}"
+        )
+
+        if spec['bornes']:
+            # MIN/MAX ne se décrémentent pas : relecture indexée limitée à cette clé
+            key_col, key_expr = spec['keys'][0]
+            key_expr = key_expr.format(r=r)
+            statements.append(
+                f"UPDATE {spec['table']} SET "
+                f"premier_pointage = (SELECT MIN(punch_in) FROM time_entries "
+                f"WHERE {key_col} = {key_expr} AND total_cost IS NOT NULL), "
+                f"dernier_pointage = (SELECT MAX(punch_out) FROM time_entries "
+                f"WHERE {key_col} = {key_expr} AND total_cost IS NOT NULL) "
+                f"WHERE {key_col} = {key_expr} AND {counted}"
+            )
+
+    for portee, portee_expr, jour_expr, type_membre, membre_expr in MEMBER_SPECS:
+        portee_expr, jour_expr, membre_expr = (e.format(r=r) for e in (portee_expr, jour_expr, membre_expr))
+        key_match = (
+            f"portee = '{portee}' AND portee_id = {portee_expr} AND jour = {jour_expr} "
+            f"AND type_membre = '{type_membre}' AND membre_id = {membre_expr}"
+        )
+        statements.append(
+            f"UPDATE tt_rollup_membres SET nb_pointages = nb_pointages - 1 WHERE {key_match} AND {counted}"
+        )
+        statements.append(
+            f"DELETE FROM tt_rollup_membres WHERE {key_match} AND nb_pointages <= 0"
+        )
+
+    return statements
+
+
+def _move_operation_statements() -> List[str]:
+    """Réaffecte les synthèses poste-jour quand une opération change de poste"""
+    statements = []
+    poste_spec = next(spec for spec in ROLLUP_SPECS if spec['table'] == 'tt_rollup_poste_jour')
+    measures = poste_spec['measures']
+
+    for sign, wc in (('-', 'OLD.work_center_id'), ('', 'NEW.work_center_id')):
+        sums = [f"{sign}COALESCE(SUM({expr.format(r='te')}), 0)" for _, expr in measures]
+        cols = [col for col, _ in measures]
+        statements.append(
+            f"INSERT INTO tt_rollup_poste_jour (work_center_id, jour, {', '.join(cols)}) "
+            f"SELECT {wc}, DATE(te.punch_in), {', '.join(sums)} FROM time_entries te "
+            f"WHERE te.operation_id = NEW.id AND te.total_cost IS NOT NULL "
+            f"AND te.punch_in IS NOT NULL AND {wc} IS NOT NULL "
+            f"GROUP BY DATE(te.punch_in) "
+            f"ON CONFLICT(work_center_id, jour) DO UPDATE SET "
+            + ", ".join(f"{col} = {col} + excluded.{col}" for col in cols)
+        )
+        statements.append(
+            "INSERT INTO tt_rollup_membres (portee, portee_id, jour, type_membre, membre_id, nb_pointages) "
+            f"SELECT 'POSTE', {wc}, DATE(te.punch_in), 'EMPLOYE', te.employee_id, {sign}COUNT(*) "
+            f"FROM time_entries te WHERE te.operation_id = NEW.id AND te.total_cost IS NOT NULL "
+            f"AND te.punch_in IS NOT NULL AND te.employee_id IS NOT NULL AND {wc} IS NOT NULL "
+            f"GROUP BY DATE(te.punch_in), te.employee_id "
+            "ON CONFLICT(portee, portee_id, jour, type_membre, membre_id) "
+            "DO UPDATE SET nb_pointages = nb_pointages + excluded.nb_pointages"
+        )
+
+    statements.append(
+        "DELETE FROM tt_rollup_membres WHERE portee = 'POSTE' "
+        "AND portee_id = OLD.work_center_id AND nb_pointages <= 0"
+    )
+    return statements
+
+
+def _trigger(name: str, event: str, when: str, statements: List[str]) -> str:
+    body = ";\n    ".join(statements)
+    return f"CREATE TRIGGER IF NOT EXISTS {name}\n{event}\nFOR EACH ROW\nWHEN {when}\nBEGIN\n    {body};\nEND"
+
+
+ROLLUP_TRIGGERS_DDL = [
+    _trigger(
+        'trigger_tt_rollup_insert',
+        'AFTER INSERT ON time_entries',
+        'NEW.total_cost IS NOT NULL',
+        _add_statements('NEW')
+    ),
+    _trigger(
+        'trigger_tt_rollup_delete',
+        'AFTER DELETE ON time_entries',
+        'OLD.total_cost IS NOT NULL',
+        _remove_statements('OLD')
+    ),
+    _trigger(
+        'trigger_tt_rollup_update',
+        'AFTER UPDATE OF employee_id, project_id, operation_id, formulaire_bt_id, '
+        'punch_in, punch_out, total_hours, hourly_rate, total_cost ON time_entries',
+        'OLD.total_cost IS NOT NULL OR NEW.total_cost IS NOT NULL',
+        _remove_statements('OLD') + _add_statements('NEW')
+    ),
+    _trigger(
+        'trigger_tt_rollup_operation_poste',
+        'AFTER UPDATE OF work_center_id ON operations',
+        'OLD.work_center_id IS NOT NEW.work_center_id',
+        _move_operation_statements()
+    ),
+]
+
+
+# =========================================================================
+# CRÉATION ET RECONSTRUCTION
+# =========================================================================
+
+def create_rollup_schema(cursor):
+    """Crée les tables de synthèse et leurs triggers (idempotent)"""
+    for ddl in ROLLUP_TABLES_DDL:
+        cursor.execute(ddl)
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_tt_rollup_poste_jour_jour ON tt_rollup_poste_jour(jour)"
+    )
+    # Relectures MIN/MAX par opération lors des suppressions / corrections
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_time_entries_operation ON time_entries(operation_id)")
+    for ddl in ROLLUP_TRIGGERS_DDL:
+        cursor.execute(ddl)
+
+
+def rebuild_rollups(cursor) -> Dict[str, int]:
+    """
+    Reconstruit entièrement les synthèses depuis time_entries (réparation).
+    À exécuter dans une transaction : les lecteurs ne voient jamais de synthèse vide.
+
+    Returns:
+        Nombre de lignes par table de synthèse
+    """
+    for table in ROLLUP_TABLES:
+        cursor.execute(f"DELETE FROM {table}")
+
+    counted = COUNTED.format(r='te')
+    for spec in ROLLUP_SPECS:
+        key_cols = [col for col, _ in spec['keys']]
+        key_exprs = [expr.format(r='te') for _, expr in spec['keys']]
+        cols = key_cols + [col for col, _ in spec['measures']]
+        exprs = key_exprs + [f"SUM({expr.format(r='te')})" for _, expr in spec['measures']]
+        if spec['bornes']:
+            cols += ['premier_pointage', 'dernier_pointage']
+            exprs += ["MIN(te.punch_in)", "MAX(te.punch_out)"]
+        not_null = " AND ".join(f"{expr} IS NOT NULL" for expr in key_exprs)
+        cursor.execute(
+            f"INSERT INTO {spec['table']} ({', '.join(cols)}) "
+            f"SELECT {', '.join(exprs)} FROM time_entries te "
+            f"WHERE {counted} AND {not_null} GROUP BY {', '.join(key_exprs)}"
+        )
+
+    for portee, portee_expr, jour_expr, type_membre, membre_expr in MEMBER_SPECS:
+        portee_expr, jour_expr, membre_expr = (e.format(r='te') for e in (portee_expr, jour_expr, membre_expr))
+        cursor.execute(
+            "INSERT INTO tt_rollup_membres (portee, portee_id, jour, type_membre, membre_id, nb_pointages) "
+            f"SELECT '{portee}', {portee_expr}, {jour_expr}, '{type_membre}', {membre_expr}, COUNT(*) "
+            f"FROM time_entries te WHERE {counted} AND {portee_expr} IS NOT NULL "
+            f"AND {jour_expr} IS NOT NULL AND {membre_expr} IS NOT NULL "
+            f"GROUP BY {portee_expr}, {jour_expr}, {membre_expr}"
+        )
+
+    counts = {}
+    for table in ROLLUP_TABLES:
+        counts[table] = cursor.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+    return counts
@@ -7,6 +7,11 @@ from typing import Dict, List, Optional, Tuple
 import logging
 import json
 import io
+import os
+
+from timetracker_export import (
+    EXPORT_FORMATS, export_to_tempfile, export_mime, iter_export_text
+)
 
 logger = logging.getLogger(__name__)
 
@@ -448,16 +453,18 @@ class TimeTrackerUnified:
                 # Tâche BT
                 real_operation_id = None
                 formulaire_bt_id = operation_info.get('formulaire_bt_id') or operation_info.get('formulaire_id')
+                formulaire_ligne_id = operation_id - 100000
             else:
                 # Vraie opération
                 real_operation_id = operation_id
                 formulaire_bt_id = operation_info.get('formulaire_bt_id')
+                formulaire_ligne_id = None
             
             # Créer l'entrée de pointage avec opération
             query = '''
                 INSERT INTO time_entries 
-                (employee_id, project_id, operation_id, formulaire_bt_id, punch_in, notes)
-                VALUES (?, ?, ?, ?, ?, ?)
+                (employee_id, project_id, operation_id, formulaire_bt_id, formulaire_ligne_id, punch_in, notes)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
             '''
             
             entry_id = self.db.execute_insert(query, (
@@ -465,6 +472,7 @@ class TimeTrackerUnified:
                 operation_info['project_id'],
                 real_operation_id,  # NULL pour les tâches BT
                 formulaire_bt_id,
+                formulaire_ligne_id,  # Tâche BT pointée (NULL pour les opérations)
                 datetime.now().isoformat(),
                 notes
             ))
@@ -592,37 +600,40 @@ class TimeTrackerUnified:
                 temps_estime = ligne_info[0]['prix_unitaire'] or 0.0
                 operation_description = ligne_info[0]['description']
                 
-                # Statistiques sur ce BT
+                # Statistiques sur ce BT (synthèse tt_rollup_bt, sans parcours de time_entries)
                 query = '''
                     SELECT 
-                        COUNT(*) as total_sessions,
-                        COUNT(DISTINCT employee_id) as unique_employees,
-                        COALESCE(SUM(total_hours), 0) as total_hours_real,
-                        COALESCE(SUM(total_cost), 0) as total_cost,
-                        MIN(te.punch_in) as first_punch,
-                        MAX(te.punch_out) as last_punch
-                    FROM time_entries te
-                    WHERE te.formulaire_bt_id = ? AND te.punch_out IS NOT NULL
+                        COALESCE(MAX(r.nb_pointages), 0) as total_sessions,
+                        (SELECT COUNT(*) FROM tt_rollup_membres m
+                         WHERE m.portee = 'BT' AND m.portee_id = ?
+                         AND m.jour = '' AND m.type_membre = 'EMPLOYE') as unique_employees,
+                        COALESCE(MAX(r.total_heures), 0) as total_hours_real,
+                        COALESCE(MAX(r.total_cout), 0) as total_cost,
+                        MAX(r.premier_pointage) as first_punch,
+                        MAX(r.dernier_pointage) as last_punch
+                    FROM tt_rollup_bt r
+                    WHERE r.formulaire_bt_id = ?
                 '''
                 
-                result = self.db.execute_query(query, (formulaire_bt_id,))
+                result = self.db.execute_query(query, (formulaire_bt_id, formulaire_bt_id))
                 
             else:
                 # Vraie opération
                 query = '''
                     SELECT 
-                        COUNT(*) as total_sessions,
-                        COUNT(DISTINCT employee_id) as unique_employees,
-                        COALESCE(SUM(total_hours), 0) as total_hours_real,
-                        COALESCE(SUM(total_cost), 0) as total_cost,
+                        r.nb_pointages as total_sessions,
+                        (SELECT COUNT(*) FROM tt_rollup_membres m
+                         WHERE m.portee = 'OPERATION' AND m.portee_id = r.operation_id
+                         AND m.jour = '' AND m.type_membre = 'EMPLOYE') as unique_employees,
+                        r.total_heures as total_hours_real,
+                        r.total_cout as total_cost,
                         o.temps_estime,
                         o.description as operation_description,
-                        MIN(te.punch_in) as first_punch,
-                        MAX(te.punch_out) as last_punch
-                    FROM time_entries te
-                    LEFT JOIN operations o ON te.operation_id = o.id
-                    WHERE te.operation_id = ? AND te.punch_out IS NOT NULL
-                    GROUP BY o.id, o.temps_estime, o.description
+                        r.premier_pointage as first_punch,
+                        r.dernier_pointage as last_punch
+                    FROM tt_rollup_operations r
+                    LEFT JOIN operations o ON r.operation_id = o.id
+                    WHERE r.operation_id = ? AND r.nb_pointages > 0
                 '''
                 
                 result = self.db.execute_query(query, (operation_id,))
@@ -659,7 +670,7 @@ class TimeTrackerUnified:
         try:
             # Récupérer le temps total pointé sur cette opération
             total_result = self.db.execute_query(
-                "SELECT COALESCE(SUM(total_hours), 0) as total_hours FROM time_entries WHERE operation_id = ? AND total_cost IS NOT NULL",
+                "SELECT COALESCE(MAX(total_heures), 0) as total_hours FROM tt_rollup_operations WHERE operation_id = ?",
                 (operation_id,)
             )
             
@@ -701,101 +712,137 @@ class TimeTrackerUnified:
     # MÉTHODES DE CONSULTATION
     # =========================================================================
     
-    def get_punch_history(self, employee_id: int = None, days: int = 7) -> List[Dict]:
+    # Historique : une ligne par pointage. La tâche BT est celle enregistrée au pointage
+    # (formulaire_ligne_id) ; les anciens pointages sans tâche restent génériques.
+    PUNCH_HISTORY_QUERY = '''
+        SELECT te.*, 
+               p.nom_projet, 
+               e.prenom || ' ' || e.nom as employee_name,
+               e.poste as employee_poste,
+               DATE(te.punch_in) as date_travail,
+               
+               -- Opérations classiques ou tâche BT pointée
+               COALESCE(o.description, NULLIF(NULLIF(fl.description, ''), 'None')) as operation_description,
+               COALESCE(o.sequence_number, fl.sequence_ligne) as sequence_number,
+               COALESCE(
+                   wc.nom,
+                   CASE WHEN json_valid(fl.notes_ligne) THEN json_extract(fl.notes_ligne, '$.operation') END
+               ) as work_center_name,
+               
+               -- Informations BT
+               f.numero_document as bt_numero,
+               f.statut as bt_statut,
+               
+               -- Déterminer le type de pointage
+               CASE 
+                   WHEN te.operation_id IS NOT NULL THEN 'OPERATION'
+                   WHEN te.formulaire_bt_id IS NOT NULL THEN 'BT_TASK'
+                   ELSE 'GENERAL'
+               END as pointage_type
+               
+        FROM time_entries te
+        LEFT JOIN projects p ON te.project_id = p.id
+        LEFT JOIN employees e ON te.employee_id = e.id
+        LEFT JOIN operations o ON te.operation_id = o.id
+        LEFT JOIN work_centers wc ON o.work_center_id = wc.id
+        LEFT JOIN formulaires f ON te.formulaire_bt_id = f.id AND f.type_formulaire = 'BON_TRAVAIL'
+        LEFT JOIN formulaire_lignes fl ON te.operation_id IS NULL AND fl.id = te.formulaire_ligne_id
+    '''
+    
+    def _punch_history_where(self, employee_ids: List[int] = None, date_debut: str = None,
+                             date_fin: str = None, operations_seulement: bool = False) -> Tuple[str, List]:
+        """Filtres de l'historique sur punch_in brut (utilisables par les index)"""
+        conditions, params = [], []
+        if employee_ids:
+            conditions.append(f"te.employee_id IN ({', '.join('?' for _ in employee_ids)})")
+            params.extend(employee_ids)
+        if date_debut:
+            conditions.append("te.punch_in >= ?")
+            params.append(date_debut)
+        if date_fin:
+            conditions.append("te.punch_in < DATE(?, '+1 day')")
+            params.append(date_fin)
+        if operations_seulement:
+            conditions.append(
+                "((te.operation_id IS NULL AND te.formulaire_bt_id IS NOT NULL) "
+                "OR (te.operation_id IS NOT NULL AND EXISTS "
+                "(SELECT 1 FROM operations WHERE id = te.operation_id AND description != '')))"
+            )
+        return (" WHERE " + " AND ".join(conditions)) if conditions else "", params
+    
+    def _unifier_pointage(self, row) -> Dict:
+        """Complète l'affichage d'un pointage sur tâche BT"""
+        punch_data = dict(row)
+        if punch_data['pointage_type'] == 'BT_TASK':
+            punch_data['operation_description'] = punch_data['operation_description'] or 'Tâche BT'
+            punch_data['work_center_name'] = punch_data['work_center_name'] or 'Poste Manuel'
+        return punch_data
+    
+    def get_punch_history_page(self, employee_ids: List[int] = None, date_debut: str = None,
+                               date_fin: str = None, curseur: Tuple[str, int] = None,
+                               limite: int = 100, operations_seulement: bool = False) -> Dict:
         """
-        Récupère l'historique des pointages avec support opérations ET tâches BT
+        Page d'historique des pointages, du plus récent au plus ancien (pagination par clé).
+        
+        Args:
+            employee_ids: Employés à inclure (tous si vide)
+            date_debut / date_fin: Bornes incluses (YYYY-MM-DD)
+            curseur: (punch_in, id) du dernier pointage de la page précédente
+            limite: Nombre de pointages par page
+        
+        Returns:
+            {'pointages': [...], 'curseur_suivant': (punch_in, id) ou None en fin d'historique}
         """
         try:
-            start_date = (datetime.now() - timedelta(days=days)).strftime('%Y-%m-%d')
+            where, params = self._punch_history_where(employee_ids, date_debut, date_fin, operations_seulement)
+            if curseur:
+                where += (" AND " if where else " WHERE ") + "(te.punch_in, te.id) < (?, ?)"
+                params.extend(curseur)
             
-            query = '''
-                SELECT te.*, 
-                       p.nom_projet, 
-                       e.prenom || ' ' || e.nom as employee_name,
-                       e.poste as employee_poste,
-                       DATE(te.punch_in) as date_travail,
-                       
-                       -- Opérations classiques
-                       o.description as operation_description,
-                       o.sequence_number,
-                       wc.nom as work_center_name,
-                       
-                       -- Informations BT
-                       f.numero_document as bt_numero,
-                       f.statut as bt_statut,
-                       
-                       -- Tâches BT depuis formulaire_lignes
-                       fl.description as bt_task_description,
-                       fl.sequence_ligne as bt_task_sequence,
-                       
-                       -- Déterminer le type de pointage
-                       CASE 
-                           WHEN te.operation_id IS NOT NULL THEN 'OPERATION'
-                           WHEN te.formulaire_bt_id IS NOT NULL THEN 'BT_TASK'
-                           ELSE 'GENERAL'
-                       END as pointage_type
-                       
-                FROM time_entries te
-                LEFT JOIN projects p ON te.project_id = p.id
-                LEFT JOIN employees e ON te.employee_id = e.id
-                
-                -- Jointures pour vraies opérations
-                LEFT JOIN operations o ON te.operation_id = o.id
-                LEFT JOIN work_centers wc ON o.work_center_id = wc.id
-                
-                -- Jointures pour BT et ses tâches
-                LEFT JOIN formulaires f ON te.formulaire_bt_id = f.id AND f.type_formulaire = 'BON_TRAVAIL'
-                LEFT JOIN formulaire_lignes fl ON f.id = fl.formulaire_id 
-                    AND fl.sequence_ligne < 1000 
-                    AND fl.description IS NOT NULL
-                    AND fl.description != ''
-                    AND fl.description != 'None'
-                
-                WHERE DATE(te.punch_in) >= ?
-            '''
-            params = [start_date]
+            query = self.PUNCH_HISTORY_QUERY + where + " ORDER BY te.punch_in DESC, te.id DESC LIMIT ?"
+            rows = self.db.execute_query(query, tuple(params) + (limite + 1,))
             
-            if employee_id:
-                query += " AND te.employee_id = ?"
-                params.append(employee_id)
+            pointages = [self._unifier_pointage(row) for row in rows[:limite]]
+            curseur_suivant = None
+            if len(rows) > limite:
+                curseur_suivant = (pointages[-1]['punch_in'], pointages[-1]['id'])
             
-            query += " ORDER BY te.punch_in DESC"
+            return {'pointages': pointages, 'curseur_suivant': curseur_suivant}
             
-            rows = self.db.execute_query(query, tuple(params))
+        except Exception as e:
+            logger.error(f"Erreur page historique punch: {e}")
+            return {'pointages': [], 'curseur_suivant': None}
+    
+    def get_punch_history_summary(self, employee_ids: List[int] = None, date_debut: str = None,
+                                  date_fin: str = None, operations_seulement: bool = False) -> Dict:
+        """Totaux de l'historique filtré (indépendants de la page affichée)"""
+        try:
+            where, params = self._punch_history_where(employee_ids, date_debut, date_fin, operations_seulement)
+            result = self.db.execute_query(f'''
+                SELECT COUNT(*) as total_sessions,
+                       COUNT(te.punch_out) as completed_sessions,
+                       COALESCE(SUM(te.total_hours), 0) as total_hours,
+                       COALESCE(SUM(te.total_cost), 0) as total_revenue
+                FROM time_entries te{where}
+            ''', tuple(params))
+            return dict(result[0]) if result else {}
             
-            # Post-traitement pour unifier les descriptions
-            history = []
-            for row in rows:
-                punch_data = dict(row)
-                
-                # Unifier la description selon le type
-                if punch_data['pointage_type'] == 'BT_TASK' and punch_data['bt_task_description']:
-                    # C'est une tâche BT - utiliser les infos de formulaire_lignes
-                    punch_data['operation_description'] = punch_data['bt_task_description']
-                    punch_data['sequence_number'] = punch_data['bt_task_sequence']
-                    
-                    # Essayer d'extraire le poste de travail depuis les notes de la tâche
-                    if not punch_data['work_center_name']:
-                        try:
-                            # Récupérer les notes de la ligne pour le poste
-                            ligne_result = self.db.execute_query(
-                                "SELECT notes_ligne FROM formulaire_lignes WHERE formulaire_id = ? AND sequence_ligne = ? LIMIT 1",
-                                (punch_data['formulaire_bt_id'], punch_data['bt_task_sequence'])
-                            )
-                            if ligne_result and ligne_result[0]['notes_ligne']:
-                                notes_data = json.loads(ligne_result[0]['notes_ligne'])
-                                punch_data['work_center_name'] = notes_data.get('operation', 'Poste Manuel')
-                        except:
-                            punch_data['work_center_name'] = 'Poste Manuel'
-                
-                elif punch_data['pointage_type'] == 'BT_TASK' and not punch_data['operation_description']:
-                    # Tâche BT mais description vide - mettre une valeur par défaut
-                    punch_data['operation_description'] = 'Tâche BT'
-                    punch_data['work_center_name'] = punch_data['work_center_name'] or 'Poste Manuel'
-                
-                history.append(punch_data)
+        except Exception as e:
+            logger.error(f"Erreur résumé historique punch: {e}")
+            return {}
+    
+    def get_punch_history(self, employee_id: int = None, days: int = 7) -> List[Dict]:
+        """
+        Récupère l'historique des pointages avec support opérations ET tâches BT
+        """
+        try:
+            start_date = (datetime.now() - timedelta(days=days)).strftime('%Y-%m-%d')
+            where, params = self._punch_history_where([employee_id] if employee_id else None, start_date)
             
-            return history
+            rows = self.db.execute_query(
+                self.PUNCH_HISTORY_QUERY + where + " ORDER BY te.punch_in DESC, te.id DESC", tuple(params)
+            )
+            return [self._unifier_pointage(row) for row in rows]
             
         except Exception as e:
             logger.error(f"Erreur historique punch: {e}")
@@ -958,40 +1005,24 @@ class TimeTrackerUnified:
     # MÉTHODES ADMINISTRATIVES - GESTION HISTORIQUE
     # =========================================================================
     
-    def create_history_backup(self) -> str:
-        """Crée une sauvegarde de l'historique avant suppression"""
+    def create_history_backup(self, date_debut: str = None, date_fin: str = None,
+                              employee_id: int = None) -> Tuple[Optional[str], Optional[str]]:
+        """
+        Crée une sauvegarde de l'historique avant suppression (NDJSON compressé gzip),
+        écrite en flux dans un fichier temporaire et limitée aux pointages concernés.
+        
+        Returns:
+            (chemin du fichier temporaire, nom de téléchargement) ou (None, None)
+        """
         try:
-            backup_data = {
-                'timestamp': datetime.now().isoformat(),
-                'time_entries': []
-            }
-            
-            # Récupérer tous les pointages avec détails
-            query = '''
-                SELECT te.*, 
-                       p.nom_projet, 
-                       e.prenom || ' ' || e.nom as employee_name,
-                       o.description as operation_description,
-                       f.numero_document as bt_numero
-                FROM time_entries te
-                LEFT JOIN projects p ON te.project_id = p.id
-                LEFT JOIN employees e ON te.employee_id = e.id
-                LEFT JOIN operations o ON te.operation_id = o.id
-                LEFT JOIN formulaires f ON te.formulaire_bt_id = f.id
-                ORDER BY te.punch_in DESC
-            '''
-            
-            rows = self.db.execute_query(query)
-            for row in rows:
-                backup_data['time_entries'].append(dict(row))
-            
-            # Créer le fichier de sauvegarde
-            backup_json = json.dumps(backup_data, indent=2, default=str)
-            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-            filename = f"timetracker_backup_{timestamp}.json"
-            
-            logger.info(f"Sauvegarde créée: {len(backup_data['time_entries'])} entrées")
-            return backup_json, filename
+            path, filename, count = export_to_tempfile(
+                self.db, 'ndjson', compress=True, prefix='timetracker_backup',
+                date_debut=date_debut, date_fin=date_fin,
+                employee_ids=[employee_id] if employee_id else None
+            )
+            if path:
+                logger.info(f"Sauvegarde créée: {count} entrées")
+            return path, filename
             
         except Exception as e:
             logger.error(f"Erreur création sauvegarde: {e}")
@@ -1057,17 +1088,17 @@ class TimeTrackerUnified:
                 'success': False,
                 'entries_deleted': 0,
                 'backup_created': False,
-                'backup_data': None,
+                'backup_path': None,
                 'backup_filename': None,
                 'message': ''
             }
             
             # Créer une sauvegarde si demandé
             if create_backup:
-                backup_data, backup_filename = self.create_history_backup()
-                if backup_data:
+                backup_path, backup_filename = self.create_history_backup()
+                if backup_path:
                     result['backup_created'] = True
-                    result['backup_data'] = backup_data
+                    result['backup_path'] = backup_path
                     result['backup_filename'] = backup_filename
             
             # Compter les entrées avant suppression
@@ -1100,17 +1131,17 @@ class TimeTrackerUnified:
                 'success': False,
                 'entries_deleted': 0,
                 'backup_created': False,
-                'backup_data': None,
+                'backup_path': None,
                 'backup_filename': None,
                 'message': ''
             }
             
             # Créer une sauvegarde si demandé
             if create_backup:
-                backup_data, backup_filename = self.create_history_backup()
-                if backup_data:
+                backup_path, backup_filename = self.create_history_backup(date_debut=start_date, date_fin=end_date)
+                if backup_path:
                     result['backup_created'] = True
-                    result['backup_data'] = backup_data
+                    result['backup_path'] = backup_path
                     result['backup_filename'] = backup_filename
             
             # Compter les entrées dans la plage
@@ -1155,7 +1186,7 @@ class TimeTrackerUnified:
                 'success': False,
                 'entries_deleted': 0,
                 'backup_created': False,
-                'backup_data': None,
+                'backup_path': None,
                 'backup_filename': None,
                 'employee_name': '',
                 'message': ''
@@ -1171,10 +1202,10 @@ class TimeTrackerUnified:
             
             # Créer une sauvegarde si demandé
             if create_backup:
-                backup_data, backup_filename = self.create_history_backup()
-                if backup_data:
+                backup_path, backup_filename = self.create_history_backup(employee_id=employee_id)
+                if backup_path:
                     result['backup_created'] = True
-                    result['backup_data'] = backup_data
+                    result['backup_path'] = backup_path
                     result['backup_filename'] = backup_filename
             
             # Compter les entrées de l'employé
@@ -1217,17 +1248,17 @@ class TimeTrackerUnified:
                 'success': False,
                 'entries_deleted': 0,
                 'backup_created': False,
-                'backup_data': None,
+                'backup_path': None,
                 'backup_filename': None,
                 'message': ''
             }
             
             # Créer une sauvegarde si demandé
             if create_backup:
-                backup_data, backup_filename = self.create_history_backup()
-                if backup_data:
+                backup_path, backup_filename = self.create_history_backup(date_fin=(datetime.now() - timedelta(days=older_than_days + 1)).strftime('%Y-%m-%d'))
+                if backup_path:
                     result['backup_created'] = True
-                    result['backup_data'] = backup_data
+                    result['backup_path'] = backup_path
                     result['backup_filename'] = backup_filename
             
             cutoff_date = (datetime.now() - timedelta(days=older_than_days)).strftime('%Y-%m-%d')
@@ -1276,7 +1307,7 @@ class TimeTrackerUnified:
                 'success': False,
                 'entries_deleted': 0,
                 'backup_created': False,
-                'backup_data': None,
+                'backup_path': None,
                 'backup_filename': None,
                 'orphan_details': {},
                 'message': ''
@@ -1284,10 +1315,10 @@ class TimeTrackerUnified:
             
             # Créer une sauvegarde si demandé
             if create_backup:
-                backup_data, backup_filename = self.create_history_backup()
-                if backup_data:
+                backup_path, backup_filename = self.create_history_backup()
+                if backup_path:
                     result['backup_created'] = True
-                    result['backup_data'] = backup_data
+                    result['backup_path'] = backup_path
                     result['backup_filename'] = backup_filename
             
             orphan_count = 0
@@ -2209,6 +2240,9 @@ def show_employee_history_interface(tt):
 # INTERFACES COMMUNES - SUPERVISEUR ET EMPLOYÉ
 # =========================================================================
 
+# Pointages par page dans l'historique superviseur
+HISTORY_PAGE_SIZE = 100
+
 def show_history_interface_operations(tt):
     """Interface d'historique adaptée pour les opérations"""
     
@@ -2232,28 +2266,34 @@ def show_history_interface_operations(tt):
     with col3:
         show_operations_only = st.checkbox("🔧 Opérations seulement", value=True)
     
-    # Récupérer l'historique avec opérations
-    history = tt.get_punch_history(employee_filter, days_filter)
+    filtres = {
+        'employee_ids': [employee_filter] if employee_filter else None,
+        'date_debut': (datetime.now() - timedelta(days=days_filter)).strftime('%Y-%m-%d'),
+        'operations_seulement': show_operations_only
+    }
     
-    # Filtrer pour opérations seulement si demandé
-    if show_operations_only:
-        history = [h for h in history if h.get('operation_description')]
+    # Pagination par clé : pile des curseurs de début de page, réinitialisée si les filtres changent
+    signature_filtres = (employee_filter, days_filter, show_operations_only)
+    if st.session_state.get('hist_op_filtres') != signature_filtres:
+        st.session_state.hist_op_filtres = signature_filtres
+        st.session_state.hist_op_curseurs = [None]
+    curseurs = st.session_state.hist_op_curseurs
+    
+    page = tt.get_punch_history_page(curseur=curseurs[-1], limite=HISTORY_PAGE_SIZE, **filtres)
+    history = page['pointages']
     
     if not history:
         st.info("Aucun pointage trouvé")
         return
     
-    # Résumé
-    total_sessions = len(history)
-    completed_sessions = len([h for h in history if h['punch_out'] is not None])
-    total_hours = sum(h['total_hours'] or 0 for h in history)
-    total_revenue = sum(h['total_cost'] or 0 for h in history)
+    # Résumé (sur toute la période filtrée)
+    summary = tt.get_punch_history_summary(**filtres)
     
     col1, col2, col3, col4 = st.columns(4)
-    col1.metric("Sessions", total_sessions)
-    col2.metric("Terminées", completed_sessions)
-    col3.metric("Heures Total", f"{total_hours:.1f}h")
-    col4.metric("Revenus", f"{total_revenue:,.0f}$")
+    col1.metric("Sessions", summary.get('total_sessions', 0))
+    col2.metric("Terminées", summary.get('completed_sessions', 0))
+    col3.metric("Heures Total", f"{summary.get('total_hours', 0):.1f}h")
+    col4.metric("Revenus", f"{summary.get('total_revenue', 0):,.0f}$")
     
     # Tableau détaillé
     st.markdown("##### 📋 Détail des Pointages sur Opérations")
@@ -2315,8 +2355,21 @@ def show_history_interface_operations(tt):
         df = pd.DataFrame(df_data)
         st.dataframe(df, use_container_width=True, hide_index=True)
         
+        # Navigation entre les pages
+        col_prev, col_page, col_next = st.columns([1, 2, 1])
+        with col_prev:
+            if len(curseurs) > 1 and st.button("⬅️ Plus récents", key="hist_op_prev", use_container_width=True):
+                curseurs.pop()
+                st.rerun()
+        with col_page:
+            st.caption(f"Page {len(curseurs)} - {len(history)} pointages")
+        with col_next:
+            if page['curseur_suivant'] and st.button("Plus anciens ➡️", key="hist_op_next", use_container_width=True):
+                curseurs.append(page['curseur_suivant'])
+                st.rerun()
+        
         # Bouton export
-        if st.button("📥 Exporter CSV Opérations", use_container_width=True):
+        if st.button("📥 Exporter CSV (page affichée)", use_container_width=True):
             csv = df.to_csv(index=False)
             st.download_button(
                 label="💾 Télécharger CSV",
@@ -2446,6 +2499,65 @@ def show_operation_statistics_interface(tt):
 # INTERFACE ADMINISTRATEUR - SECTION SUPERVISEUR SEULEMENT
 # =========================================================================
 
+def show_download_from_file(path: str, filename: str, mime: str, label: str, key: str = None):
+    """Bouton de téléchargement alimenté par un fichier d'export temporaire (supprimé ensuite)"""
+    try:
+        with open(path, 'rb') as export_file:
+            st.download_button(label=label, data=export_file, file_name=filename, mime=mime, key=key)
+    finally:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+def show_backup_download_button(result: Dict):
+    """Téléchargement de la sauvegarde créée avant une suppression d'historique"""
+    show_download_from_file(
+        result['backup_path'], result['backup_filename'], export_mime('ndjson', True),
+        label="💾 Télécharger la Sauvegarde"
+    )
+
+def show_history_export_section(tt):
+    """Export de l'historique en flux (NDJSON / CSV / JSON, gzip) avec filtres"""
+    st.markdown("##### 📤 Export de l'Historique")
+    
+    col_exp1, col_exp2, col_exp3 = st.columns(3)
+    with col_exp1:
+        export_start = st.date_input("Du:", value=None, key="export_start_date")
+    with col_exp2:
+        export_end = st.date_input("Au:", value=None, key="export_end_date")
+    with col_exp3:
+        employees = tt.get_all_employees()
+        employee_options = {emp['id']: emp['display_name'] for emp in employees}
+        export_employees = st.multiselect(
+            "Employés (tous si vide):",
+            options=list(employee_options.keys()),
+            format_func=lambda x: employee_options[x],
+            key="export_employees"
+        )
+    
+    col_fmt1, col_fmt2 = st.columns(2)
+    with col_fmt1:
+        export_format = st.selectbox("Format:", options=list(EXPORT_FORMATS.keys()), key="export_format")
+    with col_fmt2:
+        export_gzip = st.checkbox("Compresser (gzip)", value=True, key="export_gzip")
+    
+    if st.button("📤 Préparer l'Export", key="prepare_export_btn"):
+        with st.spinner("Export en cours..."):
+            path, filename, count = export_to_tempfile(
+                tt.db, export_format, compress=export_gzip,
+                date_debut=export_start.strftime('%Y-%m-%d') if export_start else None,
+                date_fin=export_end.strftime('%Y-%m-%d') if export_end else None,
+                employee_ids=export_employees or None
+            )
+        
+        if path:
+            st.success(f"✅ {count} pointages exportés")
+            show_download_from_file(path, filename, export_mime(export_format, export_gzip),
+                                    label="💾 Télécharger l'Export", key="download_export_btn")
+        else:
+            st.error("❌ Erreur lors de l'export")
+
 def show_admin_interface(tt):
     """Interface d'administration avec gestion de l'historique"""
     
@@ -2514,6 +2626,10 @@ def show_admin_interface(tt):
     
     st.markdown("---")
     
+    show_history_export_section(tt)
+    
+    st.markdown("---")
+    
     # Options de suppression
     st.markdown("##### 🗑️ Options de Suppression d'Historique")
     
@@ -2541,13 +2657,8 @@ def show_admin_interface(tt):
                 if result['success']:
                     st.success(result['message'])
                     
-                    if result['backup_created'] and result['backup_data']:
-                        st.download_button(
-                            label="💾 Télécharger la Sauvegarde",
-                            data=result['backup_data'],
-                            file_name=result['backup_filename'],
-                            mime="application/json"
-                        )
+                    if result['backup_created'] and result['backup_path']:
+                        show_backup_download_button(result)
                     
                     # Forcer le rechargement des stats
                     st.rerun()
@@ -2579,13 +2690,8 @@ def show_admin_interface(tt):
                 if result['success']:
                     st.success(result['message'])
                     
-                    if result['backup_created'] and result['backup_data']:
-                        st.download_button(
-                            label="💾 Télécharger la Sauvegarde",
-                            data=result['backup_data'],
-                            file_name=result['backup_filename'],
-                            mime="application/json"
-                        )
+                    if result['backup_created'] and result['backup_path']:
+                        show_backup_download_button(result)
                     
                     st.rerun()
                 else:
@@ -2622,13 +2728,8 @@ def show_admin_interface(tt):
                     if result['success']:
                         st.success(result['message'])
                         
-                        if result['backup_created'] and result['backup_data']:
-                            st.download_button(
-                                label="💾 Télécharger la Sauvegarde",
-                                data=result['backup_data'],
-                                file_name=result['backup_filename'],
-                                mime="application/json"
-                            )
+                        if result['backup_created'] and result['backup_path']:
+                            show_backup_download_button(result)
                         
                         st.rerun()
                     else:
@@ -2661,13 +2762,8 @@ def show_admin_interface(tt):
             if result['success']:
                 st.success(result['message'])
                 
-                if result['backup_created'] and result['backup_data']:
-                    st.download_button(
-                        label="💾 Télécharger la Sauvegarde",
-                        data=result['backup_data'],
-                        file_name=result['backup_filename'],
-                        mime="application/json"
-                    )
+                if result['backup_created'] and result['backup_path']:
+                    show_backup_download_button(result)
                 
                 st.rerun()
             else:
@@ -2702,13 +2798,8 @@ def show_admin_interface(tt):
                     for category, count in result['orphan_details'].items():
                         st.write(f"- {category}: {count} entrées")
                 
-                if result['backup_created'] and result['backup_data']:
-                    st.download_button(
-                        label="💾 Télécharger la Sauvegarde",
-                        data=result['backup_data'],
-                        file_name=result['backup_filename'],
-                        mime="application/json"
-                    )
+                if result['backup_created'] and result['backup_path']:
+                    show_backup_download_button(result)
                 
                 st.rerun()
             else:
@@ -3068,39 +3159,25 @@ def initialize_timetracker_unified(db) -> TimeTrackerUnified:
 # FONCTIONS D'EXPORT/IMPORT POUR COMPATIBILITÉ
 # =========================================================================
 
-def export_timetracker_data(tt) -> str:
-    """Exporte toutes les données TimeTracker en JSON"""
+def export_timetracker_data(tt, date_debut: str = None, date_fin: str = None,
+                            employee_ids: List[int] = None) -> str:
+    """Exporte les données TimeTracker en JSON (document construit en flux, sans liste intermédiaire)"""
     try:
-        export_data = {
+        entete = {
             'metadata': {
                 'export_date': datetime.now().isoformat(),
                 'version': '2.1',
                 'type': 'timetracker_unified_export'
             },
-            'time_entries': [],
             'statistics': tt.get_timetracker_statistics_unified()
         }
         
-        # Récupérer toutes les entrées avec détails
-        query = '''
-            SELECT te.*, 
-                   p.nom_projet, 
-                   e.prenom || ' ' || e.nom as employee_name,
-                   o.description as operation_description,
-                   f.numero_document as bt_numero
-            FROM time_entries te
-            LEFT JOIN projects p ON te.project_id = p.id
-            LEFT JOIN employees e ON te.employee_id = e.id
-            LEFT JOIN operations o ON te.operation_id = o.id
-            LEFT JOIN formulaires f ON te.formulaire_bt_id = f.id
-            ORDER BY te.punch_in DESC
-        '''
-        
-        rows = tt.db.execute_query(query)
-        for row in rows:
-            export_data['time_entries'].append(dict(row))
-        
-        return json.dumps(export_data, indent=2, default=str)
+        buffer = io.StringIO()
+        with tt.db.read_snapshot() as conn:
+            for chunk in iter_export_text(conn, 'json', entete=entete, date_debut=date_debut,
+                                          date_fin=date_fin, employee_ids=employee_ids):
+                buffer.write(chunk)
+        return buffer.getvalue()
         
     except Exception as e:
         logger.error(f"Erreur export données: {e}")